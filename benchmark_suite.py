@@ -0,0 +1,556 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# 合成データによる性能測定（取り込み・search_vns の作り直し・読み込みクエリ）
+#
+# SCALING_ANALYSIS.md / FUTURE_CHALLENGES.md では 5万件規模での遅さが心配されていますが、
+# 実際に測る仕組みがありませんでした。このスクリプトは、VNDB と同じ形の合成データを
+# 決まった乱数の種から作り（何度実行しても同じデータ）、次の処理の時間を測ります。
+#
+#   1. upsert_visual_novel（1件ずつ）と BulkVNWriter（COPY 一括）の取り込み速度
+#   2. build_search_vns.py による search_vns の作り直し（全件の rebuild_full と差分の refresh_delta）
+#   3. update_tag_translations（sql / python の両モード）
+#   4. トップページ（frontend/app/page.tsx）と詳細ページ（build_display.PAGE_QUERIES）の
+#      クエリの p50 / p95 / p99
+#
+# データはすべて専用のスキーマ（bench_vndb = vndb.* の代わり、bench_public = public の代わり）に
+# 作るので、本番のテーブルには触れません。結果は JSON ファイルに保存し、
+# --compare で前回の結果と比べて遅くなった項目を報告します（遅くなっていれば終了コード 1）。
+#
+# 実行方法:
+#   python benchmark_suite.py                          # 1k / 10k で測定
+#   python benchmark_suite.py --scales 1k 10k 50k 200k
+#   python benchmark_suite.py --scales 50k --compare bench_results/baseline.json
+# -----------------------------------------------------------------------------
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2.extensions
+
+import build_search_vns
+from db import get_db_connection
+from ingest_vndb_data import create_table_if_not_exists, upsert_visual_novel
+from tag_translations import TAG_TRANSLATIONS
+from bulk_upsert import BulkVNWriter
+from build_display import PAGE_QUERIES
+import update_tag_translations
+
+SCALES = {'1k': 1000, '10k': 10000, '50k': 50000, '200k': 200000}
+DEFAULT_SCALES = ['1k', '10k']
+BENCH_VNDB = 'bench_vndb'
+BENCH_PUBLIC = 'bench_public'
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results')
+
+TAG_COUNT = 2600               # VNDB の適用可能なタグ数と同じくらい
+DELTA_FRACTION = 0.01          # 差分モードの測定で、入力を書き換える VN の割合
+GENERATE_CHUNK = 5000          # 何件の VN ごとに COPY するか
+# 前回の結果より、この倍率を超えて遅くなった項目を「遅くなった」と判定します
+DEFAULT_THRESHOLD = 1.25
+
+# トップページ（frontend/app/page.tsx）と同じクエリ
+HOME_QUERIES = [
+    """SELECT id, title, title_ja, rating, votecount, cover_url
+       FROM public.search_vns
+       WHERE rating IS NOT NULL
+       ORDER BY rating DESC NULLS LAST
+       LIMIT 100""",
+    "SELECT COUNT(*) as count FROM public.search_vns",
+]
+
+def in_bench_schema(sql):
+    """SQL の vndb. / public. を、ベンチマーク用のスキーマに置き換えます（s2.vndb.org などの URL はそのまま）"""
+    sql = re.sub(r'(?<![\w.])vndb\.', f'{BENCH_VNDB}.', sql)
+    return re.sub(r'(?<![\w.])public\.', f'{BENCH_PUBLIC}.', sql)
+
+class BenchCursor(psycopg2.extensions.cursor):
+    """実行する SQL を in_bench_schema() で書き換えるカーソル（本番用のスクリプトをそのまま測るため）"""
+
+    def execute(self, query, vars=None):
+        return super().execute(in_bench_schema(query), vars)
+
+@contextmanager
+def bench_cursors(conn):
+    """この中では conn.cursor() が BenchCursor になります"""
+    previous = conn.cursor_factory
+    conn.cursor_factory = BenchCursor
+    try:
+        yield
+    finally:
+        conn.cursor_factory = previous
+
+# -----------------------------------------------------------------------------
+# 1. 合成データ（vndb.* と同じ形のテーブル）
+# -----------------------------------------------------------------------------
+VNDB_TABLES = {
+    'vn': 'id TEXT PRIMARY KEY, olang TEXT, c_rating SMALLINT, c_votecount INTEGER, '
+          'c_released INTEGER, c_image TEXT, description TEXT, alias TEXT',
+    'vn_titles': 'id TEXT, lang TEXT, official BOOLEAN, title TEXT, latin TEXT',
+    'tags': 'id INTEGER PRIMARY KEY, name TEXT, cat TEXT',
+    'tags_vn': 'date TIMESTAMPTZ, tag INTEGER, vid TEXT, uid TEXT, vote SMALLINT, '
+               'spoiler SMALLINT, ignore BOOLEAN, lie BOOLEAN, notes TEXT',
+    'images': 'id TEXT PRIMARY KEY',
+    'vn_screenshots': 'id TEXT, scr TEXT',
+    'chars': 'id TEXT PRIMARY KEY, image TEXT, gender TEXT',
+    'chars_vns': 'id TEXT, vid TEXT, rid TEXT, role TEXT',
+    'chars_names': 'id TEXT, lang TEXT, name TEXT',
+    'vn_staff': 'id TEXT, aid INTEGER, role TEXT, note TEXT',
+    'staff_alias': 'aid INTEGER PRIMARY KEY, id TEXT, name TEXT',
+    'staff_extlinks': 'id TEXT, link INTEGER',
+    'extlinks': 'id INTEGER PRIMARY KEY, site TEXT, value TEXT',
+    'vn_extlinks': 'id TEXT, link INTEGER',
+    'releases_vn': 'id TEXT, vid TEXT',
+    'releases_extlinks': 'id TEXT, link INTEGER',
+    'releases_titles': 'id TEXT, lang TEXT, title TEXT',
+    'releases_producers': 'id TEXT, pid TEXT',
+    'producers': 'id TEXT PRIMARY KEY, name TEXT',
+    'producers_extlinks': 'id TEXT, link INTEGER',
+}
+
+# 投入後に作るインデックス（VNDB のダンプに含まれるものに合わせています）
+VNDB_INDEXES = [
+    ('vn_titles', 'id, lang'), ('tags_vn', 'vid'), ('tags_vn', 'tag'),
+    ('vn_screenshots', 'id'), ('chars_vns', 'vid'), ('chars_names', 'id'), ('vn_staff', 'id'),
+    ('vn_extlinks', 'id'), ('releases_vn', 'vid'), ('releases_extlinks', 'id'),
+    ('releases_titles', 'id'), ('releases_producers', 'id'), ('producers_extlinks', 'id'),
+    ('staff_extlinks', 'id'),
+]
+
+EXTLINK_SITES = ['dlsite', 'dmm', 'getchu', 'steam', 'wikidata', 'twitter', 'egs', 'melon']
+CHAR_ROLES = ['main', 'primary', 'side', 'appears']
+STAFF_ROLES = ['scenario', 'chardesign', 'art', 'director', 'music', 'songs', 'staff']
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわん'
+WORDS = ['Love', 'Heart', 'Summer', 'Memories', 'Sakura', 'Night', 'Days', 'Story', 'Angel',
+         'School', 'Sky', 'Eden', 'Island', 'Snow', 'Garden', 'Star']
+
+def tag_names():
+    """翻訳辞書にあるタグ名 + 辞書にないタグ名（翻訳されないタグも混ぜます）"""
+    names = list(TAG_TRANSLATIONS)
+    names += [f'Synthetic Tag {n}' for n in range(len(names) + 1, TAG_COUNT + 1)]
+    return names
+
+class SyntheticVNDB:
+    """
+    VN 1件ごとに、関連テーブル（タイトル・タグ・キャラ・スタッフ・リリース…）の行を作ります。
+    乱数の種と件数が同じなら、毎回まったく同じデータになります。
+    件数の比率は本番のダンプに近くなるようにしています（1作品あたりキャラ約6人・スタッフ約10人など）。
+    """
+
+    def __init__(self, count, seed=0):
+        self.count = count
+        self.seed = seed
+        self.tag_names = tag_names()
+        # 人気のあるタグほど多くの作品に付くように（順位の 0.8 乗に反比例）
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(TAG_COUNT)]
+        total = 0.0
+        self.tag_cum_weights = []
+        for w in weights:
+            total += w
+            self.tag_cum_weights.append(total)
+        self.producer_count = max(50, count // 20)
+        self.staff_count = max(200, count // 4)
+        self.extlink_count = count * 4
+
+    def _title(self, rng):
+        return (''.join(rng.choice(KANA) for _ in range(rng.randint(3, 10))),
+                ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))))
+
+    def shared_rows(self):
+        """VN に依存しないテーブル（タグ・外部リンク・制作会社・スタッフ）"""
+        rng = random.Random(f'{self.seed}-shared')
+        yield 'tags', [(n + 1, name, rng.choice(['cont', 'ero', 'tech']))
+                       for n, name in enumerate(self.tag_names)]
+        yield 'extlinks', [(n, rng.choice(EXTLINK_SITES), f'value{n}')
+                           for n in range(1, self.extlink_count + 1)]
+        yield 'producers', [(f'p{n}', f'Producer {n}') for n in range(1, self.producer_count + 1)]
+        yield 'producers_extlinks', [(f'p{n}', rng.randint(1, self.extlink_count))
+                                     for n in range(1, self.producer_count + 1) for _ in range(rng.randint(0, 3))]
+        yield 'staff_alias', [(n, f's{n}', f'Staff {n}') for n in range(1, self.staff_count + 1)]
+        yield 'staff_extlinks', [(f's{n}', rng.randint(1, self.extlink_count))
+                                 for n in range(1, self.staff_count + 1) for _ in range(rng.randint(0, 2))]
+
+    def vn_rows(self, start, end):
+        """VN 番号 start〜end-1 の行を {テーブル名: 行のリスト} で返します"""
+        rows = {name: [] for name in VNDB_TABLES if name not in
+                ('tags', 'extlinks', 'producers', 'producers_extlinks', 'staff_alias', 'staff_extlinks')}
+        for n in range(start, end):
+            rng = random.Random(f'{self.seed}-vn-{n}')
+            vid = f'v{n}'
+            title_ja, title_en = self._title(rng)
+            olang = 'ja' if rng.random() < 0.8 else 'en'
+            votes = int(rng.paretovariate(1.2) * 5) - 5
+            rated = votes >= 10
+            released = 0 if rng.random() < 0.05 else \
+                rng.randint(1990, 2025) * 10000 + rng.randint(1, 12) * 100 + rng.randint(1, 28)
+            rows['vn'].append((vid, olang, rng.randint(200, 950) if rated else None, votes, released,
+                               f'cv{n}' if rng.random() < 0.9 else None,
+                               f'[b]{title_en}[/b]\n' + 'Synthetic description. ' * rng.randint(1, 20),
+                               title_en.upper() if rng.random() < 0.3 else ''))
+            rows['vn_titles'].append((vid, 'ja', olang == 'ja', title_ja, title_en))
+            rows['vn_titles'].append((vid, 'en', olang == 'en', title_en, None))
+
+            for tag in set(rng.choices(range(1, TAG_COUNT + 1), cum_weights=self.tag_cum_weights,
+                                       k=rng.randint(3, 25))):
+                for voter in range(rng.randint(1, 4)):
+                    rows['tags_vn'].append(('2024-01-01', tag, vid, f'u{rng.randint(1, 50000)}',
+                                            rng.choice([3, 3, 2, 2, 1, -1]), rng.choice([None, 0, 1, 2]),
+                                            rng.random() < 0.02, False, ''))
+
+            for shot in range(rng.randint(0, 10)):
+                image = f'sf{n}_{shot}'
+                rows['images'].append((image,))
+                rows['vn_screenshots'].append((vid, image))
+            releases = [f'r{n}_{k}' for k in range(rng.randint(1, 4))]
+            for cid in range(rng.randint(0, 12)):
+                char = f'c{n}_{cid}'
+                rows['chars'].append((char, f'ch{n}{cid}' if rng.random() < 0.8 else None,
+                                      rng.choice(['m', 'f', None])))
+                rows['chars_vns'].append((char, vid, None, rng.choice(CHAR_ROLES)))
+                if rng.random() < 0.5:
+                    rows['chars_vns'].append((char, vid, releases[0], rng.choice(CHAR_ROLES)))
+                rows['chars_names'].append((char, 'ja' if rng.random() < 0.6 else 'en', f'キャラ{n}_{cid}'))
+            for _ in range(rng.randint(0, 20)):
+                rows['vn_staff'].append((vid, rng.randint(1, self.staff_count), rng.choice(STAFF_ROLES), None))
+            for _ in range(rng.randint(0, 4)):
+                rows['vn_extlinks'].append((vid, rng.randint(1, self.extlink_count)))
+            for release in releases:
+                rows['releases_vn'].append((release, vid))
+                rows['releases_titles'].append((release, 'ja', f'{title_ja} 初回版'))
+                rows['releases_producers'].append((release, f'p{rng.randint(1, self.producer_count)}'))
+                for _ in range(rng.randint(0, 3)):
+                    rows['releases_extlinks'].append((release, rng.randint(1, self.extlink_count)))
+        return rows
+
+    def api_payloads(self):
+        """fetch_vndb_data() が返すのと同じ形の VN データ（取り込みの測定用）"""
+        for n in range(1, self.count + 1):
+            rng = random.Random(f'{self.seed}-api-{n}')
+            title_ja, title_en = self._title(rng)
+            tags = rng.choices(range(TAG_COUNT), cum_weights=self.tag_cum_weights, k=rng.randint(3, 25))
+            yield {
+                'id': f'v{n}',
+                'title': title_en,
+                'alttitle': title_ja if rng.random() < 0.5 else None,
+                'titles': [{'lang': 'ja', 'title': title_ja}, {'lang': 'en', 'title': title_en}],
+                'released': f'{rng.randint(1990, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'description': f'[b]{title_en}[/b]\n' + 'Synthetic description. ' * rng.randint(1, 20),
+                'image': {'url': f'https://t.vndb.org/cv/{n % 100:02d}/{n}.jpg',
+                          'sexual': round(rng.random() * 2, 2), 'violence': round(rng.random() * 2, 2)},
+                'rating': round(rng.uniform(10, 95), 2),
+                'votecount': int(rng.paretovariate(1.2) * 5) - 5,
+                'tags': [{'name': self.tag_names[t], 'rating': round(rng.uniform(0.5, 3), 1)}
+                         for t in sorted(set(tags))],
+                'developers': [{'name': f'Producer {rng.randint(1, self.producer_count)}'}],
+                'screenshots': [{'url': f'https://t.vndb.org/sf/{n % 100:02d}/{n}{k}.jpg'}
+                                for k in range(rng.randint(0, 10))],
+            }
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_rows(cur, table, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(v) for v in row) + '\n')
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN", buf)
+
+def reset_schemas(conn):
+    with conn.cursor() as cur:
+        for schema in (BENCH_VNDB, BENCH_PUBLIC):
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+        # スキーマ名を書いていないテーブル（visual_novels など）も bench_public に作られます
+        cur.execute(f"SET search_path TO {BENCH_PUBLIC}")
+    conn.commit()
+
+def drop_schemas(conn):
+    with conn.cursor() as cur:
+        for schema in (BENCH_VNDB, BENCH_PUBLIC):
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.commit()
+
+def generate_vndb(conn, data):
+    """合成データを bench_vndb に COPY で投入し、インデックスを作ります"""
+    started = time.perf_counter()
+    rows_total = 0
+    with conn.cursor() as cur:
+        for table, definition in VNDB_TABLES.items():
+            cur.execute(f"CREATE TABLE {BENCH_VNDB}.{table} ({definition})")
+        for table, rows in data.shared_rows():
+            copy_rows(cur, f'{BENCH_VNDB}.{table}', rows)
+            rows_total += len(rows)
+        for start in range(1, data.count + 1, GENERATE_CHUNK):
+            for table, rows in data.vn_rows(start, min(start + GENERATE_CHUNK, data.count + 1)).items():
+                copy_rows(cur, f'{BENCH_VNDB}.{table}', rows)
+                rows_total += len(rows)
+            conn.commit()
+            print(f"\r   合成データ {min(start + GENERATE_CHUNK - 1, data.count)}/{data.count} 件", end='', flush=True)
+        print()
+        for table, columns in VNDB_INDEXES:
+            cur.execute(f"CREATE INDEX ON {BENCH_VNDB}.{table} ({columns})")
+        for table in VNDB_TABLES:
+            cur.execute(f"ANALYZE {BENCH_VNDB}.{table}")
+    conn.commit()
+    return {'seconds': time.perf_counter() - started, 'rows': rows_total}
+
+# -----------------------------------------------------------------------------
+# 2. 測定
+# -----------------------------------------------------------------------------
+def percentiles(values):
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'samples': len(ordered)}
+
+def bench_ingest(conn, data, upsert_limit, batch_size):
+    """upsert_visual_novel（1件ずつ）と BulkVNWriter（COPY 一括）の取り込み速度"""
+    create_table_if_not_exists(conn)
+    result = {}
+
+    # 1件ずつの UPSERT は遅いので、最初の upsert_limit 件だけで速度を測ります
+    limit = min(upsert_limit, data.count)
+    started = time.perf_counter()
+    for n, vn in enumerate(data.api_payloads()):
+        if n >= limit:
+            break
+        upsert_visual_novel(conn, vn)
+    conn.commit()
+    seconds = time.perf_counter() - started
+    result['upsert_visual_novel'] = {'rows': limit, 'seconds': seconds, 'rows_per_second': limit / seconds}
+
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE visual_novels")
+    conn.commit()
+    writer = BulkVNWriter(conn, batch_size=batch_size)
+    started = time.perf_counter()
+    writer.add_many(data.api_payloads())
+    writer.flush()
+    conn.commit()
+    seconds = time.perf_counter() - started
+    result['bulk_upsert'] = {'rows': data.count, 'seconds': seconds, 'rows_per_second': data.count / seconds,
+                             'written': writer.rows_written, 'skipped': writer.unchanged}
+
+    # 同じデータの再取り込み（内容の指紋が同じなので、書き込みは発生しないはず）
+    writer = BulkVNWriter(conn, batch_size=batch_size)
+    started = time.perf_counter()
+    writer.add_many(data.api_payloads())
+    writer.flush()
+    conn.commit()
+    seconds = time.perf_counter() - started
+    # rows_per_second は照合した件数の速度です（written は 0、skipped が全件のはず）
+    result['bulk_upsert_unchanged'] = {'rows': data.count, 'seconds': seconds,
+                                       'rows_per_second': data.count / seconds,
+                                       'written': writer.rows_written, 'skipped': writer.unchanged}
+    return result
+
+def bench_rebuild(conn, data, seed):
+    """
+    build_search_vns.py の全件の作り直し（rebuild_full）と差分の反映（refresh_delta）を、
+    ベンチマーク用のスキーマで測ります（vndb.* は BenchCursor で bench_vndb.* に読み替えます）。
+    差分は「入力が変わっていないとき」（ハッシュの照合だけ）と、DELTA_FRACTION の VN の
+    投票数を書き換えたときの2通りです。
+    """
+    result = {}
+    with bench_cursors(conn), contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        build_search_vns.rebuild_full(conn)
+        result['full'] = {'seconds': time.perf_counter() - started}
+
+        started = time.perf_counter()
+        build_search_vns.refresh_delta(conn)
+        result['delta_unchanged'] = {'seconds': time.perf_counter() - started}
+
+        rng = random.Random(f'{seed}-delta')
+        changed = [f'v{n}' for n in rng.sample(range(1, data.count + 1), max(1, int(data.count * DELTA_FRACTION)))]
+        with conn.cursor() as cur:
+            cur.execute("UPDATE vndb.vn SET c_votecount = c_votecount + 1 WHERE id = ANY(%s)", (changed,))
+        conn.commit()
+        started = time.perf_counter()
+        build_search_vns.refresh_delta(conn)
+        result['delta'] = {'seconds': time.perf_counter() - started, 'changed': len(changed)}
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM search_vns")
+            result['full']['rows'] = cur.fetchone()[0]
+        conn.commit()
+    return result
+
+STRIP_NAME_JA = """
+UPDATE visual_novels v SET tags = (
+    SELECT jsonb_agg(e.tag - 'name_ja' ORDER BY e.ord)
+    FROM jsonb_array_elements(v.tags) WITH ORDINALITY AS e(tag, ord)
+)
+WHERE jsonb_typeof(v.tags) = 'array' AND jsonb_array_length(v.tags) > 0
+"""
+
+def bench_translations(conn, batch_size):
+    """
+    update_tag_translations を sql / python の両モードで測ります。
+    取り込み時に name_ja が付いているので、毎回いったん外してから実行します。
+    """
+    result = {}
+    for mode, run in (('sql', update_tag_translations.update_with_sql),
+                      ('python', update_tag_translations.update_with_python)):
+        with conn.cursor() as cur:
+            update_tag_translations.sync_translation_table(cur)
+            cur.execute(STRIP_NAME_JA)
+            cur.execute("ANALYZE visual_novels")
+        conn.commit()
+        started = time.perf_counter()
+        # 区切りごとの進捗表示は量が多いので捨てます
+        with contextlib.redirect_stdout(io.StringIO()):
+            updated = run(conn, batch_size, False, False)
+        conn.commit()
+        seconds = time.perf_counter() - started
+        result[mode] = {'rows': updated, 'seconds': seconds,
+                        'rows_per_second': updated / seconds if seconds else 0.0}
+    return result
+
+def time_queries(conn, queries, params_list, repeat=1):
+    """params_list の各パラメータで queries を順に実行し、1回分（全クエリ）の時間をミリ秒で集計します"""
+    timings = []
+    with conn.cursor() as cur:
+        # 1回目はキャッシュを温めるだけで、集計には入れません
+        for query in queries:
+            cur.execute(query, params_list[0])
+            cur.fetchall()
+        for _ in range(repeat):
+            for params in params_list:
+                t0 = time.perf_counter()
+                for query in queries:
+                    cur.execute(query, params)
+                    cur.fetchall()
+                timings.append((time.perf_counter() - t0) * 1000)
+    conn.commit()
+    return percentiles(timings)
+
+def bench_reads(conn, data, sample, seed):
+    home = time_queries(conn, [in_bench_schema(q) for q in HOME_QUERIES], [{}], repeat=sample)
+    rng = random.Random(seed)
+    ids = [{'id': f'v{rng.randint(1, data.count)}'} for _ in range(sample)]
+    game = time_queries(conn, [in_bench_schema(q) for q in PAGE_QUERIES], ids)
+    return {'home_ms': home, 'game_page_ms': game}
+
+def run_scale(conn, name, count, args):
+    print(f"\n=== {name}（{count:,} 件）===")
+    data = SyntheticVNDB(count, seed=args.seed)
+    reset_schemas(conn)
+    result = {'count': count}
+    try:
+        result['generate'] = generate_vndb(conn, data)
+        print(f"📥 合成データ: {result['generate']['rows']:,} 行（{result['generate']['seconds']:.1f} 秒）")
+
+        result['ingest'] = bench_ingest(conn, data, args.upsert_limit, args.batch_size)
+        for key, value in result['ingest'].items():
+            print(f"   取り込み {key}: {value['rows_per_second']:,.0f} 件/秒（{value['rows']:,} 件）")
+
+        result['rebuild_search_vns'] = bench_rebuild(conn, data, args.seed)
+        rebuild = result['rebuild_search_vns']
+        print(f"   search_vns の作り直し: 全件 {rebuild['full']['seconds']:.2f} 秒 / "
+              f"差分（変更なし）{rebuild['delta_unchanged']['seconds']:.2f} 秒 / "
+              f"差分（{rebuild['delta']['changed']:,} 件）{rebuild['delta']['seconds']:.2f} 秒")
+
+        result['update_tag_translations'] = bench_translations(conn, args.batch_size)
+        for mode, value in result['update_tag_translations'].items():
+            print(f"   update_tag_translations（{mode}）: {value['seconds']:.2f} 秒（{value['rows']:,} 件）")
+
+        result['reads'] = bench_reads(conn, data, args.sample, args.seed)
+        for key, value in result['reads'].items():
+            print(f"   {key}: p50 {value['p50']:.2f} / p95 {value['p95']:.2f} / p99 {value['p99']:.2f}")
+    finally:
+        if not args.keep:
+            drop_schemas(conn)
+    return result
+
+# -----------------------------------------------------------------------------
+# 3. 結果の保存と比較
+# -----------------------------------------------------------------------------
+def environment(conn):
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_version")
+        server_version = cur.fetchone()[0]
+    conn.commit()
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'postgres': server_version, 'git_commit': commit}
+
+def flatten(result, prefix=''):
+    """比べる数値（秒・ミリ秒。小さいほど良いもの）だけを 'scale.ingest.bulk_upsert.seconds' の形で返します"""
+    out = {}
+    for key, value in result.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            out.update(flatten(value, path + '.'))
+        elif key in ('seconds', 'p50', 'p95', 'p99'):
+            out[path] = value
+    return out
+
+def compare(current, baseline, threshold):
+    """前回の結果より threshold 倍を超えて遅くなった項目を返します"""
+    now, before = flatten(current['scales']), flatten(baseline.get('scales', {}))
+    regressions = []
+    for key, value in sorted(now.items()):
+        # 生成にかかった時間は測定対象ではないので比べません
+        if key in before and '.generate.' not in key and before[key] > 0 and value / before[key] > threshold:
+            regressions.append((key, before[key], value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='合成データによる性能測定')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=DEFAULT_SCALES)
+    parser.add_argument('--seed', type=int, default=0, help='合成データの乱数の種')
+    parser.add_argument('--upsert-limit', type=int, default=2000,
+                        help='upsert_visual_novel（1件ずつ）で測る件数の上限')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--sample', type=int, default=200, help='読み込みクエリを測る回数')
+    parser.add_argument('--output', help='結果の JSON ファイル（省略時は bench_results/日時.json）')
+    parser.add_argument('--compare', metavar='BASELINE', help='前回の結果 JSON と比べる')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'この倍率を超えて遅くなったら報告する（既定: {DEFAULT_THRESHOLD}）')
+    parser.add_argument('--keep', action='store_true', help='測定後もベンチマーク用のスキーマを残す')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        results = {'started_at': datetime.now().isoformat(timespec='seconds'), 'seed': args.seed,
+                   'environment': environment(conn), 'scales': {}}
+        for name in args.scales:
+            results['scales'][name] = run_scale(conn, name, SCALES[name], args)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"⚠️  {args.threshold} 倍を超えて遅くなった項目:")
+            for key, before, now in regressions:
+                print(f"   {key}: {before:.3f} → {now:.3f}（{now / before:.2f} 倍）")
+            raise SystemExit(1)
+        print("前回の結果から遅くなった項目はありません")
+
+if __name__ == '__main__':
+    main()
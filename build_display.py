@@ -0,0 +1,449 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# search_vns.display（ゲーム詳細ページ用のまとめデータ）を作るスクリプト
+#
+# frontend/app/game/[id]/page.tsx は1回の表示で9本のクエリを実行しています
+# （基本情報・タグ・スクリーンショット・キャラクター・スタッフ・外部リンク4種類）。
+# リリースや制作会社の外部リンクは releases_vn → producers → extlinks と何段もJOINします。
+#
+# そこで、ページが必要とする内容をあらかじめ VN ごとの JSONB にまとめて
+# search_vns.display に保存しておきます。詳細ページは主キーで1行読むだけになります。
+#
+#   - 集計は VN ごとのループではなく、まとまった件数（チャンク）ずつ GROUP BY で一括計算
+#   - 内容が変わった行だけを UPDATE（IS DISTINCT FROM）
+#   - 差分モードでは display が空の行と、vndb.* の入力が前回から変わった VN だけを計算し直す
+#     （入力の VN ごとのハッシュを vn_source_hashes に記録しておき、build_search_vns.py と同じ方法で比べます）
+#
+# display の中身（各配列は page.tsx のクエリ結果の行と同じ形です）:
+#   {"version": 1, "vn": {...基本情報...}, "tags": [...], "screenshots": [...],
+#    "characters": [...], "staff": [...], "vn_links": [...], "release_links": [...],
+#    "producer_links": [...], "staff_links": [...]}
+#
+# 実行方法:
+#   python build_display.py                 # 差分だけ（display が空の行 + 入力が変わった VN）
+#   python build_display.py --all           # 全件を計算し直す（変わった行だけ書き込み）
+#   python build_display.py --ids v11 v17   # 指定した VN だけ
+#   python build_display.py --benchmark     # 全件の作成時間と、ページ表示のクエリ時間を比較
+# -----------------------------------------------------------------------------
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from db import get_db_connection
+from build_search_vns import (
+    TABLE, compute_source_hashes, diff_source_hashes, ensure_state_table, record_build,
+    save_source_hashes, source_hash_sql,
+)
+from vn_roles import character_role_order, staff_role_order
+
+# payload の形を変えたら上げてください（フロントエンドは違う版なら従来のクエリに戻ります）
+DISPLAY_VERSION = 1
+STATE_NAME = 'display'
+
+# 1回の UPDATE で計算する VN の数
+DEFAULT_CHUNK_SIZE = 2000
+
+# ページと同じ件数の上限
+TAG_LIMIT = 20
+SCREENSHOT_LIMIT = 12
+CHARACTER_LIMIT = 24
+STAFF_LIMIT = 30
+
+# display の計算に使う vndb スキーマのテーブル
+SOURCE_TABLES = [
+    'vn', 'tags', 'images', 'vn_screenshots', 'chars', 'chars_vns', 'chars_names',
+    'vn_staff', 'staff_alias', 'staff_extlinks', 'extlinks', 'vn_extlinks', 'releases_vn',
+    'releases_extlinks', 'releases_titles', 'releases_producers', 'producers', 'producers_extlinks',
+]
+
+# -----------------------------------------------------------------------------
+# 1. display を作るSQL（%(ids)s の VN の分をまとめて計算）
+# -----------------------------------------------------------------------------
+DISPLAY_SQL = f"""
+WITH tags AS (
+    -- search_vns.tag_ids（vote > 0、ignore = false のタグ）を使うので、tags_vn は読みません
+    SELECT vid, jsonb_agg(jsonb_build_object('name', name, 'id', id) ORDER BY name, id) AS items
+    FROM (
+        SELECT s.id AS vid, t.name, t.id, ROW_NUMBER() OVER (PARTITION BY s.id ORDER BY t.name, t.id) AS rn
+        FROM {TABLE} s
+        CROSS JOIN UNNEST(s.tag_ids) AS u(tag)
+        JOIN vndb.tags t ON t.id = u.tag
+        WHERE s.id = ANY(%(ids)s)
+    ) x
+    WHERE rn <= {TAG_LIMIT}
+    GROUP BY vid
+),
+screenshots AS (
+    SELECT vid, jsonb_agg(jsonb_build_object('id', id) ORDER BY id) AS items
+    FROM (
+        SELECT vs.id AS vid, i.id, ROW_NUMBER() OVER (PARTITION BY vs.id ORDER BY i.id) AS rn
+        FROM vndb.vn_screenshots vs
+        JOIN vndb.images i ON i.id = vs.scr
+        WHERE vs.id = ANY(%(ids)s)
+    ) x
+    WHERE rn <= {SCREENSHOT_LIMIT}
+    GROUP BY vid
+),
+char_names AS (
+    -- 日本語名があればそれを、なければ最初の名前を使います
+    SELECT cn.id,
+           COALESCE((ARRAY_AGG(cn.name) FILTER (WHERE cn.lang = 'ja'))[1], (ARRAY_AGG(cn.name))[1]) AS name
+    FROM vndb.chars_names cn
+    WHERE cn.id IN (SELECT id FROM vndb.chars_vns WHERE vid = ANY(%(ids)s))
+    GROUP BY cn.id
+),
+characters AS (
+    SELECT vid, jsonb_agg(jsonb_build_object(
+               'id', id, 'name', name, 'role', role, 'image_url', image_url, 'gender', gender
+           ) ORDER BY rn) AS items
+    FROM (
+        SELECT vid, id, name, role, image_url, gender,
+               ROW_NUMBER() OVER (PARTITION BY vid ORDER BY {character_role_order()}, id) AS rn
+        FROM (
+            -- リリースごとに同じキャラクターが何行もあるので、一番重要な役割の1行にします
+            -- （page.tsx のキャラクター取得も同じ規則で、同じ並び・同じ24件になります）
+            SELECT DISTINCT ON (cv.vid, c.id)
+                   cv.vid, c.id, n.name, cv.role, c.image AS image_url, c.gender
+            FROM vndb.chars_vns cv
+            JOIN vndb.chars c ON c.id = cv.id
+            LEFT JOIN char_names n ON n.id = c.id
+            WHERE cv.vid = ANY(%(ids)s)
+            ORDER BY cv.vid, c.id, {character_role_order('cv.role')}
+        ) d
+    ) x
+    WHERE rn <= {CHARACTER_LIMIT}
+    GROUP BY vid
+),
+staff AS (
+    SELECT vid, jsonb_agg(jsonb_build_object('id', id, 'name', name, 'role', role, 'note', note)
+                          ORDER BY rn) AS items
+    FROM (
+        SELECT vs.id AS vid, vs.aid AS id, s.name, vs.role, vs.note,
+               ROW_NUMBER() OVER (PARTITION BY vs.id ORDER BY {staff_role_order('vs.role')}, s.name) AS rn
+        FROM vndb.vn_staff vs
+        JOIN vndb.staff_alias s ON vs.aid = s.aid
+        WHERE vs.id = ANY(%(ids)s)
+    ) x
+    WHERE rn <= {STAFF_LIMIT}
+    GROUP BY vid
+),
+vn_links AS (
+    SELECT ve.id AS vid,
+           jsonb_agg(jsonb_build_object('site', e.site, 'value', e.value) ORDER BY e.site, e.value) AS items
+    FROM vndb.vn_extlinks ve
+    JOIN vndb.extlinks e ON e.id = ve.link
+    WHERE ve.id = ANY(%(ids)s)
+    GROUP BY ve.id
+),
+release_links AS (
+    SELECT rv.vid, jsonb_agg(jsonb_build_object(
+               'release_id', rv.id, 'release_title', rt.title, 'site', e.site, 'value', e.value
+           ) ORDER BY rv.id, e.site, e.value) AS items
+    FROM vndb.releases_vn rv
+    JOIN vndb.releases_extlinks rel ON rel.id = rv.id
+    JOIN vndb.extlinks e ON e.id = rel.link
+    LEFT JOIN vndb.releases_titles rt ON rt.id = rv.id AND rt.lang = 'ja'
+    WHERE rv.vid = ANY(%(ids)s)
+    GROUP BY rv.vid
+),
+producer_links AS (
+    SELECT vid, jsonb_agg(jsonb_build_object(
+               'producer_id', producer_id, 'producer_name', producer_name, 'site', site, 'value', value
+           ) ORDER BY producer_name, site, value) AS items
+    FROM (
+        SELECT DISTINCT rv.vid, p.id AS producer_id, p.name AS producer_name, e.site, e.value
+        FROM vndb.releases_vn rv
+        JOIN vndb.releases_producers rp ON rp.id = rv.id
+        JOIN vndb.producers p ON p.id = rp.pid
+        JOIN vndb.producers_extlinks pe ON pe.id = p.id
+        JOIN vndb.extlinks e ON e.id = pe.link
+        WHERE rv.vid = ANY(%(ids)s)
+    ) d
+    GROUP BY vid
+),
+staff_links AS (
+    SELECT vid, jsonb_agg(jsonb_build_object(
+               'staff_id', staff_id, 'staff_name', staff_name, 'site', site, 'value', value
+           ) ORDER BY staff_name, site, value) AS items
+    FROM (
+        SELECT DISTINCT vs.id AS vid, sa.id AS staff_id, sa.name AS staff_name, e.site, e.value
+        FROM vndb.vn_staff vs
+        JOIN vndb.staff_alias sa ON sa.aid = vs.aid
+        JOIN vndb.staff_extlinks se ON se.id = sa.id
+        JOIN vndb.extlinks e ON e.id = se.link
+        WHERE vs.id = ANY(%(ids)s)
+    ) d
+    GROUP BY vid
+)
+SELECT
+    s.id,
+    jsonb_build_object(
+        'version', {DISPLAY_VERSION},
+        'vn', jsonb_build_object(
+            'id', s.id, 'title', s.title, 'title_ja', s.title_ja,
+            'rating', s.rating, 'votecount', s.votecount,
+            'description', v.description, 'c_image', v.c_image
+        ),
+        'tags', COALESCE(tg.items, '[]'::jsonb),
+        'screenshots', COALESCE(sc.items, '[]'::jsonb),
+        'characters', COALESCE(ch.items, '[]'::jsonb),
+        'staff', COALESCE(st.items, '[]'::jsonb),
+        'vn_links', COALESCE(vl.items, '[]'::jsonb),
+        'release_links', COALESCE(rl.items, '[]'::jsonb),
+        'producer_links', COALESCE(pl.items, '[]'::jsonb),
+        'staff_links', COALESCE(sl.items, '[]'::jsonb)
+    ) AS display
+FROM {TABLE} s
+JOIN vndb.vn v ON v.id = s.id
+LEFT JOIN tags tg ON tg.vid = s.id
+LEFT JOIN screenshots sc ON sc.vid = s.id
+LEFT JOIN characters ch ON ch.vid = s.id
+LEFT JOIN staff st ON st.vid = s.id
+LEFT JOIN vn_links vl ON vl.vid = s.id
+LEFT JOIN release_links rl ON rl.vid = s.id
+LEFT JOIN producer_links pl ON pl.vid = s.id
+LEFT JOIN staff_links sl ON sl.vid = s.id
+WHERE s.id = ANY(%(ids)s)
+"""
+
+# -----------------------------------------------------------------------------
+# 2. 対象の VN を決める
+# -----------------------------------------------------------------------------
+def check_source_tables(cur):
+    cur.execute("SELECT " + ", ".join(f"to_regclass('vndb.{t}') IS NOT NULL" for t in SOURCE_TABLES))
+    missing = [t for t, ok in zip(SOURCE_TABLES, cur.fetchone()) if not ok]
+    if missing:
+        sys.exit(f"vndb スキーマに次のテーブルがありません: {', '.join(missing)}"
+                 "（import_vndb_dump.py でダンプを取り込んでください）")
+
+# DISPLAY_SQL が読む列（search_vns と vndb.*）の VN ごとのハッシュ
+SOURCE_HASH_SQL = source_hash_sql(f"SELECT id FROM {TABLE}", [
+    f"SELECT id, ROW(title, title_ja, rating, votecount, tag_ids)::text FROM {TABLE}",
+    "SELECT id, ROW(description, c_image)::text FROM vndb.vn",
+    f"""SELECT s.id, ROW(t.id, t.name)::text
+        FROM {TABLE} s CROSS JOIN UNNEST(s.tag_ids) AS u(tag) JOIN vndb.tags t ON t.id = u.tag""",
+    """SELECT vs.id, i.id::text
+        FROM vndb.vn_screenshots vs JOIN vndb.images i ON i.id = vs.scr""",
+    """SELECT cv.vid, ROW(cv.id, cv.role, c.image, c.gender)::text
+        FROM vndb.chars_vns cv JOIN vndb.chars c ON c.id = cv.id""",
+    """SELECT cv.vid, ROW(cn.id, cn.lang, cn.name)::text
+        FROM vndb.chars_vns cv JOIN vndb.chars_names cn ON cn.id = cv.id""",
+    """SELECT vs.id, ROW(vs.aid, vs.role, vs.note, s.name)::text
+        FROM vndb.vn_staff vs JOIN vndb.staff_alias s ON s.aid = vs.aid""",
+    """SELECT ve.id, ROW(e.site, e.value)::text
+        FROM vndb.vn_extlinks ve JOIN vndb.extlinks e ON e.id = ve.link""",
+    """SELECT rv.vid, ROW(rv.id, rt.title, e.site, e.value)::text
+        FROM vndb.releases_vn rv
+        JOIN vndb.releases_extlinks rel ON rel.id = rv.id
+        JOIN vndb.extlinks e ON e.id = rel.link
+        LEFT JOIN vndb.releases_titles rt ON rt.id = rv.id AND rt.lang = 'ja'""",
+    """SELECT rv.vid, ROW(p.id, p.name, e.site, e.value)::text
+        FROM vndb.releases_vn rv
+        JOIN vndb.releases_producers rp ON rp.id = rv.id
+        JOIN vndb.producers p ON p.id = rp.pid
+        JOIN vndb.producers_extlinks pe ON pe.id = p.id
+        JOIN vndb.extlinks e ON e.id = pe.link""",
+    """SELECT vs.id, ROW(sa.id, sa.name, e.site, e.value)::text
+        FROM vndb.vn_staff vs
+        JOIN vndb.staff_alias sa ON sa.aid = vs.aid
+        JOIN vndb.staff_extlinks se ON se.id = sa.id
+        JOIN vndb.extlinks e ON e.id = se.link""",
+])
+
+def changed_ids(cur):
+    """
+    差分モードで計算し直す VN ID を返します。
+      - display が空の行（新しく search_vns に入った VN、search_vns を作り直した後の全行）
+      - display の版が違う行
+      - 入力（SOURCE_HASH_SQL）のハッシュが前回の記録と違う VN（前回の記録がなければ全件）
+    ハッシュは一時テーブルに残るので、書き込みが終わったら save_source_hashes() で記録します。
+    """
+    ids = set(diff_source_hashes(cur, STATE_NAME, SOURCE_HASH_SQL))
+    print(f"入力が前回から変わった VN: {len(ids)} 件")
+    cur.execute(f"SELECT id FROM {TABLE} WHERE display IS NULL OR (display->>'version')::int <> %s",
+                (DISPLAY_VERSION,))
+    ids.update(vn_id for (vn_id,) in cur.fetchall())
+    print(f"差分: {len(ids)} 件")
+    return sorted(ids)
+
+# -----------------------------------------------------------------------------
+# 3. display の書き込み
+# -----------------------------------------------------------------------------
+def update_chunk(cur, ids):
+    """ids の VN の display を計算し、内容が変わった行だけを書き込みます"""
+    cur.execute(f"""
+    UPDATE {TABLE} s
+    SET display = d.display
+    FROM ({DISPLAY_SQL}) d
+    WHERE s.id = d.id AND s.display IS DISTINCT FROM d.display
+    """, {'ids': ids})
+    return cur.rowcount
+
+def build_display(conn, ids=None, full=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    display を作ります。ids を渡せばその VN だけ、full=True なら全件、
+    どちらもなければ前回からの差分だけを計算します。
+    チャンクごとにコミットするので、途中で止めても終わった分は残ります
+    （入力のハッシュは最後まで終わったときだけ記録するので、次の差分モードで残りを計算し直します）。
+    """
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        check_source_tables(cur)
+        cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS display JSONB")
+        ensure_state_table(cur)
+        cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+        started_at = cur.fetchone()[0]
+        # ids を指定したときは一部しか計算しないので、ハッシュの記録には触りません
+        by_hash = ids is None
+        if by_hash and not full:
+            ids = changed_ids(cur)
+        elif by_hash:
+            compute_source_hashes(cur, SOURCE_HASH_SQL)
+            cur.execute(f"SELECT id FROM {TABLE} ORDER BY id")
+            ids = [vn_id for (vn_id,) in cur.fetchall()]
+    conn.commit()
+
+    total = len(ids)
+    written = 0
+    for start in range(0, total, chunk_size):
+        chunk = ids[start:start + chunk_size]
+        with conn.cursor() as cur:
+            written += update_chunk(cur, chunk)
+        conn.commit()
+        done = min(start + chunk_size, total)
+        elapsed = time.perf_counter() - started
+        print(f"\r   {done}/{total} 件（{done / elapsed:,.0f} 件/秒）", end='', flush=True)
+    if total:
+        print()
+
+    with conn.cursor() as cur:
+        if by_hash:
+            save_source_hashes(cur, STATE_NAME)
+        record_build(cur, STATE_NAME, started_at)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    print(f"✅ display を作成しました: 計算 {total} 件 / 書き込み {written} 件（{elapsed:.2f} 秒）")
+    return total, written, elapsed
+
+# -----------------------------------------------------------------------------
+# 4. ベンチマーク（全件の作成時間 + 1ページ分の取得時間の比較）
+# -----------------------------------------------------------------------------
+# page.tsx が1ページごとに実行しているクエリ（比較用。内容は page.tsx と同じです）
+PAGE_QUERIES = [
+    """SELECT v.id, v.c_rating::numeric / 10 as rating, v.c_votecount as votecount, v.description, v.c_image,
+        (SELECT t.title FROM vndb.vn_titles t WHERE t.id = v.id AND t.lang = v.olang LIMIT 1) as title,
+        (SELECT t.title FROM vndb.vn_titles t WHERE t.id = v.id AND t.lang = 'ja' LIMIT 1) as title_ja
+       FROM vndb.vn v WHERE v.id = %(id)s""",
+    """SELECT DISTINCT t.name, t.id FROM vndb.tags t JOIN vndb.tags_vn tv ON t.id = tv.tag
+       WHERE tv.vid = %(id)s AND tv.vote > 0 AND NOT tv.ignore LIMIT 20""",
+    """SELECT i.id FROM vndb.images i JOIN vndb.vn_screenshots vs ON i.id = vs.scr
+       WHERE vs.id = %(id)s LIMIT 12""",
+    f"""SELECT c.id, COALESCE(cn.name, (SELECT name FROM vndb.chars_names WHERE id = c.id LIMIT 1)) as name,
+              cv.role, c.image as image_url, c.gender
+       FROM (SELECT DISTINCT ON (id) id, role FROM vndb.chars_vns WHERE vid = %(id)s
+             ORDER BY id, {character_role_order()}) cv
+       JOIN vndb.chars c ON cv.id = c.id
+       LEFT JOIN vndb.chars_names cn ON c.id = cn.id AND cn.lang = 'ja'
+       ORDER BY {character_role_order('cv.role')}, c.id
+       LIMIT 24""",
+    f"""SELECT vs.aid as id, s.name, vs.role, vs.note
+       FROM vndb.vn_staff vs JOIN vndb.staff_alias s ON vs.aid = s.aid
+       WHERE vs.id = %(id)s ORDER BY {staff_role_order('vs.role')}, s.name LIMIT 30""",
+    """SELECT e.site, e.value FROM vndb.vn_extlinks ve JOIN vndb.extlinks e ON e.id = ve.link
+       WHERE ve.id = %(id)s ORDER BY e.site, e.value""",
+    """SELECT rv.id as release_id, rt.title as release_title, e.site, e.value
+       FROM vndb.releases_vn rv
+       JOIN vndb.releases_extlinks rel ON rel.id = rv.id
+       JOIN vndb.extlinks e ON e.id = rel.link
+       LEFT JOIN vndb.releases_titles rt ON rt.id = rv.id AND rt.lang = 'ja'
+       WHERE rv.vid = %(id)s ORDER BY rv.id, e.site, e.value""",
+    """SELECT DISTINCT p.id as producer_id, p.name as producer_name, e.site, e.value
+       FROM vndb.releases_vn rv
+       JOIN vndb.releases_producers rp ON rp.id = rv.id
+       JOIN vndb.producers p ON p.id = rp.pid
+       JOIN vndb.producers_extlinks pe ON pe.id = p.id
+       JOIN vndb.extlinks e ON e.id = pe.link
+       WHERE rv.vid = %(id)s ORDER BY p.name, e.site, e.value""",
+    """SELECT DISTINCT sa.id as staff_id, sa.name as staff_name, e.site, e.value
+       FROM vndb.vn_staff vs
+       JOIN vndb.staff_alias sa ON sa.aid = vs.aid
+       JOIN vndb.staff_extlinks se ON se.id = sa.id
+       JOIN vndb.extlinks e ON e.id = se.link
+       WHERE vs.id = %(id)s ORDER BY sa.name, e.site, e.value""",
+]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run_benchmark(conn, sample=200, chunk_size=DEFAULT_CHUNK_SIZE, seed=42):
+    """
+    1. 全件の display 作成（変わった行だけ書き込み）の時間
+    2. 変更がない状態でもう一度全件を計算した時間（差分チェックだけのコスト）
+    3. ランダムに選んだ VN について、9本のクエリと display 1行の取得時間（ミリ秒）
+    """
+    print("🏁 全件の作成（1回目）")
+    total, written, first = build_display(conn, full=True, chunk_size=chunk_size)
+    print("🏁 全件の作成（2回目・変更なし）")
+    _total, _written, second = build_display(conn, full=True, chunk_size=chunk_size)
+
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT id FROM {TABLE} ORDER BY id")
+        ids = [vn_id for (vn_id,) in cur.fetchall()]
+        ids = random.Random(seed).sample(ids, min(sample, len(ids)))
+
+        fanout, single, sizes = [], [], []
+        for vn_id in ids:
+            t0 = time.perf_counter()
+            for query in PAGE_QUERIES:
+                cur.execute(query, {'id': vn_id})
+                cur.fetchall()
+            fanout.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            cur.execute(f"SELECT display FROM {TABLE} WHERE id = %s", (vn_id,))
+            cur.fetchone()
+            single.append((time.perf_counter() - t0) * 1000)
+
+            cur.execute(f"SELECT pg_column_size(display) FROM {TABLE} WHERE id = %s", (vn_id,))
+            sizes.append(cur.fetchone()[0] or 0)
+    conn.commit()
+
+    print()
+    print(f"全件の作成: {total} 件 / {first:.2f} 秒（{total / first:,.0f} 件/秒）、書き込み {written} 件")
+    print(f"変更なしの再計算: {second:.2f} 秒（{total / second:,.0f} 件/秒）")
+    print(f"詳細ページ1件あたり（{len(ids)} 件をサンプル、ミリ秒）:")
+    print(f"{'方式':<22} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, values in [(f'従来（{len(PAGE_QUERIES)}クエリ）', fanout), ('display（主キー1回）', single)]:
+        print(f"{label:<20} {percentile(values, 0.5):>8.2f} {percentile(values, 0.95):>8.2f} "
+              f"{percentile(values, 0.99):>8.2f}")
+    print(f"display の平均サイズ: {statistics.mean(sizes) / 1024:,.1f} KiB（圧縮後）")
+
+# -----------------------------------------------------------------------------
+# 5. メイン処理
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='search_vns.display（詳細ページ用データ）を作成します')
+    parser.add_argument('--all', action='store_true', help='全件を計算し直す（変わった行だけ書き込み）')
+    parser.add_argument('--ids', nargs='+', help='計算し直す VN ID（例: v11 v17）')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'1回の UPDATE で計算する VN の数（既定: {DEFAULT_CHUNK_SIZE}）')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='全件の作成時間と、詳細ページのクエリ時間を比較する')
+    parser.add_argument('--sample', type=int, default=200, help='ベンチマークで比較する VN の数')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.benchmark:
+            run_benchmark(conn, sample=args.sample, chunk_size=args.chunk_size)
+        else:
+            build_display(conn, ids=args.ids, full=args.all, chunk_size=args.chunk_size)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
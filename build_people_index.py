@@ -0,0 +1,473 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# スタッフ・キャラクターから VN を引く索引（転置インデックス）を作るスクリプト
+#
+# 「この声優が出ている作品」「この原画家の2010年以降の作品」のような、人から VN を探す
+# 方法が今はありません。詳細ページは VN ごとに vn_staff → staff_alias、
+# chars_vns → chars → chars_names を JOIN しているだけです。ここでは:
+#   - people_vns  : (人, VN, 役割) ごとに1行。発売日（search_vns.released）も持ちます
+#                   (person_id, released) と (person_id, role, released) のインデックスで、
+#                   「この人の作品を新しい順に」「原画として関わった2010年以降の作品」が
+#                   インデックスを1回たどるだけで返ります
+#   - people_names: 名前を title_search.normalize() で正規化したもの（かな・全角半角・大文字小文字を吸収）
+#                   ローマ字表記（latin 列があるとき。かなだけの名前は latin がなくてもローマ字にします）と、
+#                   2語の名前の逆順（"Nasu Kinoko" と "Kinoko Nasu"）も入れ、1文字・2文字の n-gram で
+#                   部分一致も引けるようにします。検索語がかなだけなら、ローマ字にした語でも探します
+#
+# person_id は VNDB の ID です（スタッフは 's123'、キャラクターは 'c456'）。
+# 役割はスタッフなら vn_staff.role（scenario / art / music など）、声優は 'seiyuu'
+# （vndb.vn_seiyuu があるとき。演じたキャラクターを characters に入れます）、
+# キャラクターなら chars_vns.role（main / primary / side / appears）です。
+#
+# 差分モード（--delta）では、入力（vn_staff / chars_vns / vn_seiyuu と発売日）の VN ごとのハッシュが
+# 前回の記録（vn_source_hashes）と違う VN（または --ids の VN）の行だけを計算し直し、
+# その VN に関わる人の名前だけを入れ直します。名義の改名など VN が変わらない変更は、全件の作り直しで反映されます。
+# 作成の記録は search_vns とは別の people_vns_state に残します。
+#
+# 実行方法:
+#   python build_people_index.py                     # 全件を作り直して入れ替え
+#   python build_people_index.py --delta             # 入力が前回から変わった VN だけ反映
+#   python build_people_index.py --ids v11 v17       # 指定した VN だけ反映
+#   python build_people_index.py search きのこ --role scenario --since 2010-01-01
+#   python build_people_index.py vns s123 --role art # ID で直接引く
+# -----------------------------------------------------------------------------
+
+import argparse
+import time
+from datetime import date
+
+from db import get_db_connection, insert_values
+from build_search_vns import (
+    TABLE as SEARCH_TABLE, compute_source_hashes, diff_source_hashes, save_source_hashes, source_hash_sql,
+)
+from title_search import EXACT, PREFIX, SUBSTRING, QUALITY_LABELS, ngrams, normalize, query_grams, to_romaji
+from vn_roles import character_role_order
+
+POSTINGS = 'people_vns'
+NAMES = 'people_names'
+STATE_TABLE = f'{POSTINGS}_state'
+# vn_source_hashes に記録するときの名前
+HASH_NAME = 'people'
+
+# 全件の作り直しで使う影テーブル
+SHADOWS = {POSTINGS: 'people_vns_new', NAMES: 'people_names_new'}
+
+# 索引の計算に使う vndb スキーマのテーブル（vn_seiyuu はあるときだけ使います）
+SOURCE_TABLES = ['vn_staff', 'staff_alias', 'chars_vns']
+
+# -----------------------------------------------------------------------------
+# 1. テーブル定義とインデックス
+# -----------------------------------------------------------------------------
+def create_tables_sql(postings, names):
+    return f"""
+    CREATE TABLE IF NOT EXISTS {postings} (
+        person_id TEXT NOT NULL,        -- スタッフ 's123' / キャラクター 'c456'
+        vid TEXT NOT NULL,              -- VN ID
+        role TEXT NOT NULL,             -- scenario / art / seiyuu / main / side など
+        released DATE,                  -- VN の発売日（search_vns.released）
+        aid INTEGER,                    -- クレジットされた名義（スタッフ・声優のとき）
+        characters TEXT[],              -- 演じたキャラクター（声優のとき）
+        note TEXT,                      -- vn_staff.note など
+        PRIMARY KEY (person_id, vid, role)
+    );
+    CREATE TABLE IF NOT EXISTS {names} (
+        person_id TEXT NOT NULL,
+        kind TEXT NOT NULL,             -- name / latin / romaji（かなの名前） / reversed（2語の名前の逆順）
+        name TEXT NOT NULL,             -- 元の表記
+        normalized TEXT NOT NULL,       -- normalize() した文字列
+        grams TEXT[] NOT NULL,          -- 1文字・2文字の n-gram
+        PRIMARY KEY (person_id, normalized)
+    )
+    """
+
+def ensure_state_table(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        name TEXT PRIMARY KEY,          -- full / delta
+        built_at TIMESTAMP NOT NULL,
+        postings INTEGER,               -- people_vns の行数
+        names INTEGER                   -- people_names の行数
+    )
+    """)
+
+def record_state(cur, name, started_at):
+    cur.execute(f"""
+    INSERT INTO {STATE_TABLE} (name, built_at, postings, names)
+    VALUES (%s, %s, (SELECT COUNT(*) FROM {POSTINGS}), (SELECT COUNT(*) FROM {NAMES}))
+    ON CONFLICT (name) DO UPDATE SET
+        built_at = EXCLUDED.built_at, postings = EXCLUDED.postings, names = EXCLUDED.names
+    """, (name, started_at))
+
+# (テーブル, インデックス名の末尾, 定義)。本番では idx_<テーブル>_<末尾> という名前になります
+INDEXES = [
+    (POSTINGS, 'released', '(person_id, released DESC NULLS LAST, vid)'),          # 人 → 作品（新しい順）
+    (POSTINGS, 'role_released', '(person_id, role, released DESC NULLS LAST, vid)'),  # 人 + 役割 → 作品
+    (POSTINGS, 'vid', '(vid)'),                                                     # 差分モードで VN から引く用
+    (NAMES, 'normalized', '(normalized text_pattern_ops)'),                         # 完全一致・前方一致
+    (NAMES, 'grams', 'USING GIN (grams)'),                                          # 部分一致
+]
+
+def index_name(table, suffix):
+    return f"idx_{table}_{suffix}"
+
+# -----------------------------------------------------------------------------
+# 2. 行を作るSQL
+# -----------------------------------------------------------------------------
+def source_columns(cur):
+    """ダンプによってあったりなかったりするテーブル・列を調べます（'vn_seiyuu.cid' の形）"""
+    cur.execute("""
+    SELECT table_name || '.' || column_name FROM information_schema.columns
+    WHERE table_schema = 'vndb' AND table_name IN ('staff_alias', 'chars', 'chars_names', 'vn_seiyuu')
+    """)
+    return {column for (column,) in cur.fetchall()}
+
+def postings_sql(columns, filtered):
+    """
+    people_vns の行を返す SELECT 文です。search_vns に載っている VN だけを対象にします。
+    filtered=True のときは %(ids)s に渡した VN だけを計算します。
+    """
+    def vn_filter(column):
+        return f"WHERE {column} = ANY(%(ids)s)" if filtered else ""
+
+    parts = [f"""
+    -- 同じ人が同じ役割で別の名義でも載っていたら、最初の名義の1行にまとめます
+    SELECT sa.id AS person_id, vs.id AS vid, vs.role,
+           MIN(vs.aid) AS aid, NULL::text[] AS characters,
+           (ARRAY_AGG(NULLIF(vs.note, '') ORDER BY vs.aid))[1] AS note
+    FROM vndb.vn_staff vs
+    JOIN vndb.staff_alias sa ON sa.aid = vs.aid
+    {vn_filter('vs.id')}
+    GROUP BY sa.id, vs.id, vs.role
+    """, f"""
+    -- リリースごとに同じキャラクターが何行もあるので、一番重要な役割の1行にします
+    SELECT cv.id AS person_id, cv.vid,
+           (ARRAY_AGG(cv.role ORDER BY {character_role_order('cv.role')}))[1] AS role,
+           NULL::integer AS aid, NULL::text[] AS characters, NULL::text AS note
+    FROM vndb.chars_vns cv
+    {vn_filter('cv.vid')}
+    GROUP BY cv.id, cv.vid
+    """]
+    if 'vn_seiyuu.cid' in columns:
+        parts.append(f"""
+        -- 声優: 同じ VN で演じたキャラクターを配列にまとめます
+        SELECT sa.id AS person_id, vs.id AS vid, 'seiyuu' AS role,
+               MIN(vs.aid) AS aid, ARRAY_AGG(DISTINCT vs.cid ORDER BY vs.cid) AS characters,
+               (ARRAY_AGG(NULLIF(vs.note, '') ORDER BY vs.aid))[1] AS note
+        FROM vndb.vn_seiyuu vs
+        JOIN vndb.staff_alias sa ON sa.aid = vs.aid
+        {vn_filter('vs.id')}
+        GROUP BY sa.id, vs.id
+        """)
+    union = '\n    UNION ALL\n'.join(parts)
+    return f"""
+    SELECT p.person_id, p.vid, p.role, s.released, p.aid, p.characters, p.note
+    FROM ({union}) p
+    JOIN {SEARCH_TABLE} s ON s.id = p.vid
+    """
+
+POSTING_COLUMNS = ['person_id', 'vid', 'role', 'released', 'aid', 'characters', 'note']
+
+def source_hash(columns):
+    """postings_sql() が読む列の VN ごとのハッシュを返す SELECT 文です（差分モードで変わった VN を見つける用）"""
+    parts = [
+        f"SELECT id, released::text FROM {SEARCH_TABLE}",
+        """SELECT vs.id, ROW(sa.id, vs.aid, vs.role, vs.note)::text
+            FROM vndb.vn_staff vs JOIN vndb.staff_alias sa ON sa.aid = vs.aid""",
+        "SELECT vid, ROW(id, role)::text FROM vndb.chars_vns",
+    ]
+    if 'vn_seiyuu.cid' in columns:
+        parts.append("""SELECT vs.id, ROW(sa.id, vs.aid, vs.cid, vs.note)::text
+            FROM vndb.vn_seiyuu vs JOIN vndb.staff_alias sa ON sa.aid = vs.aid""")
+    return source_hash_sql(f"SELECT id FROM {SEARCH_TABLE}", parts)
+
+def names_sql(columns, postings, filtered):
+    """
+    (person_id, 表記, ローマ字表記) を返す SELECT 文です。postings に載っている人だけを対象にします。
+    filtered=True のときは %(persons)s に渡した人だけです。
+    """
+    latin = 'sa.latin' if 'staff_alias.latin' in columns else 'NULL::text'
+    parts = [f"SELECT sa.id AS person_id, sa.name, {latin} AS latin FROM vndb.staff_alias sa"]
+    # キャラクター名は、このスキーマでは chars_names（言語ごと）、本番のダンプでは chars.name / latin にあります
+    if 'chars_names.name' in columns:
+        parts.append("SELECT cn.id, cn.name, NULL::text FROM vndb.chars_names cn")
+    if 'chars.name' in columns:
+        chars_latin = 'c.latin' if 'chars.latin' in columns else 'NULL::text'
+        parts.append(f"SELECT c.id, c.name, {chars_latin} FROM vndb.chars c")
+    person_filter = "AND n.person_id = ANY(%(persons)s)" if filtered else ""
+    return f"""
+    SELECT n.person_id, n.name, n.latin
+    FROM ({' UNION ALL '.join(parts)}) n
+    WHERE n.person_id IN (SELECT person_id FROM {postings}) {person_filter}
+    """
+
+# -----------------------------------------------------------------------------
+# 3. 名前の正規化
+# -----------------------------------------------------------------------------
+def name_variants(name, latin):
+    """1つの名前から、索引に入れる (種類, 元の表記, 正規化した文字列) を返します"""
+    variants = []
+    for kind, text in (('name', name), ('latin', latin)):
+        if not text:
+            continue
+        variants.append((kind, text, normalize(text)))
+        # ローマ字は「姓 名」「名 姓」のどちらで入力しても見つかるように、2語なら逆順も入れます
+        words = text.split()
+        if len(words) == 2 and text.isascii():
+            variants.append(('reversed', text, normalize(f'{words[1]} {words[0]}')))
+    # かなだけの名前は、latin 列がないダンプでもローマ字で引けるようにします（漢字の名前は読みが分からないので対象外）
+    if name:
+        words = [to_romaji(normalize(word)) for word in name.split()]
+        if words and all(words):
+            variants.append(('romaji', name, ''.join(words)))
+            if len(words) == 2:
+                variants.append(('reversed', name, words[1] + words[0]))
+    return variants
+
+def name_rows(cur, sql, params=None):
+    """names_sql() の結果を people_names の行（person_id, kind, name, normalized, grams）にします"""
+    cur.execute(sql, params)
+    rows = {}
+    for person_id, name, latin in cur.fetchall():
+        for kind, text, normalized in name_variants(name, latin):
+            # 同じ人で正規化後が同じ名前（表記ゆれ・名義違い）は1つにまとめます
+            if normalized and (person_id, normalized) not in rows:
+                rows[person_id, normalized] = (person_id, kind, text, normalized, sorted(ngrams(normalized)))
+    return list(rows.values())
+
+# -----------------------------------------------------------------------------
+# 4. 全件の作り直し（影テーブル + 名前の入れ替え）
+# -----------------------------------------------------------------------------
+def check_source_tables(cur):
+    cur.execute("SELECT " + ", ".join(f"to_regclass('vndb.{t}') IS NOT NULL" for t in SOURCE_TABLES))
+    missing = [t for t, ok in zip(SOURCE_TABLES, cur.fetchone()) if not ok]
+    if missing:
+        raise RuntimeError(f"vndb スキーマに次のテーブルがありません: {', '.join(missing)}"
+                           "（import_vndb_dump.py でダンプを取り込んでください）")
+
+def build_full(conn):
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        check_source_tables(cur)
+        columns = source_columns(cur)
+        cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+        started_at = cur.fetchone()[0]
+        # 次の差分モードで比べる入力のハッシュ（記録は入れ替えのあと）
+        compute_source_hashes(cur, source_hash(columns))
+
+        # --- A. 影テーブルに投入（本番のテーブルには触れません） ---
+        postings, names = SHADOWS[POSTINGS], SHADOWS[NAMES]
+        cur.execute(f"DROP TABLE IF EXISTS {postings}, {names}")
+        cur.execute(create_tables_sql(postings, names))
+        cur.execute(f"INSERT INTO {postings} ({', '.join(POSTING_COLUMNS)}) {postings_sql(columns, filtered=False)}",
+                    {})
+        posting_count = cur.rowcount
+        rows = name_rows(cur, names_sql(columns, postings, filtered=False))
+        insert_values(cur, f"INSERT INTO {names} (person_id, kind, name, normalized, grams) VALUES %s", rows)
+        print(f"{posting_count} 件の (人, VN, 役割) と {len(rows)} 件の名前を作成しました"
+              f"（{time.perf_counter() - started:.1f} 秒）")
+
+        # --- B. インデックス作成と統計情報の更新 ---
+        for table, suffix, definition in INDEXES:
+            cur.execute(f"CREATE INDEX {index_name(SHADOWS[table], suffix)} ON {SHADOWS[table]} {definition}")
+        cur.execute(f"ANALYZE {postings}")
+        cur.execute(f"ANALYZE {names}")
+
+        # --- C. 入れ替え（読む側は古い完成版か新しい完成版のどちらかを見ます） ---
+        cur.execute("SET LOCAL lock_timeout = '10s'")
+        for table, shadow in SHADOWS.items():
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+            cur.execute(f"ALTER INDEX {shadow}_pkey RENAME TO {table}_pkey")
+        for table, suffix, _definition in INDEXES:
+            cur.execute(f"ALTER INDEX {index_name(SHADOWS[table], suffix)} RENAME TO {index_name(table, suffix)}")
+
+        save_source_hashes(cur, HASH_NAME)
+        ensure_state_table(cur)
+        record_state(cur, 'full', started_at)
+    conn.commit()
+    print(f"✅ {POSTINGS} / {NAMES} を作り直しました（合計 {time.perf_counter() - started:.1f} 秒）")
+
+# -----------------------------------------------------------------------------
+# 5. 差分の反映（変わった VN の行と、その VN に関わる人の名前だけ）
+# -----------------------------------------------------------------------------
+def refresh_delta(conn, ids=None):
+    """
+    ids（なければ入力のハッシュが前回の記録と違う VN）の行を計算し直し、内容が変わった行だけを書き換えます。
+    前回の記録がない場合は全 VN が対象になります。テーブルがまだなければ全件を作り直します。
+    """
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        check_source_tables(cur)
+        columns = source_columns(cur)
+        ensure_state_table(cur)
+        cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+        started_at = cur.fetchone()[0]
+        cur.execute(f"SELECT to_regclass('{POSTINGS}') IS NOT NULL AND to_regclass('{NAMES}') IS NOT NULL")
+        exists = cur.fetchone()[0]
+        if not exists:
+            conn.rollback()
+            build_full(conn)
+            return
+        by_hash = ids is None
+        if by_hash:
+            ids = diff_source_hashes(cur, HASH_NAME, source_hash(columns))
+            print(f"入力が前回から変わった VN: {len(ids)} 件")
+
+        params = {'ids': list(ids)}
+
+    with conn.cursor() as cur:
+        # --- A. 計算し直した行を一時テーブルに置く ---
+        cur.execute(f"CREATE TEMP TABLE people_vns_delta ON COMMIT DROP AS {postings_sql(columns, filtered=True)}",
+                    params)
+
+        # --- B. なくなった行を削除し、変わった行だけ UPSERT ---
+        # search_vns から消えた VN の行も、ここで一緒に削除します
+        cur.execute(f"""
+        DELETE FROM {POSTINGS} p
+        WHERE (p.vid = ANY(%(ids)s) OR NOT EXISTS (SELECT 1 FROM {SEARCH_TABLE} s WHERE s.id = p.vid))
+          AND NOT EXISTS (
+              SELECT 1 FROM people_vns_delta d
+              WHERE d.person_id = p.person_id AND d.vid = p.vid AND d.role = p.role
+          )
+        RETURNING p.person_id
+        """, params)
+        removed = cur.fetchall()
+        columns_list = ', '.join(POSTING_COLUMNS)
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in POSTING_COLUMNS[3:])
+        old_values = ', '.join(f'p.{c}' for c in POSTING_COLUMNS[3:])
+        new_values = ', '.join(f'EXCLUDED.{c}' for c in POSTING_COLUMNS[3:])
+        cur.execute(f"""
+        INSERT INTO {POSTINGS} AS p ({columns_list})
+        SELECT {columns_list} FROM people_vns_delta
+        ON CONFLICT (person_id, vid, role) DO UPDATE SET {updates}
+        WHERE ({old_values}) IS DISTINCT FROM ({new_values})
+        RETURNING p.person_id
+        """)
+        written = cur.fetchall()
+
+        # --- C. 行が増減した人の名前を入れ直す ---
+        persons = sorted({person_id for (person_id,) in removed + written})
+        rows = name_rows(cur, names_sql(columns, POSTINGS, filtered=True), {'persons': persons})
+        cur.execute(f"DELETE FROM {NAMES} WHERE person_id = ANY(%s)", (persons,))
+        insert_values(cur, f"INSERT INTO {NAMES} (person_id, kind, name, normalized, grams) VALUES %s", rows)
+
+        if by_hash:
+            save_source_hashes(cur, HASH_NAME)
+        record_state(cur, 'delta', started_at)
+    conn.commit()
+    print(f"✅ 差分を反映しました: VN {len(ids)} 件 → 書き込み {len(written)} 行 / 削除 {len(removed)} 行、"
+          f"名前を入れ直した人 {len(persons)} 人（{time.perf_counter() - started:.2f} 秒）")
+
+# -----------------------------------------------------------------------------
+# 6. 検索
+# -----------------------------------------------------------------------------
+SEARCH_SQL = f"""
+SELECT n.person_id,
+       MIN(CASE WHEN n.normalized = %(q)s THEN {EXACT}
+                WHEN LEFT(n.normalized, %(length)s) = %(q)s THEN {PREFIX}
+                ELSE {SUBSTRING} END) AS quality,
+       (ARRAY_AGG(n.name ORDER BY n.kind <> 'name', n.name))[1] AS name
+FROM {NAMES} n
+WHERE n.grams @> %(grams)s::text[] AND STRPOS(n.normalized, %(q)s) > 0
+GROUP BY n.person_id
+ORDER BY quality, n.person_id
+LIMIT %(limit)s
+"""
+
+def search_people(cur, text, limit=10):
+    """
+    名前で人を探して (person_id, 一致の質, 名前) を返します。
+    かなで入力したときは、ローマ字（latin 列）の名前も探して、人ごとに良いほうの一致を使います。
+    """
+    q = normalize(text)
+    if not q:
+        return []
+    found = {}
+    for query in dict.fromkeys([q, to_romaji(q)]):
+        if not query:
+            continue
+        cur.execute(SEARCH_SQL, {'q': query, 'length': len(query), 'grams': query_grams(query), 'limit': limit})
+        for person_id, quality, name in cur.fetchall():
+            if person_id not in found or quality < found[person_id][1]:
+                found[person_id] = (person_id, quality, name)
+    return sorted(found.values(), key=lambda row: (row[1], row[0]))[:limit]
+
+def person_vns(cur, person_id, role=None, since=None, until=None, limit=50):
+    """
+    その人が関わった VN を新しい順に返します: (VN ID, 役割, 発売日, タイトル, 日本語タイトル, 演じたキャラクター)
+    role・since・until はインデックスの範囲の条件になるので、並び替えは発生しません。
+    """
+    conditions = ["p.person_id = %(person)s"]
+    if role:
+        conditions.append("p.role = %(role)s")
+    if since:
+        conditions.append("p.released >= %(since)s")
+    if until:
+        conditions.append("p.released <= %(until)s")
+    cur.execute(f"""
+    SELECT p.vid, p.role, p.released, s.title, s.title_ja, p.characters
+    FROM {POSTINGS} p
+    JOIN {SEARCH_TABLE} s ON s.id = p.vid
+    WHERE {' AND '.join(conditions)}
+    ORDER BY p.released DESC NULLS LAST, p.vid
+    LIMIT %(limit)s
+    """, {'person': person_id, 'role': role, 'since': since, 'until': until, 'limit': limit})
+    return cur.fetchall()
+
+def print_vns(rows):
+    for vn_id, role, released, title, title_ja, characters in rows:
+        played = f"  （{', '.join(characters)}）" if characters else ''
+        print(f"   {vn_id:>7}  {role:<10}  {released or '未定'}  {title_ja or title}{played}")
+
+# -----------------------------------------------------------------------------
+# 7. メイン処理
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='スタッフ・キャラクターから VN を引く索引')
+    parser.add_argument('--delta', action='store_true', help='全件を作り直さず、変わった VN だけ反映する')
+    parser.add_argument('--ids', nargs='+', help='差分モードで計算し直す VN ID（例: v11 v17）')
+    sub = parser.add_subparsers(dest='command')
+    search = sub.add_parser('search', help='名前で探して、関わった VN を表示する')
+    search.add_argument('text')
+    vns = sub.add_parser('vns', help='ID（s123 / c456）で関わった VN を表示する')
+    vns.add_argument('person_id')
+    for p in (search, vns):
+        p.add_argument('--role', help='役割で絞り込む（例: scenario / art / seiyuu / main）')
+        p.add_argument('--since', type=date.fromisoformat, help='この日以降の発売（YYYY-MM-DD）')
+        p.add_argument('--until', type=date.fromisoformat, help='この日までの発売（YYYY-MM-DD）')
+        p.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.command is None:
+            if args.delta or args.ids:
+                refresh_delta(conn, ids=args.ids)
+            else:
+                build_full(conn)
+            return
+
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+            if args.command == 'vns':
+                cur.execute(f"SELECT name FROM {NAMES} WHERE person_id = %s ORDER BY kind <> 'name', name LIMIT 1",
+                            (args.person_id,))
+                row = cur.fetchone()
+                people = [(args.person_id, EXACT, row[0] if row else '')]
+            else:
+                print(f"正規化: {args.text!r} → {normalize(args.text)!r}")
+                people = search_people(cur, args.text, limit=5)
+            for person_id, quality, name in people:
+                rows = person_vns(cur, person_id, role=args.role, since=args.since, until=args.until,
+                                  limit=args.limit)
+                print(f"👤 {person_id} {name}（{QUALITY_LABELS[quality]}）: {len(rows)} 件")
+                print_vns(rows)
+            print(f"🔍 {len(people)} 人（{(time.perf_counter() - t0) * 1000:.2f} ms）")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# search_vns（検索用の非正規化テーブル）を作り直すスクリプト
+#
+# sql/create_search_vns.sql は TRUNCATE してから入れ直すため、処理中はトップページが
+# 空や途中までのデータを読んでしまいます。また1行ごとに vn_titles / tags_vn への
+# 相関サブクエリを3回実行していました。このスクリプトでは:
+#   - タイトルとタグ配列を GROUP BY でまとめて1回だけ集計し、
+#   - 影テーブル（search_vns_new）に投入してインデックスまで作成してから、
+#   - 1トランザクションの中で名前を入れ替えます（読む側は常に完成したテーブルを見ます）
+#
+# 差分モード（--delta）では、変わった行だけを UPDATE / INSERT / DELETE します。
+# 計算し直す VN は、入力（vndb.vn / vn_titles / tags_vn の行）の VN ごとのハッシュを
+# 前回の記録（vn_source_hashes）と比べて決めます。ダンプを入れ直して vndb.* が変わった分だけが対象です。
+# ※ 差分モードで減るのは書き込み側（行の書き換え・インデックスの更新・WAL・読む側のロック）だけです。
+#   vndb.* には行ごとの更新日時がないので、ハッシュを作るために毎回 vn / vn_titles / tags_vn を
+#   全件読んで集計します。読み込みの量は全件の作り直しとほとんど変わりません。
+#
+# ランキングも作成時に計算しておきます（表示のたびに並び替えなくて済むように）:
+#   - score: 投票数の少ない VN が上位に来すぎないよう、全体の平均点に寄せたベイズ平均
+#       score = (votecount * rating + m * C) / (votecount + m)
+#       C = 評価のある VN の平均点、m = 投票数の中央値（--prior-votes で指定も可）
+#   - rank_score / rank_votecount / rank_released: 同じ値は同じ順位にする順位（dense_rank）
+#   - tag_top_vns: タグ（親タグを含む）ごとの score 上位 TAG_TOP_N 件を配列で1行に
+#     「タグ X のおすすめ」は主キーで1行読むだけになります
+#
+# タグの票も (VN, タグ) ごとにまとめ、tag_ids と同じ順番の配列で持ちます:
+#   tag_scores（平均点）/ tag_votes（票数）/ tag_spoilers（最大のネタバレ度 0〜2）
+# 「タグ X が 2 点以上で、大きなネタバレではない」は tags_vn を JOIN せずに1行で判定できます:
+#   SELECT id FROM search_vns
+#   WHERE tag_ids @> ARRAY[X] AND EXISTS (
+#       SELECT 1 FROM UNNEST(tag_ids, tag_scores, tag_spoilers) AS u(tag, score, spoiler)
+#       WHERE tag = X AND score >= 2 AND spoiler < 2)
+#
+# 実行方法:
+#   python build_search_vns.py            # 全件を作り直して入れ替え
+#   python build_search_vns.py --delta    # vndb.* の入力が前回から変わった VN だけ反映
+#   python build_search_vns.py --prior-votes 50   # ベイズ平均の m を指定して作り直す
+# -----------------------------------------------------------------------------
+
+import argparse
+import time
+
+from db import get_db_connection
+from build_tag_closure import ensure_closure_table
+
+TABLE = 'search_vns'
+SHADOW = 'search_vns_new'
+TAG_TOP = 'tag_top_vns'
+TAG_TOP_SHADOW = 'tag_top_vns_new'
+
+# タグごとに保存する上位の件数
+TAG_TOP_N = 100
+
+# -----------------------------------------------------------------------------
+# 1. テーブル定義とインデックス
+# -----------------------------------------------------------------------------
+# 列の定義（以前の sql/create_search_vns.sql の列に、後から足した列を続けています）
+COLUMNS = [
+    ('id', 'TEXT PRIMARY KEY'),       # VN ID (例: "v11")
+    ('title', 'TEXT'),                # 原語タイトル
+    ('title_ja', 'TEXT'),             # 日本語タイトル
+    ('released', 'DATE'),             # 発売日
+    ('rating', 'NUMERIC'),            # 評価点 (0-100)
+    ('votecount', 'INTEGER'),         # 投票数
+    ('tag_ids', 'INTEGER[]'),         # タグIDの配列 (GINインデックス用)
+    ('cover_url', 'TEXT'),            # パッケージ画像URL
+    ('display', 'JSONB'),             # 詳細ページ用のまとめデータ (build_display.py)
+    ('tag_ids_closure', 'INTEGER[]'), # tag_ids + その祖先タグ (階層検索用)
+    ('score', 'NUMERIC'),             # 投票数で重みをつけた評価点（ベイズ平均）
+    ('rank_score', 'INTEGER'),        # score の順位（1 が最上位、値がなければ NULL）
+    ('rank_votecount', 'INTEGER'),    # 投票数の順位
+    ('rank_released', 'INTEGER'),     # 発売日の新しい順の順位
+    ('tag_scores', 'REAL[]'),         # タグごとの平均点（tag_ids と同じ順番）
+    ('tag_votes', 'INTEGER[]'),       # タグごとの票数（同上）
+    ('tag_spoilers', 'SMALLINT[]'),   # タグごとの最大のネタバレ度 0〜2（同上）
+]
+
+# このスクリプトで vndb スキーマから計算する列（display は build_display.py で埋めます）
+# score と順位の列は、全体を見て決まるので update_ranks() で別に計算します
+BUILT_COLUMNS = ['id', 'title', 'title_ja', 'released', 'rating', 'votecount', 'tag_ids', 'cover_url',
+                 'tag_ids_closure', 'tag_scores', 'tag_votes', 'tag_spoilers']
+
+# (インデックス名の末尾, 定義)。本番では idx_search_vns_<末尾> という名前になります
+# 並び替え用は id まで含めて、同じ値の行の順番も決まるようにしています
+# （read_api.py のキーセット方式のページ送りが、インデックスをたどるだけで済むように）
+INDEXES = [
+    ('rating_id', '(rating DESC NULLS LAST, id DESC)'),        # 評価順ソート用
+    ('votecount_id', '(votecount DESC NULLS LAST, id DESC)'),  # 投票数順ソート用
+    ('released_id', '(released DESC NULLS LAST, id DESC)'),    # 発売日順ソート用
+    ('score_id', '(score DESC NULLS LAST, id DESC)'),          # おすすめ順ソート用
+    ('tag_ids', 'USING GIN (tag_ids)'),            # タグ検索用
+    ('tag_ids_closure', 'USING GIN (tag_ids_closure)'),  # 親タグも含めたタグ検索用
+]
+
+# 以前の定義（id を含まない並び替え用）。上の *_id に含まれるので差分モードで削除します
+OBSOLETE_INDEXES = ['rating', 'votecount', 'released']
+
+def create_table_sql(table):
+    columns = ',\n    '.join(f'{name} {definition}' for name, definition in COLUMNS)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    {columns}\n)"
+
+def create_tag_top_sql(table):
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        tag_id INTEGER PRIMARY KEY,     -- タグID（子タグの VN も含みます）
+        vn_ids INTEGER[] NOT NULL,      -- VN の番号（'v' を除いた数字）。score の高い順
+        scores REAL[] NOT NULL          -- score（vn_ids と同じ順）
+    )
+    """
+
+def index_name(table, suffix):
+    return f"idx_{table}_{suffix}"
+
+# -----------------------------------------------------------------------------
+# 2. 行を作るSQL（集計はVNごとではなく、テーブル全体で1回ずつ）
+# -----------------------------------------------------------------------------
+def rows_sql(filtered):
+    """
+    search_vns の行を返す SELECT 文です。
+    filtered=True のときは %(ids)s に渡した VN だけを対象にします。
+    """
+    vn_filter = "WHERE v.id = ANY(%(ids)s)" if filtered else ""
+    tag_filter = "AND tv.vid = ANY(%(ids)s)" if filtered else ""
+    return f"""
+    WITH titles AS (
+        -- 原語タイトルと日本語タイトルを、VNごとに1回の集計で取り出します
+        SELECT
+            t.id,
+            (ARRAY_AGG(t.title) FILTER (WHERE t.lang = v.olang))[1] AS title,
+            (ARRAY_AGG(t.title) FILTER (WHERE t.lang = 'ja'))[1] AS title_ja
+        FROM vndb.vn_titles t
+        JOIN vndb.vn v ON v.id = t.id
+        {vn_filter}
+        GROUP BY t.id
+    ),
+    tag_votes AS (
+        -- (VN, タグ) ごとに ignore でない票をまとめます
+        -- 1票でも vote > 0 があるタグだけを残します（従来の tag_ids と同じタグの集合）
+        SELECT tv.vid, tv.tag,
+               ROUND(AVG(tv.vote), 2)::real AS score,
+               COUNT(*)::integer AS votes,
+               COALESCE(MAX(tv.spoiler), 0)::smallint AS spoiler
+        FROM vndb.tags_vn tv
+        WHERE NOT tv.ignore {tag_filter}
+        GROUP BY tv.vid, tv.tag
+        HAVING BOOL_OR(tv.vote > 0)
+    ),
+    tags AS (
+        -- タグIDの配列と、同じ順番（タグIDの昇順）の平均点・票数・ネタバレ度の配列
+        SELECT vid AS id,
+               ARRAY_AGG(tag ORDER BY tag) AS tag_ids,
+               ARRAY_AGG(score ORDER BY tag) AS tag_scores,
+               ARRAY_AGG(votes ORDER BY tag) AS tag_votes,
+               ARRAY_AGG(spoiler ORDER BY tag) AS tag_spoilers
+        FROM tag_votes
+        GROUP BY vid
+    ),
+    closure AS (
+        -- 直接のタグに、その祖先タグ（tag_closure）をすべて足した配列
+        -- 閉包に載っていない新しいタグは、そのタグ自身だけを入れます
+        SELECT tg.id, ARRAY_AGG(DISTINCT COALESCE(c.ancestor_id, tg.tag)) AS tag_ids_closure
+        FROM (SELECT id, UNNEST(tag_ids) AS tag FROM tags) tg
+        LEFT JOIN tag_closure c ON c.descendant_id = tg.tag
+        GROUP BY tg.id
+    )
+    SELECT
+        v.id,
+        ti.title,
+        ti.title_ja,
+        -- YYYYMMDD形式を日付に変換（99999999 = 未定 は NULL）
+        CASE
+            WHEN v.c_released > 0 AND v.c_released < 99990000 THEN
+                TO_DATE(LPAD(v.c_released::text, 8, '0'), 'YYYYMMDD')
+            ELSE NULL
+        END AS released,
+        -- 評価点（10で割って100点満点に）
+        v.c_rating::numeric / 10 AS rating,
+        v.c_votecount AS votecount,
+        tg.tag_ids,
+        -- カバー画像URL（バケット計算込み）
+        CASE
+            WHEN v.c_image IS NOT NULL THEN
+                'https://s2.vndb.org/cv/' ||
+                LPAD((SUBSTRING(v.c_image FROM 3)::integer %% 100)::text, 2, '0') ||
+                '/' || SUBSTRING(v.c_image FROM 3) || '.jpg'
+            ELSE NULL
+        END AS cover_url,
+        cl.tag_ids_closure,
+        tg.tag_scores,
+        tg.tag_votes,
+        tg.tag_spoilers
+    FROM vndb.vn v
+    LEFT JOIN titles ti ON ti.id = v.id
+    LEFT JOIN tags tg ON tg.id = v.id
+    LEFT JOIN closure cl ON cl.id = v.id
+    {vn_filter}
+    """
+
+# -----------------------------------------------------------------------------
+# 3. 前回の作成日時と、VN ごとの入力のハッシュの記録
+# -----------------------------------------------------------------------------
+def ensure_state_table(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS search_vns_build_state (
+        name TEXT PRIMARY KEY,
+        built_at TIMESTAMP NOT NULL,
+        row_count INTEGER
+    )
+    """)
+
+def record_build(cur, name, started_at):
+    """作成を開始した時刻を記録します（処理中に更新されたVNは次回の差分に含まれます）"""
+    cur.execute(f"SELECT COUNT(*) FROM {TABLE}")
+    row_count = cur.fetchone()[0]
+    cur.execute("""
+    INSERT INTO search_vns_build_state (name, built_at, row_count)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (name) DO UPDATE SET built_at = EXCLUDED.built_at, row_count = EXCLUDED.row_count
+    """, (name, started_at, row_count))
+    return row_count
+
+def source_hash_sql(base, parts):
+    """
+    VN ごとの入力のハッシュ (id, source_hash) を返す SELECT 文です。
+    base は対象の VN ID を返す SELECT、parts は (VN ID, 入力の1行を文字列にしたもの) を返す SELECT のリストです。
+    入力の行が1つでも増減・変化すれば、その VN のハッシュが変わります。
+    """
+    joins, hashes = [], []
+    for i, sql in enumerate(parts):
+        joins.append(f"""
+    LEFT JOIN (
+        SELECT vid, md5(string_agg(item, E'\\n' ORDER BY item)) AS h
+        FROM ({sql}) AS x(vid, item)
+        GROUP BY vid
+    ) p{i} ON p{i}.vid = b.id""")
+        hashes.append(f"COALESCE(p{i}.h, '')")
+    return f"""
+    SELECT b.id, md5(concat_ws('|', {', '.join(hashes)})) AS source_hash
+    FROM ({base}) AS b(id){''.join(joins)}
+    """
+
+# search_vns の行を作るのに使う vndb.* の列（rows_sql() で読んでいるもの）
+SOURCE_HASH_SQL = source_hash_sql("SELECT id FROM vndb.vn", [
+    "SELECT id, ROW(olang, c_released, c_rating, c_votecount, c_image)::text FROM vndb.vn",
+    "SELECT id, ROW(lang, title)::text FROM vndb.vn_titles",
+    "SELECT vid, ROW(tag, vote, spoiler, ignore)::text FROM vndb.tags_vn",
+])
+
+def ensure_source_hash_table(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS vn_source_hashes (
+        name TEXT NOT NULL,             -- 記録したスクリプト（search_vns / display / people）
+        id TEXT NOT NULL,               -- VN ID
+        source_hash TEXT NOT NULL,      -- source_hash_sql() のハッシュ
+        PRIMARY KEY (name, id)
+    )
+    """)
+
+def compute_source_hashes(cur, hash_sql):
+    """
+    今の入力のハッシュを一時テーブル（source_hashes_new）に置きます。
+    全件を作り直すときは前回との比較はいらないので、これだけを呼んで最後に save_source_hashes() で記録します。
+    """
+    ensure_source_hash_table(cur)
+    cur.execute("DROP TABLE IF EXISTS source_hashes_new")
+    # チャンクごとにコミットする build_display.py でも使えるよう、ON COMMIT DROP にはしません
+    cur.execute(f"CREATE TEMP TABLE source_hashes_new AS {hash_sql}")
+
+def diff_source_hashes(cur, name, hash_sql):
+    """
+    compute_source_hashes() で今の入力のハッシュを計算し、name で前回記録したハッシュと
+    違う VN（増えた VN・消えた VN を含む）の ID を返します。前回の記録がなければ全件です。
+    """
+    compute_source_hashes(cur, hash_sql)
+    cur.execute("""
+    SELECT COALESCE(n.id, o.id)
+    FROM source_hashes_new n
+    FULL JOIN (SELECT id, source_hash FROM vn_source_hashes WHERE name = %s) o ON o.id = n.id
+    WHERE n.source_hash IS DISTINCT FROM o.source_hash
+    """, (name,))
+    return sorted(vn_id for (vn_id,) in cur.fetchall())
+
+def save_source_hashes(cur, name):
+    """compute_source_hashes() で計算したハッシュを記録します（書き込みと同じトランザクションで呼んでください）"""
+    cur.execute("""
+    DELETE FROM vn_source_hashes o
+    WHERE o.name = %s AND NOT EXISTS (SELECT 1 FROM source_hashes_new n WHERE n.id = o.id)
+    """, (name,))
+    cur.execute("""
+    INSERT INTO vn_source_hashes AS o (name, id, source_hash)
+    SELECT %s, id, source_hash FROM source_hashes_new
+    ON CONFLICT (name, id) DO UPDATE SET source_hash = EXCLUDED.source_hash
+    WHERE o.source_hash <> EXCLUDED.source_hash
+    """, (name,))
+    cur.execute("DROP TABLE source_hashes_new")
+
+# -----------------------------------------------------------------------------
+# 4. ランキング（ベイズ平均・順位・タグごとの上位）
+# -----------------------------------------------------------------------------
+def ensure_prior_table(cur):
+    # 差分モードでは、全件作成のときに決めた C と m をそのまま使います
+    # （毎回計算し直すと、1件変わっただけで全行の score が少しずつ変わってしまうため）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS search_vns_rank_prior (
+        name TEXT PRIMARY KEY,
+        mean_rating NUMERIC,      -- C: 評価のある VN の平均点
+        prior_votes NUMERIC,      -- m: この票数分だけ C に寄せます
+        built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def choose_prior(cur, table, prior_votes=None):
+    """table から (C, m) を決めます。prior_votes を渡すと m はその値にします"""
+    cur.execute(f"""
+    SELECT ROUND(AVG(rating), 2),
+           ROUND((PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY votecount))::numeric, 1)
+    FROM {table}
+    WHERE rating IS NOT NULL AND votecount > 0
+    """)
+    mean_rating, median_votes = cur.fetchone()
+    return mean_rating, (prior_votes if prior_votes is not None else median_votes)
+
+def load_prior(cur):
+    ensure_prior_table(cur)
+    cur.execute("SELECT mean_rating, prior_votes FROM search_vns_rank_prior WHERE name = 'score'")
+    return cur.fetchone()
+
+def save_prior(cur, prior):
+    ensure_prior_table(cur)
+    cur.execute("""
+    INSERT INTO search_vns_rank_prior (name, mean_rating, prior_votes, built_at)
+    VALUES ('score', %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET
+        mean_rating = EXCLUDED.mean_rating, prior_votes = EXCLUDED.prior_votes, built_at = CURRENT_TIMESTAMP
+    """, prior)
+
+def update_ranks(cur, table, prior):
+    """
+    score と3つの順位を計算し、値が変わった行だけ書き換えます。書き換えた行数を返します。
+    順位はテーブル全体で決まるので、1件の投票数が増えただけでも、その下の行の順位はずれます。
+    """
+    mean_rating, prior_votes = prior
+    cur.execute(f"""
+    UPDATE {table} s
+    SET score = r.score, rank_score = r.rank_score,
+        rank_votecount = r.rank_votecount, rank_released = r.rank_released
+    FROM (
+        SELECT
+            id, score,
+            -- NULLS LAST なので、値のある行の順位は NULL の行に影響されません
+            CASE WHEN score IS NOT NULL THEN DENSE_RANK() OVER (ORDER BY score DESC NULLS LAST) END
+                AS rank_score,
+            CASE WHEN votecount IS NOT NULL THEN DENSE_RANK() OVER (ORDER BY votecount DESC NULLS LAST) END
+                AS rank_votecount,
+            CASE WHEN released IS NOT NULL THEN DENSE_RANK() OVER (ORDER BY released DESC NULLS LAST) END
+                AS rank_released
+        FROM (
+            SELECT
+                id, votecount, released,
+                CASE WHEN rating IS NOT NULL AND votecount > 0 THEN
+                    ROUND((votecount * rating + %(m)s::numeric * %(c)s::numeric)
+                          / (votecount + %(m)s::numeric), 2)
+                END AS score
+            FROM {table}
+        ) b
+    ) r
+    WHERE r.id = s.id
+      AND (s.score, s.rank_score, s.rank_votecount, s.rank_released)
+          IS DISTINCT FROM (r.score, r.rank_score, r.rank_votecount, r.rank_released)
+    """, {'c': mean_rating, 'm': prior_votes})
+    return cur.rowcount
+
+def tag_top_sql(source, filtered):
+    """
+    タグごとの上位 %(n)s 件を返す SELECT 文です（並び順は score_id インデックスと同じ）。
+    filtered=True のときは %(tags)s に渡したタグだけを計算します。
+    """
+    tag_filter = "AND s.tag_ids_closure && %(tags)s AND t.tag_id = ANY(%(tags)s)" if filtered else ""
+    return f"""
+    SELECT tag_id, ARRAY_AGG(vn ORDER BY rn) AS vn_ids, ARRAY_AGG(score ORDER BY rn) AS scores
+    FROM (
+        SELECT
+            t.tag_id,
+            SUBSTRING(s.id FROM 2)::integer AS vn,
+            s.score::real AS score,
+            ROW_NUMBER() OVER (PARTITION BY t.tag_id ORDER BY s.score DESC, s.id DESC) AS rn
+        FROM {source} s
+        CROSS JOIN UNNEST(s.tag_ids_closure) AS t(tag_id)
+        WHERE s.score IS NOT NULL {tag_filter}
+    ) r
+    WHERE rn <= %(n)s
+    GROUP BY tag_id
+    """
+
+def refresh_tag_top(cur, tags=None):
+    """
+    tag_top_vns のうち、tags のリストだけを計算し直して、変わった行だけ書き換えます。
+    tags=None のときはすべてのタグです。(書き込み件数, 削除件数) を返します。
+    """
+    cur.execute(create_tag_top_sql(TAG_TOP))
+    filtered = tags is not None
+    if filtered and not tags:
+        return 0, 0
+    params = {'tags': sorted(tags or []), 'n': TAG_TOP_N}
+    cur.execute(f"CREATE TEMP TABLE tag_top_delta AS {tag_top_sql(TABLE, filtered)}", params)
+    cur.execute(f"""
+    INSERT INTO {TAG_TOP} AS t (tag_id, vn_ids, scores)
+    SELECT tag_id, vn_ids, scores FROM tag_top_delta
+    ON CONFLICT (tag_id) DO UPDATE SET vn_ids = EXCLUDED.vn_ids, scores = EXCLUDED.scores
+    WHERE (t.vn_ids, t.scores) IS DISTINCT FROM (EXCLUDED.vn_ids, EXCLUDED.scores)
+    """)
+    written = cur.rowcount
+    tag_filter = "t.tag_id = ANY(%(tags)s) AND" if filtered else ""
+    cur.execute(f"""
+    DELETE FROM {TAG_TOP} t
+    WHERE {tag_filter} NOT EXISTS (SELECT 1 FROM tag_top_delta d WHERE d.tag_id = t.tag_id)
+    """, params)
+    deleted = cur.rowcount
+    # 同じトランザクションで何度呼んでもよいように、すぐに消しておきます
+    cur.execute("DROP TABLE tag_top_delta")
+    return written, deleted
+
+# -----------------------------------------------------------------------------
+# 5. 全件の作り直し（影テーブル + 名前の入れ替え）
+# -----------------------------------------------------------------------------
+def rebuild_full(conn, prior_votes=None):
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+        started_at = cur.fetchone()[0]
+
+        # --- A. 影テーブルを作ってデータを入れる（本番の search_vns には触れません） ---
+        ensure_closure_table(cur)  # まだ build_tag_closure.py を実行していなくても動くように
+        # 次の差分モードで比べる入力のハッシュ（記録は入れ替えのあと）
+        compute_source_hashes(cur, SOURCE_HASH_SQL)
+        cur.execute(f"DROP TABLE IF EXISTS {SHADOW}")
+        cur.execute(create_table_sql(SHADOW))
+        columns = ', '.join(BUILT_COLUMNS)
+        cur.execute(f"INSERT INTO {SHADOW} ({columns}) {rows_sql(filtered=False)}", {})
+        print(f"影テーブルに {cur.rowcount} 件を投入しました（{time.perf_counter() - started:.1f} 秒）")
+
+        # display は別の処理（build_display.py）で作るので、今の値を引き継いでおきます
+        # （引き継がないと、作り直すまで詳細ページが従来のクエリに戻ってしまいます）
+        cur.execute(f"SELECT to_regclass('{TABLE}') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute(f"""
+            UPDATE {SHADOW} n SET display = o.display
+            FROM {TABLE} o
+            WHERE o.id = n.id AND o.display IS NOT NULL
+            """)
+
+        # --- B. score・順位と、タグごとの上位リスト ---
+        prior = choose_prior(cur, SHADOW, prior_votes)
+        update_ranks(cur, SHADOW, prior)
+        cur.execute(f"DROP TABLE IF EXISTS {TAG_TOP_SHADOW}")
+        cur.execute(create_tag_top_sql(TAG_TOP_SHADOW))
+        cur.execute(f"INSERT INTO {TAG_TOP_SHADOW} (tag_id, vn_ids, scores) {tag_top_sql(SHADOW, filtered=False)}",
+                    {'n': TAG_TOP_N})
+        print(f"ランキングを計算しました: C = {prior[0]}, m = {prior[1]}、"
+              f"タグ {cur.rowcount} 件の上位リスト（{time.perf_counter() - started:.1f} 秒）")
+
+        # --- C. インデックス作成と統計情報の更新 ---
+        for suffix, definition in INDEXES:
+            cur.execute(f"CREATE INDEX {index_name(SHADOW, suffix)} ON {SHADOW} {definition}")
+        cur.execute(f"ANALYZE {SHADOW}")
+        cur.execute(f"ANALYZE {TAG_TOP_SHADOW}")
+    conn.commit()
+    print(f"インデックスを作成しました（{time.perf_counter() - started:.1f} 秒）")
+
+    # --- D. 1トランザクションで入れ替え ---
+    swap_shadow(conn)
+    with conn.cursor() as cur:
+        ensure_state_table(cur)
+        save_prior(cur, prior)
+        save_source_hashes(cur, TABLE)
+        row_count = record_build(cur, 'full', started_at)
+    conn.commit()
+    print(f"✅ search_vns を入れ替えました: {row_count} 件（合計 {time.perf_counter() - started:.1f} 秒）")
+
+def swap_shadow(conn):
+    """
+    影テーブルを本番の名前に入れ替えます。
+    古いテーブルの削除と名前の変更を1つのトランザクションで行うので、
+    読む側は「古い完成版」か「新しい完成版」のどちらかしか見ません。
+    """
+    with conn.cursor() as cur:
+        # 読み込み中のクエリが長く続いていても、待ちすぎないようにします
+        cur.execute("SET LOCAL lock_timeout = '10s'")
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(f"ALTER TABLE {SHADOW} RENAME TO {TABLE}")
+        cur.execute(f"ALTER INDEX {SHADOW}_pkey RENAME TO {TABLE}_pkey")
+        for suffix, _definition in INDEXES:
+            cur.execute(f"ALTER INDEX {index_name(SHADOW, suffix)} RENAME TO {index_name(TABLE, suffix)}")
+        # タグごとの上位リストも同じトランザクションで入れ替えます（一覧と食い違わないように）
+        cur.execute(f"DROP TABLE IF EXISTS {TAG_TOP}")
+        cur.execute(f"ALTER TABLE {TAG_TOP_SHADOW} RENAME TO {TAG_TOP}")
+        cur.execute(f"ALTER INDEX {TAG_TOP_SHADOW}_pkey RENAME TO {TAG_TOP}_pkey")
+    conn.commit()
+
+# -----------------------------------------------------------------------------
+# 6. 差分の反映（変わった行だけを書き換え）
+# -----------------------------------------------------------------------------
+def refresh_delta(conn, ids=None, prior_votes=None):
+    """
+    ids を渡すとその VN だけ、渡さなければ vndb.* の入力のハッシュが前回の記録と違う VN を
+    計算し直し、内容が変わった行だけを書き換えます。
+    前回の記録がない場合は全 VN を計算し、差分だけを書き込みます。
+    タグごとの上位リストは、計算し直した VN の（変更前と変更後の）タグの分だけ作り直します。
+    """
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(create_table_sql(TABLE))
+        # 以前の search_vns にはない列・インデックスを足しておきます
+        for name, definition in COLUMNS[1:]:
+            cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS {name} {definition}")
+        for suffix, definition in INDEXES:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name(TABLE, suffix)} ON {TABLE} {definition}")
+        for suffix in OBSOLETE_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {index_name(TABLE, suffix)}")
+        ensure_closure_table(cur)
+        ensure_state_table(cur)
+        cur.execute(f"SELECT to_regclass('{TAG_TOP}') IS NOT NULL")
+        has_tag_top = cur.fetchone()[0]
+        cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+        started_at = cur.fetchone()[0]
+
+        by_hash = ids is None
+        if by_hash:
+            ids = diff_source_hashes(cur, TABLE, SOURCE_HASH_SQL)
+            print(f"vndb.* の入力が前回から変わった VN: {len(ids)} 件")
+        params = {"ids": list(ids)}
+
+        # --- A. 計算し直した行を一時テーブルに置く ---
+        cur.execute(f"""
+        CREATE TEMP TABLE search_vns_delta ON COMMIT DROP AS
+        {rows_sql(filtered=True)}
+        """, params)
+
+        # 上位リストを作り直すタグ（書き換え前のタグと、書き換え後のタグ）
+        cur.execute(f"""
+        SELECT UNNEST(tag_ids_closure) FROM {TABLE} WHERE id = ANY(%(ids)s)
+        UNION
+        SELECT UNNEST(tag_ids_closure) FROM search_vns_delta
+        """, params)
+        affected_tags = {tag for (tag,) in cur.fetchall()}
+
+        # --- B. 内容が変わった行だけ UPSERT ---
+        columns = ', '.join(BUILT_COLUMNS)
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in BUILT_COLUMNS if c != 'id')
+        old_values = ', '.join(f's.{c}' for c in BUILT_COLUMNS if c != 'id')
+        new_values = ', '.join(f'EXCLUDED.{c}' for c in BUILT_COLUMNS if c != 'id')
+        cur.execute(f"""
+        INSERT INTO {TABLE} AS s ({columns})
+        SELECT {columns} FROM search_vns_delta
+        ON CONFLICT (id) DO UPDATE SET {updates}
+        WHERE ({old_values}) IS DISTINCT FROM ({new_values})
+        """)
+        written = cur.rowcount
+
+        # --- C. vndb.vn から消えた VN を削除 ---
+        # ハッシュの記録より前からある行も消えるよう、ids に限らず全体を見ます
+        cur.execute(f"""
+        DELETE FROM {TABLE} s
+        WHERE NOT EXISTS (SELECT 1 FROM vndb.vn v WHERE v.id = s.id)
+        RETURNING s.tag_ids_closure
+        """)
+        removed = cur.fetchall()
+        deleted = len(removed)
+        affected_tags.update(tag for (tags,) in removed for tag in tags or [])
+
+        # --- D. score・順位と、タグごとの上位リスト ---
+        prior = load_prior(cur)
+        if prior is None or prior_votes is not None:
+            # 初回または m を指定し直したときは、全行の score が変わります
+            prior = choose_prior(cur, TABLE, prior_votes)
+            save_prior(cur, prior)
+            affected_tags = None
+        ranked = update_ranks(cur, TABLE, prior)
+        top_written, top_deleted = refresh_tag_top(cur, affected_tags if has_tag_top else None)
+
+        if by_hash:
+            save_source_hashes(cur, TABLE)
+        record_build(cur, 'delta', started_at)
+    conn.commit()
+    print(f"✅ 差分を反映しました: 書き込み {written} 件 / 削除 {deleted} 件 / 順位の更新 {ranked} 件 / "
+          f"タグ上位リスト 書き込み {top_written} 件・削除 {top_deleted} 件"
+          f"（{time.perf_counter() - started:.2f} 秒）")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='search_vns を作り直します')
+    parser.add_argument('--delta', action='store_true',
+                        help='全件を作り直さず、vndb.* の入力が前回から変わった VN の行だけを反映する'
+                             '（減るのは書き込みだけで、変更の判定に vndb.* を全件読みます）')
+    parser.add_argument('--ids', nargs='+',
+                        help='差分モードで計算し直す VN ID（例: v11 v17）')
+    parser.add_argument('--prior-votes', type=float,
+                        help='ベイズ平均の m（この票数分だけ平均点に寄せる。省略時は投票数の中央値）')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.delta or args.ids:
+            refresh_delta(conn, ids=args.ids, prior_votes=args.prior_votes)
+        else:
+            rebuild_full(conn, prior_votes=args.prior_votes)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
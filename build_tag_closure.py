@@ -0,0 +1,230 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# タグの親子関係（階層）の推移閉包を作るスクリプト
+#
+# vndb-tags-*.json の各タグは parents（親タグのID）を持っています。
+# 例: Fantasy(2) ← Magic(4)。search_vns.tag_ids には投票された「直接のタグ」しか
+# 入っていないため、「Fantasy」で検索しても Magic だけが付いた VN は見つかりません。
+#
+# そこで、全タグについて「祖先 → 子孫」の組をあらかじめ計算して保存します。
+#   - tag_closure テーブル: (ancestor_id, descendant_id, depth) の組（自分自身も depth 0 で含む）
+#   - search_vns.tag_ids_closure: tag_ids にその祖先タグをすべて足した配列（GINインデックス付き）
+#
+# 「Fantasy とその子孫タグのどれかが付いた VN」は、次の1回のインデックス検索で済みます:
+#   SELECT id FROM search_vns WHERE tag_ids_closure @> ARRAY[2];
+#
+# タグダンプの中身が前回と同じなら何もしません。変わっていた場合は、
+# 増減した組だけを書き換え、影響を受けるタグを持つ search_vns の行だけを更新します。
+# -----------------------------------------------------------------------------
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import time
+
+from db import get_db_connection
+
+# リポジトリ内の最新のタグダンプ（ファイル名の日付順で一番新しいもの）
+DEFAULT_TAGS_PATH = (sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'vndb-tags-*.json'))) or [None])[-1]
+
+# -----------------------------------------------------------------------------
+# 1. 閉包の計算（Python側）
+# -----------------------------------------------------------------------------
+def load_tags(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compute_closure(tags):
+    """
+    {(祖先ID, 子孫ID): 最短の距離} を返します。自分自身は距離 0 で含めます。
+    タグは複数の親を持てる（DAG）ので、幅優先で親をたどって最短距離を記録します。
+    """
+    parents = {tag['id']: tag.get('parents', []) for tag in tags}
+    closure = {}
+    for tag_id in parents:
+        closure[(tag_id, tag_id)] = 0
+        frontier = [tag_id]
+        depth = 0
+        seen = {tag_id}
+        while frontier:
+            depth += 1
+            next_frontier = []
+            for current in frontier:
+                for parent in parents.get(current, []):
+                    if parent not in seen:
+                        seen.add(parent)
+                        closure[(parent, tag_id)] = depth
+                        next_frontier.append(parent)
+            frontier = next_frontier
+    return closure
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -----------------------------------------------------------------------------
+# 2. テーブル
+# -----------------------------------------------------------------------------
+def ensure_closure_table(cur):
+    """tag_closure と、前回取り込んだダンプの記録用テーブルを作ります"""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS tag_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth SMALLINT NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    )
+    """)
+    # 「このタグの祖先は？」の検索用
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_tag_closure_descendant
+    ON tag_closure (descendant_id, ancestor_id)
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS tag_closure_state (
+        name TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        pair_count INTEGER NOT NULL,
+        built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+# search_vns の1行分の tag_ids_closure を計算する式
+# 閉包に載っていないタグ（ダンプより新しいタグなど）は、そのタグ自身だけを入れます
+CLOSURE_EXPR = """
+CASE WHEN {tag_ids} IS NULL THEN NULL ELSE ARRAY(
+    SELECT DISTINCT COALESCE(c.ancestor_id, t.tag)
+    FROM UNNEST({tag_ids}) AS t(tag)
+    LEFT JOIN tag_closure c ON c.descendant_id = t.tag
+    ORDER BY 1
+) END
+"""
+
+def refresh_search_vns_closure(cur, changed_tags=None):
+    """
+    search_vns.tag_ids_closure を更新します。
+    changed_tags を渡すと、そのタグを持つ行だけを対象にします（GINインデックスで絞り込み）。
+    """
+    cur.execute("SELECT to_regclass('search_vns') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("ALTER TABLE search_vns ADD COLUMN IF NOT EXISTS tag_ids_closure INTEGER[]")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_search_vns_tag_ids_closure
+    ON search_vns USING GIN (tag_ids_closure)
+    """)
+    condition = "WHERE s.tag_ids && %(changed)s" if changed_tags is not None else ""
+    closure = CLOSURE_EXPR.format(tag_ids='s.tag_ids')
+    cur.execute(f"""
+    UPDATE search_vns s
+    SET tag_ids_closure = {closure}
+    {condition}
+    """, {'changed': sorted(changed_tags or [])})
+    return cur.rowcount
+
+# -----------------------------------------------------------------------------
+# 3. 差分の反映
+# -----------------------------------------------------------------------------
+def build_tag_closure(conn, path, force=False):
+    started = time.perf_counter()
+    sha256 = file_sha256(path)
+    with conn.cursor() as cur:
+        ensure_closure_table(cur)
+        cur.execute("SELECT sha256 FROM tag_closure_state WHERE name = 'tags'")
+        row = cur.fetchone()
+        if row and row[0] == sha256 and not force:
+            conn.commit()
+            print(f"タグダンプは前回から変わっていません（{os.path.basename(path)}）。スキップします。")
+            return
+
+        tags = load_tags(path)
+        closure = compute_closure(tags)
+        print(f"{len(tags)} タグから {len(closure)} 組の祖先・子孫関係を計算しました")
+
+        # --- A. 新しい組を一時テーブルに COPY ---
+        cur.execute("""
+        CREATE TEMP TABLE tag_closure_new (
+            ancestor_id INTEGER, descendant_id INTEGER, depth SMALLINT
+        ) ON COMMIT DROP
+        """)
+        buf = io.StringIO()
+        for (ancestor, descendant), depth in closure.items():
+            buf.write(f"{ancestor}\t{descendant}\t{depth}\n")
+        buf.seek(0)
+        cur.copy_expert("COPY tag_closure_new FROM STDIN", buf)
+
+        # --- B. 消えた組を削除し、増えた組・距離が変わった組を書き込み ---
+        cur.execute("""
+        DELETE FROM tag_closure c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM tag_closure_new n
+            WHERE n.ancestor_id = c.ancestor_id AND n.descendant_id = c.descendant_id
+        )
+        RETURNING descendant_id, ancestor_id
+        """)
+        removed = cur.fetchall()
+        deleted = len(removed)
+        changed = {tag for tag, _ancestor in removed}
+        cur.execute("""
+        INSERT INTO tag_closure AS c (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM tag_closure_new
+        ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = EXCLUDED.depth
+        WHERE c.depth <> EXCLUDED.depth
+        RETURNING descendant_id, ancestor_id
+        """)
+        written = cur.fetchall()
+        changed.update(tag for tag, _ancestor in written)
+
+        # --- C. 祖先の集合が変わったタグを持つ search_vns の行だけ更新 ---
+        updated = refresh_search_vns_closure(cur, changed_tags=changed) if changed else 0
+
+        # build_search_vns がこのモジュールを import しているので、ここで読み込みます
+        from build_search_vns import ensure_state_table, record_build, refresh_tag_top
+
+        # 組が増減した祖先タグは、含まれる VN が変わるので上位リストも作り直します
+        cur.execute("SELECT to_regclass('tag_top_vns') IS NOT NULL")
+        if changed and cur.fetchone()[0]:
+            refresh_tag_top(cur, {ancestor for _tag, ancestor in removed + written})
+
+        # search_vns を書き換えたことを記録します（search_snapshot.py のスナップショットが古いと分かるように）
+        if updated:
+            ensure_state_table(cur)
+            cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+            record_build(cur, 'closure', cur.fetchone()[0])
+
+        cur.execute("""
+        INSERT INTO tag_closure_state (name, source, sha256, pair_count, built_at)
+        VALUES ('tags', %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET
+            source = EXCLUDED.source, sha256 = EXCLUDED.sha256,
+            pair_count = EXCLUDED.pair_count, built_at = CURRENT_TIMESTAMP
+        """, (os.path.basename(path), sha256, len(closure)))
+    conn.commit()
+    print(f"✅ 完了！ 追加・更新 {len(written)} 組 / 削除 {deleted} 組、"
+          f"影響のあったタグ {len(changed)} 件、search_vns 更新 {updated} 行"
+          f"（{time.perf_counter() - started:.2f} 秒）")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='タグ階層の推移閉包を作成します')
+    parser.add_argument('tags_json', nargs='?', default=DEFAULT_TAGS_PATH,
+                        help='VNDB のタグダンプ（省略時はリポジトリ内の最新の vndb-tags-*.json）')
+    parser.add_argument('--force', action='store_true',
+                        help='ダンプが前回と同じでも計算し直す')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        build_tag_closure(conn, args.tags_json, force=args.force)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,304 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# COPY を使った visual_novels への一括保存（バルクUPSERT）
+#
+# upsert_visual_novel() は1件ごとに INSERT ... ON CONFLICT を1回送るため、
+# 件数が増えると通信の往復とSQLの実行回数が処理時間の大半を占めます。
+# ここでは次の2段階でまとめて保存します。
+#   1. 変換済みの行を COPY FROM STDIN で一時テーブル（接続ごと・WALなし）に流し込む
+#   2. 一時テーブルから visual_novels へ、1回の INSERT ... SELECT でUPSERTする
+#
+# 書き込む前に content_hash（内容の指紋）をまとめて照合し、
+# 新規または内容が変わった行だけを書き込みます。
+# -----------------------------------------------------------------------------
+
+import argparse
+import io
+import json
+import random
+import time
+
+import pipeline_metrics
+from db import get_db_connection
+from ingest_vndb_data import (
+    VN_COLUMNS, VN_JSON_COLUMNS, transform_visual_novel,
+    create_table_if_not_exists, upsert_visual_novel,
+)
+
+# ステージングテーブル名。接続ごとの一時テーブルなので、同時に動く別の書き込み
+# （ingest と benchmark_suite、ingest の2重起動など）とは中身もロックも共有しません
+STAGING_TABLE = 'visual_novels_staging'
+
+# -----------------------------------------------------------------------------
+# 1. COPY 用のテキスト変換
+# -----------------------------------------------------------------------------
+def _copy_escape(value):
+    """
+    1つの値を COPY のテキスト形式に変換します。
+    None は \\N、区切り文字（タブ）や改行はバックスラッシュでエスケープします。
+    """
+    if value is None:
+        return '\\N'
+    text = str(value)
+    return (text.replace('\\', '\\\\')
+                .replace('\t', '\\t')
+                .replace('\n', '\\n')
+                .replace('\r', '\\r'))
+
+def format_copy_line(row):
+    """VN_COLUMNS 順のタプルを COPY の1行（末尾改行つき）にします"""
+    fields = []
+    for column, value in zip(VN_COLUMNS, row):
+        if column in VN_JSON_COLUMNS:
+            value = json.dumps(value, ensure_ascii=False)
+        fields.append(_copy_escape(value))
+    return '\t'.join(fields) + '\n'
+
+def prepare_copy_row(vn_data):
+    """
+    APIの1件分を (VN ID, content_hash, COPY の1行) にします。
+    変換（タイトル選択・タグ翻訳・BBCode除去）と JSON 化までをここで済ませるので、
+    transform_stage.py では別プロセスでこの関数を呼び、結果だけを add_prepared() に渡します。
+    """
+    row = transform_visual_novel(vn_data)
+    return row[0], row[-1], format_copy_line(row)
+
+# -----------------------------------------------------------------------------
+# 2. バルク書き込みクラス
+# -----------------------------------------------------------------------------
+class BulkVNWriter:
+    """
+    VNデータを貯めておき、batch_size 件ごとに COPY + UPSERT でまとめて保存します。
+
+    コミットは呼び出し側の責任です（ページ単位でカーソルと一緒に確定するため）。
+    auto_flush=False にすると自動では書き出さないので、区切りの良いところで
+    呼び出し側が flush() してください。最後にも flush() を忘れずに呼んでください。
+    """
+
+    def __init__(self, conn, batch_size=1000, auto_flush=True):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.auto_flush = auto_flush
+        # 同じIDが1バッチに2回入ると ON CONFLICT がエラーになるので、IDをキーにして後勝ちにします
+        # 値は (content_hash, COPY の1行)
+        self._pending = {}
+        # 受け取った件数（rows_seen）のうち、実際に書き込んだのは rows_written 件、
+        # 内容の指紋が同じで書き込まなかったのは unchanged 件です
+        self.rows_seen = 0
+        self.rows_written = 0
+        self.elapsed = 0.0
+        # 変更検知の集計（新規・更新・変更なし）と、今回APIから受け取ったID
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.seen_ids = set()
+
+    def _create_staging_table(self, cur):
+        """
+        この接続だけの一時テーブルを作ります（すでにあれば何もしません）。
+        一時テーブルは WAL を書かず、ロールバックされると作成も取り消されるので、書き出すたびに確認します。
+        ON COMMIT DELETE ROWS なので、マージしそこねた行が次のトランザクションに残ることもありません。
+        """
+        cur.execute("SELECT to_regclass('pg_temp.' || %s)", (STAGING_TABLE,))
+        if cur.fetchone()[0] is None:
+            cur.execute(f"""
+            CREATE TEMP TABLE {STAGING_TABLE}
+                (LIKE visual_novels INCLUDING DEFAULTS)
+                ON COMMIT DELETE ROWS
+            """)
+
+    @property
+    def pending(self):
+        """まだ書き出していない件数"""
+        return len(self._pending)
+
+    def add(self, vn_data):
+        """1件追加します。auto_flush なら batch_size に達した時点で書き出します"""
+        with pipeline_metrics.current().stage('transform', rows=1):
+            vn_id, content_hash, line = prepare_copy_row(vn_data)
+        self._add_line(vn_id, content_hash, line)
+
+    def add_many(self, vns):
+        for vn in vns:
+            self.add(vn)
+
+    def add_prepared(self, prepared):
+        """prepare_copy_row() の結果（transform_stage.py で変換済みのもの）をまとめて追加します"""
+        for vn_id, content_hash, line in prepared:
+            self._add_line(vn_id, content_hash, line)
+
+    def _add_line(self, vn_id, content_hash, line):
+        self._pending[vn_id] = (content_hash, line)
+        if self.auto_flush and len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _filter_changed(self, cur, rows):
+        """DBに保存済みのハッシュとまとめて照合し、新規または変更のあった行だけを返します"""
+        cur.execute(
+            "SELECT id, content_hash FROM visual_novels WHERE id = ANY(%s)",
+            ([vn_id for vn_id, _line in rows],)
+        )
+        stored = dict(cur.fetchall())
+        return [line for vn_id, (content_hash, line) in rows
+                if vn_id not in stored or stored[vn_id] != content_hash]
+
+    def flush(self):
+        """貯まっている行のうち変更があるものを COPY でステージングに流し込み、visual_novels にマージします"""
+        if not self._pending:
+            return 0
+        started = time.perf_counter()
+        rows = list(self._pending.items())
+        self._pending.clear()
+        self.seen_ids.update(vn_id for vn_id, _line in rows)
+
+        columns = ', '.join(VN_COLUMNS)
+        updates = ',\n                '.join(
+            f'{c} = EXCLUDED.{c}' for c in VN_COLUMNS if c != 'id'
+        )
+
+        with self.conn.cursor() as cur:
+            changed = self._filter_changed(cur, rows)
+            self.unchanged += len(rows) - len(changed)
+
+            if changed:
+                # --- A. COPY 用のデータをメモリ上に作成 ---
+                buf = io.StringIO()
+                buf.writelines(changed)
+                buf.seek(0)
+
+                # --- B. ステージングへ COPY ---
+                self._create_staging_table(cur)
+                cur.copy_expert(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN", buf)
+
+                # --- C. 1回のSQLで visual_novels にUPSERT ---
+                # ステージングの行は DELETE ... RETURNING で取り出すので、同じトランザクションで
+                # 次に flush() したときに前のバッチが残っていることはありません（TRUNCATE も不要です）
+                # xmax = 0 の行は今回新しく挿入された行、それ以外は更新された行です
+                cur.execute(f"""
+                WITH staged AS (
+                    DELETE FROM {STAGING_TABLE} RETURNING {columns}
+                )
+                INSERT INTO visual_novels ({columns}, updated_at)
+                SELECT {columns}, CURRENT_TIMESTAMP
+                FROM staged
+                ON CONFLICT (id) DO UPDATE SET
+                    {updates},
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE visual_novels.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                RETURNING (xmax = 0);
+                """)
+                results = [inserted for (inserted,) in cur.fetchall()]
+                self.inserted += sum(results)
+                self.updated += len(results) - sum(results)
+                # 照合と書き込みの間に他の処理が同じ内容を書いていた場合は「変更なし」扱い
+                self.unchanged += len(changed) - len(results)
+                self.rows_written += len(results)
+
+        elapsed = time.perf_counter() - started
+        pipeline_metrics.current().observe('db_write', elapsed, rows=len(rows))
+        self.elapsed += elapsed
+        self.rows_seen += len(rows)
+        return len(rows)
+
+    def vanished_ids(self):
+        """
+        DBにはあるが、今回APIから1度も返ってこなかったIDの一覧です。
+        全ページを最初から取り込んだときにだけ意味があります（削除はしません）。
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT id FROM visual_novels WHERE NOT (id = ANY(%s)) ORDER BY id",
+                (list(self.seen_ids),)
+            )
+            return [vn_id for (vn_id,) in cur.fetchall()]
+
+    @property
+    def rows_per_second(self):
+        """実際に書き込んだ行の速度（変更なしでスキップした行は数えません）"""
+        return self.rows_written / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        """処理件数とスループットを1行の文字列で返します"""
+        return (f"書き込み {self.rows_written} 件 / スキップ {self.unchanged} 件 / {self.elapsed:.2f} 秒 "
+                f"({self.rows_per_second:,.0f} rows/s) "
+                f"新規 {self.inserted} / 更新 {self.updated}")
+
+# -----------------------------------------------------------------------------
+# 3. ベンチマーク（合成データで従来方式と比較）
+# -----------------------------------------------------------------------------
+BENCH_SCHEMA = 'bench_bulk_upsert'
+
+def make_synthetic_vns(count, seed=0):
+    """fetch_vndb_data() の戻り値と同じ形の合成データを作ります"""
+    rng = random.Random(seed)
+    tag_names = ['Fantasy', 'Romance', 'School Life', 'Comedy', 'Drama', 'Mystery',
+                 'Male Protagonist', 'Nakige', 'Multiple Endings', 'Unknown Tag']
+    for i in range(1, count + 1):
+        yield {
+            'id': f'v{i}',
+            'title': f'Synthetic Title {i}',
+            'alttitle': None,
+            'titles': [{'lang': 'ja', 'title': f'合成タイトル{i}'}],
+            'released': f'{rng.randint(1995, 2025)}-{rng.randint(1, 12):02d}-01',
+            'description': 'Line one.\nLine two with a tab\tand a backslash \\.',
+            'image': {'url': f'https://s2.vndb.org/cv/{i % 100:02d}/{i}.jpg',
+                      'sexual': rng.random() * 2, 'violence': rng.random() * 2},
+            'rating': round(rng.uniform(10, 95), 2),
+            'votecount': rng.randint(0, 20000),
+            'tags': [{'name': name, 'rating': round(rng.uniform(0, 3), 1)}
+                     for name in rng.sample(tag_names, 5)],
+            'developers': [{'name': f'Studio {i % 500}'}],
+            'screenshots': [{'url': f'https://s2.vndb.org/sf/{i % 100:02d}/{i}{n}.jpg'}
+                            for n in range(3)],
+        }
+
+def run_benchmark(count, batch_size):
+    """
+    専用スキーマ（bench_bulk_upsert）の中で、1件ずつのUPSERTとバルク書き込みを比較します。
+    本番の visual_novels には触れません。
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+            cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+        create_table_if_not_exists(conn)
+
+        # 従来方式（1件ずつ）
+        started = time.perf_counter()
+        for vn in make_synthetic_vns(count):
+            upsert_visual_novel(conn, vn)
+        conn.commit()
+        per_row = time.perf_counter() - started
+        print(f"1件ずつ: {count} 件 / {per_row:.2f} 秒 ({count / per_row:,.0f} rows/s)")
+
+        # バルク方式（新しいスキーマに入れ直すので、全件が COPY + INSERT の経路を通ります）
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE visual_novels")
+        conn.commit()
+        writer = BulkVNWriter(conn, batch_size=batch_size)
+        writer.add_many(make_synthetic_vns(count))
+        writer.flush()
+        conn.commit()
+        print(f"COPY一括: {writer.report()}")
+        print(f"速度比: {per_row / writer.elapsed:.1f} 倍")
+
+        # 同じデータの再取り込み（ハッシュ照合だけで、書き込みは発生しません）
+        rerun = BulkVNWriter(conn, batch_size=batch_size)
+        rerun.add_many(make_synthetic_vns(count))
+        rerun.flush()
+        conn.commit()
+        print(f"再取り込み: {rerun.report()}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='COPY を使ったバルクUPSERTのベンチマーク')
+    parser.add_argument('--count', type=int, default=50000, help='合成データの件数')
+    parser.add_argument('--batch-size', type=int, default=5000, help='1回のCOPYで送る件数')
+    args = parser.parse_args()
+    run_benchmark(args.count, args.batch_size)
@@ -1,29 +1,24 @@
-import requests
-import json
+import argparse
+import asyncio
 
-# VNDB の全タグ数を正確に調査する（ページング方式）
+from vndb_client import VNDBClient, VNDBError
+from tag_catalog import TagCatalog, FLAG_SEARCHABLE, FLAG_APPLICABLE
 
-url = 'https://api.vndb.org/kana/tag'
-headers = {'Content-Type': 'application/json'}
+# VNDB の全タグ数を正確に調査する（ページング方式）
+# 複数ページを同時に先読みしつつ、レート制限の範囲内で取得します
 
 print("=== VNDB 全タグ数を調査 ===\n")
 
-total_tags = 0
-page = 1
-page_size = 100  # 1ページ100件
-
-while True:
+async def count_tags(client):
+    total_tags = 0
+    page_size = 100  # 1ページ100件
     payload = {
         "filters": ["search", "=", ""],
         "fields": "id",
         "results": page_size,
-        "page": page
     }
     
-    response = requests.post(url, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        data = response.json()
+    async for page, data in client.iter_pages('tag', payload):
         count = len(data['results'])
         total_tags += count
         
@@ -33,30 +28,56 @@ while True:
         if not data.get('more', False):
             print(f"\n【結論】VNDBの総タグ数: {total_tags}件")
             break
-            
-        page += 1
         
         # 安全のため、10ページで打ち切り
-        if page > 10:
+        if page >= 10:
             print(f"\n【注意】10ページ（1000件）で調査を打ち切りました")
             print(f"少なくとも {total_tags}件以上のタグが存在します")
             break
-    else:
-        print(f"エラー: {response.status_code}")
-        print(response.text)
-        break
-
-# カテゴリ別の内訳
-print("\n=== カテゴリ別タグ数 ===")
-for category_name, category_code in [("コンテンツ", "cont"), ("性的", "ero"), ("技術的", "tech")]:
-    payload = {
-        "filters": ["category", "=", category_code],
-        "fields": "id",
-        "results": 100
-    }
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        data = response.json()
+
+async def count_by_category(client):
+    # カテゴリ別の内訳（3カテゴリ分を同時に問い合わせます）
+    print("\n=== カテゴリ別タグ数 ===")
+    categories = [("コンテンツ", "cont"), ("性的", "ero"), ("技術的", "tech")]
+    responses = await asyncio.gather(*[
+        client.post('tag', {
+            "filters": ["category", "=", category_code],
+            "fields": "id",
+            "results": 100
+        })
+        for _category_name, category_code in categories
+    ])
+    for (category_name, category_code), data in zip(categories, responses):
         count = len(data['results'])
         more = " (100件以上)" if data.get('more') else ""
         print(f"{category_name} ({category_code}): {count}件{more}")
+
+def count_offline(catalog_path):
+    # API を使わず、tag_catalog.py で作ったカタログファイルから数えます
+    with TagCatalog(catalog_path) as catalog:
+        print(f"【結論】タグダンプの総タグ数: {catalog.count}件")
+        print(f"（検索可能: {catalog.count_where(FLAG_SEARCHABLE)}件 / "
+              f"付与可能: {catalog.count_where(FLAG_APPLICABLE)}件）")
+        print("\n=== カテゴリ別タグ数 ===")
+        labels = {"cont": "コンテンツ", "ero": "性的", "tech": "技術的"}
+        for category_code, count in catalog.category_counts().items():
+            print(f"{labels[category_code]} ({category_code}): {count}件")
+
+async def main():
+    async with VNDBClient() as client:
+        try:
+            await count_tags(client)
+            await count_by_category(client)
+        except VNDBError as e:
+            print(f"エラー: {e.status}")
+            print(e.text)
+
+parser = argparse.ArgumentParser(description='VNDB のタグ数を調査します')
+parser.add_argument('--offline', metavar='CATALOG',
+                    help='API を使わず、タグカタログ（tag_catalog.py build で作成）から数える')
+args = parser.parse_args()
+
+if args.offline:
+    count_offline(args.offline)
+else:
+    asyncio.run(main())
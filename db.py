@@ -0,0 +1,219 @@
+# -----------------------------------------------------------------------------
+# データベース接続の共通処理（接続プール・プリペアドステートメント・サーバーサイドカーソル）
+#
+# 以前は DB_CONFIG と get_db_connection() が ingest_vndb_data.py と
+# update_tag_translations.py にコピーされていて、各スクリプトが毎回新しい接続を開き、
+# 結果をすべてメモリに読み込む（クライアント側の）カーソルを使っていました。
+# ここにまとめて、どのスクリプトからも同じ方法で使えるようにします。
+#
+#   - get_db_connection()     : 1本の接続（従来と同じ）
+#   - ConnectionPool          : スレッドから安全に使える接続プール（上限に達したら空くまで待つ）
+#   - PreparedStatement       : 何度も実行する SQL を接続ごとに1回だけ PREPARE して使い回す
+#   - iter_rows / iter_batches: 名前付き（サーバーサイド）カーソルで fetch_size 件ずつ読む
+#   - insert_values           : 複数行を1回の通信にまとめて送る
+#
+# 使い方:
+#   from db import get_db_connection, iter_rows
+#   conn = get_db_connection()
+#   for vn_id, title in iter_rows(conn, "SELECT id, title FROM search_vns", fetch_size=5000):
+#       ...
+#
+# 接続先は .env の POSTGRES_* です。プールの上限は DB_POOL_MAX（既定 8）で変えられます。
+# -----------------------------------------------------------------------------
+
+import itertools
+import os
+import re
+import threading
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+# .envファイルから環境変数を読み込む
+load_dotenv()
+
+DB_CONFIG = {
+    'dbname': os.getenv('POSTGRES_DB'),
+    'user': os.getenv('POSTGRES_USER'),
+    'password': os.getenv('POSTGRES_PASSWORD'),
+    'host': os.getenv('POSTGRES_HOST'),
+    'port': os.getenv('POSTGRES_PORT')
+}
+
+DEFAULT_POOL_MAX = int(os.getenv('DB_POOL_MAX', 8))
+DEFAULT_FETCH_SIZE = 2000
+DEFAULT_PAGE_SIZE = 1000
+
+# -----------------------------------------------------------------------------
+# 1. 接続
+# -----------------------------------------------------------------------------
+def get_db_connection():
+    """データベースへの接続を確立します"""
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        return conn
+    except Exception as e:
+        print(f"データベース接続エラー: {e}")
+        raise
+
+class ConnectionPool:
+    """
+    スレッドから安全に使える接続プールです。
+    psycopg2 の ThreadedConnectionPool は上限に達すると例外になるので、
+    セマフォで「空くまで待つ」ようにしています（同時接続数を上限以下に保つため）。
+
+    使い方:
+        pool = ConnectionPool(maxconn=4, setup=["SET search_path TO bench, public"])
+        with pool.connection() as conn:      # 正常に抜けたらコミット、例外ならロールバック
+            with conn.cursor() as cur:
+                ...
+        pool.close()
+    """
+
+    def __init__(self, minconn=1, maxconn=DEFAULT_POOL_MAX, setup=(), **overrides):
+        self.maxconn = maxconn
+        # 新しく開いた接続で1回だけ実行する SQL（search_path や synchronous_commit など）
+        self.setup = list(setup)
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **dict(DB_CONFIG, **overrides))
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._prepared = weakref.WeakSet()
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        if conn not in self._prepared:
+            if self.setup:
+                with conn.cursor() as cur:
+                    for statement in self.setup:
+                        cur.execute(statement)
+                conn.commit()
+            self._prepared.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            # 途中のトランザクションが残ったまま他の処理に渡さないようにします
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            broken = bool(conn.closed)
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def close(self):
+        self._pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------
+# 2. プリペアドステートメント
+# -----------------------------------------------------------------------------
+_PARAM_RE = re.compile(r'\$(\d+)')
+
+class PreparedStatement:
+    """
+    SQL を接続ごとに1回だけ PREPARE し、以降は EXECUTE で実行します。
+    SQL の解析と実行計画の作成が2回目から省けるので、1件ずつの UPSERT のように
+    同じ SQL を何千回も送る処理で効きます。
+
+    SQL のパラメータは Postgres の書き方（$1, $2, ...）で書きます。
+    型は PREPARE のときに列から推測されるので、JSONB の列にも Json(...) をそのまま渡せます。
+
+        UPSERT_TAG = PreparedStatement('upsert_tag', "INSERT INTO t (id, name) VALUES ($1, $2) ...")
+        with conn.cursor() as cur:
+            UPSERT_TAG.execute(cur, (1, 'Fantasy'))
+    """
+
+    _counter = itertools.count(1)
+
+    def __init__(self, name, sql):
+        # 同じ名前を別の SQL で使うと PREPARE がエラーになるので、番号を付けて区別します
+        self.name = f"{name}_{next(self._counter)}"
+        self.sql = sql
+        self.param_count = max((int(n) for n in _PARAM_RE.findall(sql)), default=0)
+        self._execute_sql = (f"EXECUTE {self.name} ({', '.join(['%s'] * self.param_count)})"
+                             if self.param_count else f"EXECUTE {self.name}")
+        self._prepared_on = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def prepare(self, cur):
+        conn = cur.connection
+        with self._lock:
+            if conn in self._prepared_on:
+                return
+            cur.execute(f"PREPARE {self.name} AS {self.sql}")
+            self._prepared_on.add(conn)
+
+    def execute(self, cur, params=()):
+        self.prepare(cur)
+        cur.execute(self._execute_sql, params)
+
+    def forget(self, conn):
+        """DISCARD ALL などで接続側の PREPARE が消えたときに呼びます"""
+        with self._lock:
+            self._prepared_on.discard(conn)
+
+# -----------------------------------------------------------------------------
+# 3. サーバーサイドカーソル（結果を少しずつ読む）
+# -----------------------------------------------------------------------------
+_cursor_counter = itertools.count(1)
+
+def iter_batches(conn, sql, params=None, fetch_size=DEFAULT_FETCH_SIZE, name=None, withhold=False):
+    """
+    名前付きカーソルで結果を fetch_size 件ずつのリストにして返します。
+    結果全体をメモリに載せないので、何十万行でもメモリ使用量は一定です。
+    withhold=True にすると、読んでいる途中でコミットしても読み続けられます。
+    """
+    name = name or f"db_reader_{next(_cursor_counter)}"
+    cur = conn.cursor(name=name, withhold=withhold)
+    cur.itersize = fetch_size
+    try:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+def iter_rows(conn, sql, params=None, fetch_size=DEFAULT_FETCH_SIZE, name=None, withhold=False):
+    """iter_batches() の1行ずつ版"""
+    for rows in iter_batches(conn, sql, params, fetch_size, name, withhold):
+        yield from rows
+
+# -----------------------------------------------------------------------------
+# 4. まとめて実行（通信の往復を減らす）
+# -----------------------------------------------------------------------------
+def insert_values(cur, sql, rows, template=None, page_size=DEFAULT_PAGE_SIZE, fetch=False):
+    """
+    "INSERT ... VALUES %s" や "UPDATE ... FROM (VALUES %s)" に、page_size 行ずつまとめて値を埋め込んで送ります。
+    fetch=True なら RETURNING の結果をまとめて返します。
+    """
+    return execute_values(cur, sql, rows, template=template, page_size=page_size, fetch=fetch)
@@ -51,6 +51,30 @@ type ProducerLinkGroup = { // 制作会社ごとの外部リンクのまとま
   links: ExternalLinkItem[]; // 外部リンク配列
 }; // 型定義の終わり
 
+// search_vns.display の中身（build_display.py が作成。各配列は下のクエリ結果の行と同じ形）
+const DISPLAY_VERSION = 1; // build_display.py の DISPLAY_VERSION と合わせる
+
+type GameDisplay = { // 詳細ページ用のまとめデータを表す型
+  version: number; // データの形の版（違う版なら従来のクエリで取得）
+  vn: { // 基本情報
+    id: string; // VN ID
+    title: string | null; // 原語タイトル
+    title_ja: string | null; // 日本語タイトル
+    rating: number | null; // 評価スコア（100点満点）
+    votecount: number | null; // 投票数
+    description: string | null; // 作品説明
+    c_image: string | null; // カバー画像ID
+  }; // 基本情報の終わり
+  tags: { name: string; id: number }[]; // タグ
+  screenshots: { id: string }[]; // スクリーンショットの画像ID
+  characters: Character[]; // キャラクター
+  staff: Staff[]; // スタッフ
+  vn_links: ExternalLinkRow[]; // VN外部リンク
+  release_links: ReleaseExternalLinkRow[]; // リリース外部リンク
+  producer_links: ProducerExternalLinkRow[]; // 制作会社外部リンク
+  staff_links: StaffExternalLinkRow[]; // スタッフ外部リンク
+}; // 型定義の終わり
+
 type StaffLinkGroup = { // スタッフごとの外部リンクのまとまりを表す型
   staffId: string; // スタッフID
   staffName: string; // スタッフ名
@@ -64,10 +88,22 @@ export default async function GameDetailPage({ params }: PageProps) {
   const client = await pool.connect();
 
   try {
+    // ========================================
+    // 0. まとめデータ（search_vns.display）があれば、主キー1回の取得で済ませる
+    // ========================================
+    const displayResult = await client.query<{ display: GameDisplay | null }>(
+      `SELECT display FROM search_vns WHERE id = $1`,
+      [id]
+    );
+    const display = displayResult.rows[0]?.display ?? null; // まだ作成されていなければ null
+    const hasDisplay = display !== null && display.version === DISPLAY_VERSION; // 版が合う場合だけ使う
+
     // ========================================
     // 1. 基本情報を取得（必須、存在チェックに使用）
     // ========================================
-    const vnResult = await client.query(
+    const vnResult = hasDisplay
+      ? { rows: [display.vn] } // まとめデータの基本情報を使う
+      : await client.query(
       `
       SELECT 
         v.id,
@@ -132,7 +168,18 @@ export default async function GameDetailPage({ params }: PageProps) {
       releaseLinksResult, // リリース外部リンク取得の結果
       producerLinksResult, // 制作会社外部リンク取得の結果
       staffLinksResult, // スタッフ外部リンク取得の結果
-    ] = await Promise.all([ // Promise.allでクエリを並列実行
+    ] = hasDisplay
+      ? [ // まとめデータがあればクエリは不要
+          { rows: display.tags },
+          { rows: display.screenshots },
+          { rows: display.characters },
+          { rows: display.staff },
+          { rows: display.vn_links },
+          { rows: display.release_links },
+          { rows: display.producer_links },
+          { rows: display.staff_links },
+        ] as const // 配列ではなく要素ごとの型を保つ（タプル）
+      : await Promise.all([ // Promise.allでクエリを並列実行
         // タグ情報を取得
         client.query(
           `
@@ -166,10 +213,15 @@ export default async function GameDetailPage({ params }: PageProps) {
             cv.role, 
             c.image as image_url,
             c.gender
-          FROM vndb.chars_vns cv
+          FROM (
+            -- リリースごとに同じキャラクターが何行もあるので、一番重要な役割の1行にする
+            SELECT DISTINCT ON (id) id, role
+            FROM vndb.chars_vns
+            WHERE vid = $1
+            ORDER BY id, CASE role WHEN 'main' THEN 1 WHEN 'primary' THEN 2 WHEN 'side' THEN 3 ELSE 4 END
+          ) cv
           JOIN vndb.chars c ON cv.id = c.id
           LEFT JOIN vndb.chars_names cn ON c.id = cn.id AND cn.lang = 'ja'
-          WHERE cv.vid = $1
           ORDER BY 
               CASE cv.role 
                   WHEN 'main' THEN 1 
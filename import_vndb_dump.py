@@ -0,0 +1,416 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# VNDB データベースダンプ（vndb-db-YYYY-MM-DD.tar.zst）を vndb スキーマに取り込むスクリプト
+#
+# 手作業で psql -f import.sql していた処理を、次の流れで高速化しています。
+#   1. tar をディスクに展開せず、先頭から順に読みながら解凍する（ストリーミング）
+#   2. import.sql のうちテーブル定義だけを先に実行する
+#      （主キー・インデックス・外部キーはデータ投入後に回す）
+#   3. 各テーブルのデータを、複数のDB接続から並列に COPY で流し込む
+#   4. インデックスと制約を並列に作成し、ANALYZE する
+#   5. 作業用スキーマ（vndb_import）と本番の vndb スキーマを1トランザクションで入れ替える
+#
+# 入れ替えまでは既存の vndb スキーマに触れないので、取り込み中もサイトは読み込めます。
+#
+# 実行方法:
+#   python import_vndb_dump.py vndb-db-2026-01-10.tar.zst --workers 4
+# -----------------------------------------------------------------------------
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db import ConnectionPool, get_db_connection
+
+# 作業用スキーマの名前（最後に本番スキーマと入れ替えます）
+STAGING_SUFFIX = '_import'
+
+# 1ファイルあたり、このサイズまではメモリ上に置き、超えたら一時ファイルに書き出します
+SPOOL_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# -----------------------------------------------------------------------------
+# 1. ダンプのストリーミング読み込み
+# -----------------------------------------------------------------------------
+def open_dump_stream(path):
+    """
+    ダンプの tar を先頭から順に読むためのファイルオブジェクトを返します。
+    .zst は zstandard ライブラリ、.gz / .xz / .bz2 は tarfile 自身が解凍します。
+    """
+    raw = open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raw.close()
+            sys.exit("zstd で圧縮されたダンプを読むには `pip install zstandard` が必要です。")
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(raw), mode='r|')
+    return tarfile.open(fileobj=raw, mode='r|*')
+
+def iter_dump_members(path):
+    """
+    (ファイル名, ファイルオブジェクト) を順に返します。
+    ファイルオブジェクトは次の要素に進むと読めなくなるので、その場で読み切ってください。
+    展開済みのディレクトリを渡した場合は、import.sql → *.header → データファイルの順に返します
+    （データファイルを COPY に回す時点で、列の並びが分かっているようにするためです）。
+    """
+    if os.path.isdir(path):
+        names = []
+        for root, _dirs, files in os.walk(path):
+            names.extend(os.path.relpath(os.path.join(root, name), path).replace(os.sep, '/')
+                         for name in files)
+        names.sort(key=lambda name: (name != 'import.sql', not name.endswith('.header'), name))
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                yield name, f
+        return
+    with open_dump_stream(path) as tar:
+        for member in tar:
+            if member.isfile():
+                yield re.sub(r'^\./', '', member.name), tar.extractfile(member)
+
+# -----------------------------------------------------------------------------
+# 2. import.sql の解析
+# -----------------------------------------------------------------------------
+COPY_RE = re.compile(r"^\\copy\s+(\S+?)\s*(?:\(([^)]*)\))?\s+from\s+'([^']+)'", re.I)
+INDEX_RE = re.compile(r"^create\s+(?:unique\s+)?index\b.*?\bon\s+(?:only\s+)?(\S+)", re.I | re.S)
+CONSTRAINT_RE = re.compile(
+    r"^alter\s+table\s+(?:only\s+)?(\S+)\s+add\s+(?:constraint\s+\S+\s+)?"
+    r"(primary\s+key|unique|foreign\s+key|check|exclude)", re.I | re.S)
+CREATE_TABLE_RE = re.compile(r"^create\s+(?:unlogged\s+)?table\s+(?:if\s+not\s+exists\s+)?(\S+)\s*\(", re.I)
+
+def split_statements(sql_text):
+    """
+    import.sql を文ごとに分割します。
+    バックスラッシュで始まる psql のメタコマンドは1行で1文、
+    それ以外は行末の ; までを1文として扱います（$$ で囲まれた関数本体の中は除く）。
+    """
+    statements = []
+    buf = []
+    in_dollar = False
+    for line in sql_text.splitlines():
+        stripped = line.strip()
+        if not buf and (not stripped or stripped.startswith('--')):
+            continue
+        if not buf and stripped.startswith('\\'):
+            statements.append(stripped)
+            continue
+        buf.append(line)
+        if line.count('$$') % 2 == 1:
+            in_dollar = not in_dollar
+        if not in_dollar and stripped.endswith(';'):
+            statements.append('\n'.join(buf).strip())
+            buf = []
+    if buf:
+        statements.append('\n'.join(buf).strip())
+    return statements
+
+def _split_top_level(body):
+    """カッコの外側にあるカンマで分割します（CREATE TABLE の列定義用）"""
+    items, depth, current = [], 0, []
+    for ch in body:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            items.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    items.append(''.join(current))
+    return items
+
+def defer_inline_keys(statement):
+    """
+    CREATE TABLE の中に書かれた PRIMARY KEY を取り除き、
+    データ投入後に実行する ALTER TABLE ... ADD PRIMARY KEY 文として返します。
+    インデックスがない状態で COPY したほうが速いためです。
+    """
+    match = CREATE_TABLE_RE.match(statement)
+    if not match:
+        return statement, []
+    table = match.group(1)
+    start = match.end()
+    end = statement.rstrip().rstrip(';').rstrip().rfind(')')
+    items = _split_top_level(statement[start:end])
+
+    kept, key_columns = [], []
+    for item in items:
+        table_key = re.match(r"^\s*(?:constraint\s+\S+\s+)?primary\s+key\s*\(([^)]*)\)\s*$", item, re.I)
+        if table_key:
+            key_columns = [c.strip() for c in table_key.group(1).split(',')]
+            continue
+        if re.search(r"\bprimary\s+key\b", item, re.I):
+            key_columns = [item.split()[0]]
+            item = re.sub(r"\s+primary\s+key\b", '', item, flags=re.I)
+        kept.append(item)
+
+    if not key_columns:
+        return statement, []
+    rewritten = statement[:start] + ','.join(kept) + statement[end:]
+    deferred = [f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(key_columns)});"]
+    return rewritten, deferred
+
+class ImportPlan:
+    """import.sql の各文を、実行するタイミングごとに分類したものです"""
+
+    def __init__(self, sql_text):
+        self.schema = []       # データ投入前に実行（型・テーブル定義）
+        self.copies = {}       # データファイル名 → (テーブル名, 列リスト)
+        self.indexes = {}      # テーブル名 → [主キー・UNIQUE・インデックス作成文]（テーブル単位で並列）
+        self.foreign_keys = [] # 外部キー（ロックの取り合いを避けるため順番に実行）
+        self.post = []         # ビューなど、最後に実行する文
+        self.skipped = []      # このスクリプトでは実行しないメタコマンド
+
+        for statement in split_statements(sql_text):
+            self._classify(statement)
+
+    def _add_index(self, table, statement):
+        self.indexes.setdefault(table, []).append(statement)
+
+    def _classify(self, statement):
+        if statement.startswith('\\'):
+            match = COPY_RE.match(statement)
+            if match:
+                table, columns, filename = match.groups()
+                self.copies[re.sub(r'^\./', '', filename)] = (table, columns)
+            else:
+                self.skipped.append(statement)
+            return
+        if re.match(r"^(begin|commit|start\s+transaction)\b", statement, re.I):
+            return
+        if INDEX_RE.match(statement):
+            self._add_index(INDEX_RE.match(statement).group(1), statement)
+            return
+        match = CONSTRAINT_RE.match(statement)
+        if match:
+            if match.group(2).lower().startswith('foreign'):
+                self.foreign_keys.append(statement)
+            else:
+                self._add_index(match.group(1), statement)
+            return
+        if re.match(r"^create\s+(or\s+replace\s+)?(materialized\s+)?view\b", statement, re.I):
+            self.post.append(statement)
+            return
+        statement, deferred = defer_inline_keys(statement)
+        self.schema.append(statement)
+        for key_statement in deferred:
+            self._add_index(CREATE_TABLE_RE.match(statement).group(1), key_statement)
+
+# -----------------------------------------------------------------------------
+# 3. 並列処理用のワーカー接続
+# -----------------------------------------------------------------------------
+def worker_pool(schema, workers):
+    """ワーカーのスレッド数と同じ本数の接続プール（db.ConnectionPool）を作ります"""
+    return ConnectionPool(minconn=1, maxconn=workers, setup=[
+        f"SET search_path TO {schema}, public",
+        # 取り込み用の設定（作業用スキーマなので、落ちたらやり直せば良い）
+        "SET synchronous_commit TO off",
+        "SET maintenance_work_mem TO '512MB'",
+    ])
+
+def run_statements(pool, statements):
+    """複数の文を1本の接続で順番に実行し、コミットします"""
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+
+def copy_table(pool, table, columns, fileobj):
+    """1テーブル分のデータを COPY で流し込み、件数を返します"""
+    column_list = f" ({columns})" if columns else ''
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.copy_expert(f"COPY {table}{column_list} FROM STDIN", fileobj, size=1024 * 1024)
+                return cur.rowcount
+    finally:
+        fileobj.close()
+
+# -----------------------------------------------------------------------------
+# 4. 古いスキーマの削除
+# -----------------------------------------------------------------------------
+def external_dependents(cur, schema):
+    """
+    schema の中のテーブルや型に依存している、ほかのスキーマのオブジェクト（ビュー・外部キーなど）を返します。
+    ビューのルール・列の既定値・トリガーは、それが付いているテーブルのスキーマで判定します。
+    """
+    cur.execute("""
+    SELECT DISTINCT pg_describe_object(d.classid, d.objid, d.objsubid)
+    FROM pg_depend d
+    CROSS JOIN LATERAL pg_identify_object(d.refclassid, d.refobjid, 0) ref
+    CROSS JOIN LATERAL pg_identify_object(d.classid, d.objid, 0) dep
+    LEFT JOIN pg_rewrite r ON d.classid = 'pg_rewrite'::regclass AND r.oid = d.objid
+    LEFT JOIN pg_attrdef ad ON d.classid = 'pg_attrdef'::regclass AND ad.oid = d.objid
+    LEFT JOIN pg_trigger tg ON d.classid = 'pg_trigger'::regclass AND tg.oid = d.objid
+    LEFT JOIN pg_class owner ON owner.oid = COALESCE(r.ev_class, ad.adrelid, tg.tgrelid)
+    LEFT JOIN pg_namespace owner_ns ON owner_ns.oid = owner.relnamespace
+    WHERE ref.schema = %(schema)s
+      AND d.deptype IN ('n', 'a')
+      AND COALESCE(owner_ns.nspname, dep.schema) IS DISTINCT FROM %(schema)s
+    ORDER BY 1
+    """, {'schema': schema})
+    return [name for (name,) in cur.fetchall()]
+
+def drop_old_schema(cur, old):
+    """
+    入れ替えで退避したスキーマを削除します。
+    ほかのスキーマのビューや外部キーが参照していると DROP SCHEMA ... CASCADE で一緒に消えてしまうので、
+    その場合は参照しているオブジェクトを一覧にしてエラーにします。
+    （vndb を参照していたビューは、入れ替えのときに名前の変わった古いスキーマを指したままになります）
+    """
+    dependents = external_dependents(cur, old)
+    if dependents:
+        raise RuntimeError(
+            f"ほかのスキーマに {old} を参照しているオブジェクトがあるため、{old} を削除しませんでした:\n  "
+            + "\n  ".join(dependents)
+            + f"\n新しいスキーマを参照するように作り直してから、DROP SCHEMA {old} CASCADE を実行してください。")
+    # 参照しているのが同じスキーマの中だけなので、CASCADE でもほかのスキーマには波及しません
+    cur.execute(f"DROP SCHEMA IF EXISTS {old} CASCADE")
+
+# -----------------------------------------------------------------------------
+# 5. 取り込みの本体
+# -----------------------------------------------------------------------------
+def import_dump(path, schema='vndb', workers=4, keep_old=False):
+    staging = schema + STAGING_SUFFIX
+    started = time.perf_counter()
+    print(f"--- VNDB ダンプ取り込み: {path} → {schema}（作業用: {staging}、並列数 {workers}） ---")
+
+    admin = get_db_connection()
+    with admin.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {staging} CASCADE")
+        cur.execute(f"CREATE SCHEMA {staging}")
+    admin.commit()
+
+    pool = worker_pool(staging, workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # 一時ファイルが増えすぎないよう、COPY待ちのファイル数に上限をつけます
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    plan = None
+    headers = {}
+    # import.sql や列の並び（.header）より先に届いたデータファイル（ファイル名 → 中身）
+    waiting = {}
+    futures = {}
+    total_rows = 0
+
+    def submit(name, spooled):
+        in_flight.acquire()
+        table, columns = plan.copies[name]
+        columns = columns or headers.get(name)
+        future = executor.submit(copy_table, pool, table, columns, spooled)
+        future.add_done_callback(lambda _f: in_flight.release())
+        futures[future] = table
+
+    def ready(name):
+        """列の並びが分かっていて、COPY に回せるか（import.sql に列がなければ .header を待ちます）"""
+        return plan.copies[name][1] is not None or name in headers
+
+    try:
+        # --- A. 読みながらテーブル定義を作り、データを並列COPYへ回す ---
+        for name, fileobj in iter_dump_members(path):
+            if name == 'import.sql':
+                plan = ImportPlan(fileobj.read().decode('utf-8'))
+                with admin.cursor() as cur:
+                    cur.execute(f"SET search_path TO {staging}, public")
+                    for statement in plan.schema:
+                        cur.execute(statement)
+                admin.commit()
+                print(f"テーブル定義を作成しました（{len(plan.copies)} テーブル分のデータ）")
+                for waiting_name in list(waiting):
+                    if waiting_name not in plan.copies:
+                        waiting.pop(waiting_name).close()
+                    elif ready(waiting_name):
+                        submit(waiting_name, waiting.pop(waiting_name))
+                continue
+            if name.endswith('.header'):
+                data_name = name[:-len('.header')]
+                headers[data_name] = ', '.join(fileobj.read().decode('utf-8').strip().split('\t'))
+                if plan is not None and data_name in waiting:
+                    submit(data_name, waiting.pop(data_name))
+                continue
+            if plan is not None and name not in plan.copies:
+                continue
+            if plan is None and not name.startswith('db/'):
+                continue
+
+            # tar のストリームは先にしか進めないので、いったん読み切ってからワーカーに渡します
+            spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+            shutil.copyfileobj(fileobj, spooled, 1024 * 1024)
+            spooled.seek(0)
+            if plan is not None and ready(name):
+                submit(name, spooled)
+            else:
+                waiting[name] = spooled
+
+        if plan is None:
+            raise RuntimeError("ダンプの中に import.sql が見つかりませんでした")
+        # .header のないデータファイルは、テーブル定義の列順で取り込みます
+        for waiting_name in list(waiting):
+            submit(waiting_name, waiting.pop(waiting_name))
+        for future in as_completed(futures):
+            rows = future.result()
+            total_rows += max(rows, 0)
+            print(f"  COPY 完了: {futures[future]} ({rows:,} 行)")
+        print(f"データ投入完了: {total_rows:,} 行 / {time.perf_counter() - started:.1f} 秒")
+
+        # --- B. 主キー・インデックスをテーブル単位で並列に作成 ---
+        index_started = time.perf_counter()
+        list(executor.map(lambda statements: run_statements(pool, statements),
+                          plan.indexes.values()))
+        # 外部キーはお互いのテーブルをロックするので、順番に作成します
+        run_statements(pool, plan.foreign_keys)
+        run_statements(pool, plan.post)
+        print(f"インデックス・制約の作成完了: {time.perf_counter() - index_started:.1f} 秒")
+
+        # --- C. 統計情報の更新（テーブル単位で並列） ---
+        tables = sorted({table for table, _columns in plan.copies.values()})
+        list(executor.map(lambda table: run_statements(pool, [f"ANALYZE {table}"]), tables))
+
+        # --- D. 本番スキーマと入れ替え ---
+        old = schema + '_old'
+        with admin.cursor() as cur:
+            # 前回 --keep-old で残したスキーマ（参照されていたら、入れ替える前に止めます）
+            drop_old_schema(cur, old)
+            # どのダンプをいつ取り込んだかを残します（sync_scheduler.py が入力の変化の判断に使います）
+            cur.execute(f"COMMENT ON SCHEMA {staging} IS %s",
+                        (f"{os.path.basename(os.path.normpath(path))} {time.strftime('%Y-%m-%d %H:%M:%S')}",))
+            cur.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", (schema,))
+            if cur.fetchone():
+                cur.execute(f"ALTER SCHEMA {schema} RENAME TO {old}")
+            cur.execute(f"ALTER SCHEMA {staging} RENAME TO {schema}")
+        admin.commit()
+        if not keep_old:
+            with admin.cursor() as cur:
+                drop_old_schema(cur, old)
+            admin.commit()
+
+        if plan.skipped:
+            print(f"（実行しなかったメタコマンド: {len(plan.skipped)} 件）")
+        print(f"✅ 完了！ 合計 {time.perf_counter() - started:.1f} 秒")
+    except Exception:
+        admin.rollback()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for spooled in waiting.values():
+            spooled.close()
+        pool.close()
+        admin.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VNDB のデータベースダンプを vndb スキーマに取り込みます')
+    parser.add_argument('dump', help='ダンプファイル（.tar.zst など）または展開済みディレクトリ')
+    parser.add_argument('--schema', default='vndb', help='取り込み先のスキーマ名')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='並列に使うDB接続の数')
+    parser.add_argument('--keep-old', action='store_true',
+                        help='入れ替え前のスキーマを <schema>_old として残す')
+    args = parser.parse_args()
+    import_dump(args.dump, schema=args.schema, workers=args.workers, keep_old=args.keep_old)
@@ -4,112 +4,28 @@
 # 初学者の方にも分かりやすいよう、各行に詳細なコメントをつけています。
 # -----------------------------------------------------------------------------
 
-import requests
+import hashlib
 import json
-import psycopg2
+import re
+import sys
 from psycopg2.extras import Json
 from datetime import datetime
-import os
+import argparse
 from dotenv import load_dotenv
 
+import pipeline_metrics
+from db import DB_CONFIG, PreparedStatement, get_db_connection
+from tag_translations import TAG_TRANSLATIONS
+from vndb_client import post_sync, iter_pages_sync
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
-# -----------------------------------------------------------------------------
-# タグ翻訳辞書（英語→日本語）
-# VNDBから取得したタグを日本語に翻訳するための辞書
-# -----------------------------------------------------------------------------
-TAG_TRANSLATIONS = {
-    # ジャンル・カテゴリ
-    'ADV': 'アドベンチャー',
-    'AVG': 'アドベンチャー',
-    'Horror': 'ホラー',
-    'Romance': 'ロマンス',
-    'Comedy': 'コメディ',
-    'Drama': 'ドラマ',
-    'Fantasy': 'ファンタジー',
-    'Sci-fi': 'SF',
-    'Mystery': 'ミステリー',
-    'Thriller': 'スリラー',
-    'Action': 'アクション',
-    
-    # 主人公
-    'Male Protagonist': '男性主人公',
-    'Female Protagonist': '女性主人公',
-    
-    # 設定
-    'School Life': '学校生活',
-    'High School': '高校',
-    'School': '学校',
-    'College': '大学',
-    'Modern Day': '現代',
-    'Future': '未来',
-    'Past': '過去',
-    'Japan': '日本',
-    'Slice of Life': '日常系',
-    
-    # メカニクス
-    'Multiple Endings': 'マルチエンディング',
-    'Choices': '選択肢',
-    'Branching Plot': '分岐シナリオ',
-    'Linear Plot': '一本道',
-    'Point and Click': 'ポイント&クリック',
-    
-    # コンテンツ警告
-    'Sexual Content': '性的コンテンツ',
-    'Eroge': 'エロゲ',
-    'No Sexual Content': '性的コンテンツなし',
-    'Violence': '暴力表現',
-    'Gore': 'グロ表現',
-    
-    # その他人気タグ
-    'Nakige': '泣きゲー',
-    'Utsuge': '鬱ゲー',
-    'Kinetic Novel': 'キネティックノベル',
-    'Visual Novel': 'ビジュアルノベル',
-    'RPG': 'RPG',
-    'Simulation': 'シミュレーション',
-    'Strategy': 'ストラテジー',
-    'Puzzle': 'パズル',
-    
-    # テーマ
-    'Time Travel': 'タイムトラベル',
-    'Supernatural': '超常現象',
-    'Magic': '魔法',
-    'War': '戦争',
-    'Post-apocalyptic': 'ポストアポカリプス',
-    'Cyberpunk': 'サイバーパンク',
-    'Steampunk': 'スチームパンク',
-    
-    # キャラクター属性
-    'Tsundere': 'ツンデレ',
-    'Yandere': 'ヤンデレ',
-    'Kuudere': 'クーデレ',
-    'Childhood Friend': '幼馴染',
-    'Maid': 'メイド',
-    'Teacher': '教師',
-    'Student': '学生',
-}
-
 # -----------------------------------------------------------------------------
 # 1. 設定・接続・テーブル作成（ステップ1と同じ）
 # -----------------------------------------------------------------------------
-DB_CONFIG = {
-    'dbname': os.getenv('POSTGRES_DB'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD'),
-    'host': os.getenv('POSTGRES_HOST'),
-    'port': os.getenv('POSTGRES_PORT')
-}
-
-def get_db_connection():
-    """データベースへの接続を確立します"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        print(f"データベース接続エラー: {e}")
-        raise
+# 接続設定（DB_CONFIG）と get_db_connection() は db.py にまとめました。
+# タグ翻訳辞書（TAG_TRANSLATIONS）は tag_translations.py にあります。
 
 def create_table_if_not_exists(conn):
     """テーブルが存在しない場合、作成します"""
@@ -133,51 +49,112 @@ def create_table_if_not_exists(conn):
     """
     with conn.cursor() as cur:
         cur.execute(schema)
+        # 内容の指紋（ハッシュ）。同じ内容なら再取り込み時に書き込みをスキップします
+        cur.execute("ALTER TABLE visual_novels ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+        # 全件取得モードの再開位置（カーソル）を保存するテーブル
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_cursor (
+            name TEXT PRIMARY KEY,
+            last_id TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        # 以前はページ番号で記録していました。VNDB 側で削除があるとページがずれて取りこぼすので、
+        # 最後にコミットした VN ID に変えています（古いページ番号は使えないので捨てます）
+        cur.execute("ALTER TABLE ingest_cursor ADD COLUMN IF NOT EXISTS last_id TEXT;")
+        cur.execute("ALTER TABLE ingest_cursor DROP COLUMN IF EXISTS page;")
     conn.commit()
     # 既に作成済みの場合が多いため、メッセージは控えめにします
 
+# 全件取得モードのカーソル名
+CURSOR_NAME = 'vn_full'
+
+def load_cursor(conn, name=CURSOR_NAME):
+    """最後にコミットした VN ID を返します（なければ None）"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_id FROM ingest_cursor WHERE name = %s", (name,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+def save_cursor(conn, last_id, name=CURSOR_NAME):
+    """
+    カーソルを保存します。コミットはしません。
+    ページのデータと同じトランザクションで確定させることで、
+    「データは保存されたがカーソルは古い」というズレを防ぎます。
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+        INSERT INTO ingest_cursor (name, last_id, updated_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE SET
+            last_id = EXCLUDED.last_id,
+            updated_at = CURRENT_TIMESTAMP;
+        """, (name, last_id))
+
+def clear_cursor(conn, name=CURSOR_NAME):
+    """全ページの取り込みが終わったらカーソルを削除します"""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM ingest_cursor WHERE name = %s", (name,))
+    conn.commit()
+
 # -----------------------------------------------------------------------------
 # 2. データ取得関数（VNDB APIから）
 # -----------------------------------------------------------------------------
+# APIの呼び出しは vndb_client にまとめています（レート制限と再試行つき）。
+# ローカルのテスト用サーバーに向けたい場合は VNDB_API_URL 環境変数で上書きします。
+
+# 欲しいデータの項目（フィールド）を指定します
+# ネストされたデータ（tags.nameなど）もここで指定できます
+VN_FIELDS = [
+    "id", "title", "alttitle", "released", "description",
+    "image.url", "image.sexual", "image.violence",
+    "rating", "votecount",
+    "titles.lang", "titles.title",  # 各言語のタイトル情報
+    "tags.name", "tags.rating",      # タグ情報
+    "developers.name",               # 開発会社
+    "screenshots.url"                # スクショ
+]
+
 def fetch_vndb_data():
     """
     VNDB (Visual Novel Database) のAPIから、ゲームの情報を取得します。
     """
-    url = 'https://api.vndb.org/kana/vn'
-    
-    # 欲しいデータの項目（フィールド）を指定します
-    # ネストされたデータ（tags.nameなど）もここで指定できます
-    fields = [
-        "id", "title", "alttitle", "released", "description",
-        "image.url", "image.sexual", "image.violence",
-        "rating", "votecount",
-        "titles.lang", "titles.title",  # 各言語のタイトル情報
-        "tags.name", "tags.rating",      # タグ情報
-        "developers.name",               # 開発会社
-        "screenshots.url"                # スクショ
-    ]
-    
     # APIに送るリクエストの内容（ペイロード）を作ります
     payload = {
         "filters": [],           # 検索フィルタは空（全件対象）
-        "fields": ", ".join(fields), # 上のリストをカンマ区切りの文字列にします
+        "fields": ", ".join(VN_FIELDS), # 上のリストをカンマ区切りの文字列にします
         "sort": "votecount",     # 人気投票数順にソートします
         "reverse": True,         # 降順（多い順）にします
         "results": 100           # 人気投票数トップ100件を取得します
     }
     
-    headers = {'Content-Type': 'application/json'}
-    
     print("VNDB APIからデータを取得中...")
-    response = requests.post(url, headers=headers, json=payload)
+    # エラー時（200 OK以外）は再試行したうえで例外になります
+    data = post_sync('vn', payload)
     
-    # エラーチェック: サーバーからの返事が200 OK以外ならエラーにします
-    response.raise_for_status()
-    
-    data = response.json()
     # 結果リストを返します。リストがなければ空リストを返します
     return data.get('results', [])
 
+def iter_vndb_pages(after_id=None, page_size=100):
+    """
+    全件取得モード用のジェネレータです。
+    /vn を1ページずつ取得し、(ページ番号, 結果リスト) を順に返します。
+    レスポンスの more が False になったら終了します。
+
+    並び順は ID 昇順に固定しています。after_id を渡すと ["id", ">", after_id] で
+    その VN より後だけを取得するので、中断した後は最後にコミットした VN ID から再開できます
+    （ページ番号で再開すると、VNDB 側で削除があったときにページがずれて取りこぼします）。
+    次のページは裏で先読みしているので、DBへの書き込み中も取得が進みます。
+    """
+    payload = {
+        "filters": ["id", ">", after_id] if after_id else [],
+        "fields": ", ".join(VN_FIELDS),
+        "sort": "id",
+        "results": page_size,
+    }
+    for page, data in iter_pages_sync('vn', payload):
+        yield page, data.get('results', [])
+
 # -----------------------------------------------------------------------------
 # 3. 日本語タイトル抽出関数
 # -----------------------------------------------------------------------------
@@ -202,14 +179,41 @@ def get_japanese_title(vn_data):
     # どちらもなければ None を返す
     return None
 
+# VNDB の説明文で使われる BBCode のタグ（[url=...] や [spoiler] など）
+BBCODE_URL_RE = re.compile(r'\[url=[^\]]*\](.*?)\[/url\]', re.IGNORECASE | re.DOTALL)
+BBCODE_TAG_RE = re.compile(r'\[/?(?:b|i|u|s|url|spoiler|quote|raw|code)(?:=[^\]]*)?\]', re.IGNORECASE)
+
+def strip_bbcode(text):
+    """
+    説明文から BBCode のタグを取り除き、中の文字だけを残します。
+    [url=https://...]Wikipedia[/url] は「Wikipedia」になります。
+    "[From Wikipedia]" のような、BBCode ではない角かっこはそのまま残します。
+    """
+    if not text:
+        return text
+    text = BBCODE_URL_RE.sub(r'\1', text)
+    return BBCODE_TAG_RE.sub('', text)
+
 # -----------------------------------------------------------------------------
 # 4. データ保存関数（UPSERT処理）
 # -----------------------------------------------------------------------------
-def upsert_visual_novel(conn, vn_data):
+# visual_novels に保存する列（transform_visual_novel() が返すタプルの順番）
+VN_COLUMNS = [
+    'id', 'title', 'alttitle', 'released', 'description',
+    'image_url', 'image_sexual', 'image_violence',
+    'rating', 'votecount',
+    'tags', 'developers', 'screenshots',
+    'content_hash',
+]
+
+# JSONB として保存する列
+VN_JSON_COLUMNS = {'tags', 'developers', 'screenshots'}
+
+def transform_visual_novel(vn_data):
     """
-    1つのゲームデータをデータベースに保存します。
-    既に同じIDのデータがある場合は「更新」、なければ「新規登録」します。
-    これを UPSERT (Update + Insert) と呼びます。
+    APIから取得した1件分のデータを、VN_COLUMNS の順に並んだタプルに変換します。
+    JSONB列（タグなど）はPythonのリストのまま返すので、
+    保存する側で Json() や json.dumps() を使って変換してください。
     """
     
     # --- A. データの取り出し ---
@@ -220,7 +224,8 @@ def upsert_visual_novel(conn, vn_data):
     # 日本語タイトルを取得（alttitle または titles配列から）
     alttitle = get_japanese_title(vn_data)
     released = vn_data.get('released')
-    description = vn_data.get('description')
+    # 説明文の BBCode はここで取り除いておきます（表示する側で毎回消さなくて済むように）
+    description = strip_bbcode(vn_data.get('description'))
     
     # 画像情報は入れ子（辞書の中に辞書）になっているので注意して取り出します
     image = vn_data.get('image') or {} # もしNoneなら空の辞書{}にします
@@ -246,26 +251,43 @@ def upsert_visual_novel(conn, vn_data):
         # 翻訳済みタグをリストに追加
         tags_with_translation.append(tag)
     
-    # リスト形式のデータ（タグなど）は、DB保存用にJSON形式に変換します
-    # psycopg2.extras.Json() が便利です
-    tags = Json(tags_with_translation)  # 翻訳済みタグをJSON化
-    developers = Json(vn_data.get('developers', []))
-    screenshots = Json(vn_data.get('screenshots', []))
-    
-    # --- B. SQL文の作成 ---
-    # プレースホルダ (%s) を使って、データとSQLを分離します（セキュリティ対策）
-    sql = """
+    row = (
+        vn_id, title, alttitle, released, description,
+        image_url, image_sexual, image_violence,
+        rating, votecount,
+        tags_with_translation,
+        vn_data.get('developers', []),
+        vn_data.get('screenshots', []),
+    )
+    return row + (compute_content_hash(row),)
+
+def compute_content_hash(row):
+    """
+    保存する内容（content_hash 以外の列）から、安定したハッシュ値を計算します。
+    APIが返すタグや開発会社の並び順が変わっただけでは「変更あり」にならないよう、
+    名前順に並べ替えてから計算します。
+    """
+    normalized = dict(zip(VN_COLUMNS, row))
+    normalized['tags'] = sorted(normalized['tags'], key=lambda t: t.get('name') or '')
+    normalized['developers'] = sorted(normalized['developers'], key=lambda d: d.get('name') or '')
+    text = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# 1件ずつの UPSERT（パラメータは VN_COLUMNS の順。$1, $2, ... は Postgres のプレースホルダ）
+UPSERT_VN_STATEMENT = PreparedStatement('upsert_visual_novel', """
     INSERT INTO visual_novels (
         id, title, alttitle, released, description,
         image_url, image_sexual, image_violence,
         rating, votecount,
         tags, developers, screenshots,
+        content_hash,
         updated_at
     ) VALUES (
-        %s, %s, %s, %s, %s,
-        %s, %s, %s,
-        %s, %s,
-        %s, %s, %s,
+        $1, $2, $3, $4, $5,
+        $6, $7, $8,
+        $9, $10,
+        $11, $12, $13,
+        $14,
         CURRENT_TIMESTAMP
     )
     ON CONFLICT (id) -- もし「ID」が衝突したら（既にあったら）
@@ -282,22 +304,45 @@ def upsert_visual_novel(conn, vn_data):
         tags = EXCLUDED.tags,
         developers = EXCLUDED.developers,
         screenshots = EXCLUDED.screenshots,
-        updated_at = CURRENT_TIMESTAMP;
+        content_hash = EXCLUDED.content_hash,
+        updated_at = CURRENT_TIMESTAMP
+    -- 内容が変わっていなければ更新しません（updated_at も変わりません）
+    WHERE visual_novels.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+""")
+
+def upsert_visual_novel(conn, vn_data):
     """
+    1つのゲームデータをデータベースに保存します。
+    既に同じIDのデータがある場合は「更新」、なければ「新規登録」します。
+    これを UPSERT (Update + Insert) と呼びます。
+
+    1件ごとにSQLを1回送るので、大量のデータには bulk_upsert.BulkVNWriter を使ってください。
+    """
+    metrics = pipeline_metrics.current()
+    with metrics.stage('transform', rows=1):
+        row = transform_visual_novel(vn_data)
+    
+    # リスト形式のデータ（タグなど）は、DB保存用にJSON形式に変換します
+    # psycopg2.extras.Json() が便利です
+    values = [
+        Json(value) if column in VN_JSON_COLUMNS else value
+        for column, value in zip(VN_COLUMNS, row)
+    ]
     
+    # --- B. SQL文 ---
+    # SQL は関数のすぐ上の UPSERT_VN_STATEMENT です。
+    # 接続ごとに1回だけ PREPARE して、2回目からは解析と実行計画の作成を省きます
+    # （値はパラメータとして渡すので、データと SQL は分離されたままです）
+
     # --- C. SQLの実行 ---
-    with conn.cursor() as cur:
-        cur.execute(sql, (
-            vn_id, title, alttitle, released, description,
-            image_url, image_sexual, image_violence,
-            rating, votecount,
-            tags, developers, screenshots
-        ))
+    with metrics.stage('db_write', rows=1), conn.cursor() as cur:
+        UPSERT_VN_STATEMENT.execute(cur, values)
 
 # -----------------------------------------------------------------------------
-# 4. メイン処理（実行フロー）
+# 5. メイン処理（実行フロー）
 # -----------------------------------------------------------------------------
-def main():
+def ingest_top():
+    """人気投票数トップ100件を取得して保存します（従来のモード）"""
     conn = None
     try:
         print("--- ステップ2: データの取得と保存 ---")
@@ -310,24 +355,117 @@ def main():
         results = fetch_vndb_data()
         print(f"{len(results)} 件のデータを取得しました。")
         
-        # 3. データを1件ずつDBに保存
-        count = 0
+        # 3. データを1件ずつDBに保存（進捗は pipeline_metrics が一定間隔で1行だけ表示します）
+        metrics = pipeline_metrics.current()
         for vn in results:
             upsert_visual_novel(conn, vn)
-            count += 1
-            print(f"[{count}/{len(results)}] 保存完了: {vn.get('title')}")
+            metrics.progress()
             
         # 4. 変更を確定（コミット）
-        conn.commit()
-        print("全ての処理が完了しました！")
+        with metrics.stage('commit'):
+            conn.commit()
+        print(f"{len(results)} 件を保存しました。全ての処理が完了しました！")
+        return True
         
     except Exception as e:
         if conn:
             conn.rollback() # エラー時は取り消し
         print(f"処理中にエラーが発生しました: {e}")
+        return False
     finally:
         if conn:
             conn.close()
 
+def ingest_all(page_size=100, restart=False, workers=0):
+    """
+    全件取得モード：全ページを順に取得し、COPY を使って保存します。
+    1ページ届くごとに書き出し、そのページの最後の VN ID と一緒にコミットします。
+    途中で落ちても、失うのは書き出し中のページだけで、次回は最後にコミットした VN ID の次から再開します。
+    workers を指定すると、変換（タイトル選択・タグ翻訳など）を別プロセスで行います
+    （transform_stage.py。ページの順番は保つので、再開位置の記録は変わりません）。
+    """
+    # bulk_upsert はこのファイルの関数を使うため、循環importを避けてここで読み込みます
+    from bulk_upsert import BulkVNWriter
+    from transform_stage import TransformStage
+    
+    conn = None
+    try:
+        print("--- 全件取得モード ---")
+        conn = get_db_connection()
+        create_table_if_not_exists(conn)
+        
+        if restart:
+            clear_cursor(conn)
+        resume_id = load_cursor(conn)
+        if resume_id:
+            print(f"前回の続き（{resume_id} より後の VN）から再開します。")
+        
+        # 自動書き出しはせず、ページの区切りで書き出してカーソルと一緒に確定します
+        writer = BulkVNWriter(conn, batch_size=page_size, auto_flush=False)
+        metrics = pipeline_metrics.current()
+        fetched = 0
+        with TransformStage(workers=workers, ordered=True) as stage:
+            pages = iter_vndb_pages(after_id=resume_id, page_size=page_size)
+            last_id = resume_id
+            for page, prepared in stage.map(pages):
+                writer.add_prepared(prepared)
+                fetched += len(prepared)
+                if not prepared:
+                    continue
+                # ID 昇順なので、ページの最後の VN まで渡し終えています
+                last_id = prepared[-1][0]
+                writer.flush()
+                save_cursor(conn, last_id)
+                with metrics.stage('commit'):
+                    conn.commit()
+                print(f"[ページ {page}] {last_id} までを保存（{writer.report()}）")
+                metrics.progress()
+        
+        # 最後まで取り込めたらカーソルを削除（次回は最初から）
+        clear_cursor(conn)
+        print(f"取得 {fetched} 件、保存 {writer.report()}")
+        
+        # VNDBから消えたIDの報告（途中から再開した場合は、前半のIDを見ていないので判定しません）
+        if not resume_id:
+            vanished = writer.vanished_ids()
+            if vanished:
+                preview = ', '.join(vanished[:20]) + (' ...' if len(vanished) > 20 else '')
+                print(f"VNDBから返ってこなかったID: {len(vanished)} 件 ({preview})")
+        print("全ての処理が完了しました！")
+        return True
+        
+    except Exception as e:
+        if conn:
+            conn.rollback() # 未コミットのページだけが取り消されます
+        print(f"処理中にエラーが発生しました: {e}")
+        print("もう一度実行すると、最後にコミットした VN の次から再開します。")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='VNDB APIからVNデータを取得して保存します')
+    parser.add_argument('--all', action='store_true',
+                        help='全件取得モード（ページごとにコミットし、中断しても再開可能）')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='1ページあたりの件数（最大100）')
+    parser.add_argument('--restart', action='store_true',
+                        help='保存済みのカーソルを無視して最初から取得し直す')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='全件取得モードで変換に使うプロセス数（0 ならメインスレッドで変換）')
+    pipeline_metrics.add_arguments(parser)
+    args = parser.parse_args()
+    
+    # 段階ごとの時間・件数・再試行・メモリを計測します（--metrics-json / --metrics-prom で保存）
+    with pipeline_metrics.from_args('ingest', args):
+        if args.all:
+            ok = ingest_all(page_size=args.page_size, restart=args.restart, workers=args.workers)
+        else:
+            ok = ingest_top()
+    # 失敗したことが sync_scheduler.py などの呼び出し側に分かるように、終了コードを 1 にします
+    if not ok:
+        sys.exit(1)
+
 if __name__ == '__main__':
     main()
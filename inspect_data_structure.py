@@ -1,12 +1,10 @@
-import requests
 import json
 
+from vndb_client import post_sync, VNDBError
+
 # VNDB APIから詳細情報を取得して、データ構造を確認するスクリプト
 
 def inspect_data():
-    # VNDB APIのエンドポイント
-    url = 'https://api.vndb.org/kana/vn'
-
     # 取得したいフィールドを網羅的に指定します
     # 基本情報、画像、説明、タグ、開発元など
     fields = [
@@ -34,21 +32,17 @@ def inspect_data():
         "fields": ", ".join(fields)
     }
 
-    headers = {'Content-Type': 'application/json'}
-
     print("--- VNDB API データ構造確認 ---")
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # エラー時のレスポンス詳細を表示
-        if response.status_code != 200:
-            print(f"Error Code: {response.status_code}")
-            print(f"Error Response: {response.text}")
-        
-        response.raise_for_status()
-        
-        data = response.json()
+        # エンドポイント /vn へ送信（429や5xxは自動で再試行されます）
+        try:
+            data = post_sync('vn', payload)
+        except VNDBError as e:
+            # エラー時のレスポンス詳細を表示
+            print(f"Error Code: {e.status}")
+            print(f"Error Response: {e.text}")
+            raise
         
         # 取得したデータをJSON形式で見やすく整形して表示・保存
         if 'results' in data and len(data['results']) > 0:
@@ -1,11 +1,7 @@
-import requests
-import json
+from vndb_client import post_sync, VNDBError
 
 # より多くのタグを調査する
 
-url = 'https://api.vndb.org/kana/tag'
-headers = {'Content-Type': 'application/json'}
-
 # 人気の日本語ノベルゲームでよく使われるタグを調査
 tag_ids = ["g7", "g36", "g542", "g249", "g803"]  # Horror, Romance, ADV, School Life, Fantasy
 
@@ -18,11 +14,14 @@ payload = {
 }
 
 print("=== 人気タグ トップ20 を取得 ===")
-response = requests.post(url, headers=headers, json=payload)
+try:
+    data = post_sync('tag', payload)
+except VNDBError as e:
+    data = None
+    print(f"エラー: {e.status}")
+    print(e.text)
 
-if response.status_code == 200:
-    data = response.json()
-    
+if data is not None:
     print(f"\n取得したタグ数: {len(data['results'])}\n")
     
     for i, tag in enumerate(data['results'][:10], 1):
@@ -44,6 +43,3 @@ if response.status_code == 200:
             
     if not has_japanese:
         print("【結論】日本語フィールドは見つかりませんでした")
-else:
-    print(f"エラー: {response.status_code}")
-    print(response.text)
@@ -0,0 +1,465 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# パッケージ画像・スクリーンショット・キャラクター画像を手元にミラーするスクリプト
+#
+# 今はフロントエンドが s2.vndb.org の画像を直接表示しています（ホットリンク）。
+# SCALING_ANALYSIS.md の見積もりでは画像は合計 約145GB あるので、
+# 一度だけ VNDB から取得して自分のストレージ（→ CDN）から配信できるようにします。
+#
+#   - 画像ID: search_vns（表示対象のVN）と vndb.images / vn_screenshots / chars から集める
+#   - 取得  : aiohttp で並列ダウンロード（全体の同時接続数 + ホストごとの上限）
+#   - 保存  : 中身の sha256 をファイル名にする（同じ画像は1回しか書かない）
+#   - 縮小  : 種類ごとに決まったサイズのサムネイルをプロセスプールで作る
+#   - 記録  : manifest.sqlite に取得済みの画像を記録し、再実行時は足りない分だけ取得
+#
+# ディレクトリ構成:
+#   mirror/objects/ab/abcdef...jpg        元画像（sha256 の先頭2文字で分割）
+#   mirror/thumbs/240x320/ab/abcdef...jpg サムネイル
+#   mirror/manifest.sqlite                画像ID → sha256 の対応表
+#   mirror/tmp/run-<host>-<pid>-xxxx/     実行ごとの書きかけファイル（終了時に削除）
+#
+# 実行方法:
+#   python mirror_images.py --kinds cv,sf --limit 1000
+#   VNDB_IMAGE_BASE=http://127.0.0.1:8000 python mirror_images.py   # ローカルの静的サーバーで試す
+# -----------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+import aiohttp
+
+from db import get_db_connection
+
+# 画像サーバーのベースURL（/cv/12/3412.jpg のようなパスを後ろにつけます）
+# VNDB_IMAGE_BASE 環境変数は使うときに読みます（テストでローカルの静的サーバーに向けられるように）
+DEFAULT_IMAGE_BASE = 'https://s2.vndb.org'
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mirror')
+
+# 画像の種類（画像IDの先頭2文字）と、サムネイルのサイズ（幅, 高さ）
+THUMB_SIZES = {
+    'cv': (240, 320),   # パッケージ画像（縦長）
+    'sf': (320, 180),   # スクリーンショット（16:9）
+    'ch': (192, 256),   # キャラクター画像
+}
+KINDS = list(THUMB_SIZES)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# -----------------------------------------------------------------------------
+# 1. 画像URL
+# -----------------------------------------------------------------------------
+def image_url(image_id, base=None):
+    """
+    画像ID（"cv12345" など）から URL を作ります。
+    フロントエンドと同じく、数字部分 % 100 の2桁がバケット（ディレクトリ）です。
+    """
+    kind, number = image_id[:2], image_id[2:]
+    return f"{base or image_base()}/{kind}/{int(number) % 100:02d}/{number}.jpg"
+
+def image_base():
+    return os.getenv('VNDB_IMAGE_BASE', DEFAULT_IMAGE_BASE).rstrip('/')
+
+def object_path(root, sha256):
+    return os.path.join(root, 'objects', sha256[:2], f'{sha256}.jpg')
+
+def thumb_path(root, sha256, size):
+    return os.path.join(root, 'thumbs', f'{size[0]}x{size[1]}', sha256[:2], f'{sha256}.jpg')
+
+# -----------------------------------------------------------------------------
+# 2. ミラー対象の画像IDを集める
+# -----------------------------------------------------------------------------
+# 種類ごとのクエリ。投票数の多いVNの画像から順に取得します
+# (画像ID, 並び順) を返し、必要なテーブル（to_regclass で確認）がなければその種類は飛ばします
+SOURCE_QUERIES = {
+    'cv': (['search_vns'], r"""
+        SELECT 'cv' || SUBSTRING(cover_url FROM '/cv/[0-9]+/([0-9]+)\.jpg$') AS image_id,
+               MAX(votecount) AS votes
+        FROM search_vns
+        WHERE cover_url IS NOT NULL
+        GROUP BY 1
+    """),
+    'sf': (['search_vns', 'vndb.images', 'vndb.vn_screenshots'], """
+        SELECT i.id::text AS image_id, MAX(s.votecount) AS votes
+        FROM vndb.vn_screenshots vs
+        JOIN vndb.images i ON i.id = vs.scr
+        JOIN search_vns s ON s.id = vs.id::text
+        GROUP BY 1
+    """),
+    'ch': (['search_vns', 'vndb.chars', 'vndb.chars_vns'], """
+        SELECT c.image::text AS image_id, MAX(s.votecount) AS votes
+        FROM vndb.chars_vns cv
+        JOIN vndb.chars c ON c.id = cv.id
+        JOIN search_vns s ON s.id = cv.vid::text
+        WHERE c.image IS NOT NULL
+        GROUP BY 1
+    """),
+}
+
+def collect_image_ids(conn, kinds=KINDS, limit=None):
+    """ミラー対象の画像IDのリストを返します（種類ごとに投票数の多い順）"""
+    image_ids = []
+    with conn.cursor() as cur:
+        for kind in kinds:
+            tables, query = SOURCE_QUERIES[kind]
+            cur.execute("SELECT " + ", ".join(f"to_regclass('{t}') IS NOT NULL" for t in tables))
+            missing = [t for t, ok in zip(tables, cur.fetchone()) if not ok]
+            if missing:
+                print(f"⚠️  {kind}: {', '.join(missing)} がないのでスキップします")
+                continue
+            sql = f"SELECT image_id FROM ({query}) q WHERE image_id IS NOT NULL ORDER BY votes DESC NULLS LAST"
+            if limit:
+                sql += f" LIMIT {int(limit)}"
+            cur.execute(sql)
+            ids = [image_id for (image_id,) in cur.fetchall()]
+            print(f"   {kind}: {len(ids)} 枚")
+            image_ids.extend(ids)
+    return image_ids
+
+# -----------------------------------------------------------------------------
+# 3. マニフェスト（取得済みの画像の記録）
+# -----------------------------------------------------------------------------
+class Manifest:
+    """
+    image_id ごとに、取得結果（ok / missing / error）と中身の sha256 を記録します。
+    ok と missing（404）は次回以降スキップし、error は次回また試します。
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            image_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL,
+            sha256 TEXT,
+            bytes INTEGER,
+            error TEXT,
+            fetched_at REAL NOT NULL
+        )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256)")
+        self._pending_writes = 0
+
+    def done_ids(self, retry_missing=False):
+        statuses = ('ok',) if retry_missing else ('ok', 'missing')
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self.db.execute(
+            f"SELECT image_id, sha256 FROM images WHERE status IN ({placeholders})", statuses)
+        return dict(rows.fetchall())
+
+    def record(self, image_id, url, status, sha256=None, size=None, error=None):
+        self.db.execute("""
+        INSERT INTO images (image_id, url, status, sha256, bytes, error, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (image_id) DO UPDATE SET
+            url = excluded.url, status = excluded.status, sha256 = excluded.sha256,
+            bytes = excluded.bytes, error = excluded.error, fetched_at = excluded.fetched_at
+        """, (image_id, url, status, sha256, size, error, time.time()))
+        # 1件ずつコミットすると遅いので、100件ごとにまとめます
+        self._pending_writes += 1
+        if self._pending_writes >= 100:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._pending_writes = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+# -----------------------------------------------------------------------------
+# 4. サムネイル作成（プロセスプールで実行）
+# -----------------------------------------------------------------------------
+def make_thumbnail(src, dst, size):
+    """
+    src を size ちょうどの大きさに切り抜き・縮小して JPEG で保存します。
+    すでに dst があれば何もしません（同じ画像の2回目以降）。
+    """
+    if os.path.exists(dst):
+        return False
+    from PIL import Image, ImageOps
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as image:
+        thumb = ImageOps.fit(image.convert('RGB'), size, Image.LANCZOS)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    thumb.save(tmp, 'JPEG', quality=85, optimize=True)
+    os.replace(tmp, dst)
+    return True
+
+# -----------------------------------------------------------------------------
+# 5. 実行ごとの一時ディレクトリ
+# -----------------------------------------------------------------------------
+def run_prefix():
+    """一時ディレクトリの名前の先頭（どのホストのどのプロセスのものか分かるようにします）"""
+    return f"run-{socket.gethostname()}-{os.getpid()}"
+
+def remove_stale_tmp_dirs(tmp_root):
+    """
+    中断した実行が残した一時ディレクトリを消します。
+    消すのはこのホストで作られ、作ったプロセスがもう動いていないものだけです
+    （別ホストのものは生きているか確かめられないので残します）。
+    """
+    host_prefix = f"run-{socket.gethostname()}-"
+    for name in os.listdir(tmp_root):
+        if not name.startswith(host_prefix):
+            continue
+        pid = name[len(host_prefix):].split('-', 1)[0]
+        if not pid.isdigit() or pid_alive(int(pid)):
+            continue
+        shutil.rmtree(os.path.join(tmp_root, name), ignore_errors=True)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# -----------------------------------------------------------------------------
+# 6. ダウンロード
+# -----------------------------------------------------------------------------
+class ImageMirror:
+    """
+    使い方:
+        mirror = ImageMirror('mirror', concurrency=16, per_host=4)
+        asyncio.run(mirror.run(['cv12345', 'sf67890']))
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, base=None, concurrency=16, per_host=4,
+                 thumbnails=True, workers=None, max_retries=3, timeout=60):
+        self.root = root
+        self.base = (base or image_base()).rstrip('/')
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.thumbnails = thumbnails
+        self.workers = workers
+        self.max_retries = max_retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._host_limits = {}
+        # 作成中のサムネイル（(sha256, サイズ) → 完了を待つ Future）
+        self._thumbs_in_flight = {}
+        # 書きかけのファイルは実行ごとの一時ディレクトリに置きます（os.replace で
+        # objects/ へ移すので root の下に作ります）。同じ root で別のプロセスが
+        # 動いていても、お互いのファイルを消さないようにするためです
+        tmp_root = os.path.join(root, 'tmp')
+        os.makedirs(tmp_root, exist_ok=True)
+        remove_stale_tmp_dirs(tmp_root)
+        self.tmp_dir = tempfile.mkdtemp(prefix=f'{run_prefix()}-', dir=tmp_root)
+        self.manifest = Manifest(os.path.join(root, 'manifest.sqlite'))
+        # 集計
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.missing = 0
+        self.errors = 0
+        self.bytes = 0
+        self.thumbs = 0
+
+    def _host_limit(self, url):
+        """ホストごとの同時接続数を制限するセマフォ"""
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _download(self, session, url):
+        """
+        url を一時ファイルに書き出しながら sha256 を計算します。
+        (sha256, バイト数, 一時ファイル) を返し、404 なら None を返します。
+        """
+        attempt = 0
+        while True:
+            tmp = os.path.join(self.tmp_dir, f"{random.getrandbits(64):016x}.part")
+            try:
+                async with self._host_limit(url):
+                    async with session.get(url) as response:
+                        if response.status == 404:
+                            return None
+                        if response.status != 200:
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history,
+                                status=response.status, message=response.reason)
+                        digest = hashlib.sha256()
+                        size = 0
+                        with open(tmp, 'wb') as f:
+                            async for chunk in response.content.iter_chunked(64 * 1024):
+                                digest.update(chunk)
+                                f.write(chunk)
+                                size += len(chunk)
+                        return digest.hexdigest(), size, tmp
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                status = getattr(e, 'status', None)
+                if attempt >= self.max_retries or (status is not None and status not in RETRY_STATUSES):
+                    raise
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+                attempt += 1
+
+    async def _mirror_one(self, session, pool, image_id):
+        url = image_url(image_id, self.base)
+        try:
+            result = await self._download(session, url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            self.manifest.record(image_id, url, 'error', error=str(e) or type(e).__name__)
+            return
+        if result is None:
+            self.missing += 1
+            self.manifest.record(image_id, url, 'missing')
+            return
+
+        sha256, size, tmp = result
+        dst = object_path(self.root, sha256)
+        if os.path.exists(dst):
+            # 同じ中身の画像はすでに保存済み（別IDで同じ画像が使われている場合など）
+            os.remove(tmp)
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(tmp, dst)
+            self.downloaded += 1
+            self.bytes += size
+
+        if self.thumbnails:
+            try:
+                await self._thumbnail(pool, sha256, THUMB_SIZES[image_id[:2]])
+            except Exception as e:
+                # 壊れた画像など。次回また試せるように error で記録します
+                self.errors += 1
+                self.manifest.record(image_id, url, 'error', sha256, size, f"thumbnail: {e}")
+                return
+        self.manifest.record(image_id, url, 'ok', sha256, size)
+
+    async def _thumbnail(self, pool, sha256, size_wh):
+        """
+        サムネイルを作ります。同じ中身の画像が同時に届いたときは、
+        先に始めた方の完了を待つだけにして、作成（と thumbs の集計）は1回にします。
+        """
+        key = (sha256, size_wh)
+        future = self._thumbs_in_flight.get(key)
+        if future is not None:
+            await future
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            pool, make_thumbnail, object_path(self.root, sha256), thumb_path(self.root, sha256, size_wh), size_wh)
+        self._thumbs_in_flight[key] = future
+        try:
+            created = await future
+        finally:
+            del self._thumbs_in_flight[key]
+        self.thumbs += int(created)
+
+    async def run(self, image_ids):
+        """image_ids のうち、まだ取得していないものだけをダウンロードします"""
+        started = time.perf_counter()
+        total = len(image_ids)
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        done = 0
+
+        async def worker(session, pool):
+            nonlocal done
+            while True:
+                image_id = await queue.get()
+                if image_id is None:
+                    return
+                await self._mirror_one(session, pool, image_id)
+                done += 1
+                if done % 100 == 0 or done == total:
+                    elapsed = time.perf_counter() - started
+                    print(f"\r   {done}/{total} 枚（{self.bytes / 1024 / 1024:,.1f} MiB、"
+                          f"{done / elapsed:,.1f} 枚/秒）", end='', flush=True)
+
+        pool = ProcessPoolExecutor(self.workers) if self.thumbnails else None
+        try:
+            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+                tasks = [asyncio.create_task(worker(session, pool)) for _ in range(self.concurrency)]
+                # キューの大きさに上限があるので、ダウンロードが詰まれば投入側も待ちます
+                for image_id in image_ids:
+                    await queue.put(image_id)
+                for _ in tasks:
+                    await queue.put(None)
+                await asyncio.gather(*tasks)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            self.manifest.commit()
+        if total:
+            print()
+
+    def pending(self, image_ids, retry_missing=False, verify=False):
+        """マニフェストを見て、まだ取得していない画像IDだけを返します"""
+        done = self.manifest.done_ids(retry_missing)
+        if verify:
+            # ファイルが消えていたら取り直します
+            done = {image_id: sha256 for image_id, sha256 in done.items()
+                    if sha256 is None or os.path.exists(object_path(self.root, sha256))}
+        return [image_id for image_id in image_ids if image_id not in done]
+
+    def close(self):
+        self.manifest.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+# -----------------------------------------------------------------------------
+# 7. メイン処理
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='VNDB の画像をローカルにミラーします')
+    parser.add_argument('--root', default=DEFAULT_ROOT, help='保存先ディレクトリ')
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                        help='対象の種類（cv=パッケージ, sf=スクリーンショット, ch=キャラクター）')
+    parser.add_argument('--limit', type=int, help='種類ごとの最大枚数（投票数の多いVNから）')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時ダウンロード数')
+    parser.add_argument('--per-host', type=int, default=4, help='1ホストあたりの同時接続数')
+    parser.add_argument('--workers', type=int, help='サムネイル作成のプロセス数（省略時はCPU数）')
+    parser.add_argument('--no-thumbnails', action='store_true', help='サムネイルを作らない')
+    parser.add_argument('--retry-missing', action='store_true', help='404 だった画像も取り直す')
+    parser.add_argument('--verify', action='store_true', help='取得済みのファイルが残っているか確認する')
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in THUMB_SIZES]
+    if unknown:
+        sys.exit(f"不明な種類です: {', '.join(unknown)}（{', '.join(KINDS)} から選んでください）")
+    if not args.no_thumbnails:
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            sys.exit("サムネイルを作るには `pip install Pillow` が必要です（--no-thumbnails で省略できます）。")
+
+    print("🔍 ミラー対象の画像を集めています...")
+    conn = get_db_connection()
+    try:
+        image_ids = collect_image_ids(conn, kinds, args.limit)
+    finally:
+        conn.close()
+
+    mirror = ImageMirror(args.root, concurrency=args.concurrency, per_host=args.per_host,
+                         thumbnails=not args.no_thumbnails, workers=args.workers)
+    try:
+        todo = mirror.pending(image_ids, args.retry_missing, args.verify)
+        print(f"📥 {len(image_ids)} 枚のうち、未取得の {len(todo)} 枚をダウンロードします（{mirror.base}）")
+        asyncio.run(mirror.run(todo))
+    finally:
+        mirror.close()
+    print(f"✅ 完了！ 新規 {mirror.downloaded} 枚（{mirror.bytes / 1024 / 1024:,.1f} MiB）、"
+          f"重複 {mirror.deduplicated} 枚、404 {mirror.missing} 枚、エラー {mirror.errors} 枚、"
+          f"サムネイル {mirror.thumbs} 枚")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+# -----------------------------------------------------------------------------
+# データ取り込み処理の計測（段階ごとの時間・件数・再試行・メモリ）
+#
+# 取り込み（ingest_vndb_data.py）やタグ翻訳（update_tag_translations.py）の様子は、
+# これまで1件ごとの print でしか分からず、その print 自体がループを遅くしていました。
+# このモジュールは、処理を段階（stage）に分けて時間を測り、次の形で出力します。
+#
+#   - 進捗の1行表示  : progress_interval 秒ごとに1行（件数・速度・段階ごとの p95・再試行・メモリ）
+#   - JSON のまとめ  : 実行の最後に、段階ごとのヒストグラムと集計を保存（--metrics-json）
+#   - Prometheus 形式: node_exporter の textfile collector で読めるファイル（--metrics-prom）
+#
+# 段階の名前:
+#   api_fetch（API の通信）/ json_decode（JSON の解析）/ transform（保存用の行に変換）/
+#   translation（タグの翻訳）/ db_read / db_write / commit
+#
+# 使い方:
+#   metrics = PipelineMetrics('ingest', json_path='metrics.json')
+#   with metrics:                              # この間は pipeline_metrics.current() で参照できます
+#       with metrics.stage('db_write', rows=len(rows)):
+#           ...
+#       metrics.progress()                     # 前回の表示から progress_interval 秒たっていれば1行表示
+#
+# vndb_client.py は current() を通して API の通信時間と再試行を記録します。
+# 計測していないときの current() は何もしないオブジェクトを返すので、呼び出し側で分岐は不要です。
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ヒストグラムの区切り（秒）。Prometheus の既定値に長めの区切りを足したものです
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_PROGRESS_INTERVAL = 10.0
+METRIC_PREFIX = 'erogedb'
+
+# -----------------------------------------------------------------------------
+# 1. ヒストグラム
+# -----------------------------------------------------------------------------
+class Histogram:
+    """固定の区切りで数えるヒストグラム（値そのものは持たないので、メモリは一定です）"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = n
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """区切りの中で直線補間した近似のパーセンタイル（Prometheus の histogram_quantile と同じ考え方）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for n, count in enumerate(self.counts):
+            upper = self.buckets[n] if n < len(self.buckets) else self.max
+            if count and seen + count >= rank:
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+            lower = upper
+        return self.max
+
+    def to_dict(self):
+        cumulative = {}
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {
+            'count': self.count, 'sum': self.sum, 'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+            'buckets': cumulative,
+        }
+
+def peak_rss_bytes():
+    """このプロセスの最大メモリ使用量（Linux の ru_maxrss は KiB、macOS はバイト）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# -----------------------------------------------------------------------------
+# 2. 計測本体
+# -----------------------------------------------------------------------------
+_current = None
+
+def current():
+    """計測中の PipelineMetrics（計測していなければ何もしないオブジェクト）を返します"""
+    return _current or _DISABLED
+
+class PipelineMetrics:
+    """
+    段階ごとの時間（ヒストグラム）と件数・バイト数、再試行、任意のカウンターを集計します。
+    API の取得は別スレッドで動くので、記録はロックで守ります。
+    """
+
+    enabled = True
+
+    def __init__(self, job, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 json_path=None, prom_path=None, stream=None):
+        self.job = job
+        self.progress_interval = progress_interval
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.stream = stream or sys.stdout
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self._lock = threading.Lock()
+        self._last_progress = self.started
+        self._previous = None
+        self.histograms = {}
+        self.rows = {}
+        self.bytes = {}
+        self.counters = {}
+        self.retries = {}
+
+    # --- 記録 ---
+    @contextmanager
+    def stage(self, name, rows=0, nbytes=0):
+        """with の中の時間を段階 name の1回分として記録します"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, rows=rows, nbytes=nbytes)
+
+    def observe(self, name, seconds, rows=0, nbytes=0):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            if rows:
+                self.rows[name] = self.rows.get(name, 0) + rows
+            if nbytes:
+                self.bytes[name] = self.bytes.get(name, 0) + nbytes
+
+    def add_rows(self, name, rows=0, nbytes=0):
+        """時間は測らずに、段階 name の件数・バイト数だけを足します（件数が後から分かる場合）"""
+        with self._lock:
+            if rows:
+                self.rows[name] = self.rows.get(name, 0) + rows
+            if nbytes:
+                self.bytes[name] = self.bytes.get(name, 0) + nbytes
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def retry(self, endpoint, reason):
+        """API の再試行（reason はステータスコードや例外の種類）"""
+        key = (endpoint.strip('/'), str(reason))
+        with self._lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    # --- 出力 ---
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _main_rows(self):
+        """進捗表示に使う「処理件数」（書き込み件数を優先）"""
+        for name in ('db_write', 'transform', 'translation', 'api_fetch'):
+            if self.rows.get(name):
+                return self.rows[name]
+        return max(self.rows.values(), default=0)
+
+    def progress_line(self):
+        with self._lock:
+            elapsed = self.elapsed
+            rows = self._main_rows()
+            # 速度は「前回の表示からの差分」で出します（全体平均だと最近の遅さが分かりにくいため）
+            previous_time, previous_rows = self._previous or (0.0, 0)
+            rate = (rows - previous_rows) / (elapsed - previous_time) if elapsed > previous_time else 0.0
+            self._previous = (elapsed, rows)
+            stages = ' | '.join(f"{name} p95 {h.quantile(0.95) * 1000:,.1f}ms"
+                                for name, h in self.histograms.items())
+            retries = sum(self.retries.values())
+        return (f"[{self.job}] {elapsed:,.0f}秒 {rows:,} 件（{rate:,.0f} 件/秒）"
+                + (f" | {stages}" if stages else '')
+                + f" | 再試行 {retries} | メモリ {peak_rss_bytes() / 1024 / 1024:,.0f} MiB")
+
+    def progress(self, force=False):
+        """前回の表示から progress_interval 秒たっていれば（または force なら）進捗を1行表示します"""
+        now = time.perf_counter()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        print(self.progress_line(), file=self.stream, flush=True)
+
+    def summary(self):
+        """実行全体のまとめ（JSON に保存する内容）"""
+        with self._lock:
+            elapsed = self.elapsed
+            return {
+                'job': self.job,
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'elapsed_seconds': elapsed,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'stages': {
+                    name: dict(histogram.to_dict(),
+                               rows=self.rows.get(name, 0), bytes=self.bytes.get(name, 0),
+                               rows_per_second=self.rows.get(name, 0) / elapsed if elapsed else 0.0)
+                    for name, histogram in self.histograms.items()
+                },
+                'rows': dict(self.rows),
+                'bytes': dict(self.bytes),
+                'counters': dict(self.counters),
+                'retries': [{'endpoint': endpoint, 'reason': reason, 'count': count}
+                            for (endpoint, reason), count in sorted(self.retries.items())],
+            }
+
+    def prometheus_text(self):
+        """Prometheus のテキスト形式（textfile collector 用）"""
+        summary = self.summary()
+        job = _label(self.job)
+        p = METRIC_PREFIX
+        lines = [
+            f'# HELP {p}_stage_duration_seconds 段階ごとの処理時間',
+            f'# TYPE {p}_stage_duration_seconds histogram',
+        ]
+        for name, stage in summary['stages'].items():
+            labels = f'job="{job}",stage="{_label(name)}"'
+            for bound, count in stage['buckets'].items():
+                lines.append(f'{p}_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{p}_stage_duration_seconds_sum{{{labels}}} {stage["sum"]:.6f}')
+            lines.append(f'{p}_stage_duration_seconds_count{{{labels}}} {stage["count"]}')
+        for metric, values, help_text in (('stage_rows_total', summary['rows'], '段階ごとの処理件数'),
+                                          ('stage_bytes_total', summary['bytes'], '段階ごとの処理バイト数')):
+            lines += [f'# HELP {p}_{metric} {help_text}', f'# TYPE {p}_{metric} counter']
+            lines += [f'{p}_{metric}{{job="{job}",stage="{_label(name)}"}} {value}'
+                      for name, value in sorted(values.items())]
+        lines += [f'# HELP {p}_events_total その他のカウンター', f'# TYPE {p}_events_total counter']
+        lines += [f'{p}_events_total{{job="{job}",name="{_label(name)}"}} {value}'
+                  for name, value in sorted(summary['counters'].items())]
+        lines += [f'# HELP {p}_retries_total API の再試行回数', f'# TYPE {p}_retries_total counter']
+        lines += [f'{p}_retries_total{{job="{job}",endpoint="{_label(r["endpoint"])}",'
+                  f'reason="{_label(r["reason"])}"}} {r["count"]}' for r in summary['retries']]
+        lines += [
+            f'# HELP {p}_peak_rss_bytes プロセスの最大メモリ使用量',
+            f'# TYPE {p}_peak_rss_bytes gauge',
+            f'{p}_peak_rss_bytes{{job="{job}"}} {summary["peak_rss_bytes"]}',
+            f'# HELP {p}_run_duration_seconds 実行時間',
+            f'# TYPE {p}_run_duration_seconds gauge',
+            f'{p}_run_duration_seconds{{job="{job}"}} {summary["elapsed_seconds"]:.3f}',
+            f'# HELP {p}_last_run_timestamp_seconds 最後に実行を終えた時刻（UNIX 時間）',
+            f'# TYPE {p}_last_run_timestamp_seconds gauge',
+            f'{p}_last_run_timestamp_seconds{{job="{job}"}} {time.time():.0f}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """--metrics-json / --metrics-prom で指定されたファイルに書き出します"""
+        if self.json_path:
+            _write_atomic(self.json_path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+        if self.prom_path:
+            _write_atomic(self.prom_path, self.prometheus_text())
+
+    def finish(self):
+        self.progress(force=True)
+        self.write()
+
+    def __enter__(self):
+        global _current
+        self._outer = _current
+        _current = self
+        return self
+
+    def __exit__(self, *exc):
+        global _current
+        _current = self._outer
+        self.finish()
+
+class _DisabledMetrics(PipelineMetrics):
+    """計測していないときの current()。記録はすべて捨てます"""
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__('disabled')
+
+    @contextmanager
+    def stage(self, name, rows=0, nbytes=0):
+        yield
+
+    def observe(self, name, seconds, rows=0, nbytes=0):
+        pass
+
+    def add_rows(self, name, rows=0, nbytes=0):
+        pass
+
+    def inc(self, name, amount=1):
+        pass
+
+    def retry(self, endpoint, reason):
+        pass
+
+    def progress(self, force=False):
+        pass
+
+    def write(self):
+        pass
+
+_DISABLED = _DisabledMetrics()
+
+def _label(value):
+    """Prometheus のラベル値のエスケープ"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _write_atomic(path, text):
+    """途中まで書いたファイルを読まれないよう、一時ファイルに書いてから置き換えます"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# -----------------------------------------------------------------------------
+# 3. コマンドライン引数
+# -----------------------------------------------------------------------------
+def add_arguments(parser):
+    """各スクリプトの argparse に計測用のオプションを足します"""
+    parser.add_argument('--metrics-json', metavar='PATH', help='実行のまとめを JSON で保存する')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='Prometheus のテキスト形式で保存する（textfile collector 用）')
+    parser.add_argument('--progress-interval', type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help=f'進捗を表示する間隔（秒、既定: {DEFAULT_PROGRESS_INTERVAL:g}）')
+
+def from_args(job, args):
+    return PipelineMetrics(job, progress_interval=args.progress_interval,
+                           json_path=args.metrics_json, prom_path=args.metrics_prom)
@@ -0,0 +1,460 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# search_vns の一覧を返す読み込み用API（asyncio版）
+#
+# トップページ（frontend/app/page.tsx）は LIMIT 100 固定で、表示のたびに
+# SELECT COUNT(*) FROM search_vns を実行しています。OFFSET でページを送ると、
+# 後ろのページほど読み飛ばす行が増えて遅くなります。このAPIでは:
+#   - キーセット（シーク）方式のページ送り: 前のページの最後の (並び替えの値, id) より
+#     後ろの行を、(列 DESC NULLS LAST, id DESC) のインデックスでたどります。
+#     何ページ目でも読む行数は1ページ分だけなので、N ページ目も1ページ目と同じ速さです。
+#   - カーソルは中身を気にしなくてよい文字列（base64）で返します。次のページは
+#     その文字列を cursor= に渡すだけです。
+#   - 総件数は COUNT(*) をせず、search_vns を作ったときに記録した件数
+#     （search_vns_build_state.row_count）を使います。記録がなければ統計情報の推定値です。
+#   - よく見られる先頭の数ページと総件数は、短い有効期限（TTL）つきでメモリに置きます。
+#     同じページへの同時アクセスは、1回の問い合わせにまとめます。
+#   - おすすめ順（score: ベイズ平均）と「タグ X のおすすめ」は build_search_vns.py で
+#     計算済みです。タグ別は tag_top_vns の1行（上位の VN 番号の配列）を読むだけで、
+#     表示のたびの並び替えはしません。
+#
+# 実行方法:
+#   python read_api.py serve --port 8080
+#     GET /vns?sort=rating&limit=100              # 1ページ目（評価順）
+#     GET /vns?sort=votecount&cursor=<next_cursor> # 次のページ（人気順）
+#     GET /vns?sort=released                       # 新着順
+#     GET /vns?sort=score                          # おすすめ順（ベイズ平均）
+#     GET /tags/2/top?limit=20                     # タグごとのおすすめ（親タグは子タグの VN も含む）
+#     GET /vns/count
+#   python read_api.py page --sort votecount --pages 3   # ターミナルで確認
+#   python read_api.py top --tag 2 --limit 10            # タグごとのおすすめを確認
+#   python read_api.py bench --pages 200                 # OFFSET 方式との比較
+# -----------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import time
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from aiohttp import web
+
+from db import ConnectionPool
+
+TABLE = 'search_vns'
+
+# 並び順の名前 → (列名, カーソルの値を戻すときの型)
+# どれも (列 DESC NULLS LAST, id DESC) のインデックスがあります（build_search_vns.INDEXES）
+SORTS = {
+    'rating': ('rating', 'numeric'),        # 評価順
+    'votecount': ('votecount', 'integer'),  # 人気順
+    'released': ('released', 'date'),       # 新着順
+    'score': ('score', 'numeric'),          # おすすめ順（投票数で重みをつけた評価点）
+}
+DEFAULT_SORT = 'rating'
+
+# 一覧に返す列（GameCard が使うもの）
+LIST_COLUMNS = ['id', 'title', 'title_ja', 'released', 'rating', 'votecount', 'cover_url', 'score']
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 200
+
+PAGE_CACHE_TTL = 30        # 秒。search_vns は作り直しのときにしか変わらないので短めで十分です
+COUNT_CACHE_TTL = 300
+PAGE_CACHE_SIZE = 256      # メモリに置くページ数の上限（古いものから捨てます）
+CACHED_PAGES = 5           # 先頭から何ページ目までをキャッシュするか
+
+
+class InvalidRequest(ValueError):
+    """並び順・件数・カーソルの指定が正しくないときの例外（HTTP では 400 を返します）"""
+
+# -----------------------------------------------------------------------------
+# 1. カーソル（前のページの最後の行の位置）
+# -----------------------------------------------------------------------------
+def encode_cursor(sort, page, value, vn_id):
+    """
+    次のページの位置を文字列にします。中身は [並び順, ページ番号, 最後の値, 最後のID] の JSON です。
+    値が NULL のとき（NULLS LAST の後半）は None のまま入れます。
+    """
+    if isinstance(value, (Decimal, date)):
+        value = str(value)
+    text = json.dumps([sort, page, value, vn_id], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(text.encode('utf-8')).rstrip(b'=').decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """encode_cursor() の逆です。(ページ番号, 最後の値, 最後のID) を返します"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, page, value, vn_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidRequest('cursor が正しくありません')
+    if cursor_sort != sort:
+        raise InvalidRequest('cursor は別の並び順のものです')
+    if not isinstance(page, int) or not isinstance(vn_id, str) or not isinstance(value, (str, int, type(None))):
+        raise InvalidRequest('cursor が正しくありません')
+    return page, value, vn_id
+
+# -----------------------------------------------------------------------------
+# 2. ページを読むSQL
+# -----------------------------------------------------------------------------
+def page_sql(sort, after):
+    """
+    1ページ分（limit + 1 件。1件多く読んで次のページがあるかを判定します）を返す SELECT 文です。
+    after はカーソルの (最後の値, 最後のID)、1ページ目は None です。
+
+    NULLS LAST なので、並び順は「値のある行（値の降順）→ 値が NULL の行（IDの降順）」です。
+    値のある行の続きは (列, id) < (値, ID) の行比較でインデックスの途中から読み始め、
+    足りない分は NULL の行で埋めます（どちらもインデックスの順に読むだけで済みます）。
+    """
+    column, cast = SORTS[sort]
+    columns = ', '.join(LIST_COLUMNS)
+    order = f"ORDER BY {column} DESC NULLS LAST, id DESC"
+    if after is None:
+        return f"SELECT {columns} FROM {TABLE} {order} LIMIT %(limit)s"
+    value, _vn_id = after
+    if value is None:
+        # すでに NULL の行を読んでいる途中
+        return f"""
+        SELECT {columns} FROM {TABLE}
+        WHERE {column} IS NULL AND id < %(id)s
+        {order} LIMIT %(limit)s
+        """
+    return f"""
+    (SELECT {columns} FROM {TABLE}
+     WHERE {column} IS NOT NULL AND ({column}, id) < (%(value)s::{cast}, %(id)s)
+     {order} LIMIT %(limit)s)
+    UNION ALL
+    (SELECT {columns} FROM {TABLE}
+     WHERE {column} IS NULL
+     {order} LIMIT %(limit)s)
+    {order} LIMIT %(limit)s
+    """
+
+def offset_sql(sort):
+    """比較用の OFFSET 方式（bench でだけ使います）"""
+    column, _cast = SORTS[sort]
+    return (f"SELECT {', '.join(LIST_COLUMNS)} FROM {TABLE} "
+            f"ORDER BY {column} DESC NULLS LAST, id DESC LIMIT %(limit)s OFFSET %(offset)s")
+
+def tag_top_sql():
+    """
+    タグごとの上位リスト（build_search_vns.py の tag_top_vns）を、保存されている順に返す SELECT 文です。
+    主キーで1行読み、配列の VN を search_vns の主キーで引くだけです（並び替えは配列の順番どおり）。
+    """
+    columns = ', '.join(f's.{c}' for c in LIST_COLUMNS)
+    return f"""
+    SELECT {columns}
+    FROM tag_top_vns t
+    CROSS JOIN LATERAL UNNEST(t.vn_ids[1:%(limit)s]) WITH ORDINALITY AS u(vn, ord)
+    JOIN {TABLE} s ON s.id = 'v' || u.vn
+    WHERE t.tag_id = %(tag)s
+    ORDER BY u.ord
+    """
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+# -----------------------------------------------------------------------------
+# 3. TTL つきキャッシュ
+# -----------------------------------------------------------------------------
+class TTLCache:
+    """
+    有効期限つきの小さなキャッシュです（容量を超えたら最後に使われたのが古いものから捨てます）。
+    同じキーを同時に読みに来た場合は、最初の1つの結果を全員で待ちます。
+    """
+
+    def __init__(self, ttl, max_entries=PAGE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # キー → (期限, 値)
+        self._loading = {}              # キー → 読み込み中の Future
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key, loader):
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if key in self._loading:
+            self.hits += 1
+            return await asyncio.shield(self._loading[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている人がいなくても「取り出されなかった例外」の警告が出ないようにします
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+        finally:
+            del self._loading[key]
+
+    def clear(self):
+        self._entries.clear()
+
+# -----------------------------------------------------------------------------
+# 4. 読み込みサービス
+# -----------------------------------------------------------------------------
+class ReadService:
+    """
+    使い方:
+        async with ReadService() as service:
+            first = await service.list_vns(sort='votecount', limit=50)
+            second = await service.list_vns(sort='votecount', limit=50, cursor=first['next_cursor'])
+
+    DB への問い合わせは接続プールを使ってスレッドで実行します（psycopg2 は同期のため）。
+    """
+
+    def __init__(self, pool=None, page_ttl=PAGE_CACHE_TTL, count_ttl=COUNT_CACHE_TTL,
+                 cached_pages=CACHED_PAGES):
+        self.pool = pool or ConnectionPool(minconn=1, maxconn=4)
+        self._owns_pool = pool is None
+        self.cached_pages = cached_pages
+        self.page_cache = TTLCache(page_ttl)
+        self.count_cache = TTLCache(count_ttl, max_entries=1)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
+
+    def _query(self, sql, params):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+
+    async def list_vns(self, sort=DEFAULT_SORT, limit=DEFAULT_LIMIT, cursor=None):
+        """
+        1ページ分を返します:
+            {"items": [...], "next_cursor": "..." または None, "page": 1,
+             "total": 12345, "total_source": "build_state"}
+        """
+        if sort not in SORTS:
+            raise InvalidRequest(f"sort は {', '.join(SORTS)} のどれかです")
+        if not 1 <= limit <= MAX_LIMIT:
+            raise InvalidRequest(f"limit は 1〜{MAX_LIMIT} です")
+        if cursor:
+            page, value, vn_id = decode_cursor(cursor, sort)
+            after = (value, vn_id)
+        else:
+            page, after = 0, None
+
+        async def load():
+            return await asyncio.to_thread(self._fetch_page, sort, limit, page, after)
+
+        # 先頭の数ページだけキャッシュします（深いページはアクセスが分散するので効きません）
+        if page < self.cached_pages:
+            result = await self.page_cache.get_or_load((sort, limit, cursor or ''), load)
+        else:
+            result = await load()
+        total, source = await self.total_count()
+        return dict(result, total=total, total_source=source)
+
+    async def top_by_tag(self, tag_id, limit=DEFAULT_LIMIT):
+        """タグのおすすめ上位を返します: {"tag_id": 2, "items": [...]}（上位 TAG_TOP_N 件まで）"""
+        if not 1 <= limit <= MAX_LIMIT:
+            raise InvalidRequest(f"limit は 1〜{MAX_LIMIT} です")
+
+        async def load():
+            rows = await asyncio.to_thread(self._query, tag_top_sql(), {'tag': tag_id, 'limit': limit})
+            items = [{c: _json_value(v) for c, v in zip(LIST_COLUMNS, row)} for row in rows]
+            return {'tag_id': tag_id, 'items': items}
+        return await self.page_cache.get_or_load(('tag', tag_id, limit), load)
+
+    def _fetch_page(self, sort, limit, page, after):
+        params = {'limit': limit + 1}
+        if after is not None:
+            params['value'], params['id'] = after
+        rows = self._query(page_sql(sort, after), params)
+
+        items = [{c: _json_value(v) for c, v in zip(LIST_COLUMNS, row)} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            column = SORTS[sort][0]
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(sort, page + 1, last[LIST_COLUMNS.index(column)], last[0])
+        return {'items': items, 'next_cursor': next_cursor, 'page': page + 1}
+
+    async def total_count(self):
+        """(総件数, 出どころ) を返します。COUNT(*) は記録も統計情報もないときだけ実行します"""
+        return await self.count_cache.get_or_load('total', lambda: asyncio.to_thread(self._fetch_total))
+
+    def _fetch_total(self):
+        # search_vns を作った（または差分を反映した）ときの件数
+        if self._has_table('search_vns_build_state'):
+            rows = self._query("SELECT row_count FROM search_vns_build_state ORDER BY built_at DESC LIMIT 1", None)
+            if rows and rows[0][0] is not None:
+                return rows[0][0], 'build_state'
+
+        # ANALYZE 済みなら統計情報の推定値（まだなら reltuples は -1 です）
+        rows = self._query("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", (TABLE,))
+        if rows and rows[0][0] >= 0:
+            return rows[0][0], 'estimate'
+        return self._query(f"SELECT COUNT(*) FROM {TABLE}", None)[0][0], 'count'
+
+    def _has_table(self, name):
+        return self._query("SELECT to_regclass(%s) IS NOT NULL", (name,))[0][0]
+
+# -----------------------------------------------------------------------------
+# 5. HTTP（aiohttp）
+# -----------------------------------------------------------------------------
+def _json_response(data, status=200):
+    return web.json_response(data, status=status,
+                             dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+async def handle_list(request):
+    service = request.app['service']
+    query = request.query
+    try:
+        try:
+            limit = int(query.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise InvalidRequest('limit は数値で指定してください')
+        result = await service.list_vns(sort=query.get('sort', DEFAULT_SORT), limit=limit,
+                                        cursor=query.get('cursor'))
+    except InvalidRequest as e:
+        return _json_response({'error': str(e)}, status=400)
+    return _json_response(result)
+
+async def handle_tag_top(request):
+    try:
+        try:
+            tag_id = int(request.match_info['tag_id'])
+            limit = int(request.query.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise InvalidRequest('タグIDと limit は数値で指定してください')
+        result = await request.app['service'].top_by_tag(tag_id, limit=limit)
+    except InvalidRequest as e:
+        return _json_response({'error': str(e)}, status=400)
+    return _json_response(result)
+
+async def handle_count(request):
+    total, source = await request.app['service'].total_count()
+    return _json_response({'total': total, 'total_source': source})
+
+def create_app(service=None):
+    app = web.Application()
+    app['service'] = service or ReadService()
+    app.router.add_get('/vns', handle_list)
+    app.router.add_get('/vns/count', handle_count)
+    app.router.add_get('/tags/{tag_id}/top', handle_tag_top)
+
+    async def on_cleanup(app):
+        app['service'].close()
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+# -----------------------------------------------------------------------------
+# 6. コマンドライン
+# -----------------------------------------------------------------------------
+async def print_pages(sort, limit, pages):
+    async with ReadService() as service:
+        cursor = None
+        for _ in range(pages):
+            started = time.perf_counter()
+            result = await service.list_vns(sort=sort, limit=limit, cursor=cursor)
+            elapsed = (time.perf_counter() - started) * 1000
+            first = result['items'][0] if result['items'] else {}
+            print(f"[{result['page']} ページ目] {len(result['items'])} 件 / 全 {result['total']:,} 件"
+                  f"（{result['total_source']}）{elapsed:.1f}ms  先頭: {first.get('id')} "
+                  f"{first.get('title_ja') or first.get('title')} ({first.get(SORTS[sort][0])})")
+            cursor = result['next_cursor']
+            if not cursor:
+                print("最後のページです。")
+                break
+
+async def print_tag_top(tag_id, limit):
+    async with ReadService() as service:
+        started = time.perf_counter()
+        result = await service.top_by_tag(tag_id, limit=limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"🔍 タグ {tag_id} のおすすめ {len(result['items'])} 件（{elapsed:.1f}ms）")
+        for rank, item in enumerate(result['items'], 1):
+            print(f"  {rank:>3}. {item['id']:<8} {item['score']}  {item['title_ja'] or item['title']}")
+
+async def run_bench(sort, limit, pages):
+    """先頭から pages ページまで送り、キーセット方式と OFFSET 方式の時間を比べます"""
+    async with ReadService(cached_pages=0) as service:
+        keyset_ms, offset_ms = [], []
+        cursor = None
+        for page in range(pages):
+            started = time.perf_counter()
+            result = await service.list_vns(sort=sort, limit=limit, cursor=cursor)
+            keyset_ms.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            rows = await asyncio.to_thread(service._query, offset_sql(sort),
+                                           {'limit': limit, 'offset': page * limit})
+            offset_ms.append((time.perf_counter() - started) * 1000)
+            # 2つの方式で同じ行が返ってくることも確かめます
+            if [row[0] for row in rows] != [item['id'] for item in result['items']]:
+                print(f"⚠️ {page + 1} ページ目の内容が OFFSET 方式と一致しません")
+            cursor = result['next_cursor']
+            if not cursor:
+                break
+
+    def summary(values):
+        head = values[:5]
+        tail = values[-5:]
+        return (f"先頭5ページ 平均 {sum(head) / len(head):.2f}ms / "
+                f"最後の5ページ 平均 {sum(tail) / len(tail):.2f}ms")
+    print(f"🔍 {sort} 順 {limit} 件 × {len(keyset_ms)} ページ")
+    print(f"   キーセット: {summary(keyset_ms)}")
+    print(f"   OFFSET    : {summary(offset_ms)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='search_vns の一覧を返す読み込み用API')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help='HTTP サーバーを起動する')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+
+    for name, help_text in (('page', 'ページを順に表示する'), ('bench', 'OFFSET 方式と速さを比べる')):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--sort', choices=list(SORTS), default=DEFAULT_SORT)
+        p.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+        p.add_argument('--pages', type=int, default=3 if name == 'page' else 100)
+
+    top = sub.add_parser('top', help='タグごとのおすすめを表示する')
+    top.add_argument('--tag', type=int, required=True, help='タグID（例: 2）')
+    top.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        web.run_app(create_app(), host=args.host, port=args.port)
+    elif args.command == 'page':
+        asyncio.run(print_pages(args.sort, args.limit, args.pages))
+    elif args.command == 'top':
+        asyncio.run(print_tag_top(args.tag, args.limit))
+    else:
+        asyncio.run(run_bench(args.sort, args.limit, args.pages))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# -----------------------------------------------------------------------------
+# VNDB API のレスポンスをディスクに保存するキャッシュ
+#
+# 調査用スクリプトや取り込み処理は、実行のたびに同じ内容を API に送っています
+# （inspect_data_structure.py の v11、investigate_tag_api.py の人気タグ20件など）。
+# 同じ「エンドポイント + リクエスト内容」の結果を SQLite ファイルに保存しておき、
+# 2回目以降は API を呼ばずに返します。
+#
+#   - キー        : エンドポイント + キーを並べ替えた JSON（書き方の違いで別物にならない）
+#   - 保存形式    : zlib で圧縮したレスポンス本文
+#   - 有効期限    : エンドポイントごとに設定（TTL）
+#   - 容量の上限  : 超えたら最後に使われたのが古いものから削除（LRU）
+#                   合計サイズは cache_meta の1行にトリガーで持つので、保存のたびに全件を数えません
+#   - オフライン  : cache_only=True ならキャッシュにないものはエラー（API を呼ばない）
+#
+# vndb_client.VNDBClient は、環境変数 VNDB_CACHE_PATH が設定されていれば自動で使います。
+#   VNDB_CACHE_PATH=.vndb_cache.sqlite python inspect_data_structure.py
+#   VNDB_CACHE_PATH=.vndb_cache.sqlite VNDB_CACHE_ONLY=1 python ingest_vndb_data.py
+#
+# 状態の確認・削除:
+#   python response_cache.py stats .vndb_cache.sqlite
+#   python response_cache.py clear .vndb_cache.sqlite
+# -----------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# エンドポイントごとの有効期限（秒）。ここにないエンドポイントは DEFAULT_TTL を使います
+DEFAULT_TTLS = {
+    'vn': 24 * 3600,
+    'release': 24 * 3600,
+    'character': 24 * 3600,
+    'tag': 7 * 24 * 3600,      # タグはあまり変わらないので長めに
+    'trait': 7 * 24 * 3600,
+}
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CacheMiss(Exception):
+    """cache_only モードで、キャッシュに結果がなかったときの例外"""
+
+
+def cache_key(endpoint, payload):
+    """エンドポイントとリクエスト内容から、書き方の違いに左右されないキーを作ります"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(f"{endpoint.strip('/')}\n{canonical}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    使い方:
+        cache = ResponseCache('.vndb_cache.sqlite')
+        data = cache.get('vn', payload)        # なければ None
+        cache.put('vn', payload, data)
+    """
+
+    def __init__(self, path, ttls=None, default_ttl=DEFAULT_TTL,
+                 max_bytes=DEFAULT_MAX_BYTES, cache_only=False):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.cache_only = cache_only
+        # 取得処理は別スレッドのイベントループから呼ばれることがあるので、ロックで守ります
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._create_size_tracking()
+        # 今回の実行での集計
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _create_size_tracking(self):
+        """
+        合計サイズを cache_meta の1行に持ち、responses の追加・更新・削除のたびにトリガーで足し引きします。
+        同じファイルを別のプロセスが使っていてもずれません。
+        以前のバージョンで作ったキャッシュは、最初の1回だけ全件を数えて初期値にします。
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cache_meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_bytes INTEGER NOT NULL
+                )
+                """)
+                self._db.execute("""
+                INSERT OR IGNORE INTO cache_meta (id, total_bytes)
+                SELECT 1, COALESCE(SUM(size), 0) FROM responses
+                """)
+                self._db.execute("""
+                CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses BEGIN
+                    UPDATE cache_meta SET total_bytes = total_bytes + NEW.size WHERE id = 1;
+                END
+                """)
+                self._db.execute("""
+                CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF size ON responses BEGIN
+                    UPDATE cache_meta SET total_bytes = total_bytes + NEW.size - OLD.size WHERE id = 1;
+                END
+                """)
+                self._db.execute("""
+                CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses BEGIN
+                    UPDATE cache_meta SET total_bytes = total_bytes - OLD.size WHERE id = 1;
+                END
+                """)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT total_bytes FROM cache_meta WHERE id = 1").fetchone()[0]
+
+    @classmethod
+    def from_env(cls):
+        """VNDB_CACHE_PATH が設定されていればキャッシュを作ります（なければ None）"""
+        path = os.getenv('VNDB_CACHE_PATH')
+        if not path:
+            return None
+        return cls(path,
+                   max_bytes=int(os.getenv('VNDB_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                   cache_only=os.getenv('VNDB_CACHE_ONLY', '') not in ('', '0'))
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint.strip('/'), self.default_ttl)
+
+    def get(self, endpoint, payload):
+        """キャッシュにあればレスポンス（dict）を返します。なければ None（cache_only なら例外）"""
+        key = cache_key(endpoint, payload)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            # cache_only のときは、期限切れでも手元のデータを使います（オフライン再生）
+            if row and (self.cache_only or now - row[1] <= self.ttl_for(endpoint)):
+                self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return json.loads(zlib.decompress(row[0]))
+            if row:
+                self.expired += 1
+            self.misses += 1
+        if self.cache_only:
+            raise CacheMiss(f"キャッシュにありません: /{endpoint.strip('/')} {json.dumps(payload)[:200]}")
+        return None
+
+    def put(self, endpoint, payload, data):
+        """レスポンスを保存し、容量の上限を超えていれば古いものから削除します"""
+        key = cache_key(endpoint, payload)
+        body = zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'), 6)
+        now = time.time()
+        with self._lock:
+            self._db.execute("""
+            INSERT INTO responses (key, endpoint, body, size, created_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                body = excluded.body, size = excluded.size,
+                created_at = excluded.created_at, accessed_at = excluded.accessed_at
+            """, (key, endpoint.strip('/'), body, len(body), now, now))
+            self._evict()
+
+    def _evict(self):
+        """合計サイズが max_bytes 以下になるまで、最後に使われたのが古い順に削除します"""
+        total = self._total_bytes()
+        while total > self.max_bytes:
+            # 上限を超えたときだけ、古い方から少しずつ読んで削除します
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                self.evictions += 1
+
+    def prune_expired(self):
+        """期限切れのエントリをまとめて削除します"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for endpoint, in self._db.execute("SELECT DISTINCT endpoint FROM responses").fetchall():
+                cur = self._db.execute(
+                    "DELETE FROM responses WHERE endpoint = ? AND created_at < ?",
+                    (endpoint, now - self.ttl_for(endpoint)))
+                removed += cur.rowcount
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("VACUUM")
+
+    def stats(self):
+        """保存件数・容量と、今回の実行でのヒット率"""
+        with self._lock:
+            rows = self._db.execute("""
+            SELECT endpoint, COUNT(*), SUM(size) FROM responses GROUP BY endpoint ORDER BY endpoint
+            """).fetchall()
+            total_bytes = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            'entries': {endpoint: {'count': count, 'bytes': size} for endpoint, count, size in rows},
+            'total_bytes': total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def summary(self):
+        """1行にまとめた集計（スクリプトの最後に表示する用）"""
+        s = self.stats()
+        return (f"キャッシュ: ヒット {s['hits']} / ミス {s['misses']} "
+                f"(ヒット率 {s['hit_rate']:.0%}、期限切れ {s['expired']}、削除 {s['evictions']})")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VNDB API レスポンスキャッシュの確認・削除')
+    parser.add_argument('command', choices=['stats', 'prune', 'clear'])
+    parser.add_argument('path', nargs='?', default=os.getenv('VNDB_CACHE_PATH', '.vndb_cache.sqlite'))
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.path)
+    if args.command == 'stats':
+        stats = cache.stats()
+        for endpoint, entry in stats['entries'].items():
+            print(f"/{endpoint}: {entry['count']}件 ({entry['bytes'] / 1024:,.1f} KiB)")
+        print(f"合計: {stats['total_bytes'] / 1024 / 1024:,.2f} MiB")
+    elif args.command == 'prune':
+        print(f"期限切れのエントリを {cache.prune_expired()} 件削除しました")
+    else:
+        cache.clear()
+        print("キャッシュを削除しました")
+    cache.close()
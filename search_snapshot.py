@@ -0,0 +1,388 @@
+# -----------------------------------------------------------------------------
+# search_vns の列形式スナップショット（バイナリ形式）の書き出しと読み込み
+#
+# 分析用のスクリプトや tag_search_engine.py は、起動のたびに search_vns 全体（5万行、
+# tag_ids の配列やタイトルの文字列）を libpq で1行ずつ受け取って Python のオブジェクトにしています。
+# そこで、列ごとの配列をそのまま並べたファイル（.vnsnap）に書き出しておき、
+# mmap して NumPy 配列としてコピーせずに参照することで、起動時の読み込みをほぼゼロにします。
+#
+# ファイルの中身（すべてリトルエンディアン、各セクションは8バイト境界にそろえます）:
+#   ヘッダー        : マジック "VNSNAP01"、バージョン、行数、セクション数、チェックサム（BLAKE2b 32バイト）
+#   セクション目次  : (名前8バイト, 開始位置, 長さ) × セクション数
+#   meta            : JSON（書き出した日時、元データの更新時刻 = ウォーターマーク、件数など）
+#   vid             : int32[行数]      VN ID の番号部分（"v11" → 11、昇順）
+#   rating          : float32[行数]    評価点（NULL は NaN）
+#   votes           : int32[行数]      投票数（NULL は -1）
+#   released        : int32[行数]      1970-01-01 からの日数（NULL は tag_search_engine.NULL_DAY）
+#   tag_off / tag   : int64[行数+1] / int32[]  tag_ids（CSR 形式。行 i は tag[tag_off[i]:tag_off[i+1]]）
+#   tcl_off / tcl   : int64[行数+1] / int32[]  tag_ids_closure（同じ形式）
+#   ttl_off / ttl   : int64[行数+1] / UTF-8    原語タイトル（ttl_nul が 1 の行は NULL）
+#   tja_off / tja   : int64[行数+1] / UTF-8    日本語タイトル（tja_nul が 1 の行は NULL）
+#   ttl_nul / tja_nul: uint8[行数]
+#
+# チェックサムはセクション目次以降の全バイトに対するものです。開くときには確かめず
+# （全体を読むことになるので）、verify() か `python search_snapshot.py verify` で確かめます。
+# ウォーターマークは search_vns_build_state のうち書き出す列を書き換えた記録（full / delta / closure）の
+# 最新の時刻で、is_stale() で今の DB と比べます。
+#
+# 使い方:
+#   python search_snapshot.py export search_vns.vnsnap
+#   python search_snapshot.py info search_vns.vnsnap      # 件数・ウォーターマーク・古くなっていないか
+#   python search_snapshot.py verify search_vns.vnsnap
+#   python tag_search_engine.py "2 & 32" --snapshot search_vns.vnsnap
+# -----------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from tag_search_engine import NULL_DAY, Snapshot
+
+MAGIC = b'VNSNAP01'
+VERSION = 1
+
+# ヘッダー: マジック, バージョン, 行数, セクション数, 予備, チェックサム
+HEADER = struct.Struct('<8sIIII32s')
+SECTION = struct.Struct('<8sQQ')
+
+# スナップショットに入れるタグの列 → (オフセットのセクション名, 値のセクション名)
+TAG_SECTIONS = {
+    'tag_ids': ('tag_off', 'tag'),
+    'tag_ids_closure': ('tcl_off', 'tcl'),
+}
+
+# タイトルの列 → (オフセット, 文字列, NULL の印)
+TEXT_SECTIONS = {
+    'title': ('ttl_off', 'ttl', 'ttl_nul'),
+    'title_ja': ('tja_off', 'tja', 'tja_nul'),
+}
+
+# mmap の中身を np.frombuffer でそのまま数値配列として読むため、リトルエンディアン前提です
+if sys.byteorder != 'little':
+    raise ImportError("search_snapshot はリトルエンディアンの環境でのみ使えます")
+
+# -----------------------------------------------------------------------------
+# 1. 元データのウォーターマーク
+# -----------------------------------------------------------------------------
+def current_watermark(conn):
+    """
+    スナップショットに書き出す列を最後に書き換えた時刻です。
+    build_search_vns.py（full / delta）と build_tag_closure.py（closure: tag_ids_closure の更新）が
+    search_vns_build_state に記録しています。display など書き出さない列の記録は見ません。
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('search_vns_build_state') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("""
+        SELECT MAX(built_at) FROM search_vns_build_state WHERE name IN ('full', 'delta', 'closure')
+        """)
+        built_at = cur.fetchone()[0]
+    return built_at.isoformat() if built_at else None
+
+# -----------------------------------------------------------------------------
+# 2. 書き出し（search_vns → バイナリ）
+# -----------------------------------------------------------------------------
+def _csr(lists, dtype):
+    """行ごとのリスト → (オフセット int64[行数+1], 値)"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.fromiter((v for values in lists for v in values), dtype=dtype, count=int(offsets[-1]))
+    return offsets, values
+
+def _text_column(texts):
+    """文字列のリスト → (オフセット int64[行数+1], UTF-8 のバイト列, NULL の印 uint8[行数])"""
+    encoded = [(text or '').encode('utf-8') for text in texts]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    nulls = np.fromiter((text is None for text in texts), dtype=np.uint8, count=len(texts))
+    return offsets, b''.join(encoded), nulls
+
+def write_snapshot(path, rows, watermark=None, has_closure=True):
+    """
+    (id, title, title_ja, rating, votecount, 1970-01-01 からの日数, tag_ids, tag_ids_closure) の行を
+    VN ID の数値順に受け取り、スナップショットファイルに書き出して (行数, ファイルサイズ) を返します。
+    値はどれも NULL（None）でかまいません。
+    一時ファイルに書いてから名前を入れ替えるので、古いファイルを mmap している読み手には影響しません。
+    """
+    vids, titles, titles_ja, rating, votecount, released = [], [], [], [], [], []
+    tags, closure = [], []
+    for vn_id, title, title_ja, vn_rating, votes, days, tag_ids, closure_ids in rows:
+        vids.append(int(vn_id[1:]))
+        titles.append(title)
+        titles_ja.append(title_ja)
+        rating.append(np.nan if vn_rating is None else float(vn_rating))
+        votecount.append(votes if votes is not None else -1)
+        released.append(NULL_DAY if days is None else days)
+        tags.append(tag_ids or ())
+        closure.append(closure_ids or ())
+    n = len(vids)
+
+    meta = {
+        'source': 'search_vns',
+        'watermark': watermark,
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'rows': n,
+        'has_closure': has_closure,
+    }
+    sections = [
+        ('meta', json.dumps(meta, ensure_ascii=False).encode('utf-8')),
+        ('vid', np.asarray(vids, dtype=np.int32).tobytes()),
+        ('rating', np.asarray(rating, dtype=np.float32).tobytes()),
+        ('votes', np.asarray(votecount, dtype=np.int32).tobytes()),
+        ('released', np.asarray(released, dtype=np.int32).tobytes()),
+    ]
+    for column, lists in (('tag_ids', tags), ('tag_ids_closure', closure)):
+        offsets, values = _csr(lists, np.int32)
+        off_name, val_name = TAG_SECTIONS[column]
+        sections += [(off_name, offsets.tobytes()), (val_name, values.tobytes())]
+    for column, texts in (('title', titles), ('title_ja', titles_ja)):
+        offsets, blob, nulls = _text_column(texts)
+        off_name, str_name, null_name = TEXT_SECTIONS[column]
+        sections += [(off_name, offsets.tobytes()), (str_name, blob), (null_name, nulls.tobytes())]
+
+    position = HEADER.size + SECTION.size * len(sections)
+    directory, body = [], bytearray()
+    for name, data in sections:
+        padding = -(position + len(body)) % 8
+        body += b'\0' * padding
+        directory.append(SECTION.pack(name.encode(), position + len(body), len(data)))
+        body += data
+    directory = b''.join(directory)
+    checksum = hashlib.blake2b(directory + body, digest_size=32).digest()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, len(sections), 0, checksum))
+        f.write(directory)
+        f.write(body)
+    os.replace(tmp_path, path)
+    return n, os.path.getsize(path)
+
+def export_snapshot(conn, path):
+    """search_vns をスナップショットファイルに書き出します"""
+    from db import iter_rows
+
+    started = time.perf_counter()
+    watermark = current_watermark(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'search_vns' AND column_name = 'tag_ids_closure'
+          AND table_schema = ANY(current_schemas(false))
+        """)
+        has_closure = cur.fetchone() is not None
+    closure_column = 'tag_ids_closure' if has_closure else 'NULL::integer[]'
+
+    # 行番号の順 = VN ID の数値順（load_snapshot() と同じ順番です）
+    rows = iter_rows(conn, f"""
+        SELECT id, title, title_ja, rating, votecount, released - DATE '1970-01-01', tag_ids, {closure_column}
+        FROM search_vns
+        ORDER BY SUBSTRING(id FROM 2)::integer
+        """, fetch_size=5000, name='search_snapshot_export')
+    n, size = write_snapshot(path, rows, watermark=watermark, has_closure=has_closure)
+    conn.commit()
+    return n, size, time.perf_counter() - started
+
+# -----------------------------------------------------------------------------
+# 3. 読み込み（mmap してそのまま配列として参照）
+# -----------------------------------------------------------------------------
+class VNIds:
+    """VN ID の番号配列を "v11" のような文字列のリストとして見せます（使うときに作ります）"""
+
+    def __init__(self, numbers):
+        self.numbers = numbers
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, i):
+        return f"v{self.numbers[i]}"
+
+    def __iter__(self):
+        return (f"v{n}" for n in self.numbers.tolist())
+
+class TextColumn:
+    """オフセットつきの文字列テーブルを、文字列のリストとして見せます（使うときにデコードします）"""
+
+    def __init__(self, offsets, blob, nulls):
+        self.offsets = offsets
+        self.blob = blob
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+class SearchSnapshotFile:
+    """
+    スナップショットファイルを mmap して、コピーせずに参照します。
+    開くときに読むのはヘッダー・目次・meta だけなので、起動はほぼ一瞬です。
+
+        with SearchSnapshotFile('search_vns.vnsnap') as snap:
+            snap.rating[:10], snap.titles_ja[0], snap.tags(0)
+            if snap.is_stale(conn):
+                ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, n_sections, _reserved, checksum = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"スナップショットの形式が違います: {path}")
+        self.n = n
+        self.checksum = checksum
+        self._sections = {}
+        for k in range(n_sections):
+            name, offset, length = SECTION.unpack_from(self._mm, HEADER.size + SECTION.size * k)
+            self._sections[name.rstrip(b'\0').decode(errors='replace')] = (offset, length)
+        # 目次が壊れていると、どの列も正しく読めないので開く時点で止めます
+        required = {'meta', 'vid', 'rating', 'votes', 'released'}
+        required.update(*TAG_SECTIONS.values(), *TEXT_SECTIONS.values())
+        missing = sorted(required - self._sections.keys())
+        if missing or any(offset + length > len(self._mm) for offset, length in self._sections.values()):
+            self._mm.close()
+            self._file.close()
+            raise ValueError(f"スナップショットの目次が壊れています: {path}（{', '.join(missing) or '範囲外'}）")
+
+        self.meta = json.loads(self._bytes('meta'))
+        self.watermark = self.meta.get('watermark')
+        self.vn_numbers = self._array('vid', np.int32)
+        self.ids = VNIds(self.vn_numbers)
+        self.rating = self._array('rating', np.float32)
+        self.votecount = self._array('votes', np.int32)
+        self.released = self._array('released', np.int32)
+        self.tag_offsets, self.tag_values = self._tag_arrays('tag_ids')
+        self.titles = self._text('title')
+        self.titles_ja = self._text('title_ja')
+
+    def _bytes(self, name):
+        offset, length = self._sections[name]
+        return self._mm[offset:offset + length]
+
+    def _array(self, name, dtype):
+        offset, length = self._sections[name]
+        return np.frombuffer(self._mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def _tag_arrays(self, column):
+        off_name, val_name = TAG_SECTIONS[column]
+        return self._array(off_name, np.int64), self._array(val_name, np.int32)
+
+    def _text(self, column):
+        off_name, str_name, null_name = TEXT_SECTIONS[column]
+        offset, length = self._sections[str_name]
+        blob = memoryview(self._mm)[offset:offset + length]
+        return TextColumn(self._array(off_name, np.int64), blob, self._array(null_name, np.uint8))
+
+    def close(self):
+        # NumPy 配列や memoryview が mmap を参照している間は閉じられないので、
+        # その場合は参照がなくなったときに GC に任せます
+        for column in (self.titles, self.titles_ja):
+            column.blob.release()
+        self.vn_numbers = self.rating = self.votecount = self.released = None
+        self.tag_offsets = self.tag_values = self.titles = self.titles_ja = self.ids = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- 公開API ---
+    def tags(self, i, column='tag_ids'):
+        """行 i のタグIDの配列"""
+        offsets, values = self._tag_arrays(column) if column != 'tag_ids' else (self.tag_offsets, self.tag_values)
+        return values[offsets[i]:offsets[i + 1]]
+
+    def verify(self):
+        """チェックサムを計算し直して、ファイルが壊れていないか確かめます"""
+        digest = hashlib.blake2b(digest_size=32)
+        with memoryview(self._mm) as view, view[HEADER.size:] as body:
+            digest.update(body)
+        return digest.digest() == self.checksum
+
+    def is_stale(self, conn):
+        """DB の search_vns が、このスナップショットを書き出した後に作り直されていれば True"""
+        return current_watermark(conn) != self.watermark
+
+    def to_search_snapshot(self, tag_column='tag_ids'):
+        """tag_search_engine の Snapshot を作ります（数値の列はコピーせずにそのまま渡します）"""
+        if tag_column == 'tag_ids_closure' and not self.meta.get('has_closure'):
+            raise ValueError("このスナップショットには tag_ids_closure が入っていません")
+        offsets, values = self._tag_arrays(tag_column)
+        return Snapshot(self.ids, self.titles, self.titles_ja, self.rating, self.votecount,
+                        self.released, offsets, values,
+                        source=f'{os.path.basename(self.path)}:{tag_column}@{self.watermark}')
+
+# -----------------------------------------------------------------------------
+# 4. コマンドライン
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='search_vns の列形式スナップショットの作成・確認')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='search_vns をスナップショットに書き出す')
+    export.add_argument('output')
+    info = sub.add_parser('info', help='件数・ウォーターマークを表示し、DB と比べて古くないか確かめる')
+    info.add_argument('snapshot')
+    verify = sub.add_parser('verify', help='チェックサムを確かめる')
+    verify.add_argument('snapshot')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        from db import get_db_connection
+        conn = get_db_connection()
+        try:
+            n, size, elapsed = export_snapshot(conn, args.output)
+        finally:
+            conn.close()
+        print(f"✅ {n} 件を {args.output} に書き出しました（{size / 1024 / 1024:.1f} MiB、{elapsed:.2f} 秒）")
+    elif args.command == 'info':
+        started = time.perf_counter()
+        with SearchSnapshotFile(args.snapshot) as snap:
+            opened = (time.perf_counter() - started) * 1000
+            print(f"📦 {snap.n} 件（開くのにかかった時間 {opened:.2f} ms）")
+            print(f"   書き出し: {snap.meta['exported_at']} / ウォーターマーク: {snap.watermark}")
+            print(f"   タグ {len(snap.tag_values)} 件 / tag_ids_closure: {'あり' if snap.meta['has_closure'] else 'なし'}")
+            from db import get_db_connection
+            conn = get_db_connection()
+            try:
+                if snap.watermark is None:
+                    print("⚠️ 書き出したときに search_vns_build_state がなかったため、古いかどうか判定できません")
+                elif snap.is_stale(conn):
+                    print(f"⚠️ DB の search_vns はこの後に作り直されています（{current_watermark(conn)}）")
+                else:
+                    print("✅ DB の search_vns と同じ時点のものです")
+            finally:
+                conn.close()
+    else:
+        with SearchSnapshotFile(args.snapshot) as snap:
+            if snap.verify():
+                print(f"✅ チェックサムが一致しました（{snap.n} 件）")
+            else:
+                print("⚠️ チェックサムが一致しません。ファイルが壊れています")
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# 「似ている作品」の事前計算（タグのベクトルのコサイン類似度）
+#
+# 詳細ページに「似ている作品」を出したいのですが、リクエストのたびに vndb.tags_vn から
+# 計算するのは重すぎます。そこで、全 VN について上位 k 件の似ている作品をまとめて計算し、
+# similar_vns テーブルに保存しておきます。
+#
+#   1. VN × タグ の疎行列を作ります（値 = 投票の平均 × IDF）
+#      - tags_vn の ignore 行は使いません。平均が 0 以下（否定票が多い）のタグも使いません
+#      - IDF はタグダンプの vns（そのタグが付いた VN 数）から: log((1 + VN数) / (1 + vns))
+#        「Male Protagonist」のようにほとんどの作品に付くタグは、似ているかどうかにあまり効きません
+#   2. 各行を長さ 1 にそろえ（コサイン類似度 = 内積）、行をブロックに分けて
+#      「ブロック × 全 VN」の内積を行列積（BLAS）で計算し、上位 k 件だけ残します
+#      ブロックは複数のプロセスで並列に処理します
+#   3. similar_vns (id, similar_ids, scores) に1行ずつ配列で保存します
+#
+# 差分モード（--changed）では、タグが変わった VN（と削除された VN）だけを計算し直します。
+#   - 変わった VN 自身                       → 全件と比べて計算し直し
+#   - 上位 k 件に変わった VN が入っていた VN → 全件と比べて計算し直し
+#   - それ以外の VN                          → 保存済みの上位 k 件と、変わった VN との類似度を
+#                                              合わせて上位 k 件を選び直すだけ（他の VN との類似度は変わらないため）
+#     変わった VN との類似度はブロック × チャンクずつ計算し、その VN の k 件目を超えたものだけを候補に残します
+#
+# 実行方法:
+#   python similar_vns.py                 # 全件を計算
+#   python similar_vns.py --changed       # タグが変わった VN の分だけ計算し直す
+#   python similar_vns.py --show v17      # 保存済みの結果を表示
+# -----------------------------------------------------------------------------
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from db import get_db_connection
+
+TABLE = 'similar_vns'
+DEFAULT_K = 20
+DEFAULT_BLOCK_SIZE = 1024     # 1回の行列積で扱う行数（行側）
+DEFAULT_CHUNK_SIZE = 8192     # 1回の行列積で扱う行数（全 VN 側）
+# 変わった VN がこの割合を超えたら、差分ではなく全件を計算し直します
+FULL_RECOMPUTE_RATIO = 0.2
+
+# リポジトリ内の最新のタグダンプ（build_tag_closure.py と同じ）
+DEFAULT_TAGS_PATH = (sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'vndb-tags-*.json'))) or [None])[-1]
+
+# -----------------------------------------------------------------------------
+# 1. タグの重み（IDF）
+# -----------------------------------------------------------------------------
+def load_tag_vn_counts(path):
+    """タグダンプ（.json）またはタグカタログ（.tagcat）から {タグID: VN数} を読みます"""
+    if path.endswith('.tagcat'):
+        from tag_catalog import TagCatalog
+        with TagCatalog(path) as catalog:
+            return dict(zip(catalog.ids.tolist(), catalog.vns.tolist()))
+    with open(path, encoding='utf-8') as f:
+        return {tag['id']: tag.get('vns', 0) for tag in json.load(f)}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -----------------------------------------------------------------------------
+# 2. VN × タグ の疎行列（CSR 形式: indptr / indices / data）
+# -----------------------------------------------------------------------------
+class TagMatrix:
+    """
+    ids[i] が i 行目の VN ID、indptr[i]〜indptr[i+1] がその行のタグ（列番号と重み）です。
+    重みは IDF を掛けたあと、行ごとに長さ 1 にそろえてあります。
+    """
+
+    def __init__(self, ids, indptr, indices, data, tag_ids, fingerprints):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.tag_ids = tag_ids
+        self.fingerprints = fingerprints
+        self.row_of = {vn_id: i for i, vn_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def ntags(self):
+        return len(self.tag_ids)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def arrays(self):
+        """ワーカープロセスに渡す配列"""
+        return self.indptr, self.indices, self.data, self.ntags
+
+def load_matrix(conn, vn_counts, n_docs=None):
+    """
+    tags_vn を (VN, タグ) ごとに平均して読み込み、IDF を掛けて正規化した行列を返します。
+    n_docs は IDF の分母（差分モードでは前回と同じ値を使い、重みがずれないようにします）。
+    """
+    with conn.cursor(name='similar_vns_tags') as cur:
+        cur.itersize = 100000
+        cur.execute("""
+        SELECT tv.vid, tv.tag, AVG(tv.vote)::real
+        FROM vndb.tags_vn tv
+        JOIN search_vns s ON s.id = tv.vid
+        WHERE NOT tv.ignore
+        GROUP BY tv.vid, tv.tag
+        HAVING AVG(tv.vote) > 0
+        ORDER BY SUBSTRING(tv.vid FROM 2)::int, tv.tag
+        """)
+        vids, tags, votes = [], [], []
+        for vid, tag, vote in cur:
+            vids.append(vid)
+            tags.append(tag)
+            votes.append(vote)
+    with conn.cursor() as cur:
+        # タグが1つもない VN も行として持っておきます（似ている作品は空）
+        cur.execute("SELECT id FROM search_vns ORDER BY SUBSTRING(id FROM 2)::int")
+        all_ids = [vn_id for (vn_id,) in cur.fetchall()]
+    conn.commit()
+
+    tag_array = np.array(tags, dtype=np.int32)
+    tag_ids, indices = np.unique(tag_array, return_inverse=True)
+    indices = indices.astype(np.int32)
+
+    if n_docs is None:
+        n_docs = max(len(all_ids), max(vn_counts.values(), default=0))
+    # ダンプにないタグ（ダンプより新しいタグ）は、手元のデータの件数で代用します
+    local_counts = np.bincount(indices, minlength=len(tag_ids))
+    df = np.array([vn_counts.get(int(t), local_counts[n]) for n, t in enumerate(tag_ids)], dtype=np.float64)
+    idf = np.log((1.0 + n_docs) / (1.0 + df)).astype(np.float32)
+
+    data = np.array(votes, dtype=np.float32) * idf[indices]
+
+    # 行の境界（tags_vn は VN 順に並んでいます）
+    counts = {}
+    for vid in vids:
+        counts[vid] = counts.get(vid, 0) + 1
+    indptr = np.zeros(len(all_ids) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([counts.get(vn_id, 0) for vn_id in all_ids])
+    if indptr[-1] != len(vids):
+        raise RuntimeError("tags_vn の VN が search_vns の並びと一致しません")
+
+    # 行ごとに長さ 1 にそろえます
+    row_of_nnz = np.repeat(np.arange(len(all_ids)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(row_of_nnz, weights=data.astype(np.float64) ** 2, minlength=len(all_ids)))
+    data = (data / np.where(norms > 0, norms, 1.0)[row_of_nnz]).astype(np.float32)
+
+    # 差分モードで「タグが変わった VN」を見つけるための指紋（タグと重みのハッシュ）
+    fingerprints = np.empty(len(all_ids), dtype=np.int64)
+    rounded = np.round(data, 5)
+    for i in range(len(all_ids)):
+        lo, hi = indptr[i], indptr[i + 1]
+        digest = hashlib.blake2b(tag_ids[indices[lo:hi]].tobytes() + rounded[lo:hi].tobytes(), digest_size=8)
+        fingerprints[i] = int.from_bytes(digest.digest(), 'little', signed=True)
+
+    matrix = TagMatrix(all_ids, indptr, indices, data, tag_ids, fingerprints)
+    return matrix, n_docs
+
+# -----------------------------------------------------------------------------
+# 3. 上位 k 件の計算（ワーカープロセスで実行）
+# -----------------------------------------------------------------------------
+_worker_matrix = None
+
+def _init_worker(indptr, indices, data, ntags, chunk_size):
+    global _worker_matrix
+    _worker_matrix = (indptr, indices, data, ntags, chunk_size)
+
+def _densify(indptr, indices, data, ntags, rows):
+    """CSR の指定した行を、密な行列（行数 × タグ数）にします"""
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    dense = np.zeros((len(rows), ntags), dtype=np.float32)
+    if lengths.sum():
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        dense[np.repeat(np.arange(len(rows)), lengths), indices[positions]] = data[positions]
+    return dense
+
+def _merge_topk(best_ids, best_scores, ids, scores, k):
+    """行ごとに、今までの上位 k 件と新しい候補を合わせて上位 k 件を選びます"""
+    all_ids = np.concatenate([best_ids, ids], axis=1)
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    if all_scores.shape[1] > k:
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_ids = np.take_along_axis(all_ids, top, axis=1)
+        all_scores = np.take_along_axis(all_scores, top, axis=1)
+    return all_ids, all_scores
+
+def _topk_block(rows, k):
+    """
+    rows（行番号の配列）について、全 VN との類似度の上位 k 件を返します。
+    戻り値: (行番号, 相手の行番号 [len(rows) × k], 類似度 [len(rows) × k])。k 件に満たない分は -1 / 0。
+    """
+    indptr, indices, data, ntags, chunk_size = _worker_matrix
+    n = len(indptr) - 1
+    block = _densify(indptr, indices, data, ntags, rows)
+    best_ids = np.full((len(rows), 0), -1, dtype=np.int32)
+    best_scores = np.zeros((len(rows), 0), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        columns = np.arange(start, min(start + chunk_size, n))
+        scores = block @ _densify(indptr, indices, data, ntags, columns).T
+        # 自分自身は除きます
+        mine = (rows >= start) & (rows < start + len(columns))
+        scores[np.nonzero(mine)[0], rows[mine] - start] = 0.0
+        take = min(k, len(columns))
+        top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        best_ids, best_scores = _merge_topk(
+            best_ids, best_scores, (top + start).astype(np.int32),
+            np.take_along_axis(scores, top, axis=1), k)
+    # 類似度の高い順に並べ、類似度 0 以下（共通のタグがない）は捨てます
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_ids[best_scores <= 0] = -1
+    return rows, best_ids, best_scores
+
+def _candidates_over(rows, thresholds, block_size):
+    """
+    rows（差分モードの「変わった VN」）と全 VN との類似度を、ブロック × チャンクずつ計算し、
+    相手の VN ごとの閾値（thresholds、その VN の上位 k 件に入るのに必要な類似度）を超えたものだけを
+    {相手の行番号: [(行番号, 類似度), ...]} で返します。
+    「変わった VN の数 × VN数」の行列は作らず、block_size × chunk_size の分だけを順に使います。
+    """
+    indptr, indices, data, ntags, chunk_size = _worker_matrix
+    n = len(indptr) - 1
+    found = {}
+    for start in range(0, n, chunk_size):
+        columns = np.arange(start, min(start + chunk_size, n))
+        chunk = _densify(indptr, indices, data, ntags, columns).T
+        limits = thresholds[columns]
+        for b in range(0, len(rows), block_size):
+            block_rows = rows[b:b + block_size]
+            scores = _densify(indptr, indices, data, ntags, block_rows) @ chunk
+            for i, j in zip(*np.nonzero(scores > limits)):
+                if block_rows[i] != start + j:
+                    found.setdefault(start + int(j), []).append((int(block_rows[i]), scores[i, j]))
+    return found
+
+def compute_topk(matrix, rows, k, workers, block_size, chunk_size):
+    """rows の各行の上位 k 件を、ブロックごとにプロセスを分けて計算します"""
+    started = time.perf_counter()
+    results = {}
+    blocks = [rows[i:i + block_size] for i in range(0, len(rows), block_size)]
+    if workers <= 1:
+        _init_worker(*matrix.arrays(), chunk_size)
+        outputs = (_topk_block(block, k) for block in blocks)
+        executor = None
+    else:
+        # 各プロセスは BLAS を1スレッドで使います（プロセス数 × スレッド数で CPU を取り合わないように）
+        for name in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+            os.environ.setdefault(name, '1')
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(*matrix.arrays(), chunk_size))
+        outputs = executor.map(_topk_block, blocks, [k] * len(blocks))
+    try:
+        done = 0
+        for block_rows, ids, scores in outputs:
+            for row, neighbor_rows, neighbor_scores in zip(block_rows.tolist(), ids, scores):
+                keep = neighbor_rows >= 0
+                results[row] = (neighbor_rows[keep], neighbor_scores[keep])
+            done += len(block_rows)
+            elapsed = time.perf_counter() - started
+            print(f"\r   {done}/{len(rows)} 件（{done / elapsed:,.0f} 件/秒）", end='', flush=True)
+    finally:
+        if executor:
+            executor.shutdown()
+    if rows.size:
+        print()
+    return results
+
+# -----------------------------------------------------------------------------
+# 4. テーブル
+# -----------------------------------------------------------------------------
+def ensure_tables(cur):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        id TEXT PRIMARY KEY,            -- VN ID（'v17' など）
+        similar_ids INTEGER[] NOT NULL, -- 似ている VN の番号（'v' を除いた数字）。似ている順
+        scores REAL[] NOT NULL,         -- コサイン類似度（similar_ids と同じ順）
+        fingerprint BIGINT NOT NULL,    -- タグと重みのハッシュ（差分モードで変化を見つける用）
+        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {TABLE}_state (
+        name TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        n_docs INTEGER NOT NULL,
+        k INTEGER NOT NULL,
+        built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def write_results(cur, matrix, results, delete_ids=(), replace_all=False):
+    """
+    計算結果を一時テーブルに COPY してから、変わった行だけを書き込みます。
+    replace_all のときは、結果に含まれない行を削除します。
+    """
+    numbers = np.array([int(vn_id[1:]) for vn_id in matrix.ids], dtype=np.int64)
+    cur.execute(f"""
+    CREATE TEMP TABLE {TABLE}_new (
+        id TEXT, similar_ids INTEGER[], scores REAL[], fingerprint BIGINT
+    ) ON COMMIT DROP
+    """)
+    buf = io.StringIO()
+    for row, (neighbors, scores) in results.items():
+        ids = ','.join(map(str, numbers[neighbors].tolist()))
+        values = ','.join(f"{s:.5f}" for s in scores.tolist())
+        buf.write(f"{matrix.ids[row]}\t{{{ids}}}\t{{{values}}}\t{matrix.fingerprints[row]}\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {TABLE}_new FROM STDIN", buf)
+    cur.execute(f"""
+    INSERT INTO {TABLE} AS t (id, similar_ids, scores, fingerprint, computed_at)
+    SELECT id, similar_ids, scores, fingerprint, CURRENT_TIMESTAMP FROM {TABLE}_new
+    ON CONFLICT (id) DO UPDATE SET
+        similar_ids = EXCLUDED.similar_ids, scores = EXCLUDED.scores,
+        fingerprint = EXCLUDED.fingerprint, computed_at = EXCLUDED.computed_at
+    WHERE (t.similar_ids, t.scores, t.fingerprint)
+          IS DISTINCT FROM (EXCLUDED.similar_ids, EXCLUDED.scores, EXCLUDED.fingerprint)
+    """)
+    written = cur.rowcount
+    if replace_all:
+        cur.execute(f"DELETE FROM {TABLE} t WHERE NOT EXISTS (SELECT 1 FROM {TABLE}_new n WHERE n.id = t.id)")
+    else:
+        cur.execute(f"DELETE FROM {TABLE} WHERE id = ANY(%s)", (list(delete_ids),))
+    return written, cur.rowcount
+
+def record_state(cur, path, sha256, n_docs, k):
+    cur.execute(f"""
+    INSERT INTO {TABLE}_state (name, source, sha256, n_docs, k, built_at)
+    VALUES ('tags', %s, %s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET
+        source = EXCLUDED.source, sha256 = EXCLUDED.sha256, n_docs = EXCLUDED.n_docs,
+        k = EXCLUDED.k, built_at = CURRENT_TIMESTAMP
+    """, (os.path.basename(path), sha256, n_docs, k))
+
+# -----------------------------------------------------------------------------
+# 5. 全件・差分の計算
+# -----------------------------------------------------------------------------
+def build_similar(conn, tags_path, k=DEFAULT_K, changed_only=False, workers=None,
+                  block_size=DEFAULT_BLOCK_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    sha256 = file_sha256(tags_path)
+    with conn.cursor() as cur:
+        ensure_tables(cur)
+        cur.execute(f"SELECT sha256, n_docs, k FROM {TABLE}_state WHERE name = 'tags'")
+        state = cur.fetchone()
+    conn.commit()
+
+    # タグダンプ（IDF）や k が変わったときは、全件の重みが変わるので差分にできません
+    if changed_only and not (state and state[0] == sha256 and state[2] == k):
+        print("⚠️  前回とタグダンプまたは k が違うため、全件を計算し直します")
+        changed_only = False
+
+    matrix, n_docs = load_matrix(conn, load_tag_vn_counts(tags_path),
+                                 n_docs=state[1] if changed_only else None)
+    print(f"📥 {len(matrix)} 件の VN × {matrix.ntags} タグ（非ゼロ {matrix.nnz:,} 個）を読み込みました"
+          f"（{time.perf_counter() - started:.1f} 秒）")
+
+    if changed_only:
+        written, deleted = _update_changed(conn, matrix, k, workers, block_size, chunk_size)
+    else:
+        rows = np.arange(len(matrix))
+        results = compute_topk(matrix, rows, k, workers, block_size, chunk_size)
+        with conn.cursor() as cur:
+            written, deleted = write_results(cur, matrix, results, replace_all=True)
+    with conn.cursor() as cur:
+        record_state(cur, tags_path, sha256, n_docs, k)
+    conn.commit()
+    print(f"✅ {TABLE}: 書き込み {written} 件 / 削除 {deleted} 件（{time.perf_counter() - started:.1f} 秒）")
+
+def _update_changed(conn, matrix, k, workers, block_size, chunk_size):
+    """タグが変わった VN と、その影響を受ける VN だけを計算し直します"""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT id, similar_ids, scores, fingerprint FROM {TABLE}")
+        stored = {vn_id: (ids, scores, fingerprint) for vn_id, ids, scores, fingerprint in cur.fetchall()}
+    conn.commit()
+
+    changed_rows = [row for row, vn_id in enumerate(matrix.ids)
+                    if vn_id not in stored or stored[vn_id][2] != matrix.fingerprints[row]]
+    deleted = [vn_id for vn_id in stored if vn_id not in matrix.row_of]
+    # 上位 k 件の中に「変わった VN」が入っていたかの判定用（番号で持ちます）
+    touched = {int(matrix.ids[row][1:]) for row in changed_rows} | {int(vn_id[1:]) for vn_id in deleted}
+    print(f"🔍 タグが変わった VN {len(changed_rows)} 件 / 削除された VN {len(deleted)} 件")
+    if not touched:
+        return 0, 0
+    if len(touched) > FULL_RECOMPUTE_RATIO * len(matrix):
+        print("変わった VN が多いため、全件を計算し直します")
+        results = compute_topk(matrix, np.arange(len(matrix)), k, workers, block_size, chunk_size)
+        with conn.cursor() as cur:
+            return write_results(cur, matrix, results, replace_all=True)
+
+    # --- A. 上位 k 件に変わった VN が入っていた VN は計算し直し、それ以外は閾値を決めておく ---
+    # 閾値 = 保存済みの k 件目の類似度（k 件に満たなければ 0）。計算し直す VN は候補を探しません
+    recompute = set(changed_rows)
+    thresholds = np.full(len(matrix), np.inf, dtype=np.float32)
+    for row, vn_id in enumerate(matrix.ids):
+        if row in recompute:
+            continue
+        ids, scores, _fingerprint = stored[vn_id]
+        if touched.intersection(ids):
+            recompute.add(row)
+            continue
+        thresholds[row] = scores[-1] if len(scores) >= k else 0.0
+
+    # --- B. 変わった VN との類似度のうち、閾値を超えたものだけを候補として上位 k 件に足す ---
+    _init_worker(*matrix.arrays(), chunk_size)
+    changed_rows = np.array(changed_rows, dtype=np.int64)
+    found = _candidates_over(changed_rows, thresholds, block_size) if len(changed_rows) else {}
+    results = {}
+    for row, candidates in found.items():
+        ids, scores, _fingerprint = stored[matrix.ids[row]]
+        merged_ids = np.concatenate([np.array([matrix.row_of[f'v{n}'] for n in ids], dtype=np.int64),
+                                     np.array([r for r, _score in candidates], dtype=np.int64)])
+        merged_scores = np.concatenate([np.array(scores, dtype=np.float32),
+                                        np.array([score for _r, score in candidates], dtype=np.float32)])
+        order = np.argsort(-merged_scores, kind='stable')[:k]
+        results[row] = (merged_ids[order], merged_scores[order])
+
+    recompute = np.array(sorted(recompute), dtype=np.int64)
+    print(f"   全件と比べ直す VN {len(recompute)} 件 / 候補を足すだけの VN {len(results)} 件")
+    results.update(compute_topk(matrix, recompute, k, workers, block_size, chunk_size))
+    with conn.cursor() as cur:
+        return write_results(cur, matrix, results, delete_ids=deleted)
+
+# -----------------------------------------------------------------------------
+# 6. 表示
+# -----------------------------------------------------------------------------
+def show(conn, vn_id):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        SELECT s.id, s.title, x.score
+        FROM {TABLE} t
+        CROSS JOIN LATERAL UNNEST(t.similar_ids, t.scores) WITH ORDINALITY AS x(vn, score, rank)
+        JOIN search_vns s ON s.id = 'v' || x.vn
+        WHERE t.id = %s
+        ORDER BY x.rank
+        """, (vn_id,))
+        rows = cur.fetchall()
+    conn.commit()
+    if not rows:
+        print(f"{vn_id} の似ている作品はありません")
+    for similar_id, title, score in rows:
+        print(f"   {score:.3f}  {similar_id:>7}  {title}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='タグの類似度で「似ている作品」を計算します')
+    parser.add_argument('tags', nargs='?', default=DEFAULT_TAGS_PATH,
+                        help='タグダンプ（.json）またはタグカタログ（.tagcat）。IDF の計算に使います')
+    parser.add_argument('--changed', action='store_true',
+                        help='タグが変わった VN の分だけ計算し直す')
+    parser.add_argument('-k', type=int, default=DEFAULT_K, help='保存する件数')
+    parser.add_argument('--workers', type=int, help='プロセス数（省略時は CPU 数）')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--show', metavar='VN_ID', help='保存済みの結果を表示する')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.show:
+            show(conn, args.show)
+        else:
+            build_similar(conn, args.tags, k=args.k, changed_only=args.changed, workers=args.workers,
+                          block_size=args.block_size, chunk_size=args.chunk_size)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,507 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# データ更新の全工程を、依存関係に沿って実行するスケジューラー
+#
+# これまでは、ダンプの取り込み → ingest_vndb_data.py → update_tag_translations.py →
+# psql -f sql/create_search_vns.sql ... を手で順番に実行していました。
+# 1つずつしか動かず、入力が変わっていない工程も毎回やり直していました。
+# ここでは各工程（ジョブ）の入力と出力を宣言し、そこから依存関係（DAG）を作ります。
+#   - 入力を作るジョブが終わってから実行します。依存し合わないジョブは同時に動かします
+#   - 同時に使う DB 接続数の合計を --db-connections 以下に抑えます
+#   - 入力のウォーターマーク（ファイルのサイズと更新時刻、テーブルを書いたジョブが残した作成時刻）が
+#     前回成功したときから変わっていないジョブは飛ばします
+#   - 実行結果は sync_runs / sync_job_state テーブルに残します。前回の実行が途中で失敗していれば、
+#     その実行で成功したジョブは飛ばし、失敗したジョブから続けます
+#
+#   import_dump ─┬─ search_vns ─┬─ display ─┬─ title_search
+#   tag_closure ─┘              │           ├─ people_index
+#                │              │           └─ snapshot
+#                └──────────────┴─ similar_vns
+#   ingest ── tag_translations
+#
+# 実行方法:
+#   python sync_scheduler.py                          # 変わったところだけ実行
+#   python sync_scheduler.py --dump vndb-db-2026-01-10.tar.zst   # ダンプの取り込みから
+#   python sync_scheduler.py --dry-run                # 何を実行するかだけ表示
+#   python sync_scheduler.py --only search_vns display --force   # 指定したジョブを必ず実行
+#   python sync_scheduler.py --skip ingest            # API からの取得を除いて実行
+#   python sync_scheduler.py --status                 # 前回の結果を表示
+# -----------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+from psycopg2.extras import Json
+
+import pipeline_metrics
+from build_tag_closure import DEFAULT_TAGS_PATH
+from db import get_db_connection
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_DB_CONNECTIONS = 4
+DEFAULT_SNAPSHOT_PATH = os.path.join(HERE, 'search_vns.vnsnap')
+
+# 2つのスケジューラーが同時に動かないようにするロックの番号（pg_try_advisory_lock）
+LOCK_ID = 7_420_001
+
+# 失敗したときに sync_job_state に残す出力の行数
+ERROR_TAIL_LINES = 20
+
+# -----------------------------------------------------------------------------
+# 1. ジョブの定義
+# -----------------------------------------------------------------------------
+class Job:
+    """
+    1つの工程です。command は HERE で実行するコマンド、inputs / outputs は資源名のリストです。
+      file:<パス>     ファイル（ウォーターマークはサイズと更新時刻）
+      table:<名前>    テーブル（書いたジョブが残した作成時刻。search_path で解決します）
+      schema:<名前>   スキーマ（取り込みで入れ替えたときの OID とコメント）
+    always=True のジョブ（API からの取得など、入力を DB から測れないもの）は毎回実行します。
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), connections=1, always=False):
+        self.name = name
+        self.command = [sys.executable] + list(command)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.connections = connections
+        self.always = always
+        self.deps = set()
+
+    @property
+    def command_text(self):
+        return ' '.join(self.command[1:])
+
+def define_jobs(args):
+    tags = args.tags
+    jobs = []
+    if args.dump:
+        jobs.append(Job('import_dump', ['import_vndb_dump.py', args.dump, '--workers', str(args.import_workers)],
+                        inputs=[f'file:{args.dump}'], outputs=['schema:vndb'],
+                        connections=args.import_workers + 1))
+    jobs += [
+        Job('ingest', ['ingest_vndb_data.py', '--all'],
+            outputs=['table:visual_novels'], always=True),
+        Job('tag_translations', ['update_tag_translations.py'],
+            inputs=['table:visual_novels', f'file:{os.path.join(HERE, "tag_translations.py")}'],
+            outputs=['table:visual_novels']),
+        # 閉包を作ったあと、search_vns.tag_ids_closure とタグごとの上位リストも更新します
+        Job('tag_closure', ['build_tag_closure.py', tags],
+            inputs=[f'file:{tags}'],
+            outputs=['table:tag_closure', 'table:search_vns', 'table:tag_top_vns']),
+        Job('search_vns', ['build_search_vns.py'],
+            inputs=['schema:vndb', 'table:tag_closure'], outputs=['table:search_vns', 'table:tag_top_vns']),
+        Job('display', ['build_display.py'],
+            inputs=['schema:vndb', 'table:search_vns'], outputs=['table:search_vns']),
+        Job('title_search', ['title_search.py', 'build'],
+            inputs=['schema:vndb', 'table:search_vns'], outputs=['table:title_search']),
+        Job('people_index', ['build_people_index.py', '--delta'],
+            inputs=['schema:vndb', 'table:search_vns'], outputs=['table:people_vns', 'table:people_names']),
+        Job('similar_vns', ['similar_vns.py', tags, '--changed'],
+            inputs=['schema:vndb', f'file:{tags}'], outputs=['table:similar_vns']),
+        Job('snapshot', ['search_snapshot.py', 'export', args.snapshot],
+            inputs=['table:search_vns'], outputs=[f'file:{args.snapshot}']),
+    ]
+    return jobs
+
+def resolve_dependencies(jobs):
+    """
+    入力を出力するジョブを依存先にして、実行できる順番（トポロジカル順）に並べて返します。
+    同じ資源を出力するジョブが複数ある場合は、そのすべてに依存します。
+    """
+    producers = {}
+    for job in jobs:
+        for resource in job.outputs:
+            producers.setdefault(resource, []).append(job.name)
+    for job in jobs:
+        job.deps = {name for resource in job.inputs for name in producers.get(resource, [])
+                    if name != job.name}
+
+    by_name = {job.name: job for job in jobs}
+    remaining = {job.name: len(job.deps) for job in jobs}
+    ready = deque(job.name for job in jobs if not job.deps)
+    order = []
+    while ready:
+        name = ready.popleft()
+        order.append(by_name[name])
+        for job in jobs:
+            if name in job.deps:
+                remaining[job.name] -= 1
+                if remaining[job.name] == 0:
+                    ready.append(job.name)
+    if len(order) != len(jobs):
+        cycle = sorted(name for name, count in remaining.items() if count > 0)
+        raise ValueError(f"ジョブの依存関係が循環しています: {', '.join(cycle)}")
+    return order
+
+# -----------------------------------------------------------------------------
+# 2. ウォーターマーク（入力が前回から変わったかどうか）
+# -----------------------------------------------------------------------------
+# 入力が変わったかどうかは、書き込んだ側が明示的に残した印で判断します。
+# pg_stat_user_tables の書き込み行数は pg_stat_reset やクラッシュで 0 に戻り、track_counts が off だと
+# 増えません。OID や relfilenode は、その場での UPDATE（tag_translations・display など）では変わりません。
+#
+# 資源ごとの印（テーブル名, SQL）です。ここにないテーブルは、このスケジューラーで書いたジョブが
+# 成功した時刻（sync_outputs）を使います。
+RESOURCE_MARKERS = {
+    # ingest（bulk_upsert）は、中身が変わった行だけ updated_at を進めます
+    'table:visual_novels': ('visual_novels', "SELECT MAX(updated_at) FROM visual_novels"),
+    # build_search_vns（full / delta）・build_tag_closure・build_display が作成のたびに記録します
+    'table:search_vns': ('search_vns_build_state', "SELECT MAX(built_at) FROM search_vns_build_state"),
+    'table:tag_top_vns': ('search_vns_build_state', "SELECT MAX(built_at) FROM search_vns_build_state"),
+    'table:tag_closure': ('tag_closure_state', "SELECT MAX(built_at) FROM tag_closure_state"),
+}
+
+def resource_watermark(cur, resource):
+    """資源の現在の状態を表す文字列です。存在しないか、印がまだ残っていなければ None"""
+    kind, _, name = resource.partition(':')
+    if kind == 'file':
+        try:
+            st = os.stat(name)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    if kind == 'schema':
+        # import_vndb_dump は作業用スキーマと入れ替えるので OID が変わり、取り込んだダンプをコメントに残します
+        cur.execute("SELECT oid, obj_description(oid, 'pg_namespace') FROM pg_namespace WHERE nspname = %s",
+                    (name,))
+        row = cur.fetchone()
+        return None if row is None else f"{row[0]}:{row[1] or ''}"
+    if kind != 'table':
+        raise ValueError(f"資源の種類が正しくありません: {resource}")
+
+    cur.execute("SELECT to_regclass(%s)::oid", (name,))
+    oid = cur.fetchone()[0]
+    if oid is None:
+        return None
+    if resource in RESOURCE_MARKERS:
+        state_table, sql = RESOURCE_MARKERS[resource]
+        cur.execute("SELECT to_regclass(%s)", (state_table,))
+        if cur.fetchone()[0] is None:
+            return None
+        cur.execute(sql)
+    else:
+        cur.execute("SELECT written_at FROM sync_outputs WHERE resource = %s", (resource,))
+    row = cur.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return f"{oid}:{row[0].isoformat()}"
+
+def input_watermarks(cur, job):
+    return {resource: resource_watermark(cur, resource) for resource in job.inputs}
+
+# -----------------------------------------------------------------------------
+# 3. 実行結果の記録
+# -----------------------------------------------------------------------------
+def ensure_state_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_runs (
+        run_id SERIAL PRIMARY KEY,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        status TEXT NOT NULL            -- running / done / failed
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_job_state (
+        job TEXT PRIMARY KEY,
+        run_id INTEGER,
+        status TEXT NOT NULL,           -- done / skipped / failed
+        command TEXT,
+        input_watermarks JSONB,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        seconds REAL,
+        error TEXT
+    )
+    """)
+    # 出力ごとに、最後に書いたジョブが成功した時刻です（RESOURCE_MARKERS にないテーブルの印）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_outputs (
+        resource TEXT PRIMARY KEY,
+        job TEXT NOT NULL,
+        run_id INTEGER,
+        written_at TIMESTAMP NOT NULL
+    )
+    """)
+
+def load_job_states(cur):
+    cur.execute("SELECT job, run_id, status, command, input_watermarks FROM sync_job_state")
+    return {job: {'run_id': run_id, 'status': status, 'command': command, 'inputs': inputs}
+            for job, run_id, status, command, inputs in cur.fetchall()}
+
+def start_run(cur, fresh, dry_run=False):
+    """
+    前回の実行が失敗（または途中で止まった）なら、その run_id を引き継いで再開します。
+    それ以外（または fresh=True）なら新しい run_id を作ります。dry_run のときは何も書き込みません。
+    """
+    cur.execute("SELECT run_id, status FROM sync_runs ORDER BY run_id DESC LIMIT 1")
+    last = cur.fetchone()
+    if last and last[1] in ('failed', 'running') and not fresh:
+        if not dry_run:
+            cur.execute("UPDATE sync_runs SET status = 'running', finished_at = NULL WHERE run_id = %s",
+                        (last[0],))
+        return last[0], True
+    if dry_run:
+        return None, False
+    cur.execute("INSERT INTO sync_runs (status) VALUES ('running') RETURNING run_id")
+    return cur.fetchone()[0], False
+
+def record_job(cur, job, run_id, status, watermarks, started_at=None, seconds=None, error=None):
+    cur.execute("""
+    INSERT INTO sync_job_state (job, run_id, status, command, input_watermarks,
+                                started_at, finished_at, seconds, error)
+    VALUES (%s, %s, %s, %s, %s, to_timestamp(%s)::timestamp, CURRENT_TIMESTAMP, %s, %s)
+    ON CONFLICT (job) DO UPDATE SET
+        run_id = EXCLUDED.run_id, status = EXCLUDED.status, command = EXCLUDED.command,
+        input_watermarks = EXCLUDED.input_watermarks, started_at = EXCLUDED.started_at,
+        finished_at = EXCLUDED.finished_at, seconds = EXCLUDED.seconds, error = EXCLUDED.error
+    """, (job.name, run_id, status, job.command_text, Json(watermarks), started_at, seconds, error))
+
+def record_outputs(cur, job, run_id):
+    for resource in job.outputs:
+        if resource.startswith('file:'):
+            continue
+        cur.execute("""
+        INSERT INTO sync_outputs (resource, job, run_id, written_at)
+        VALUES (%s, %s, %s, clock_timestamp())
+        ON CONFLICT (resource) DO UPDATE SET
+            job = EXCLUDED.job, run_id = EXCLUDED.run_id, written_at = EXCLUDED.written_at
+        """, (resource, job.name, run_id))
+
+def skip_reason(job, state, watermarks, run_id, resumed, force):
+    """飛ばしてよければその理由を、実行すべきなら None を返します"""
+    if force or state is None:
+        return None
+    if resumed and state['run_id'] == run_id and state['status'] in ('done', 'skipped'):
+        return '前回の実行で完了済み'
+    if job.always:
+        return None
+    if state['status'] in ('done', 'skipped') and state['command'] == job.command_text \
+            and state['inputs'] == watermarks and None not in watermarks.values():
+        return '入力が変わっていない'
+    return None
+
+# -----------------------------------------------------------------------------
+# 4. 実行
+# -----------------------------------------------------------------------------
+class Scheduler:
+    """
+    ジョブをトポロジカル順に見て、依存先が終わっていて DB 接続数に空きがあるものから起動します。
+    ジョブは子プロセスとして実行し、出力には [ジョブ名] を付けて表示します。
+    """
+
+    def __init__(self, jobs, conn, db_connections=DEFAULT_DB_CONNECTIONS, force=False, fresh=False,
+                 dry_run=False):
+        self.jobs = jobs
+        self.conn = conn
+        self.budget = db_connections
+        self.force = force
+        self.fresh = fresh
+        self.dry_run = dry_run
+        self.run_id = None
+        self.results = {}      # ジョブ名 → done / skipped / failed / blocked
+
+    async def run(self):
+        with self.conn.cursor() as cur:
+            ensure_state_tables(cur)
+            states = load_job_states(cur)
+            run_id, resumed = start_run(cur, fresh=self.fresh, dry_run=self.dry_run)
+        self.conn.commit()
+        if resumed:
+            print(f"🔁 前回の実行（run {run_id}）が失敗していたので、続きから再開します")
+        self.run_id = run_id
+
+        pending = list(self.jobs)
+        running = {}           # Task → Job
+        in_use = 0
+        while pending or running:
+            # --- A. 依存先が終わり、接続数に空きがあるジョブを起動 ---
+            for job in list(pending):
+                dep_results = [self.results.get(dep) for dep in job.deps]
+                if any(result in ('failed', 'blocked') for result in dep_results):
+                    pending.remove(job)
+                    self.results[job.name] = 'blocked'
+                    print(f"⏭️  [{job.name}] 依存先が失敗したため実行しません")
+                    continue
+                if None in dep_results:
+                    continue
+                # 予算より多く使うジョブは、他に何も動いていないときだけ起動します
+                needed = min(job.connections, self.budget)
+                if in_use + needed > self.budget:
+                    continue
+
+                with self.conn.cursor() as cur:
+                    watermarks = input_watermarks(cur, job)
+                self.conn.commit()
+                # dry-run では上流が実行される予定なら、入力が変わるものとして扱います
+                upstream_runs = self.dry_run and any(r == 'done' for r in dep_results)
+                reason = None if upstream_runs else skip_reason(
+                    job, states.get(job.name), watermarks, run_id, resumed, self.force)
+                pending.remove(job)
+                if reason:
+                    self.results[job.name] = 'skipped'
+                    print(f"⏭️  [{job.name}] 飛ばします（{reason}）")
+                    if not self.dry_run and states.get(job.name, {}).get('run_id') != run_id:
+                        with self.conn.cursor() as cur:
+                            record_job(cur, job, run_id, 'skipped', watermarks)
+                        self.conn.commit()
+                    continue
+                if self.dry_run:
+                    self.results[job.name] = 'done'
+                    print(f"▶️  [{job.name}] 実行します: {job.command_text}")
+                    continue
+
+                in_use += needed
+                task = asyncio.create_task(self._run_job(job, watermarks))
+                running[task] = (job, needed)
+
+            if not running:
+                if pending:
+                    continue
+                break
+
+            # --- B. どれか1つ終わるのを待つ ---
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                job, needed = running.pop(task)
+                in_use -= needed
+                self.results[job.name] = task.result()
+
+        failed = [name for name, result in self.results.items() if result in ('failed', 'blocked')]
+        if not self.dry_run:
+            with self.conn.cursor() as cur:
+                cur.execute("UPDATE sync_runs SET status = %s, finished_at = CURRENT_TIMESTAMP WHERE run_id = %s",
+                            ('failed' if failed else 'done', run_id))
+            self.conn.commit()
+        return not failed
+
+    async def _run_job(self, job, watermarks):
+        print(f"▶️  [{job.name}] 開始: {job.command_text}")
+        started_at = time.time()
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *job.command, cwd=HERE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            env=dict(os.environ, PYTHONUNBUFFERED='1'),
+            # \r で上書きする進捗表示は改行が来るまで1行になるので、行の長さの上限を広げておきます
+            limit=16 * 1024 * 1024)
+        tail = deque(maxlen=ERROR_TAIL_LINES)
+        async for raw in process.stdout:
+            line = raw.decode('utf-8', errors='replace').rstrip()
+            # 進捗表示（\r で上書きする行）は最後の部分だけを出します
+            line = line.rsplit('\r', 1)[-1]
+            tail.append(line)
+            print(f"   [{job.name}] {line}")
+        returncode = await process.wait()
+        seconds = time.perf_counter() - started
+        pipeline_metrics.current().observe(job.name, seconds)
+
+        # 自分で書き換える入力（tag_translations の visual_novels など）は、実行後の値を記録します
+        # （記録しないと、自分の書き込みのせいで次回も「入力が変わった」ことになります）
+        with self.conn.cursor() as cur:
+            if returncode == 0:
+                record_outputs(cur, job, self.run_id)
+            for resource in job.inputs:
+                if resource in job.outputs:
+                    watermarks[resource] = resource_watermark(cur, resource)
+            if returncode == 0:
+                record_job(cur, job, self.run_id, 'done', watermarks, started_at, seconds)
+            else:
+                record_job(cur, job, self.run_id, 'failed', watermarks, started_at, seconds,
+                           error=f"終了コード {returncode}\n" + '\n'.join(tail))
+        self.conn.commit()
+        if returncode == 0:
+            print(f"✅ [{job.name}] 完了（{seconds:.1f} 秒）")
+            return 'done'
+        print(f"⚠️ [{job.name}] 失敗しました（終了コード {returncode}、{seconds:.1f} 秒）")
+        return 'failed'
+
+def print_status(conn):
+    with conn.cursor() as cur:
+        ensure_state_tables(cur)
+        cur.execute("SELECT run_id, started_at, finished_at, status FROM sync_runs ORDER BY run_id DESC LIMIT 1")
+        run = cur.fetchone()
+        cur.execute("SELECT job, run_id, status, finished_at, seconds, error FROM sync_job_state ORDER BY finished_at")
+        jobs = cur.fetchall()
+    conn.commit()
+    if not run:
+        print("まだ一度も実行されていません")
+        return
+    finished = f"{run[2]:%H:%M:%S}" if run[2] else ''
+    print(f"前回の実行: run {run[0]}（{run[3]}）{run[1]:%Y-%m-%d %H:%M:%S} 〜 {finished}")
+    for job, run_id, status, finished_at, seconds, error in jobs:
+        took = f"{seconds:.1f} 秒" if seconds is not None else '-'
+        print(f"   {job:<18} {status:<8} run {run_id}  {finished_at:%Y-%m-%d %H:%M:%S}  {took}")
+        if error:
+            print('      ' + error.splitlines()[-1])
+
+# -----------------------------------------------------------------------------
+# 5. コマンドライン
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='データ更新の全工程を依存関係に沿って実行します')
+    parser.add_argument('--dump', help='VNDB のダンプ（指定したときだけ import_dump を実行）')
+    parser.add_argument('--import-workers', type=int, default=2, help='ダンプ取り込みの並列数')
+    parser.add_argument('--tags', default=DEFAULT_TAGS_PATH, help='タグダンプの JSON')
+    parser.add_argument('--snapshot', default=DEFAULT_SNAPSHOT_PATH, help='search_snapshot の書き出し先')
+    parser.add_argument('--db-connections', type=int, default=DEFAULT_DB_CONNECTIONS,
+                        help='同時に使う DB 接続数の上限')
+    parser.add_argument('--only', nargs='+', metavar='JOB', help='指定したジョブだけ実行する')
+    parser.add_argument('--skip', nargs='+', metavar='JOB', default=[], help='指定したジョブを除く')
+    parser.add_argument('--force', action='store_true', help='入力が変わっていなくても実行する')
+    parser.add_argument('--fresh', action='store_true', help='前回が失敗していても続きからにしない')
+    parser.add_argument('--dry-run', action='store_true', help='実行する予定のジョブを表示するだけ')
+    parser.add_argument('--status', action='store_true', help='前回の実行結果を表示する')
+    pipeline_metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.status:
+            print_status(conn)
+            return
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_ID,))
+            if not cur.fetchone()[0]:
+                sys.exit("⚠️ 別の sync_scheduler.py が実行中です")
+        conn.commit()
+
+        jobs = resolve_dependencies(define_jobs(args))
+        names = {job.name for job in jobs}
+        unknown = (set(args.only or []) | set(args.skip)) - names
+        if unknown:
+            sys.exit(f"ジョブ名が正しくありません: {', '.join(sorted(unknown))}（{', '.join(job.name for job in jobs)}）")
+        selected = [job for job in jobs
+                    if (not args.only or job.name in args.only) and job.name not in args.skip]
+        # 選ばなかったジョブへの依存は、満たされているものとして扱います
+        selected_names = {job.name for job in selected}
+        for job in selected:
+            job.deps &= selected_names
+
+        print(f"🗂️  {len(selected)} 個のジョブ（DB 接続は最大 {args.db_connections} 本）: "
+              f"{', '.join(job.name for job in selected)}")
+        started = time.perf_counter()
+        with pipeline_metrics.from_args('sync', args):
+            scheduler = Scheduler(selected, conn, db_connections=args.db_connections,
+                                  force=args.force, fresh=args.fresh, dry_run=args.dry_run)
+            ok = asyncio.run(scheduler.run())
+        counts = {status: list(scheduler.results.values()).count(status)
+                  for status in ('done', 'skipped', 'failed', 'blocked')}
+        label = '実行予定' if args.dry_run else '完了'
+        print(f"{'✅' if ok else '⚠️'} {label} {counts['done']} / 飛ばした {counts['skipped']} / "
+              f"失敗 {counts['failed']} / 未実行 {counts['blocked']}（{time.perf_counter() - started:.1f} 秒）")
+        if not ok:
+            print("もう一度実行すると、失敗したジョブから再開します。")
+            sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+# -----------------------------------------------------------------------------
+# タグカタログ（バイナリ形式）の作成と読み込み
+#
+# vndb-tags-*.json は長い説明文を含む 3.7万行の JSON で、毎回 json.load するのは重く、
+# count_all_tags.py のように API をページングすると時間も利用枠も使います。
+# そこで、説明文を除いた情報だけを固定長の配列にまとめたファイル（.tagcat）に変換し、
+# mmap でそのまま読むことで、起動時の読み込みをほぼゼロにします。
+#
+# ファイルの中身（すべてリトルエンディアン、各セクションは8バイト境界にそろえます）:
+#   ヘッダー        : マジック "VTAGCAT1"、バージョン、タグ数、セクション数、カテゴリ別件数
+#   セクション目次  : (名前8バイト, 開始位置, 長さ) × セクション数
+#   ids             : int32[タグ数]            タグID（昇順）
+#   vns             : int32[タグ数]            そのタグが付いた VN 数
+#   cat             : uint8[タグ数]            カテゴリ（0=cont, 1=ero, 2=tech）
+#   flags           : uint8[タグ数]            bit0=searchable, bit1=applicable, bit2=meta
+#   par_off / par   : uint32[タグ数+1] / int32[]  親タグID（par_off[i]〜par_off[i+1] が i 番目の親）
+#   name            : uint32[タグ数]            名前の文字列番号
+#   ali_off / ali   : uint32[タグ数+1] / uint32[]  別名の文字列番号
+#   key_str / key_tag: uint32[キー数] × 2      小文字化した名前・別名（昇順）と、そのタグの番号
+#   str_off / str   : uint32[文字列数+1] / UTF-8  重複をまとめた文字列テーブル
+#
+# 使い方:
+#   python tag_catalog.py build vndb-tags-2026-01-10.json vndb-tags.tagcat
+#   python tag_catalog.py stats vndb-tags.tagcat
+#   python tag_catalog.py lookup vndb-tags.tagcat Fantasy
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+MAGIC = b'VTAGCAT1'
+VERSION = 1
+CATEGORIES = ['cont', 'ero', 'tech']
+
+FLAG_SEARCHABLE = 1
+FLAG_APPLICABLE = 2
+FLAG_META = 4
+
+# ヘッダー: マジック, バージョン, タグ数, セクション数, カテゴリ別件数×3
+HEADER = struct.Struct('<8sIIIIII')
+SECTION = struct.Struct('<8sQQ')
+
+# mmap の中身を memoryview.cast でそのまま数値配列として読むため、リトルエンディアン前提です
+if sys.byteorder != 'little':
+    raise ImportError("tag_catalog はリトルエンディアンの環境でのみ使えます")
+
+# -----------------------------------------------------------------------------
+# 1. 変換（JSON → バイナリ）
+# -----------------------------------------------------------------------------
+def normalize_key(text):
+    """名前・別名の検索キー（大文字小文字を区別しない）"""
+    return text.casefold()
+
+class _StringTable:
+    """同じ文字列は1回だけ保存する（インターンする）文字列テーブル"""
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, text):
+        if text not in self.index:
+            self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return self.index[text]
+
+    def encode(self):
+        offsets = array('I', [0])
+        blob = bytearray()
+        for text in self.strings:
+            blob += text.encode('utf-8')
+            offsets.append(len(blob))
+        return offsets, bytes(blob)
+
+def build_catalog(tags_json_path, output_path):
+    """タグダンプの JSON を読み込み、バイナリのカタログファイルを書き出します"""
+    with open(tags_json_path, encoding='utf-8') as f:
+        tags = sorted(json.load(f), key=lambda t: t['id'])
+
+    strings = _StringTable()
+    ids, vns = array('i'), array('i')
+    cats, flags = bytearray(), bytearray()
+    par_off, par = array('I', [0]), array('i')
+    names = array('I')
+    ali_off, ali = array('I', [0]), array('I')
+    keys = []
+    category_counts = [0] * len(CATEGORIES)
+
+    for i, tag in enumerate(tags):
+        ids.append(tag['id'])
+        vns.append(tag.get('vns') or 0)
+        cat = CATEGORIES.index(tag.get('cat', 'cont'))
+        cats.append(cat)
+        category_counts[cat] += 1
+        flags.append((FLAG_SEARCHABLE if tag.get('searchable') else 0)
+                     | (FLAG_APPLICABLE if tag.get('applicable') else 0)
+                     | (FLAG_META if tag.get('meta') else 0))
+        par.extend(tag.get('parents', []))
+        par_off.append(len(par))
+        names.append(strings.add(tag['name']))
+        keys.append((normalize_key(tag['name']), i))
+        for alias in tag.get('aliases', []):
+            ali.append(strings.add(alias))
+            keys.append((normalize_key(alias), i))
+        ali_off.append(len(ali))
+
+    # 検索キーは UTF-8 のバイト列順に並べます（読み込み側の二分探索と同じ順番）
+    keys = sorted(set(keys), key=lambda k: (k[0].encode('utf-8'), k[1]))
+    key_str = array('I', [strings.add(key) for key, _i in keys])
+    key_tag = array('I', [i for _key, i in keys])
+    str_off, blob = strings.encode()
+
+    sections = [
+        (b'ids', ids.tobytes()), (b'vns', vns.tobytes()),
+        (b'cat', bytes(cats)), (b'flags', bytes(flags)),
+        (b'par_off', par_off.tobytes()), (b'par', par.tobytes()),
+        (b'name', names.tobytes()),
+        (b'ali_off', ali_off.tobytes()), (b'ali', ali.tobytes()),
+        (b'key_str', key_str.tobytes()), (b'key_tag', key_tag.tobytes()),
+        (b'str_off', str_off.tobytes()), (b'str', blob),
+    ]
+
+    position = HEADER.size + SECTION.size * len(sections)
+    directory, body = [], bytearray()
+    for name, data in sections:
+        padding = -(position + len(body)) % 8
+        body += b'\0' * padding
+        directory.append(SECTION.pack(name, position + len(body), len(data)))
+        body += data
+
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(tags), len(sections), *category_counts))
+        f.write(b''.join(directory))
+        f.write(body)
+    return len(tags), len(keys), len(strings.strings)
+
+# -----------------------------------------------------------------------------
+# 2. 読み込み（mmap してそのまま配列として参照）
+# -----------------------------------------------------------------------------
+class TagCatalog:
+    """
+    カタログファイルを mmap して、コピーせずに参照します。
+    開くときに読むのはヘッダーと目次だけなので、起動はほぼ一瞬です。
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        magic, version, count, n_sections, *category_counts = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"タグカタログの形式が違います: {path}")
+        self.count = count
+        self._category_counts = category_counts
+
+        sections = {}
+        for n in range(n_sections):
+            name, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * n)
+            sections[name.rstrip(b'\0').decode()] = view[offset:offset + length]
+
+        def typed(name, fmt):
+            return sections[name].cast(fmt)
+
+        self.ids = typed('ids', 'i')
+        self.vns = typed('vns', 'i')
+        self.cat = sections['cat']
+        self.flags = sections['flags']
+        self._par_off, self._par = typed('par_off', 'I'), typed('par', 'i')
+        self._name = typed('name', 'I')
+        self._ali_off, self._ali = typed('ali_off', 'I'), typed('ali', 'I')
+        self._key_str, self._key_tag = typed('key_str', 'I'), typed('key_tag', 'I')
+        self._str_off, self._str = typed('str_off', 'I'), sections['str']
+
+    def close(self):
+        # memoryview が残っていると mmap を閉じられないので、先に解放します
+        for name in ('ids', 'vns', 'cat', 'flags', '_par_off', '_par', '_name', '_ali_off',
+                     '_ali', '_key_str', '_key_tag', '_str_off', '_str'):
+            getattr(self, name).release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- 内部: 文字列と番号の変換 ---
+    def _bytes(self, n):
+        return bytes(self._str[self._str_off[n]:self._str_off[n + 1]])
+
+    def _string(self, n):
+        return self._bytes(n).decode('utf-8')
+
+    def index_of(self, tag_id):
+        """タグIDから配列上の番号を返します（見つからなければ None）"""
+        i = bisect_left(self.ids, tag_id)
+        if i < self.count and self.ids[i] == tag_id:
+            return i
+        return None
+
+    # --- 公開API ---
+    def name(self, tag_id):
+        """タグID → 名前"""
+        i = self.index_of(tag_id)
+        return None if i is None else self._string(self._name[i])
+
+    def aliases(self, tag_id):
+        i = self.index_of(tag_id)
+        if i is None:
+            return []
+        return [self._string(n) for n in self._ali[self._ali_off[i]:self._ali_off[i + 1]]]
+
+    def parents(self, tag_id):
+        i = self.index_of(tag_id)
+        return [] if i is None else list(self._par[self._par_off[i]:self._par_off[i + 1]])
+
+    def category(self, tag_id):
+        i = self.index_of(tag_id)
+        return None if i is None else CATEGORIES[self.cat[i]]
+
+    def is_searchable(self, tag_id):
+        i = self.index_of(tag_id)
+        return i is not None and bool(self.flags[i] & FLAG_SEARCHABLE)
+
+    def is_applicable(self, tag_id):
+        i = self.index_of(tag_id)
+        return i is not None and bool(self.flags[i] & FLAG_APPLICABLE)
+
+    def vn_count(self, tag_id):
+        i = self.index_of(tag_id)
+        return None if i is None else self.vns[i]
+
+    def lookup(self, text):
+        """名前または別名（大文字小文字は区別しない）→ タグID。見つからなければ None"""
+        key = normalize_key(text).encode('utf-8')
+        lo, hi = 0, len(self._key_str)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(self._key_str[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._key_str) and self._bytes(self._key_str[lo]) == key:
+            return self.ids[self._key_tag[lo]]
+        return None
+
+    def category_counts(self):
+        """{カテゴリ: タグ数}（作成時に数えた値をヘッダーから返します）"""
+        return dict(zip(CATEGORIES, self._category_counts))
+
+    def count_where(self, flag):
+        """指定したフラグ（FLAG_SEARCHABLE など）が立っているタグの数"""
+        return sum(1 for value in self.flags if value & flag)
+
+# -----------------------------------------------------------------------------
+# 3. コマンドライン
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='タグカタログ（バイナリ形式）の作成・確認')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='タグダンプの JSON からカタログを作成')
+    build.add_argument('tags_json')
+    build.add_argument('output')
+    stats = sub.add_parser('stats', help='タグ数とカテゴリ別の内訳を表示')
+    stats.add_argument('catalog')
+    lookup = sub.add_parser('lookup', help='名前・別名・IDでタグを検索')
+    lookup.add_argument('catalog')
+    lookup.add_argument('query')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        count, n_keys, n_strings = build_catalog(args.tags_json, args.output)
+        print(f"{count} タグ（検索キー {n_keys} 件、文字列 {n_strings} 件）を {args.output} に書き出しました"
+              f"（{time.perf_counter() - started:.2f} 秒）")
+    elif args.command == 'stats':
+        with TagCatalog(args.catalog) as catalog:
+            print(f"総タグ数: {catalog.count}件")
+            for category, count in catalog.category_counts().items():
+                print(f"  {category}: {count}件")
+            print(f"検索可能: {catalog.count_where(FLAG_SEARCHABLE)}件 / "
+                  f"付与可能: {catalog.count_where(FLAG_APPLICABLE)}件")
+    else:
+        with TagCatalog(args.catalog) as catalog:
+            tag_id = int(args.query.lstrip('g')) if args.query.lstrip('g').isdigit() else catalog.lookup(args.query)
+            if tag_id is None or catalog.index_of(tag_id) is None:
+                print("見つかりませんでした")
+                return
+            print(f"g{tag_id}: {catalog.name(tag_id)} [{catalog.category(tag_id)}] "
+                  f"VN {catalog.vn_count(tag_id)}件")
+            print(f"  別名: {catalog.aliases(tag_id)}")
+            print(f"  親: {[catalog.name(p) for p in catalog.parents(tag_id)]}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# search_vns をメモリに載せて、タグ検索・絞り込み・並び替え・ファセット集計を行うエンジン
+#
+# 「タグA かつ B、C は除く、評価80以上、2015年以降、投票数順」のような検索に加えて
+# 「今の結果に各タグが何件あるか」（ファセット）を毎回出そうとすると、
+# GIN インデックスがあっても Postgres 側で多くの行を読んで並び替えることになります。
+#
+# そこで search_vns を NumPy の列にして、タグごとに「そのタグが付いた VN のビット列」を持ちます
+# （約3千タグ × 5万VN でも 1タグ 6KB、全部で 20MB 弱）。
+#   - タグの条件       : ビット列の AND / OR / NOT（64ビット単位でまとめて計算）
+#   - 評価・発売日など : 列を一括比較してビット列に変換
+#   - 並び替え         : 並び順ごとに順位を前計算しておき、ヒットした行の上位 k 件だけを選ぶ
+#   - ファセット       : ヒット件数が少なければ該当行のタグを数え、多ければビット列の popcount
+#
+# データの読み直し（reload）は新しいスナップショットを裏で作ってから差し替えるので、
+# 読み直し中も検索は止まりません。
+#
+# 使い方:
+#   engine = TagSearchEngine.from_db()
+#   result = engine.search("2 & 32 & !43", rating_min=80, released_from=date(2015, 1, 1),
+#                          sort='votecount', limit=20, facets=10)
+#
+#   python tag_search_engine.py "2 & 32 & !43" --rating-min 80 --released-from 2015-01-01 --facets 10
+#   python tag_search_engine.py "Fantasy & !Nukige" --catalog vndb-tags.tagcat --bench 1000
+#   python tag_search_engine.py "2 & 32" --snapshot search_vns.vnsnap   # search_snapshot.py で書き出したもの
+#   python tag_search_engine.py "2 & 32" --min-tag-score 2 --max-spoiler 1   # 2点以上・大きなネタバレなしのタグだけ
+# -----------------------------------------------------------------------------
+
+import argparse
+import re
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+EPOCH = date(1970, 1, 1)
+NULL_DAY = np.iinfo(np.int32).min   # 発売日が未定（NULL）の行
+
+# 並び順（どれも大きい順・NULL は最後、同じ値なら ID 順）。id だけは小さい順です
+SORT_KEYS = ('votecount', 'rating', 'released', 'id')
+
+# -----------------------------------------------------------------------------
+# 1. スナップショット（ある時点の search_vns を列にしたもの。作成後は変更しません）
+# -----------------------------------------------------------------------------
+class Snapshot:
+    """
+    各列は行番号（0〜n-1）でそろえた NumPy 配列です。
+      rating    : float32（NULL は NaN）
+      votecount : int32（NULL は -1）
+      released  : int32（1970-01-01 からの日数。NULL は NULL_DAY）
+      tag_offsets / tag_values : CSR 形式のタグ（行 i のタグは values[offsets[i]:offsets[i+1]]）
+    タグのビット列は words[タグ番号] = uint64 の配列（行 i がビット i）です。
+    """
+
+    def __init__(self, ids, titles, titles_ja, rating, votecount, released, tag_offsets, tag_values,
+                 source=None):
+        started = time.perf_counter()
+        self.ids = ids
+        self.titles = titles
+        self.titles_ja = titles_ja
+        self.rating = np.asarray(rating, dtype=np.float32)
+        self.votecount = np.asarray(votecount, dtype=np.int32)
+        self.released = np.asarray(released, dtype=np.int32)
+        self.tag_offsets = np.asarray(tag_offsets, dtype=np.int64)
+        self.source = source
+        self.n = n = len(ids)
+        self.n_words = (n + 63) // 64
+
+        # --- タグID → タグ番号（0〜）と、行ごとのタグ番号 ---
+        tag_values = np.asarray(tag_values, dtype=np.int32)
+        self.tag_ids = np.unique(tag_values)
+        self.tag_index = np.searchsorted(self.tag_ids, tag_values).astype(np.int32)
+
+        # --- タグごとのビット列（同じ行・同じタグは1回しかないので OR で立てます） ---
+        rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.tag_offsets))
+        bits = np.zeros((len(self.tag_ids), self.n_words * 8), dtype=np.uint8)
+        np.bitwise_or.at(bits, (self.tag_index, rows >> 3), (1 << (rows & 7)).astype(np.uint8))
+        self.words = bits.view(np.uint64)
+        self.tag_counts = np.bitwise_count(self.words).sum(axis=1, dtype=np.int64)
+        self.all_words = self.pack(np.ones(n, dtype=bool))
+        self.empty_words = np.zeros(self.n_words, dtype=np.uint64)
+
+        # --- 並び順ごとの順位（小さいほど上位） ---
+        self.ranks = {}
+        order_index = np.arange(n)
+        for key in SORT_KEYS:
+            if key == 'id':
+                self.ranks[key] = order_index.astype(np.int32)
+                continue
+            values = getattr(self, key).astype(np.float64)
+            null = np.isnan(values) if key == 'rating' else values == (NULL_DAY if key == 'released' else -1)
+            values = np.where(null, -np.inf, values)
+            order = np.lexsort((order_index, -values))
+            rank = np.empty(n, dtype=np.int32)
+            rank[order] = np.arange(n, dtype=np.int32)
+            self.ranks[key] = rank
+        self.build_seconds = time.perf_counter() - started
+
+    def pack(self, mask):
+        """bool 配列（長さ n）→ ビット列（uint64 × n_words）"""
+        packed = np.zeros(self.n_words * 8, dtype=np.uint8)
+        bytes_ = np.packbits(mask, bitorder='little')
+        packed[:len(bytes_)] = bytes_
+        return packed.view(np.uint64)
+
+    def unpack(self, words):
+        """ビット列 → 立っている行番号の配列"""
+        return np.flatnonzero(np.unpackbits(words.view(np.uint8), count=self.n, bitorder='little'))
+
+    def tag_words(self, tag_id):
+        i = np.searchsorted(self.tag_ids, tag_id)
+        if i < len(self.tag_ids) and self.tag_ids[i] == tag_id:
+            return self.words[i]
+        return self.empty_words   # どの VN にも付いていないタグ
+
+    def row(self, i):
+        day = int(self.released[i])
+        rating = float(self.rating[i])
+        return {
+            'id': self.ids[i],
+            'title': self.titles[i],
+            'title_ja': self.titles_ja[i],
+            'rating': None if np.isnan(rating) else round(rating, 2),
+            'votecount': int(self.votecount[i]),
+            'released': None if day == NULL_DAY else EPOCH + timedelta(days=day),
+        }
+
+    @property
+    def nbytes(self):
+        arrays = [self.rating, self.votecount, self.released, self.tag_offsets, self.tag_index,
+                  self.words, *self.ranks.values()]
+        return sum(a.nbytes for a in arrays)
+
+def load_snapshot(conn, tag_column='tag_ids', min_score=None, max_spoiler=None):
+    """
+    search_vns を読み込んでスナップショットを作ります。
+    tag_column='tag_ids_closure' にすると、親タグで子タグの VN も見つかるようになります。
+    min_score / max_spoiler を渡すと、平均点がそれ以上・ネタバレ度がそれ以下のタグだけを
+    付いているものとして扱います（tag_ids と同じ順番の tag_scores / tag_spoilers を使うので、
+    tag_ids のときだけ指定できます）。
+    """
+    source = f'search_vns.{tag_column}'
+    tags_sql = tag_column
+    if min_score is not None or max_spoiler is not None:
+        if tag_column != 'tag_ids':
+            raise ValueError('min_score / max_spoiler は tag_column="tag_ids" のときだけ指定できます')
+        tags_sql = """ARRAY(
+            SELECT u.tag FROM UNNEST(tag_ids, tag_scores, tag_spoilers) AS u(tag, score, spoiler)
+            WHERE (%(min_score)s::real IS NULL OR u.score >= %(min_score)s::real)
+              AND (%(max_spoiler)s::smallint IS NULL OR u.spoiler <= %(max_spoiler)s::smallint)
+        )"""
+        source += f' (score >= {min_score}, spoiler <= {max_spoiler})'
+
+    ids, titles, titles_ja, rating, votecount, released = [], [], [], [], [], []
+    offsets, values = [0], []
+    with conn.cursor(name='tag_search_snapshot') as cur:
+        cur.itersize = 5000
+        # 行番号の順 = VN ID の数値順（並び替えで同じ値のときの順番になります）
+        cur.execute(f"""
+        SELECT id, title, title_ja, rating, votecount, released - DATE '1970-01-01', {tags_sql}
+        FROM search_vns
+        ORDER BY SUBSTRING(id FROM 2)::integer
+        """, {'min_score': min_score, 'max_spoiler': max_spoiler})
+        for vn_id, title, title_ja, vn_rating, votes, days, tags in cur:
+            ids.append(vn_id)
+            titles.append(title)
+            titles_ja.append(title_ja)
+            rating.append(np.nan if vn_rating is None else float(vn_rating))
+            votecount.append(votes if votes is not None else -1)
+            released.append(NULL_DAY if days is None else days)
+            if tags:
+                values.extend(tags)
+            offsets.append(len(values))
+    conn.commit()
+    return Snapshot(ids, titles, titles_ja, rating, votecount, released, offsets, values,
+                    source=source)
+
+# -----------------------------------------------------------------------------
+# 2. タグ条件の式
+# -----------------------------------------------------------------------------
+# 書ける式の例:
+#   2 & 32 & !43          タグ2 かつ 32、43 は除く（& は省略可: "2 32 !43"）
+#   (2 | 7) & !43         2 または 7
+#   g2 and not g43        VNDB の表記（g + 番号）や and / or / not でも可
+#   Fantasy & !"Nukige"   名前（resolver を渡したとき。空白を含む名前は "" で囲む）
+TOKEN = re.compile(r"""\s*(?:
+    (?P<num>g?\d+)(?![^\s&|!()"]) |
+    "(?P<quoted>[^"]*)" |
+    (?P<and>&&?) | (?P<or>\|\|?) | (?P<not>!|-) |
+    (?P<open>\() | (?P<close>\)) |
+    (?P<word>[^\s&|!()"]+)
+)""", re.VERBOSE)
+KEYWORDS = {'and': 'and', 'or': 'or', 'not': 'not'}
+
+def tokenize(text, resolver=None):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"式を読めません: {text[pos:]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.lower() in KEYWORDS:
+            tokens.append((KEYWORDS[value.lower()], None))
+        elif kind == 'num':
+            tokens.append(('tag', int(value.lstrip('g'))))
+        elif kind in ('word', 'quoted'):
+            tag_id = resolver(value) if resolver else None
+            if tag_id is None:
+                raise ValueError(f"タグが見つかりません: {value!r}")
+            tokens.append(('tag', tag_id))
+        else:
+            tokens.append((kind, None))
+    return tokens
+
+def parse_expression(text, resolver=None):
+    """
+    式を木（タプル）に変換します:
+      ('tag', 2) / ('not', 木) / ('and', [木, ...]) / ('or', [木, ...])
+    優先順位は NOT > AND > OR です。
+    """
+    tokens = tokenize(text, resolver)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind):
+        nonlocal pos
+        if peek() != kind:
+            raise ValueError(f"式の {pos + 1} 番目の要素で {kind} が必要です: {text!r}")
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        terms = [parse_and()]
+        while peek() == 'or':
+            take('or')
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def parse_and():
+        terms = [parse_not()]
+        while peek() in ('and', 'not', 'tag', 'open'):
+            if peek() == 'and':
+                take('and')
+            terms.append(parse_not())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def parse_not():
+        if peek() == 'not':
+            take('not')
+            return ('not', parse_not())
+        if peek() == 'open':
+            take('open')
+            node = parse_or()
+            take('close')
+            return node
+        return take('tag')
+
+    if not tokens:
+        raise ValueError("式が空です")
+    tree = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"式の {pos + 1} 番目の要素が余っています: {text!r}")
+    return tree
+
+def evaluate(snapshot, node):
+    """式の木 → ビット列"""
+    kind = node[0]
+    if kind == 'tag':
+        return snapshot.tag_words(node[1])
+    if kind == 'not':
+        return ~evaluate(snapshot, node[1]) & snapshot.all_words
+    # AND は否定のない項から計算して、否定の項は「AND NOT」として引きます
+    terms = node[1]
+    if kind == 'and':
+        positives = [t for t in terms if t[0] != 'not']
+        negatives = [t[1] for t in terms if t[0] == 'not']
+        result = evaluate(snapshot, positives[0]).copy() if positives else snapshot.all_words.copy()
+        for term in positives[1:]:
+            result &= evaluate(snapshot, term)
+        for term in negatives:
+            result &= ~evaluate(snapshot, term)
+        return result
+    result = evaluate(snapshot, terms[0]).copy()
+    for term in terms[1:]:
+        result |= evaluate(snapshot, term)
+    return result
+
+# -----------------------------------------------------------------------------
+# 3. 検索エンジン
+# -----------------------------------------------------------------------------
+class TagSearchEngine:
+    """
+    スナップショットを1つ持ち、検索のたびにその時点のものを参照します。
+    reload() は新しいスナップショットを作り終えてから参照を差し替えるだけなので、
+    実行中の検索は古いスナップショットで最後まで動きます。
+    """
+
+    def __init__(self, snapshot=None, loader=None, resolver=None):
+        self._loader = loader
+        self._reload_lock = threading.Lock()
+        self.resolver = resolver
+        self.snapshot = snapshot if snapshot is not None else loader()
+
+    @classmethod
+    def from_db(cls, tag_column='tag_ids', resolver=None, min_score=None, max_spoiler=None):
+        from db import get_db_connection
+
+        def loader():
+            conn = get_db_connection()
+            try:
+                return load_snapshot(conn, tag_column, min_score=min_score, max_spoiler=max_spoiler)
+            finally:
+                conn.close()
+        return cls(loader=loader, resolver=resolver)
+
+    @classmethod
+    def from_snapshot_file(cls, path, tag_column='tag_ids', resolver=None):
+        """
+        search_snapshot.py で書き出したファイルから読み込みます（DB に接続しません）。
+        reload() ではファイルを開き直すので、書き出し直したあとに呼べば新しい内容になります。
+        """
+        from search_snapshot import SearchSnapshotFile
+
+        def loader():
+            return SearchSnapshotFile(path).to_search_snapshot(tag_column)
+        return cls(loader=loader, resolver=resolver)
+
+    def reload(self):
+        """データを読み直して差し替えます（同時に2つは走らせません）"""
+        with self._reload_lock:
+            self.snapshot = self._loader()
+        return self.snapshot
+
+    def reload_in_background(self):
+        thread = threading.Thread(target=self.reload, name='tag-search-reload', daemon=True)
+        thread.start()
+        return thread
+
+    def search(self, expr=None, rating_min=None, rating_max=None, votecount_min=None,
+               votecount_max=None, released_from=None, released_to=None,
+               sort='votecount', limit=20, offset=0, facets=0, facet_tags=None):
+        """
+        条件に合う VN を sort の順で offset 件目から limit 件返します。
+        facets > 0 なら、結果の中で多いタグ上位 facets 件の (タグID, 件数) も返します。
+        facet_tags を渡すと、そのタグだけを数えます（絞り込み画面のチェックボックス用）。
+        """
+        started = time.perf_counter()
+        if sort not in SORT_KEYS:
+            raise ValueError(f"並び順は {', '.join(SORT_KEYS)} のどれかです: {sort!r}")
+        snap = self.snapshot   # 検索中に reload されても、この検索は同じスナップショットを使います
+
+        # --- A. タグの条件 ---
+        if expr is None:
+            words = snap.all_words
+        else:
+            tree = parse_expression(expr, self.resolver) if isinstance(expr, str) else expr
+            words = evaluate(snap, tree)
+
+        # --- B. 数値の範囲（列をまとめて比較 → ビット列にして AND） ---
+        mask = None
+        for column, low, high in (('rating', rating_min, rating_max),
+                                  ('votecount', votecount_min, votecount_max),
+                                  ('released', _days(released_from), _days(released_to))):
+            values = getattr(snap, column)
+            if low is not None:
+                mask = (values >= low) if mask is None else mask & (values >= low)
+            if high is not None:
+                cond = values <= high
+                if column == 'released':
+                    cond &= values != NULL_DAY
+                mask = cond if mask is None else mask & cond
+        if mask is not None:
+            words = words & snap.pack(mask)
+
+        # --- C. 上位 k 件（順位の小さいものを選んでから、その中だけ並べます） ---
+        rows = snap.unpack(words)
+        total = len(rows)
+        k = min(offset + limit, total)
+        ranks = snap.ranks[sort][rows]
+        if k < total:
+            top = np.argpartition(ranks, k - 1)[:k]
+            top = top[np.argsort(ranks[top], kind='stable')]
+        else:
+            top = np.argsort(ranks, kind='stable')
+        page = rows[top[offset:k]]
+
+        result = {
+            'total': total,
+            'ids': [snap.ids[i] for i in page],
+            'rows': [snap.row(i) for i in page],
+        }
+        if facets or facet_tags is not None:
+            result['facets'] = self._facets(snap, words, rows, facets, facet_tags)
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return result
+
+    def _facets(self, snap, words, rows, limit, facet_tags):
+        """結果の中で各タグが付いている VN の数"""
+        if facet_tags is not None:
+            tag_ids = np.asarray(sorted(set(facet_tags)), dtype=np.int32)
+            counts = np.array([np.bitwise_count(snap.tag_words(t) & words).sum() for t in tag_ids],
+                              dtype=np.int64)
+            return [(int(t), int(c)) for t, c in zip(tag_ids, counts)]
+
+        if len(rows) > snap.n // 2:
+            # 結果が全体の半分より多いときは、結果に入らなかった行を数えて全体の件数から引きます
+            rest = ~words & snap.all_words
+            counts = snap.tag_counts - _count_tags(snap, snap.unpack(rest), rest)
+        else:
+            counts = _count_tags(snap, rows, words)
+
+        # 件数の多い順、同じ件数ならタグID順
+        nonzero = np.flatnonzero(counts)
+        best = nonzero[np.lexsort((snap.tag_ids[nonzero], -counts[nonzero]))]
+        if limit:
+            best = best[:limit]
+        return [(int(snap.tag_ids[i]), int(counts[i])) for i in best]
+
+def _count_tags(snap, rows, words):
+    """rows（= words のビットが立っている行）について、タグごとの件数を数えます"""
+    # 該当行のタグを数えるか、全タグのビット列を数えるか、計算量の少ない方を選びます
+    starts = snap.tag_offsets[rows]
+    lengths = snap.tag_offsets[rows + 1] - starts
+    entries = int(lengths.sum())
+    if entries < snap.words.size:
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(entries)
+        return np.bincount(snap.tag_index[positions], minlength=len(snap.tag_ids))
+    return np.bitwise_count(snap.words & words).sum(axis=1, dtype=np.int64)
+
+def _days(value):
+    """date → 1970-01-01 からの日数"""
+    return None if value is None else (value - EPOCH).days
+
+# -----------------------------------------------------------------------------
+# 4. コマンドライン
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='search_vns のタグ検索（メモリ上のビット列）')
+    parser.add_argument('expr', nargs='?', help='タグの条件（例: "2 & 32 & !43"）。省略時は全件')
+    parser.add_argument('--rating-min', type=float)
+    parser.add_argument('--rating-max', type=float)
+    parser.add_argument('--votecount-min', type=int)
+    parser.add_argument('--released-from', type=date.fromisoformat, help='YYYY-MM-DD')
+    parser.add_argument('--released-to', type=date.fromisoformat, help='YYYY-MM-DD')
+    parser.add_argument('--sort', choices=SORT_KEYS, default='votecount')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--offset', type=int, default=0)
+    parser.add_argument('--facets', type=int, default=10, help='表示するファセット（タグ）の数')
+    parser.add_argument('--closure', action='store_true', help='親タグで子タグの VN も含める（tag_ids_closure）')
+    parser.add_argument('--catalog', help='タグ名で書くときのタグカタログ（tag_catalog.py で作成）')
+    parser.add_argument('--snapshot', help='DB ではなくスナップショットファイルから読む（search_snapshot.py で作成）')
+    parser.add_argument('--min-tag-score', type=float, help='平均点がこれ以上のタグだけを使う（例: 2）')
+    parser.add_argument('--max-spoiler', type=int, choices=[0, 1, 2], help='ネタバレ度がこれ以下のタグだけを使う')
+    parser.add_argument('--bench', type=int, metavar='N', help='同じ検索を N 回実行して時間を測る')
+    args = parser.parse_args()
+    tag_filtered = args.min_tag_score is not None or args.max_spoiler is not None
+    if tag_filtered and (args.closure or args.snapshot):
+        parser.error('--min-tag-score / --max-spoiler は --closure・--snapshot と一緒には使えません')
+
+    catalog = None
+    if args.catalog:
+        from tag_catalog import TagCatalog
+        catalog = TagCatalog(args.catalog)
+
+    started = time.perf_counter()
+    tag_column = 'tag_ids_closure' if args.closure else 'tag_ids'
+    resolver = catalog.lookup if catalog else None
+    if args.snapshot:
+        engine = TagSearchEngine.from_snapshot_file(args.snapshot, tag_column, resolver=resolver)
+    else:
+        engine = TagSearchEngine.from_db(tag_column, resolver=resolver,
+                                         min_score=args.min_tag_score, max_spoiler=args.max_spoiler)
+    snap = engine.snapshot
+    print(f"📦 {snap.n} 件 / {len(snap.tag_ids)} タグを読み込みました"
+          f"（{time.perf_counter() - started:.2f} 秒、うち列の作成 {snap.build_seconds:.2f} 秒、"
+          f"{snap.nbytes / 1024 / 1024:.1f} MiB）")
+
+    options = dict(rating_min=args.rating_min, rating_max=args.rating_max,
+                   votecount_min=args.votecount_min, released_from=args.released_from,
+                   released_to=args.released_to, sort=args.sort, limit=args.limit,
+                   offset=args.offset, facets=args.facets)
+    result = engine.search(args.expr, **options)
+    print(f"🔍 {result['total']} 件ヒット（{result['elapsed_ms']:.3f} ms）")
+    for row in result['rows']:
+        print(f"   {row['id']:>7}  {row['rating'] or '-':>6}  {row['votecount']:>6}  "
+              f"{row['released'] or '未定'}  {row['title_ja'] or row['title']}")
+    if result.get('facets'):
+        print("🏷️  ファセット:")
+        for tag_id, count in result['facets']:
+            name = catalog.name(tag_id) if catalog else None
+            print(f"   g{tag_id:<6} {count:>6}  {name or ''}")
+
+    if args.bench:
+        timings = []
+        for _ in range(args.bench):
+            t0 = time.perf_counter()
+            engine.search(args.expr, **options)
+            timings.append((time.perf_counter() - t0) * 1000)
+        timings.sort()
+        pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))]
+        print(f"⏱️  {args.bench} 回: 平均 {statistics.mean(timings):.3f} ms / p50 {pick(0.5):.3f} ms / "
+              f"p95 {pick(0.95):.3f} ms / p99 {pick(0.99):.3f} ms")
+    if catalog:
+        catalog.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# テストからリポジトリ直下のスクリプト（vndb_client.py など）を import できるようにします
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def mock_vndb(monkeypatch):
+    """ローカルの VNDB 代役を起動し、VNDB_API_URL をそこに向けます"""
+    from mock_vndb_server import MockVNDB, make_vns
+
+    server = MockVNDB({'vn': make_vns(25)})
+    monkeypatch.setenv('VNDB_API_URL', server.start())
+    monkeypatch.delenv('VNDB_CACHE_PATH', raising=False)
+    yield server
+    server.stop()
@@ -0,0 +1,29 @@
+-- VNDB のダンプの import.sql と同じ形の、テスト用の小さな定義です
+\set ON_ERROR_STOP 1
+
+BEGIN;
+
+CREATE TYPE language AS ENUM ('en', 'ja');
+
+CREATE TABLE vn (
+  id          text NOT NULL PRIMARY KEY,
+  olang       language NOT NULL DEFAULT 'ja',
+  c_votecount integer NOT NULL DEFAULT 0
+);
+
+CREATE TABLE vn_titles (
+  id     text NOT NULL,
+  lang   language NOT NULL,
+  title  text NOT NULL,
+  PRIMARY KEY(id, lang)
+);
+
+\copy vn from 'db/vn'
+\copy vn_titles (id, lang, title) from 'db/vn_titles'
+
+CREATE INDEX vn_titles_title ON vn_titles (title);
+ALTER TABLE vn_titles ADD CONSTRAINT vn_titles_id_fkey FOREIGN KEY (id) REFERENCES vn (id);
+
+CREATE VIEW vn_ja AS SELECT v.id, t.title FROM vn v JOIN vn_titles t ON t.id = v.id AND t.lang = 'ja';
+
+COMMIT;
@@ -0,0 +1,138 @@
+# -----------------------------------------------------------------------------
+# VNDB API (kana) のローカル代役（aiohttp）
+#
+# vndb_client.py の再試行・Retry-After・トークンバケットを、本物の API に負荷をかけずに
+# 確かめるためのサーバーです。VNDB_API_URL をこのサーバーの URL にして使います。
+#   - POST /<endpoint>: items[endpoint] を filters / sort / results / page に従って返します
+#     （filters は ["id", "=" | ">" | ">=" | "<" | "<=", "v123"] の形だけに対応）
+#   - faults に (ステータス, ヘッダー) を積んでおくと、先頭から順に1回ずつそのエラーを返します
+#   - fail_after(n) で、n 回成功した後のリクエストをすべて失敗させます（途中で落ちるクロールの再現）
+#   - hits に (時刻, エンドポイント, ステータス)、payloads に (エンドポイント, リクエスト本文) を記録します
+#
+# 手で動かすとき:
+#   python tests/mock_vndb_server.py --port 8089 --vns 500
+#   VNDB_API_URL=http://127.0.0.1:8089 python ingest_vndb_data.py
+# -----------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import operator
+import threading
+import time
+
+from aiohttp import web
+
+OPERATORS = {'=': operator.eq, '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+def id_number(vndb_id):
+    """'v123' → 123（ID の比較・並べ替え用）"""
+    return int(vndb_id[1:])
+
+
+def make_vns(count):
+    """テスト用の VN（v1〜v<count>）"""
+    return [{'id': f'v{i}', 'title': f'Title {i}', 'rating': 50 + i % 50, 'votecount': i}
+            for i in range(1, count + 1)]
+
+
+class MockVNDB:
+    def __init__(self, items=None):
+        self.items = items or {}
+        self.faults = []
+        self.hits = []
+        self.payloads = []
+        self.down_after = None
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def fail(self, status, times=1, retry_after=None):
+        """次の times 回のリクエストに status を返します（retry_after は秒）"""
+        headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+        self.faults.extend([(status, headers)] * times)
+
+    def fail_after(self, successes, status=400):
+        """successes 回成功した後は、recover() するまで status を返し続けます"""
+        self.down_after = (successes, status)
+
+    def recover(self):
+        self.down_after = None
+
+    def _select(self, endpoint, payload):
+        results = list(self.items.get(endpoint, []))
+        filters = payload.get('filters')
+        if filters:
+            field, op, value = filters
+            if field != 'id' or op not in OPERATORS:
+                raise web.HTTPBadRequest(text=f'unsupported filter: {filters}')
+            results = [r for r in results if OPERATORS[op](id_number(r['id']), id_number(value))]
+        if payload.get('sort', 'id') == 'id':
+            results.sort(key=lambda r: id_number(r['id']), reverse=bool(payload.get('reverse')))
+        per_page = int(payload.get('results', 10))
+        start = (int(payload.get('page', 1)) - 1) * per_page
+        return {'results': results[start:start + per_page], 'more': start + per_page < len(results)}
+
+    async def _handle(self, request):
+        endpoint = request.match_info['endpoint']
+        if self.down_after and self.statuses().count(200) >= self.down_after[0]:
+            status = self.down_after[1]
+            self.hits.append((time.monotonic(), endpoint, status))
+            return web.Response(status=status, text=f'injected {status} (down)')
+        if self.faults:
+            status, headers = self.faults.pop(0)
+            self.hits.append((time.monotonic(), endpoint, status))
+            return web.Response(status=status, text=f'injected {status}', headers=headers)
+        if endpoint not in self.items:
+            self.hits.append((time.monotonic(), endpoint, 404))
+            return web.Response(status=404, text=f'unknown endpoint: {endpoint}')
+        payload = await request.json()
+        self.payloads.append((endpoint, payload))
+        data = self._select(endpoint, payload)
+        self.hits.append((time.monotonic(), endpoint, 200))
+        return web.json_response(data)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/{endpoint}', self._handle)
+        return app
+
+    # --- 別スレッドのイベントループで動かす（同期ヘルパーからも呼べるように） ---
+    def start(self, host='127.0.0.1', port=0):
+        ready = threading.Event()
+
+        async def _serve():
+            self._runner = web.AppRunner(self.app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, host, port)
+            await site.start()
+            bound = self._runner.addresses[0][1]
+            self.url = f'http://{host}:{bound}'
+            ready.set()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(_serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, daemon=True)
+        self._thread.start()
+        ready.wait(10)
+        return self.url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+
+    def statuses(self, endpoint=None):
+        return [status for _t, e, status in self.hits if endpoint in (None, e)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VNDB API のローカル代役を起動します')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--vns', type=int, default=500, help='返す VN の数')
+    args = parser.parse_args()
+    web.run_app(MockVNDB({'vn': make_vns(args.vns)}).app(), host='127.0.0.1', port=args.port)
@@ -0,0 +1,26 @@
+# build_people_index.py の名前の正規化を確かめます（DB は使いません）。
+# かな・カタカナ・ローマ字のどれで入力しても、同じ正規化した文字列（title_search.normalize）にたどり着くこと。
+from build_people_index import name_variants
+from title_search import normalize, to_romaji
+
+
+def test_kana_names_are_romanized():
+    assert to_romaji(normalize('きのこ')) == 'kinoko'
+    assert to_romaji(normalize('キノコ')) == 'kinoko'
+    assert to_romaji(normalize('ｼｬﾙﾛｯﾄ')) == 'sharurotto'
+    assert to_romaji(normalize('まっちゃ')) == 'matcha'
+    assert to_romaji(normalize('ルーシー')) == 'rushi'
+    # 読みの分からない漢字や、すでにローマ字のものはそのままにします
+    assert to_romaji(normalize('奈須きのこ')) == ''
+    assert to_romaji(normalize('Kinoko')) == ''
+
+
+def test_name_without_latin_gets_romaji_variants():
+    variants = {kind: normalized for kind, _text, normalized in name_variants('なす きのこ', None)}
+    assert variants == {'name': 'なすきのこ', 'romaji': 'nasukinoko', 'reversed': 'kinokonasu'}
+
+
+def test_latin_and_romaji_fallback_agree():
+    from_latin = {normalized for _kind, _text, normalized in name_variants('奈須きのこ', 'Nasu Kinoko')}
+    from_kana = {normalized for _kind, _text, normalized in name_variants('なす きのこ', None)}
+    assert {'nasukinoko', 'kinokonasu'} <= from_latin & from_kana
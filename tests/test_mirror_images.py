@@ -0,0 +1,108 @@
+# mirror_images.py を、ローカルの静的ファイルサーバー（aiohttp の static ルート、VNDB_IMAGE_BASE で向け先を切り替え）
+# に対して確かめます。同じ中身の画像は1回だけ保存し、サムネイルも1回だけ決まったサイズで作ること。
+# マニフェストに記録した画像は、次の実行では取りに行かないこと。
+import asyncio
+import io
+import os
+
+import pytest
+from aiohttp import web
+
+PIL = pytest.importorskip('PIL')
+from PIL import Image  # noqa: E402
+
+import mirror_images  # noqa: E402
+from mirror_images import THUMB_SIZES, ImageMirror  # noqa: E402
+
+# cv1 / cv2 / sf5 は同じ中身、cv3 だけ別の中身、ch7 はサーバーにない（404）
+IMAGE_IDS = ['cv1', 'cv2', 'cv3', 'sf5', 'ch7']
+
+
+def jpeg(color, size=(800, 600)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    """s2.vndb.org と同じ /<種類>/<番号 % 100>/<番号>.jpg の並びで画像を置きます"""
+    red, blue = jpeg('red'), jpeg('blue', (600, 800))
+    root = tmp_path / 'static'
+    for image_id, data in [('cv1', red), ('cv2', red), ('cv3', blue), ('sf5', red)]:
+        kind, number = image_id[:2], int(image_id[2:])
+        path = root / kind / f'{number % 100:02d}' / f'{number}.jpg'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return root
+
+
+def run_mirror(static_dir, root, monkeypatch, image_ids=IMAGE_IDS):
+    """静的サーバーを立ててミラーを1回実行し、(ImageMirror, サーバーへのリクエスト数) を返します"""
+    hits = []
+
+    @web.middleware
+    async def slow(request, handler):
+        # 同じ中身の画像のダウンロードが重なるように、少し待たせます
+        hits.append(request.path)
+        await asyncio.sleep(0.1)
+        return await handler(request)
+
+    async def _run():
+        app = web.Application(middlewares=[slow])
+        app.router.add_static('/', str(static_dir))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        monkeypatch.setenv('VNDB_IMAGE_BASE', f'http://127.0.0.1:{runner.addresses[0][1]}/')
+        mirror = ImageMirror(str(root), concurrency=8, per_host=8, workers=2)
+        try:
+            await mirror.run(mirror.pending(image_ids))
+        finally:
+            mirror.close()
+            await runner.cleanup()
+        return mirror
+
+    mirror = asyncio.run(_run())
+    return mirror, len(hits)
+
+
+def files_under(path):
+    return sorted(os.path.relpath(os.path.join(d, f), path) for d, _dirs, files in os.walk(path) for f in files)
+
+
+def test_mirror_dedupes_content_and_thumbnails(static_dir, tmp_path, monkeypatch):
+    root = tmp_path / 'mirror'
+    mirror, hits = run_mirror(static_dir, root, monkeypatch)
+
+    assert hits == len(IMAGE_IDS)
+    assert (mirror.downloaded, mirror.deduplicated, mirror.missing, mirror.errors) == (2, 2, 1, 0)
+    assert len(files_under(root / 'objects')) == 2
+
+    # サムネイルは (中身, サイズ) ごとに1回だけ: 赤の cv 用・青の cv 用・赤の sf 用
+    assert mirror.thumbs == 3
+    thumbs = files_under(root / 'thumbs')
+    assert len(thumbs) == 3
+    for name in thumbs:
+        size_dir = name.split(os.sep)[0]
+        with Image.open(root / 'thumbs' / name) as image:
+            assert f'{image.width}x{image.height}' == size_dir
+    assert {name.split(os.sep)[0] for name in thumbs} == {
+        f'{w}x{h}' for w, h in (THUMB_SIZES['cv'], THUMB_SIZES['sf'])}
+
+    # 実行ごとの一時ディレクトリは後片付けされています
+    assert os.listdir(root / 'tmp') == []
+
+
+def test_rerun_uses_manifest_and_fetches_nothing(static_dir, tmp_path, monkeypatch):
+    root = tmp_path / 'mirror'
+    run_mirror(static_dir, root, monkeypatch)
+    mirror, hits = run_mirror(static_dir, root, monkeypatch)
+    assert hits == 0
+    assert (mirror.downloaded, mirror.thumbs) == (0, 0)
+
+
+def test_image_base_is_read_from_the_environment(monkeypatch):
+    monkeypatch.setenv('VNDB_IMAGE_BASE', 'http://127.0.0.1:9/')
+    assert mirror_images.image_url('sf12345') == 'http://127.0.0.1:9/sf/45/12345.jpg'
@@ -0,0 +1,125 @@
+# response_cache.py の有効期限（TTL）・容量の上限（LRU）・キャッシュだけで動くモードを、
+# 一時ディレクトリの SQLite ファイルで確かめます。時刻は time.time を差し替えて進めます。
+import sqlite3
+import time
+
+import pytest
+
+from response_cache import CacheMiss, ResponseCache, cache_key
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def stored_sizes(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def test_key_ignores_payload_key_order():
+    assert cache_key('vn', {'a': 1, 'b': [1, 2]}) == cache_key('/vn', {'b': [1, 2], 'a': 1})
+
+
+def test_entries_expire_after_ttl(path, clock):
+    cache = ResponseCache(path, ttls={'vn': 60})
+    cache.put('vn', {'page': 1}, {'results': [1]})
+    clock.now += 60
+    assert cache.get('vn', {'page': 1}) == {'results': [1]}
+    clock.now += 1
+    assert cache.get('vn', {'page': 1}) is None
+    assert (cache.hits, cache.misses, cache.expired) == (1, 1, 1)
+    assert cache.prune_expired() == 1
+    assert cache.stats()['total_bytes'] == 0
+    cache.close()
+
+
+def test_evicts_least_recently_used_over_the_limit(path, clock):
+    cache = ResponseCache(path)
+    payloads = [{'page': n} for n in range(4)]
+    data = {'results': ['x' * 50]}
+    for payload in payloads[:3]:
+        cache.put('vn', payload, data)
+        clock.now += 1
+    entry = cache.stats()['total_bytes'] // 3
+    # 3件分の上限にして、最初に入れた page 0 を読んでおきます → 次に古いのは page 1
+    cache.max_bytes = entry * 3
+    cache.get('vn', payloads[0])
+    clock.now += 1
+    cache.put('vn', payloads[3], data)
+
+    assert cache.evictions == 1
+    assert cache.get('vn', payloads[1]) is None
+    for payload in (payloads[0], payloads[2], payloads[3]):
+        assert cache.get('vn', payload) == data
+    # 合計サイズ（cache_meta）と、実際に残っている行のサイズが一致すること
+    assert cache.stats()['total_bytes'] == stored_sizes(path) == entry * 3
+    cache.close()
+
+
+def test_running_total_follows_overwrites_and_clear(path, clock):
+    cache = ResponseCache(path)
+    cache.put('vn', {'page': 1}, {'results': ['short']})
+    cache.put('vn', {'page': 1}, {'results': ['much longer body ' * 20]})
+    cache.put('tag', {'page': 1}, {'results': []})
+    assert cache.stats()['total_bytes'] == stored_sizes(path)
+    cache.clear()
+    assert cache.stats()['total_bytes'] == 0
+    cache.close()
+
+
+def test_total_is_seeded_for_caches_created_before_tracking(path, clock):
+    cache = ResponseCache(path)
+    cache.put('vn', {'page': 1}, {'results': [1, 2, 3]})
+    cache.put('vn', {'page': 2}, {'results': [4, 5, 6]})
+    cache.close()
+    # 合計サイズを持っていなかった頃のファイルにします
+    with sqlite3.connect(path) as db:
+        for trigger in ('responses_size_insert', 'responses_size_update', 'responses_size_delete'):
+            db.execute(f"DROP TRIGGER {trigger}")
+        db.execute("DROP TABLE cache_meta")
+
+    cache = ResponseCache(path)
+    assert cache.stats()['total_bytes'] == stored_sizes(path) > 0
+    cache.close()
+
+
+def test_cache_only_mode(path, clock):
+    cache = ResponseCache(path, ttls={'vn': 60})
+    cache.put('vn', {'page': 1}, {'results': [1]})
+    cache.close()
+
+    offline = ResponseCache(path, ttls={'vn': 60}, cache_only=True)
+    clock.now += 3600
+    # 期限切れでも手元のデータを返し、ないものは API を呼ばずにエラーにします
+    assert offline.get('vn', {'page': 1}) == {'results': [1]}
+    with pytest.raises(CacheMiss):
+        offline.get('vn', {'page': 2})
+    offline.close()
+
+
+def test_from_env(path, monkeypatch):
+    monkeypatch.delenv('VNDB_CACHE_PATH', raising=False)
+    assert ResponseCache.from_env() is None
+    monkeypatch.setenv('VNDB_CACHE_PATH', path)
+    monkeypatch.setenv('VNDB_CACHE_ONLY', '1')
+    monkeypatch.setenv('VNDB_CACHE_MAX_BYTES', '1234')
+    cache = ResponseCache.from_env()
+    assert (cache.cache_only, cache.max_bytes) == (True, 1234)
+    cache.close()
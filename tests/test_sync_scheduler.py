@@ -0,0 +1,118 @@
+# sync_scheduler.py の依存関係の解決と、ジョブを飛ばすかどうかの判断を確かめます（DB は使いません）。
+# 前回の実行が途中で失敗したときは、その実行で終わったジョブだけを飛ばし、失敗したジョブから続けること。
+import argparse
+
+import pytest
+
+from sync_scheduler import Job, define_jobs, resolve_dependencies, resource_watermark, skip_reason
+
+RUN = 7
+
+
+def jobs_by_name(dump='vndb-db-2026-01-10.tar.zst'):
+    args = argparse.Namespace(dump=dump, import_workers=2, tags='tags.json', snapshot='search_vns.vnsnap')
+    order = resolve_dependencies(define_jobs(args))
+    return order, {job.name: job for job in order}
+
+
+def state(status='done', run_id=RUN - 1, command=None, inputs=None):
+    return {'run_id': run_id, 'status': status, 'command': command, 'inputs': inputs}
+
+
+def test_dependencies_follow_inputs_and_outputs():
+    order, jobs = jobs_by_name()
+    position = {job.name: i for i, job in enumerate(order)}
+    for job in order:
+        for dep in job.deps:
+            assert position[dep] < position[job.name]
+
+    assert jobs['search_vns'].deps == {'import_dump', 'tag_closure'}
+    # search_vns を書くジョブ（tag_closure / search_vns / display）すべてのあとに実行します
+    assert jobs['snapshot'].deps == {'tag_closure', 'search_vns', 'display'}
+    assert jobs['similar_vns'].deps == {'import_dump'}
+    # 自分の出力を入力にしているジョブは、自分には依存しません
+    assert jobs['tag_translations'].deps == {'ingest'}
+    assert jobs['display'].deps == {'import_dump', 'tag_closure', 'search_vns'}
+
+
+def test_without_dump_nothing_waits_for_the_import():
+    _order, jobs = jobs_by_name(dump=None)
+    assert 'import_dump' not in jobs
+    assert jobs['similar_vns'].deps == set()
+
+
+def test_cycle_is_rejected():
+    jobs = [Job('a', ['a.py'], inputs=['table:y'], outputs=['table:x']),
+            Job('b', ['b.py'], inputs=['table:x'], outputs=['table:y']),
+            Job('c', ['c.py'], outputs=['table:z'])]
+    with pytest.raises(ValueError, match='a, b'):
+        resolve_dependencies(jobs)
+
+
+def test_skips_only_when_command_and_inputs_are_unchanged():
+    _order, jobs = jobs_by_name()
+    job = jobs['display']
+    marks = {'schema:vndb': '16384:vndb-db.tar.zst', 'table:search_vns': '16500:2026-10-17T10:00:00'}
+    done = state(command=job.command_text, inputs=dict(marks))
+
+    assert skip_reason(job, done, dict(marks), RUN, False, False) == '入力が変わっていない'
+    assert skip_reason(job, state('skipped', command=job.command_text, inputs=dict(marks)),
+                       dict(marks), RUN, False, False) == '入力が変わっていない'
+    # 上流（search_vns など）が書き直すと、作成時刻が進みます
+    changed = dict(marks, **{'table:search_vns': '16500:2026-10-17T11:00:00'})
+    assert skip_reason(job, done, changed, RUN, False, False) is None
+    # 印がまだない入力、前回の失敗、コマンドの変更、--force、初回はいずれも実行します
+    assert skip_reason(job, done, dict(marks, **{'schema:vndb': None}), RUN, False, False) is None
+    assert skip_reason(job, state('failed', command=job.command_text, inputs=dict(marks)),
+                       dict(marks), RUN, False, False) is None
+    assert skip_reason(job, state(command='build_display.py --all', inputs=dict(marks)),
+                       dict(marks), RUN, False, False) is None
+    assert skip_reason(job, done, dict(marks), RUN, False, True) is None
+    assert skip_reason(job, None, dict(marks), RUN, False, False) is None
+
+
+def test_always_jobs_run_every_time():
+    _order, jobs = jobs_by_name()
+    job = jobs['ingest']
+    assert skip_reason(job, state(command=job.command_text, inputs={}), {}, RUN, False, False) is None
+
+
+def test_resume_continues_from_the_failed_job():
+    """run 7 で tag_closure と search_vns が終わり、display が失敗し、その下流は実行されなかった場合"""
+    _order, jobs = jobs_by_name()
+    states = {
+        'tag_closure': state('done', run_id=RUN, command=jobs['tag_closure'].command_text, inputs={}),
+        'search_vns': state('done', run_id=RUN, command=jobs['search_vns'].command_text, inputs={}),
+        'similar_vns': state('skipped', run_id=RUN, command=jobs['similar_vns'].command_text, inputs={}),
+        'display': state('failed', run_id=RUN, command=jobs['display'].command_text, inputs={}),
+        # 下流は前回（run 6）の記録のまま
+        'title_search': state('done', run_id=RUN - 1, command=jobs['title_search'].command_text,
+                              inputs={'schema:vndb': 'a', 'table:search_vns': 'old'}),
+    }
+    now = {'schema:vndb': 'a', 'table:search_vns': 'new'}
+
+    def reason(name, watermarks=now):
+        return skip_reason(jobs[name], states.get(name), dict(watermarks), RUN, True, False)
+
+    # 再開した実行で終わっているものは、入力が変わっていても飛ばします（always のジョブも同じ）
+    assert reason('tag_closure') == '前回の実行で完了済み'
+    assert reason('search_vns') == '前回の実行で完了済み'
+    assert reason('similar_vns') == '前回の実行で完了済み'
+    states['ingest'] = state('done', run_id=RUN, command=jobs['ingest'].command_text, inputs={})
+    assert reason('ingest', {}) == '前回の実行で完了済み'
+    # 失敗したジョブと、まだ実行していない下流は実行します
+    assert reason('display') is None
+    assert reason('title_search') is None
+    assert reason('snapshot') is None
+    # 新しい実行（resumed=False）では、同じ run_id の記録でも入力で判断します
+    assert skip_reason(jobs['tag_closure'], states['tag_closure'], {'file:tags.json': '1:2'},
+                       RUN, False, False) is None
+
+
+def test_file_watermark_follows_size_and_mtime(tmp_path):
+    path = tmp_path / 'tags.json'
+    assert resource_watermark(None, f'file:{path}') is None
+    path.write_text('[]')
+    first = resource_watermark(None, f'file:{path}')
+    path.write_text('[1]')
+    assert resource_watermark(None, f'file:{path}') != first
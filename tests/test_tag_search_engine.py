@@ -0,0 +1,217 @@
+# tag_search_engine.py の式の解析・ビット列での評価・並び替え・ファセット集計を、
+# 小さなメモリ上の Snapshot（DB は使いません）に対して、1行ずつ数える素朴な計算と比べて確かめます。
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from tag_search_engine import EPOCH, NULL_DAY, SORT_KEYS, Snapshot, TagSearchEngine, evaluate, parse_expression
+
+# 64 の倍数にしないで、最後のワードが途中で終わる場合も通します
+N_ROWS = 203
+TAGS = [2, 3, 5, 7, 11, 13, 17, 19]
+
+
+def make_rows(seed=3):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(N_ROWS):
+        rows.append({
+            'id': f'v{i * 3 + 1}',
+            'rating': None if rng.random() < 0.15 else round(rng.uniform(10, 100), 1),
+            'votecount': -1 if rng.random() < 0.1 else rng.randint(0, 400),
+            'released': None if rng.random() < 0.15 else rng.randint(8000, 20000),
+            # 2 はほとんどの行に付け、ファセットで「結果が全体の半分より多い」場合も通します
+            'tags': sorted({t for t in TAGS if rng.random() < 0.3} | ({2} if rng.random() < 0.8 else set())),
+        })
+    return rows
+
+
+@pytest.fixture(scope='module')
+def rows():
+    return make_rows()
+
+
+@pytest.fixture(scope='module')
+def engine(rows):
+    offsets = np.cumsum([0] + [len(row['tags']) for row in rows])
+    snapshot = Snapshot(
+        [row['id'] for row in rows], [f"Title {row['id']}" for row in rows], [None] * len(rows),
+        [np.nan if row['rating'] is None else row['rating'] for row in rows],
+        [row['votecount'] for row in rows],
+        [NULL_DAY if row['released'] is None else row['released'] for row in rows],
+        offsets, [t for row in rows for t in row['tags']])
+    names = {'Fantasy': 2, 'Nukige': 3, 'Slice of Life': 5}
+    return TagSearchEngine(snapshot, resolver=names.get)
+
+
+# --- 素朴な計算（1行ずつ） ---
+def matches(tree, tags):
+    kind = tree[0]
+    if kind == 'tag':
+        return tree[1] in tags
+    if kind == 'not':
+        return not matches(tree[1], tags)
+    if kind == 'and':
+        return all(matches(t, tags) for t in tree[1])
+    return any(matches(t, tags) for t in tree[1])
+
+
+def brute_search(rows, tree=None, rating_min=None, rating_max=None, votecount_min=None, votecount_max=None,
+                 released_from=None, released_to=None, sort='votecount'):
+    def day(value):
+        return None if value is None else (value - EPOCH).days
+
+    hits = []
+    for i, row in enumerate(rows):
+        if tree is not None and not matches(tree, row['tags']):
+            continue
+        rating = row['rating']
+        if rating_min is not None and (rating is None or rating < rating_min):
+            continue
+        if rating_max is not None and (rating is None or rating > rating_max):
+            continue
+        if votecount_min is not None and row['votecount'] < votecount_min:
+            continue
+        if votecount_max is not None and row['votecount'] > votecount_max:
+            continue
+        released = row['released']
+        if released_from is not None and (released is None or released < day(released_from)):
+            continue
+        if released_to is not None and (released is None or released > day(released_to)):
+            continue
+        hits.append(i)
+
+    def key(i):
+        if sort == 'id':
+            return (i,)
+        value = rows[i][sort]
+        null = value is None or (sort == 'votecount' and value == -1)
+        # 大きい順・NULL は最後・同じ値なら行番号（= ID）順
+        return (null, 0 if null else -value, i)
+    return sorted(hits, key=key)
+
+
+def brute_facets(rows, hits, limit=None, facet_tags=None):
+    counts = {}
+    for i in hits:
+        for tag in rows[i]['tags']:
+            counts[tag] = counts.get(tag, 0) + 1
+    if facet_tags is not None:
+        return [(tag, counts.get(tag, 0)) for tag in sorted(set(facet_tags))]
+    best = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return best[:limit] if limit else best
+
+
+# --- 式の解析 ---
+def test_parse_precedence_and_spellings():
+    assert parse_expression('2') == ('tag', 2)
+    assert parse_expression('2 & 3 | 5') == ('or', [('and', [('tag', 2), ('tag', 3)]), ('tag', 5)])
+    assert parse_expression('2 | 3 & 5') == ('or', [('tag', 2), ('and', [('tag', 3), ('tag', 5)])])
+    assert parse_expression('!2 & 3') == ('and', [('not', ('tag', 2)), ('tag', 3)])
+    assert parse_expression('(2 | 3) 5 -7') == (
+        'and', [('or', [('tag', 2), ('tag', 3)]), ('tag', 5), ('not', ('tag', 7))])
+    # VNDB の表記と and / or / not、&& / ||
+    assert parse_expression('g2 AND not g3 || g5') == parse_expression('2 & !3 | 5')
+    assert parse_expression('!!2') == ('not', ('not', ('tag', 2)))
+
+
+def test_parse_names_with_resolver(engine):
+    resolver = engine.resolver
+    assert parse_expression('Fantasy & !"Slice of Life"', resolver) == (
+        'and', [('tag', 2), ('not', ('tag', 5))])
+    with pytest.raises(ValueError, match='タグが見つかりません'):
+        parse_expression('Fantasy & Unknown', resolver)
+    with pytest.raises(ValueError, match='タグが見つかりません'):
+        parse_expression('Fantasy')
+
+
+@pytest.mark.parametrize('text', ['', '   ', '2 &', '(2 | 3', '2 | 3)', '& 2', '2 !'])
+def test_parse_errors(text):
+    with pytest.raises(ValueError):
+        parse_expression(text)
+
+
+# --- 評価 ---
+@pytest.mark.parametrize('expr', [
+    '2', '19', '2 & 3', '2 | 3 | 5', '!2', '2 & !3 & !5', '!(2 | 3)', '(2 | 7) & !(3 & 11)',
+    '!2 & !3', '2 & 999', '2 | 999', '!999',
+])
+def test_evaluate_matches_brute_force(engine, rows, expr):
+    snap = engine.snapshot
+    tree = parse_expression(expr)
+    words = evaluate(snap, tree)
+    assert snap.unpack(words).tolist() == [i for i, row in enumerate(rows) if matches(tree, row['tags'])]
+    # NOT の結果も、最後のワードの行数より後ろのビットは立ちません
+    assert int(np.bitwise_count(words).sum()) == len(snap.unpack(words))
+
+
+def test_evaluate_does_not_modify_tag_bits(engine):
+    snap = engine.snapshot
+    before = snap.words.copy()
+    evaluate(snap, parse_expression('2 & 3 & !5 | 7'))
+    evaluate(snap, parse_expression('(2) & 3'))
+    assert np.array_equal(before, snap.words)
+
+
+# --- 絞り込み・並び替え・上位 k 件 ---
+@pytest.mark.parametrize('sort', SORT_KEYS)
+@pytest.mark.parametrize('expr, filters', [
+    (None, {}),
+    ('2 & !3', {}),
+    ('2 | 5', {'rating_min': 50}),
+    (None, {'rating_min': 30, 'rating_max': 70, 'votecount_min': 10}),
+    ('!7', {'votecount_max': 100, 'released_from': EPOCH + timedelta(days=10000)}),
+    (None, {'released_to': date(2010, 1, 1)}),
+    ('3 & 5 & 7 & 11', {'rating_min': 99}),
+])
+def test_search_matches_brute_force(engine, rows, sort, expr, filters):
+    tree = parse_expression(expr) if expr else None
+    expected = brute_search(rows, tree, sort=sort, **filters)
+    for offset, limit in ((0, 10), (5, 7), (0, len(rows) + 1), (len(expected), 5)):
+        result = engine.search(expr, sort=sort, limit=limit, offset=offset, **filters)
+        assert result['total'] == len(expected)
+        assert result['ids'] == [rows[i]['id'] for i in expected[offset:offset + limit]]
+
+
+def test_rows_report_nulls(engine, rows):
+    result = engine.search(None, sort='id', limit=len(rows))
+    for row, out in zip(rows, result['rows']):
+        assert out['rating'] == row['rating']
+        assert out['released'] == (None if row['released'] is None else EPOCH + timedelta(days=row['released']))
+
+
+def test_unknown_sort_is_rejected(engine):
+    with pytest.raises(ValueError):
+        engine.search('2', sort='title')
+
+
+# --- ファセット ---
+@pytest.mark.parametrize('expr, filters', [
+    (None, {}),                          # 結果が全体の半分より多い（引き算で数える）
+    ('2', {}),
+    ('3 & 5', {}),                       # 結果が少ない（該当行のタグを数える）
+    ('19 & 17', {'rating_min': 90}),
+    ('999', {}),                         # 結果なし
+])
+def test_facets_match_brute_force(engine, rows, expr, filters):
+    tree = parse_expression(expr) if expr else None
+    hits = brute_search(rows, tree, **filters)
+    for limit in (3, len(rows)):
+        result = engine.search(expr, limit=1, facets=limit, **filters)
+        assert result['facets'] == brute_facets(rows, hits, limit)
+    result = engine.search(expr, limit=1, facet_tags=[5, 2, 999, 5], **filters)
+    assert result['facets'] == brute_facets(rows, hits, facet_tags=[5, 2, 999])
+
+
+def test_facet_counting_strategies_agree(engine):
+    """_count_tags の2つの数え方（行のタグを数える / ビット列を数える）が同じ結果になること"""
+    snap = engine.snapshot
+    for expr in ('2', '3 & 5', '!2'):
+        words = evaluate(snap, parse_expression(expr))
+        rows = snap.unpack(words)
+        by_bits = np.bitwise_count(snap.words & words).sum(axis=1, dtype=np.int64)
+        facets = engine._facets(snap, words, rows, 0, None)
+        assert facets == [(int(snap.tag_ids[i]), int(by_bits[i]))
+                          for i in np.lexsort((snap.tag_ids, -by_bits)) if by_bits[i]]
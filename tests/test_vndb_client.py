@@ -0,0 +1,96 @@
+# vndb_client.py の再試行・Retry-After・トークンバケットを、ローカルの代役サーバー
+# （mock_vndb_server.py、VNDB_API_URL で向け先を切り替え）に対して確かめます。
+import asyncio
+import time
+
+import pytest
+
+import vndb_client
+from vndb_client import TokenBucket, VNDBClient, VNDBError, iter_pages_sync, post_sync
+
+# 再試行の待ち時間を短くしたクライアント（Retry-After があればそちらが優先されます）
+FAST = {'backoff_base': 0.01, 'backoff_max': 0.05, 'cache': False}
+
+
+def post(payload, endpoint='vn', **options):
+    async def _run():
+        async with VNDBClient(**dict(FAST, **options)) as client:
+            return await client.post(endpoint, payload), client.retries
+    return asyncio.run(_run())
+
+
+def test_retries_503_then_succeeds(mock_vndb):
+    mock_vndb.fail(503, times=2)
+    data, retries = post({'filters': ['id', '=', 'v3']})
+    assert [r['id'] for r in data['results']] == ['v3']
+    assert retries == 2
+    assert mock_vndb.statuses() == [503, 503, 200]
+
+
+def test_honours_retry_after_on_429(mock_vndb):
+    mock_vndb.fail(429, retry_after=1)
+    data, retries = post({'filters': ['id', '=', 'v1']})
+    assert data['results'][0]['id'] == 'v1'
+    assert retries == 1
+    (first, _e, _s), (second, _e2, _s2) = mock_vndb.hits
+    # バケツを止めるだけで、そのうえ眠ることはしない（2倍待たない）
+    assert 1.0 <= second - first < 1.5
+
+
+def test_gives_up_after_max_retries(mock_vndb):
+    mock_vndb.fail(503, times=3)
+    with pytest.raises(VNDBError) as excinfo:
+        post({}, max_retries=2)
+    assert excinfo.value.status == 503
+    assert mock_vndb.statuses() == [503, 503, 503]
+
+
+def test_client_errors_are_not_retried(mock_vndb):
+    mock_vndb.fail(400)
+    with pytest.raises(VNDBError) as excinfo:
+        post({})
+    assert excinfo.value.status == 400
+    assert len(mock_vndb.hits) == 1
+
+
+def test_token_bucket_paces_concurrent_requests(mock_vndb):
+    # 10件/秒・まとめて2件まで → 8件目は (8 - 2) / 10 = 0.6 秒後より前には投げられません
+    async def _run():
+        async with VNDBClient(rate=10, burst=2, concurrency=8, **FAST) as client:
+            await asyncio.gather(*(client.post('vn', {'page': p}) for p in range(1, 9)))
+    asyncio.run(_run())
+    times = sorted(t for t, _e, _s in mock_vndb.hits)
+    assert len(times) == 8
+    assert times[-1] - times[0] >= 0.5
+
+
+def test_post_sync_calls_share_one_bucket(mock_vndb, monkeypatch):
+    # 呼ぶたびにクライアントを作り直しても、5件/秒を超えないこと
+    monkeypatch.setattr(vndb_client, 'SYNC_BUCKET', TokenBucket(rate=5, capacity=1))
+    started = time.monotonic()
+    for i in range(1, 5):
+        assert post_sync('vn', {'filters': ['id', '=', f'v{i}']}, cache=False)['results'][0]['id'] == f'v{i}'
+    assert time.monotonic() - started >= 0.5
+
+
+def test_iter_pages_sync_retries_inside_the_crawl(mock_vndb):
+    mock_vndb.fail(503)
+    pages = list(iter_pages_sync('vn', {'results': 10}, **FAST))
+    assert [page for page, _data in pages] == [1, 2, 3]
+    ids = [r['id'] for _page, data in pages for r in data['results']]
+    assert ids == [f'v{i}' for i in range(1, 26)]
+    assert mock_vndb.statuses().count(503) == 1
+
+
+def test_iter_pages_stops_scheduling_after_last_page(mock_vndb):
+    # 25件・10件ずつなら3ページ目で more: false。呼び出し側がゆっくり読んでいても、
+    # 4ページ目以降は投げません（トークン待ちのまま取り消されます）
+    async def _run():
+        async with VNDBClient(rate=20, burst=1, concurrency=4, **FAST) as client:
+            pages = []
+            async for page, _data in client.iter_pages('vn', {'results': 10}):
+                pages.append(page)
+                await asyncio.sleep(0.3)
+            return pages
+    assert asyncio.run(_run()) == [1, 2, 3]
+    assert sorted(payload['page'] for _e, payload in mock_vndb.payloads) == [1, 2, 3]
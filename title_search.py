@@ -0,0 +1,445 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# タイトル検索用の索引（かな・全角半角・大文字小文字の違いを吸収）
+#
+# 今のタイトル列（search_vns.title / title_ja）には検索用の索引がなく、
+# 「ふぇいと」「フェイト」「ﾌｪｲﾄ」「FATE」のような書き方の違いも吸収できません。
+# DB_DESIGN_RECOMMENDATION.md の searchable_title にあたるものを作ります。
+#
+#   1. 正規化: NFKC → 小文字化（casefold）→ カタカナをひらがなに → ラテン文字のアクセントを外す
+#             → 記号・空白を取り除く
+#      例: 「Fate/stay night」→「fatestaynight」、「ﾌｪｲﾄ・ｽﾃｲﾅｲﾄ」→「ふぇいとすていないと」
+#   2. vndb.vn_titles の全タイトル（原題・ローマ字表記）と vn.alias（別名）を正規化し、
+#      1文字・2文字の n-gram を作ります。
+#   3. 使い方は2通り:
+#      - Postgres: title_search テーブル（n-gram 配列に GIN インデックス）
+#      - プロセス内: TitleIndex（n-gram → タイトル番号の配列。入力しながらの検索向け）
+#
+# 並び順は「一致の質（完全一致 → 前方一致 → 部分一致）」→ 投票数の多い順です。
+#
+# 実行方法:
+#   python title_search.py build               # title_search テーブルを作り直す
+#   python title_search.py search ふぇいと      # プロセス内の索引で検索
+#   python title_search.py search ふぇいと --db # Postgres で検索
+#   python title_search.py bench               # 入力途中の文字列で p50/p95/p99 を測る
+# -----------------------------------------------------------------------------
+
+import argparse
+import io
+import random
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+
+from db import get_db_connection, iter_rows
+
+TABLE = 'title_search'
+SHADOW = 'title_search_new'
+
+# 一致の質（小さいほど上位）
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+# -----------------------------------------------------------------------------
+# 1. 正規化と n-gram
+# -----------------------------------------------------------------------------
+def _build_translation():
+    """カタカナ → ひらがな、アクセント付きラテン文字 → アクセントなし の変換表"""
+    table = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}   # ァ〜ヶ → ぁ〜ゖ
+    table[0x30FD] = 0x309D   # ヽ → ゝ
+    table[0x30FE] = 0x309E   # ヾ → ゞ
+    for code in range(0x00C0, 0x0250):
+        base = ''.join(c for c in unicodedata.normalize('NFKD', chr(code)) if not unicodedata.combining(c))
+        if base and base != chr(code):
+            table[code] = base.casefold()
+    return table
+
+TRANSLATION = _build_translation()
+NON_WORD = re.compile(r'[\W_]+')
+
+def normalize(text):
+    """検索用にタイトルを正規化します（同じ読み・表記ゆれが同じ文字列になるように）"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold().translate(TRANSLATION)
+    return NON_WORD.sub('', text)
+
+def ngrams(normalized):
+    """1文字と2文字の n-gram（重複なし）"""
+    grams = set(normalized)
+    grams.update(normalized[i:i + 2] for i in range(len(normalized) - 1))
+    return grams
+
+def query_grams(normalized):
+    """検索語から、索引を引くときに使う n-gram（2文字以上なら2文字の n-gram だけ）"""
+    if len(normalized) == 1:
+        return [normalized]
+    return sorted({normalized[i:i + 2] for i in range(len(normalized) - 1)})
+
+def _build_romaji():
+    """ひらがな（normalize() の後なのでカタカナもひらがなです）→ ヘボン式ローマ字の表"""
+    rows = [
+        ('あいうえお', 'a i u e o'), ('かきくけこ', 'ka ki ku ke ko'), ('さしすせそ', 'sa shi su se so'),
+        ('たちつてと', 'ta chi tsu te to'), ('なにぬねの', 'na ni nu ne no'), ('はひふへほ', 'ha hi fu he ho'),
+        ('まみむめも', 'ma mi mu me mo'), ('やゆよ', 'ya yu yo'), ('らりるれろ', 'ra ri ru re ro'),
+        ('わゐゑをん', 'wa i e wo n'), ('がぎぐげご', 'ga gi gu ge go'), ('ざじずぜぞ', 'za ji zu ze zo'),
+        ('だぢづでど', 'da ji zu de do'), ('ばびぶべぼ', 'ba bi bu be bo'), ('ぱぴぷぺぽ', 'pa pi pu pe po'),
+        ('ぁぃぅぇぉゃゅょゎゔ', 'a i u e o ya yu yo wa vu'),
+    ]
+    table = {}
+    for kana, romaji in rows:
+        table.update(zip(kana, romaji.split()))
+    # 拗音（きゃ → kya、しゃ → sha）
+    for kana in 'きしちにひみりぎじぢびぴ':
+        stem = table[kana][:-1]
+        for small, vowel in zip('ゃゅょ', 'auo'):
+            table[kana + small] = stem + vowel if stem in ('sh', 'ch', 'j') else stem + 'y' + vowel
+    return table
+
+ROMAJI = _build_romaji()
+
+def to_romaji(normalized):
+    """
+    normalize() した文字列がかなだけなら、ローマ字にして返します（漢字などを含むときは ''）。
+    長音（ー）は書かず、促音（っ）は次の子音を重ねます。「おう」は ou のままです。
+    """
+    out = []
+    double = False
+    i = 0
+    while i < len(normalized):
+        pair = normalized[i:i + 2]
+        if len(pair) == 2 and pair in ROMAJI:
+            romaji, i = ROMAJI[pair], i + 2
+        elif normalized[i] in ('っ', 'ー'):
+            double = double or normalized[i] == 'っ'
+            i += 1
+            continue
+        elif normalized[i] in ROMAJI:
+            romaji, i = ROMAJI[normalized[i]], i + 1
+        else:
+            return ''
+        if double:
+            out.append('t' if romaji.startswith('ch') else romaji[0])
+            double = False
+        out.append(romaji)
+    return ''.join(out)
+
+# -----------------------------------------------------------------------------
+# 2. タイトルを集める
+# -----------------------------------------------------------------------------
+def iter_titles(cur):
+    """
+    (VN ID, 種類, 言語, 表示用タイトル, 投票数) を返します。
+    種類は title（原題・各言語のタイトル）/ latin（ローマ字表記）/ alias（別名）です。
+    search_vns に載っている VN だけを対象にします。
+    """
+    # タイトルは数十万行になるので、サーバーサイドカーソルで少しずつ読みます
+    for vn_id, lang, title, latin, votes in iter_rows(cur.connection, """
+    SELECT t.id, t.lang, t.title, t.latin, s.votecount
+    FROM vndb.vn_titles t
+    JOIN search_vns s ON s.id = t.id
+    """, fetch_size=5000, name='title_search_titles'):
+        yield vn_id, 'title', lang, title, votes
+        if latin:
+            yield vn_id, 'latin', lang, latin, votes
+
+    # 別名（改行区切り）は本番のダンプにだけある列なので、あるときだけ使います
+    cur.execute("""
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'vndb' AND table_name = 'vn' AND column_name = 'alias'
+    """)
+    if cur.fetchone():
+        for vn_id, aliases, votes in iter_rows(cur.connection, """
+        SELECT v.id, v.alias, s.votecount
+        FROM vndb.vn v JOIN search_vns s ON s.id = v.id
+        WHERE v.alias <> ''
+        """, fetch_size=5000, name='title_search_aliases'):
+            for alias in aliases.split('\n'):
+                if alias.strip():
+                    yield vn_id, 'alias', None, alias.strip(), votes
+
+# -----------------------------------------------------------------------------
+# 3. Postgres の title_search テーブル
+# -----------------------------------------------------------------------------
+def _copy_text(value):
+    if value is None:
+        return '\\N'
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _array_literal(grams):
+    """Postgres の配列リテラル（"..." で囲み、" と \\ はエスケープ）"""
+    items = ('"' + g.replace('\\', '\\\\').replace('"', '\\"') + '"' for g in sorted(grams))
+    return '{' + ','.join(items) + '}'
+
+def build_title_table(conn):
+    """
+    title_search を影テーブルで作り直し、1トランザクションで入れ替えます。
+    正規化は Python 側で行い、COPY でまとめて投入します。
+    """
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        buf = io.StringIO()
+        count = 0
+        seen = set()
+        for vn_id, kind, lang, title, _votes in iter_titles(cur):
+            normalized = normalize(title)
+            # 同じ VN で正規化後が同じタイトル（"Title 1" と "title 1" など）は1つにまとめます
+            if not normalized or (vn_id, normalized) in seen:
+                continue
+            seen.add((vn_id, normalized))
+            fields = [vn_id, kind, lang, title, normalized]
+            buf.write('\t'.join(_copy_text(f) for f in fields) + '\t' +
+                      _copy_text(_array_literal(ngrams(normalized))) + '\n')
+            count += 1
+        print(f"{count} 件のタイトルを正規化しました（{time.perf_counter() - started:.1f} 秒）")
+
+        cur.execute(f"DROP TABLE IF EXISTS {SHADOW}")
+        cur.execute(f"""
+        CREATE TABLE {SHADOW} (
+            vid TEXT NOT NULL,
+            kind TEXT NOT NULL,         -- title / latin / alias
+            lang TEXT,
+            title TEXT NOT NULL,        -- 元の表記
+            normalized TEXT NOT NULL,   -- normalize() した文字列
+            grams TEXT[] NOT NULL       -- 1文字・2文字の n-gram
+        )
+        """)
+        buf.seek(0)
+        cur.copy_expert(f"COPY {SHADOW} FROM STDIN", buf)
+        cur.execute(f"CREATE INDEX idx_{SHADOW}_grams ON {SHADOW} USING GIN (grams)")
+        cur.execute(f"CREATE INDEX idx_{SHADOW}_normalized ON {SHADOW} (normalized text_pattern_ops)")
+        cur.execute(f"CREATE INDEX idx_{SHADOW}_vid ON {SHADOW} (vid)")
+        cur.execute(f"ANALYZE {SHADOW}")
+
+        # 入れ替え（読む側は古い完成版か新しい完成版のどちらかを見ます）
+        cur.execute("SET LOCAL lock_timeout = '10s'")
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(f"ALTER TABLE {SHADOW} RENAME TO {TABLE}")
+        for suffix in ('grams', 'normalized', 'vid'):
+            cur.execute(f"ALTER INDEX idx_{SHADOW}_{suffix} RENAME TO idx_{TABLE}_{suffix}")
+    conn.commit()
+    print(f"✅ {TABLE} を作り直しました: {count} 件（{time.perf_counter() - started:.1f} 秒）")
+
+SEARCH_SQL = f"""
+WITH hits AS (
+    SELECT t.vid,
+           MIN(CASE WHEN t.normalized = %(q)s THEN {EXACT}
+                    WHEN LEFT(t.normalized, %(length)s) = %(q)s THEN {PREFIX}
+                    ELSE {SUBSTRING} END) AS quality
+    FROM {TABLE} t
+    WHERE t.grams @> %(grams)s::text[] AND STRPOS(t.normalized, %(q)s) > 0
+    GROUP BY t.vid
+)
+SELECT s.id, s.title, s.title_ja, s.votecount, h.quality
+FROM hits h
+JOIN search_vns s ON s.id = h.vid
+ORDER BY h.quality, s.votecount DESC NULLS LAST, s.id
+LIMIT %(limit)s
+"""
+
+def search_db(cur, text, limit=20):
+    """title_search テーブルで検索して (VN ID, タイトル, 日本語タイトル, 投票数, 一致の質) を返します"""
+    q = normalize(text)
+    if not q:
+        return []
+    cur.execute(SEARCH_SQL, {'q': q, 'length': len(q), 'grams': query_grams(q), 'limit': limit})
+    return cur.fetchall()
+
+# -----------------------------------------------------------------------------
+# 4. プロセス内の索引
+# -----------------------------------------------------------------------------
+class TitleIndex:
+    """
+    タイトル番号は投票数の多い順に振ります。
+    そのため n-gram ごとの番号の配列（昇順）は、そのまま投票数の多い順になっていて、
+    部分一致の候補を並べ替えずに上から見ていくだけで済みます。
+    前方一致は、正規化したタイトルを辞書順に並べた配列を二分探索して探します。
+    """
+
+    def __init__(self, titles):
+        started = time.perf_counter()
+        # titles: (VN ID, 表示用タイトル, 投票数) のリスト
+        entries = {}
+        for vn_id, title, votes in titles:
+            normalized = normalize(title)
+            if normalized and (vn_id, normalized) not in entries:
+                entries[(vn_id, normalized)] = (votes or 0, title)
+        order = sorted(entries.items(), key=lambda item: (-item[1][0], _vn_number(item[0][0])))
+        self.vids = [vn_id for (vn_id, _n), _v in order]
+        self.normalized = [normalized for (_id, normalized), _v in order]
+        self.titles = [title for _k, (_votes, title) in order]
+        self.votes = np.array([votes for _k, (votes, _t) in order], dtype=np.int32)
+
+        postings = {}
+        for number, normalized in enumerate(self.normalized):
+            for gram in ngrams(normalized):
+                postings.setdefault(gram, []).append(number)
+        self.postings = {gram: np.array(numbers, dtype=np.int32) for gram, numbers in postings.items()}
+
+        by_text = sorted(range(len(self.normalized)), key=self.normalized.__getitem__)
+        self.sorted_keys = [self.normalized[i] for i in by_text]
+        self.sorted_numbers = np.array(by_text, dtype=np.int32)
+        self.build_seconds = time.perf_counter() - started
+
+    @classmethod
+    def from_db(cls, conn):
+        with conn.cursor() as cur:
+            titles = [(vn_id, title, votes) for vn_id, _kind, _lang, title, votes in iter_titles(cur)]
+        conn.commit()
+        return cls(titles)
+
+    def __len__(self):
+        return len(self.normalized)
+
+    def search(self, text, limit=20):
+        """(VN ID, 一致したタイトル, 投票数, 一致の質) を最大 limit 件返します（1つの VN は1回だけ）"""
+        q = normalize(text)
+        if not q:
+            return []
+        results = []
+        seen = set()
+
+        def add(number, quality):
+            vn_id = self.vids[number]
+            if vn_id not in seen:
+                seen.add(vn_id)
+                results.append((vn_id, self.titles[number], int(self.votes[number]), quality))
+
+        # --- A. 完全一致・前方一致（辞書順の配列で範囲を探し、番号順 = 投票数順に並べる） ---
+        lo = bisect_left(self.sorted_keys, q)
+        hi = bisect_left(self.sorted_keys, q + '\U0010ffff', lo)
+        prefixed = np.sort(self.sorted_numbers[lo:hi])
+        exact = [n for n in prefixed if self.normalized[n] == q]
+        for number in exact:
+            add(number, EXACT)
+        for number in prefixed:
+            if len(results) >= limit:
+                return results
+            add(number, PREFIX)
+
+        # --- B. 部分一致（n-gram の積集合を投票数順に見て、実際に含むものだけ採用） ---
+        grams = query_grams(q)
+        lists = [self.postings.get(gram) for gram in grams]
+        if any(numbers is None for numbers in lists):
+            return results
+        lists.sort(key=len)
+        candidates = lists[0]
+        for numbers in lists[1:]:
+            candidates = np.intersect1d(candidates, numbers, assume_unique=True)
+            if not len(candidates):
+                return results
+        # 2文字以下なら n-gram に含まれること自体が部分一致なので、確認は不要です
+        verify = len(q) > 2
+        for number in candidates:
+            if len(results) >= limit:
+                break
+            if verify and q not in self.normalized[number]:
+                continue
+            add(number, SUBSTRING)
+        return results
+
+def _vn_number(vn_id):
+    return int(vn_id[1:]) if vn_id[1:].isdigit() else 0
+
+# -----------------------------------------------------------------------------
+# 5. ベンチマーク（入力途中の文字列で検索）
+# -----------------------------------------------------------------------------
+def typing_queries(index, count=500, seed=42):
+    """ランダムに選んだタイトルを1文字ずつ入力していく途中の文字列を作ります"""
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        title = index.titles[rng.randrange(len(index))]
+        typed = ''
+        for ch in title:
+            typed += ch
+            if normalize(typed):
+                queries.append(typed)
+        # 部分一致（タイトルの途中から入力）も混ぜます
+        normalized = normalize(title)
+        if len(normalized) > 4:
+            start = rng.randrange(len(normalized) - 3)
+            queries.append(normalized[start:start + 3])
+    return queries[:count]
+
+def percentiles(timings):
+    timings = sorted(timings)
+    pick = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))]
+    return pick(0.5), pick(0.95), pick(0.99)
+
+def run_benchmark(conn, count=500):
+    index = TitleIndex.from_db(conn)
+    print(f"📦 プロセス内の索引: {len(index)} 件 / n-gram {len(index.postings)} 種類"
+          f"（作成 {index.build_seconds:.2f} 秒）")
+    queries = typing_queries(index, count)
+
+    timings = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q)
+        timings.append((time.perf_counter() - t0) * 1000)
+    p50, p95, p99 = percentiles(timings)
+    print(f"プロセス内: p50 {p50:.3f} ms / p95 {p95:.3f} ms / p99 {p99:.3f} ms（{len(queries)} 回）")
+
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT to_regclass('{TABLE}') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            print(f"⚠️  {TABLE} テーブルがないので Postgres 側は測りません（build を先に実行してください）")
+            return
+        timings = []
+        for q in queries:
+            t0 = time.perf_counter()
+            search_db(cur, q)
+            timings.append((time.perf_counter() - t0) * 1000)
+    conn.commit()
+    p50, p95, p99 = percentiles(timings)
+    print(f"Postgres  : p50 {p50:.3f} ms / p95 {p95:.3f} ms / p99 {p99:.3f} ms（{len(queries)} 回）")
+
+# -----------------------------------------------------------------------------
+# 6. コマンドライン
+# -----------------------------------------------------------------------------
+QUALITY_LABELS = {EXACT: '完全一致', PREFIX: '前方一致', SUBSTRING: '部分一致'}
+
+def main():
+    parser = argparse.ArgumentParser(description='タイトル検索用の索引')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('build', help='title_search テーブルを作り直す')
+    search = sub.add_parser('search', help='タイトルを検索する')
+    search.add_argument('text')
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--db', action='store_true', help='Postgres の title_search テーブルで検索する')
+    bench = sub.add_parser('bench', help='入力途中の文字列で検索時間を測る')
+    bench.add_argument('--count', type=int, default=500)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.command == 'build':
+            build_title_table(conn)
+        elif args.command == 'bench':
+            run_benchmark(conn, args.count)
+        else:
+            print(f"正規化: {args.text!r} → {normalize(args.text)!r}")
+            t0 = time.perf_counter()
+            if args.db:
+                with conn.cursor() as cur:
+                    rows = [(vn_id, title_ja or title, votes, quality)
+                            for vn_id, title, title_ja, votes, quality in search_db(cur, args.text, args.limit)]
+            else:
+                index = TitleIndex.from_db(conn)
+                t0 = time.perf_counter()
+                rows = index.search(args.text, args.limit)
+            elapsed = (time.perf_counter() - t0) * 1000
+            for vn_id, title, votes, quality in rows:
+                print(f"   {vn_id:>7}  {QUALITY_LABELS[quality]}  {votes or 0:>6}  {title}")
+            print(f"🔍 {len(rows)} 件（{elapsed:.3f} ms）")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
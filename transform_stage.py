@@ -0,0 +1,152 @@
+#!/home/rich/eroge-db/.venv/bin/python
+# -----------------------------------------------------------------------------
+# VNデータの変換を複数プロセスで行う段階（取得・変換・書き込みを並行させる）
+#
+# 全件取得モードでは、APIの1ページ分を受け取るたびに、メインスレッドで
+#   日本語タイトルの選択 → タグの翻訳 → BBCode の除去 → content_hash の計算 → JSON 化
+# を1件ずつ行ってから COPY していました。説明文や titles をすべて取り込むと、
+# この CPU の処理が取得や書き込みより遅くなります。ここでは:
+#   - ページ（VNのリスト）ごとにプロセスプールへ渡し、
+#     bulk_upsert.prepare_copy_row() で COPY にそのまま流せる行にして返します
+#   - 同時に処理中にするページ数を max_inflight までに抑えます（背圧）。
+#     書き込みが遅ければ新しいページを受け取らないので、取得側（vndb_client の先読み）も待ちます
+#   - ordered=True（標準）なら渡した順に返します。ページ番号と一緒にコミットする
+#     ingest_all() はこちらを使います。ordered=False なら終わったものから返します
+#
+# 取得（別スレッド）・変換（子プロセス）・書き込み（メインスレッド）が同時に進みます。
+#
+# 使い方:
+#   with TransformStage(workers=4) as stage:
+#       for page, prepared in stage.map(iter_vndb_pages()):
+#           writer.add_prepared(prepared)
+#
+#   python ingest_vndb_data.py --all --workers 4     # 全件取得で使う
+#   python transform_stage.py --count 20000 --workers 4   # 合成データで速さと結果の一致を確認
+# -----------------------------------------------------------------------------
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pipeline_metrics
+from bulk_upsert import prepare_copy_row
+
+# 1プロセスあたりに同時に渡しておくページ数（1つ処理している間に次を待たせておく分）
+INFLIGHT_PER_WORKER = 2
+
+# -----------------------------------------------------------------------------
+# 1. 子プロセスで実行する処理
+# -----------------------------------------------------------------------------
+def transform_batch(vns):
+    """VNのリストを prepare_copy_row() の結果のリストにします。かかった時間も返します"""
+    started = time.perf_counter()
+    prepared = [prepare_copy_row(vn) for vn in vns]
+    return prepared, time.perf_counter() - started
+
+# -----------------------------------------------------------------------------
+# 2. 変換段階
+# -----------------------------------------------------------------------------
+class TransformStage:
+    """
+    (キー, VNのリスト) を受け取り、(キー, 変換済みの行のリスト) を返します。
+    キーは呼び出し側で使うもの（ページ番号など）で、そのまま返します。
+    workers=0 のときはプロセスを使わず、メインスレッドで変換します（従来と同じ動き）。
+    """
+
+    def __init__(self, workers=None, ordered=True, max_inflight=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.ordered = ordered
+        self.max_inflight = max_inflight or max(1, self.workers) * INFLIGHT_PER_WORKER
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            # fork だと取得スレッドや DB 接続の状態まで子プロセスに複製されるので、spawn で起動します
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self
+
+    def __exit__(self, *exc):
+        if self._executor:
+            # 途中で例外になった場合、まだ始まっていない変換は取り消します
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def map(self, items):
+        metrics = pipeline_metrics.current()
+        if self._executor is None:
+            for key, vns in items:
+                prepared, elapsed = transform_batch(vns)
+                metrics.observe('transform', elapsed, rows=len(prepared))
+                yield key, prepared
+            return
+
+        source = iter(items)
+        inflight = deque()   # (キー, Future) を渡した順に
+        exhausted = False
+        while True:
+            # --- A. 空きがある分だけ次のページを受け取って渡す ---
+            while not exhausted and len(inflight) < self.max_inflight:
+                try:
+                    key, vns = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                inflight.append((key, self._executor.submit(transform_batch, vns)))
+            if not inflight:
+                return
+
+            # --- B. 結果を1つ受け取る（順番どおり、または終わったものから） ---
+            if self.ordered:
+                key, future = inflight.popleft()
+            else:
+                done, _pending = wait([f for _key, f in inflight], return_when=FIRST_COMPLETED)
+                index = next(i for i, (_key, f) in enumerate(inflight) if f in done)
+                key, future = inflight[index]
+                del inflight[index]
+            prepared, elapsed = future.result()
+            metrics.observe('transform', elapsed, rows=len(prepared))
+            yield key, prepared
+
+# -----------------------------------------------------------------------------
+# 3. ベンチマーク（合成データでメインスレッドの変換と比較）
+# -----------------------------------------------------------------------------
+def run_benchmark(count, batch_size, workers, ordered):
+    from benchmark_suite import SyntheticVNDB
+
+    print(f"📥 合成データを {count} 件作成中...")
+    vns = list(SyntheticVNDB(count).api_payloads())
+    batches = [(n, vns[i:i + batch_size]) for n, i in enumerate(range(0, len(vns), batch_size))]
+
+    started = time.perf_counter()
+    with TransformStage(workers=0) as stage:
+        expected = [row for _key, prepared in stage.map(batches) for row in prepared]
+    inline = time.perf_counter() - started
+    print(f"   メインスレッド: {inline:.2f} 秒（{count / inline:,.0f} 件/秒）")
+
+    started = time.perf_counter()
+    with TransformStage(workers=workers, ordered=ordered) as stage:
+        results = list(stage.map(batches))
+    parallel = time.perf_counter() - started
+    print(f"   {workers} プロセス（{'順番どおり' if ordered else '終わった順'}）: {parallel:.2f} 秒"
+          f"（{count / parallel:,.0f} 件/秒、プロセスの起動を含む）")
+
+    if not ordered:
+        results.sort(key=lambda item: item[0])
+    actual = [row for _key, prepared in results for row in prepared]
+    if actual == expected:
+        print("✅ メインスレッドで変換した結果と完全に一致しました")
+    else:
+        print("⚠️ メインスレッドで変換した結果と一致しません")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VNデータの変換を複数プロセスで行う段階のベンチマーク')
+    parser.add_argument('--count', type=int, default=20000, help='合成データの件数')
+    parser.add_argument('--batch-size', type=int, default=100, help='1回に渡す件数（APIの1ページ分）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='プロセス数')
+    parser.add_argument('--unordered', action='store_true', help='終わったものから受け取る')
+    args = parser.parse_args()
+    run_benchmark(args.count, args.batch_size, args.workers, ordered=not args.unordered)
@@ -2,141 +2,240 @@
 # -----------------------------------------------------------------------------
 # 既存のタグデータに日本語翻訳（name_ja）を追加するスクリプト
 # データベース内の全ゲームのタグを読み取り、翻訳を追加して更新します
+#
+# 翻訳は tag_translations テーブルに置き、SQL だけで一括更新します（--mode sql、標準）。
+# 全件を Python に読み込んで1件ずつ UPDATE するのではなく、
+# ID順に batch_size 件ずつ区切って、区切りごとに1回の UPDATE で書き換えます。
+# Python 側で処理する場合（--mode python）も、サーバーサイドカーソルで少しずつ読み、
+# execute_values でまとめて書き込むので、メモリ使用量は一定です。
+#
+# 実行方法:
+#   python update_tag_translations.py               # name_ja がないタグにだけ追加
+#   python update_tag_translations.py --retranslate # 既存の name_ja も辞書で付け直す
+#   python update_tag_translations.py --dry-run     # 書き込まずに、変わる件数だけ表示
+#   python update_tag_translations.py --metrics-prom /var/lib/node_exporter/tag_translations.prom
 # -----------------------------------------------------------------------------
 
-import psycopg2
-from psycopg2.extras import Json
-import os
-from dotenv import load_dotenv
+import argparse
+import json
+import time
 
-# .envファイルから環境変数を読み込む
-load_dotenv()
+import pipeline_metrics
+from db import get_db_connection, insert_values, iter_batches
+# タグ翻訳辞書（取り込み時の name_ja と同じもの）
+from tag_translations import TAG_TRANSLATIONS
 
-# タグ翻訳辞書（ingest_vndb_data.pyと同じもの）
-TAG_TRANSLATIONS = {
-    # ジャンル・カテゴリ
-    'ADV': 'アドベンチャー',
-    'AVG': 'アドベンチャー',
-    'Horror': 'ホラー',
-    'Romance': 'ロマンス',
-    'Comedy': 'コメディ',
-    'Drama': 'ドラマ',
-    'Fantasy': 'ファンタジー',
-    'Sci-fi': 'SF',
-    'Mystery': 'ミステリー',
-    'Thriller': 'スリラー',
-    'Action': 'アクション',
-    'Male Protagonist': '男性主人公',
-    'Female Protagonist': '女性主人公',
-    'School Life': '学校生活',
-    'High School': '高校',
-    'School': '学校',
-    'College': '大学',
-    'Modern Day': '現代',
-    'Future': '未来',
-    'Past': '過去',
-    'Japan': '日本',
-    'Slice of Life': '日常系',
-    'Multiple Endings': 'マルチエンディング',
-    'Choices': '選択肢',
-    'Branching Plot': '分岐シナリオ',
-    'Linear Plot': '一本道',
-    'Point and Click': 'ポイント&クリック',
-    'Sexual Content': '性的コンテンツ',
-    'Eroge': 'エロゲ',
-    'No Sexual Content': '性的コンテンツなし',
-    'Violence': '暴力表現',
-    'Gore': 'グロ表現',
-    'Nakige': '泣きゲー',
-    'Utsuge': '鬱ゲー',
-    'Kinetic Novel': 'キネティックノベル',
-    'Visual Novel': 'ビジュアルノベル',
-    'RPG': 'RPG',
-    'Simulation': 'シミュレーション',
-    'Strategy': 'ストラテジー',
-    'Puzzle': 'パズル',
-    'Time Travel': 'タイムトラベル',
-    'Supernatural': '超常現象',
-    'Magic': '魔法',
-    'War': '戦争',
-    'Post-apocalyptic': 'ポストアポカリプス',
-    'Cyberpunk': 'サイバーパンク',
-    'Steampunk': 'スチームパンク',
-    'Tsundere': 'ツンデレ',
-    'Yandere': 'ヤンデレ',
-    'Kuudere': 'クーデレ',
-    'Childhood Friend': '幼馴染',
-    'Maid': 'メイド',
-    'Teacher': '教師',
-    'Student': '学生',
-}
+# -----------------------------------------------------------------------------
+# 1. 翻訳テーブル
+# -----------------------------------------------------------------------------
+def sync_translation_table(cur):
+    """
+    tag_translations テーブルを作り、TAG_TRANSLATIONS の内容を反映します。
+    辞書にない翻訳をテーブルに直接追加しておくこともできます（上書きはされません）。
+    """
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS tag_translations (
+        name TEXT PRIMARY KEY,
+        name_ja TEXT NOT NULL
+    )
+    """)
+    insert_values(cur, """
+    INSERT INTO tag_translations (name, name_ja) VALUES %s
+    ON CONFLICT (name) DO UPDATE SET name_ja = EXCLUDED.name_ja
+    WHERE tag_translations.name_ja IS DISTINCT FROM EXCLUDED.name_ja
+    """, list(TAG_TRANSLATIONS.items()))
+
+# -----------------------------------------------------------------------------
+# 2. SQL だけで一括更新するモード
+# -----------------------------------------------------------------------------
+def new_tags_sql(retranslate):
+    """
+    1件分の tags（JSONB配列）に name_ja を付けた新しい配列を作る SELECT 文です。
+    配列の順番は WITH ORDINALITY で元のまま保ちます。
+    %(lower)s < id <= %(upper)s の範囲だけを対象にします。
+    """
+    if retranslate:
+        new_tag = "e.tag || jsonb_build_object('name_ja', COALESCE(tt.name_ja, e.tag->>'name', ''))"
+    else:
+        # name_ja がまだない場合のみ追加（従来と同じ動き）
+        new_tag = """CASE WHEN e.tag ? 'name_ja' THEN e.tag
+                 ELSE e.tag || jsonb_build_object('name_ja', COALESCE(tt.name_ja, e.tag->>'name', ''))
+            END"""
+    return f"""
+    SELECT vn.id, jsonb_agg({new_tag} ORDER BY e.ord) AS tags
+    FROM visual_novels vn
+    CROSS JOIN LATERAL jsonb_array_elements(vn.tags) WITH ORDINALITY AS e(tag, ord)
+    LEFT JOIN tag_translations tt ON tt.name = e.tag->>'name'
+    WHERE vn.id > %(lower)s AND vn.id <= %(upper)s
+      AND jsonb_typeof(vn.tags) = 'array'
+    GROUP BY vn.id
+    """
+
+def iter_id_ranges(cur, batch_size):
+    """ID順に batch_size 件ずつの範囲 (lower, upper] を返します"""
+    lower = ''
+    while True:
+        cur.execute("""
+        SELECT MAX(id) FROM (
+            SELECT id FROM visual_novels
+            WHERE id > %s AND tags IS NOT NULL
+            ORDER BY id LIMIT %s
+        ) batch
+        """, (lower, batch_size))
+        upper = cur.fetchone()[0]
+        if upper is None:
+            return
+        yield lower, upper
+        lower = upper
+
+def update_with_sql(conn, batch_size, retranslate, dry_run):
+    metrics = pipeline_metrics.current()
+    updated_count = 0
+    with conn.cursor() as cur:
+        for lower, upper in iter_id_ranges(cur, batch_size):
+            params = {'lower': lower, 'upper': upper}
+            if dry_run:
+                with metrics.stage('db_read'):
+                    cur.execute(f"""
+                    SELECT COUNT(*) FROM ({new_tags_sql(retranslate)}) n
+                    JOIN visual_novels v ON v.id = n.id
+                    WHERE v.tags IS DISTINCT FROM n.tags
+                    """, params)
+                    changed = cur.fetchone()[0]
+                updated_count += changed
+                metrics.add_rows('db_read', rows=changed)
+                metrics.progress()
+                continue
+            # 内容が変わるゲームだけを UPDATE します（翻訳も SQL の中で行うので、段階は db_write だけです）
+            with metrics.stage('db_write'):
+                cur.execute(f"""
+                UPDATE visual_novels v SET tags = n.tags
+                FROM ({new_tags_sql(retranslate)}) n
+                WHERE v.id = n.id AND v.tags IS DISTINCT FROM n.tags
+                """, params)
+            updated_count += cur.rowcount
+            metrics.add_rows('db_write', rows=cur.rowcount)
+            with metrics.stage('commit'):
+                conn.commit()  # 区切りごとに確定して、ロックとWALを小さく保ちます
+            metrics.progress()
+    return updated_count
+
+# -----------------------------------------------------------------------------
+# 3. Python 側で処理するモード（サーバーサイドカーソル + execute_values）
+# -----------------------------------------------------------------------------
+def translate_tags(tags, translations, retranslate):
+    """タグのリストに name_ja を付けます。変更があれば True を返します"""
+    updated = False
+    for tag in tags:
+        tag_name = tag.get('name', '')
+        # name_ja がまだない場合のみ追加（retranslate なら付け直し）
+        if retranslate or 'name_ja' not in tag:
+            name_ja = translations.get(tag_name, tag_name)
+            if tag.get('name_ja') != name_ja:
+                tag['name_ja'] = name_ja
+                updated = True
+    return updated
+
+def update_with_python(conn, batch_size, retranslate, dry_run):
+    metrics = pipeline_metrics.current()
+    with conn.cursor() as cur:
+        cur.execute("SELECT name, name_ja FROM tag_translations")
+        translations = dict(cur.fetchall())
 
-# データベース接続設定
-DB_CONFIG = {
-    'dbname': os.getenv('POSTGRES_DB'),
-    'user': os.getenv('POSTGRES_USER'),
-    'password': os.getenv('POSTGRES_PASSWORD'),
-    'host': os.getenv('POSTGRES_HOST'),
-    'port': os.getenv('POSTGRES_PORT')
-}
+    updated_count = 0
+    # サーバーサイドカーソルで batch_size 件ずつ読みます
+    # （WITH HOLD なので、途中でコミットしても読み続けられます）
+    batches = iter_batches(conn, "SELECT id, tags FROM visual_novels WHERE tags IS NOT NULL ORDER BY id",
+                           fetch_size=batch_size, name='tag_translation_reader', withhold=True)
+    try:
+        while True:
+            with metrics.stage('db_read'):
+                rows = next(batches, None)
+            if rows is None:
+                break
+            metrics.add_rows('db_read', rows=len(rows))
+            with metrics.stage('translation', rows=len(rows)):
+                changed = [
+                    (game_id, json.dumps(tags, ensure_ascii=False))
+                    for game_id, tags in rows
+                    if tags and translate_tags(tags, translations, retranslate)
+                ]
+            updated_count += len(changed)
+            if changed and not dry_run:
+                with metrics.stage('db_write', rows=len(changed),
+                                   nbytes=sum(len(tags) for _id, tags in changed)):
+                    with conn.cursor() as cur:
+                        insert_values(cur, """
+                        UPDATE visual_novels v SET tags = data.tags::jsonb
+                        FROM (VALUES %s) AS data(id, tags)
+                        WHERE v.id = data.id
+                        """, changed, page_size=batch_size)
+                with metrics.stage('commit'):
+                    conn.commit()
+            metrics.progress()
+    finally:
+        batches.close()
+    return updated_count
 
-def update_tag_translations():
+# -----------------------------------------------------------------------------
+# 4. メイン処理
+# -----------------------------------------------------------------------------
+def update_tag_translations(mode='sql', batch_size=5000, retranslate=False, dry_run=False):
     """
     既存のタグデータに name_ja フィールドを追加します
+    計測は pipeline_metrics.current() に記録します（呼び出し側で PipelineMetrics を有効にしてください）
     """
     print("データベースに接続中...")
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
+    conn = get_db_connection()
+    started = time.perf_counter()
     
     try:
-        # 全ゲームのIDとタグを取得
-        print("既存データを取得中...")
-        cur.execute("SELECT id, tags FROM visual_novels WHERE tags IS NOT NULL")
-        rows = cur.fetchall()
+        with conn.cursor() as cur:
+            sync_translation_table(cur)
+        if dry_run:
+            print("（ドライラン: データベースは変更しません）")
+        else:
+            conn.commit()
         
-        print(f"対象ゲーム数: {len(rows)}件")
+        if mode == 'python':
+            updated_count = update_with_python(conn, batch_size, retranslate, dry_run)
+        else:
+            updated_count = update_with_sql(conn, batch_size, retranslate, dry_run)
         
-        # 各ゲームのタグを更新
-        updated_count = 0
-        for game_id, tags in rows:
-            if not tags:  # タグがない場合スキップ
-                continue
-                
-            # タグに name_ja を追加
-            updated = False
-            for tag in tags:
-                tag_name = tag.get('name', '')
-                # name_ja がまだない場合のみ追加
-                if 'name_ja' not in tag:
-                    tag['name_ja'] = TAG_TRANSLATIONS.get(tag_name, tag_name)
-                    updated = True
-            
-            # 更新されたタグをデータベースに保存
-            if updated:
-                cur.execute(
-                    "UPDATE visual_novels SET tags = %s WHERE id = %s",
-                    (Json(tags), game_id)
-                )
-                updated_count += 1
-                print(f"  更新: {game_id} ({updated_count}/{len(rows)})")
-        
-        # コミット（確定）
-        conn.commit()
-        print(f"\n✅ 完了！ {updated_count}件のゲームのタグを更新しました。")
+        elapsed = time.perf_counter() - started
+        if dry_run:
+            conn.rollback()
+            print(f"\n🔍 ドライラン: {updated_count}件のゲームのタグが変更されます（{elapsed:.2f} 秒）")
+        else:
+            conn.commit()
+            print(f"\n✅ 完了！ {updated_count}件のゲームのタグを更新しました（{elapsed:.2f} 秒）")
         
     except Exception as e:
-        # エラーが発生した場合はロールバック
+        # エラーが発生した場合はロールバック（確定済みの区切りはそのまま残ります）
         conn.rollback()
         print(f"❌ エラーが発生しました: {e}")
         raise
     finally:
         # 接続を閉じる
-        cur.close()
         conn.close()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='タグに日本語翻訳（name_ja）を追加します')
+    parser.add_argument('--mode', choices=['sql', 'python'], default='sql',
+                        help='sql: SQLだけで一括更新（標準） / python: Pythonで変換してまとめて書き込み')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='1回の UPDATE で処理するゲーム数')
+    parser.add_argument('--retranslate', action='store_true',
+                        help='既に name_ja があるタグも、現在の翻訳で付け直す')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='書き込まずに、変更されるゲーム数だけを表示する')
+    pipeline_metrics.add_arguments(parser)
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("タグ翻訳更新スクリプト")
     print("既存データに日本語翻訳（name_ja）を追加します")
     print("=" * 60)
-    update_tag_translations()
+    with pipeline_metrics.from_args('update_tag_translations', args):
+        update_tag_translations(mode=args.mode, batch_size=args.batch_size,
+                                retranslate=args.retranslate, dry_run=args.dry_run)
@@ -0,0 +1,25 @@
+# -----------------------------------------------------------------------------
+# キャラクター・スタッフの役割の並び順（frontend/app/game/[id]/page.tsx の ORDER BY と同じ）
+#
+# build_display.py（詳細ページのまとめデータ）と build_people_index.py（人 → VN の索引）の
+# 両方で使うので、どちらかのスクリプトから import せずにここにまとめています。
+#
+# 使い方:
+#   from vn_roles import character_role_order
+#   f"... ORDER BY {character_role_order('cv.role')}, c.id"
+# -----------------------------------------------------------------------------
+
+# この順に並べ、ここにない役割（appears など）は最後にします
+CHARACTER_ROLES = ['main', 'primary', 'side']
+STAFF_ROLES = ['scenario', 'chardesign', 'art', 'director', 'music', 'songs']
+
+def role_order(column, roles):
+    """column の役割を roles の順位（1, 2, ...）にする CASE 式です"""
+    whens = ' '.join(f"WHEN '{role}' THEN {rank}" for rank, role in enumerate(roles, 1))
+    return f"CASE {column} {whens} ELSE {len(roles) + 1} END"
+
+def character_role_order(column='role'):
+    return role_order(column, CHARACTER_ROLES)
+
+def staff_role_order(column='role'):
+    return role_order(column, STAFF_ROLES)
@@ -0,0 +1,329 @@
+# -----------------------------------------------------------------------------
+# VNDB API (kana) 共通クライアント（asyncio版）
+#
+# 各スクリプトがバラバラに requests.post を1回ずつ呼んでいたのをまとめたものです。
+#   - トークンバケットで VNDB の利用制限（5分で200リクエスト）を超えないように調整
+#   - 429（制限超過）や 5xx（サーバーエラー）はジッター付きの指数バックオフで再試行
+#   - ページ番号で取得するエンドポイントは、複数ページを同時に先読み（パイプライン化）
+#
+# 同期コードから使うときは post_sync() / iter_pages_sync() を使ってください。
+# 同期ヘルパーはモジュール全体で1つのトークンバケット（SYNC_BUCKET）を共有するので、
+# ループで何度も post_sync() を呼んでも、まとめて利用制限の内側に収まります。
+# VNDB_API_URL 環境変数でローカルのモックサーバー（tests/mock_vndb_server.py）に向けることもできます。
+# VNDB_CACHE_PATH を設定すると、レスポンスをディスクにキャッシュします（response_cache.py）。
+# 通信時間・JSON の解析時間・再試行は pipeline_metrics に記録します（計測中のときだけ）。
+# -----------------------------------------------------------------------------
+
+import asyncio
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+import aiohttp
+
+import pipeline_metrics
+from response_cache import ResponseCache
+
+# APIのベースURL（末尾に /vn や /tag をつけて使います）
+# VNDB_API_URL 環境変数はクライアントを作るときに読みます
+DEFAULT_API_URL = 'https://api.vndb.org/kana'
+
+# VNDB の制限は「5分あたり200リクエスト」なので、少しだけ余裕を持たせます
+DEFAULT_RATE = 195 / 300   # 1秒あたりに補充されるトークン数
+DEFAULT_BURST = 5          # まとめて使えるトークンの上限
+DEFAULT_CONCURRENCY = 4    # 同時に投げるリクエスト数
+
+# 再試行の対象になるステータスコード
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class VNDBError(Exception):
+    """APIがエラーを返したときの例外（ステータスコードと本文を持ちます）"""
+
+    def __init__(self, status, text, endpoint=None):
+        super().__init__(f"VNDB API エラー {status} ({endpoint}): {text[:200]}")
+        self.status = status
+        self.text = text
+        self.endpoint = endpoint
+
+# -----------------------------------------------------------------------------
+# 1. トークンバケット（レート制限）
+# -----------------------------------------------------------------------------
+class TokenBucket:
+    """
+    一定の速度（rate 個/秒）でトークンが補充されるバケツです。
+    リクエストの前に acquire() でトークンを1つ取り出し、なければ補充まで待ちます。
+    429 を受けたら penalize() で、このバケツを使う全リクエストを Retry-After の間止めます。
+    別々のイベントループ（asyncio.run() を何度も呼ぶ同期ヘルパーや、別スレッド）からも
+    同じバケツを使えるよう、状態はスレッドのロックで守ります。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # penalize() で止めている間の終わりの時刻
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self):
+        """トークンを1つ予約し、使えるようになるまでの秒数を返します"""
+        with self._lock:
+            self._refill()
+            # 足りなければマイナス（借り）にしておくので、先に予約した順にトークンが渡ります
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        wait = self._reserve()
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # 待っている間に 429 を受けていたら、止めている間が終わるまで待ちます
+            while self.paused_until > time.monotonic():
+                await asyncio.sleep(self.paused_until - time.monotonic())
+        except asyncio.CancelledError:
+            # 先読みの取り消しなどで使わなかった予約は返します
+            with self._lock:
+                self.tokens += 1
+            raise
+
+    def penalize(self, seconds):
+        """429 を受けたときに、今から seconds 秒の間はどのリクエストにもトークンを渡さないようにします"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# -----------------------------------------------------------------------------
+# 2. クライアント本体
+# -----------------------------------------------------------------------------
+class VNDBClient:
+    """
+    使い方:
+        async with VNDBClient() as client:
+            data = await client.post('vn', {"filters": ["id", "=", "v11"], "fields": "title"})
+            async for page, data in client.iter_pages('tag', {"fields": "id"}):
+                ...
+    """
+
+    def __init__(self, base_url=None, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 concurrency=DEFAULT_CONCURRENCY, max_retries=5,
+                 backoff_base=1.0, backoff_max=60.0, timeout=60, cache=None, bucket=None):
+        self.base_url = (base_url or os.getenv('VNDB_API_URL', DEFAULT_API_URL)).rstrip('/')
+        # bucket を渡すと、ほかのクライアントと同じレート制限を共有します
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session = None
+        # cache を省略すると環境変数 VNDB_CACHE_PATH から作ります（False で無効）
+        self._owns_cache = cache is None
+        self.cache = ResponseCache.from_env() if cache is None else (cache or None)
+        # 統計情報（何回リクエストして何回再試行したか）
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+        if self._owns_cache and self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def _backoff(self, attempt, retry_after=None):
+        """再試行までの待ち時間（Retry-After があればその秒数、なければフルジッター付きの指数バックオフ）"""
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def post(self, endpoint, payload):
+        """
+        エンドポイント（'vn', 'tag', 'release', 'character' など）にPOSTして、JSONを返します。
+        429 / 5xx / 通信エラーは max_retries 回まで再試行します。
+        キャッシュがあれば、有効期限内の結果は API を呼ばずに返します。
+        """
+        if self.cache is not None:
+            cached = self.cache.get(endpoint, payload)
+            if cached is not None:
+                pipeline_metrics.current().inc('api_cache_hits')
+                return cached
+            data = await self._request(endpoint, payload)
+            self.cache.put(endpoint, payload, data)
+            return data
+        return await self._request(endpoint, payload)
+
+    async def _request(self, endpoint, payload):
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        metrics = pipeline_metrics.current()
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            retry_after = None
+            penalized = False
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    # 通信（レスポンス本文を受け取り終わるまで）と JSON の解析は別の段階として測ります
+                    started = time.perf_counter()
+                    async with self._session.post(url, json=payload) as response:
+                        body = await response.read()
+                        metrics.observe('api_fetch', time.perf_counter() - started, rows=1, nbytes=len(body))
+                        if response.status == 200:
+                            with metrics.stage('json_decode', nbytes=len(body)):
+                                return json.loads(body)
+                        text = body.decode('utf-8', errors='replace')
+                        if response.status not in RETRY_STATUSES:
+                            raise VNDBError(response.status, text, endpoint)
+                        error = VNDBError(response.status, text, endpoint)
+                        header = response.headers.get('Retry-After')
+                        if header and header.isdigit():
+                            retry_after = int(header)
+                        if response.status == 429:
+                            # バケツごと止めるので、次の acquire() が Retry-After の分だけ待ちます
+                            # （ここでさらに眠ると、サーバーが求めた時間の2倍待つことになります）
+                            self.bucket.penalize(retry_after or self.backoff_base)
+                            penalized = True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            self.retries += 1
+            metrics.retry(endpoint, error.status if isinstance(error, VNDBError) else type(error).__name__)
+            if not penalized:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def iter_pages(self, endpoint, payload, start_page=1, window=None):
+        """
+        ページ番号つきのクエリを、先のページも同時に投げながら順番に返します。
+        (ページ番号, レスポンスJSON) を yield し、more が False のページで終わります。
+        more が False のページが届いた時点で、それより先のページは（呼び出し側がまだ
+        そこまで読んでいなくても）投げるのをやめ、トークン待ちのものは取り消します。
+        """
+        window = window or self.concurrency
+        tasks = {}
+        next_page = start_page
+        page = start_page
+        last_page = None    # more が False だったページ
+
+        def _on_done(done_page, task):
+            nonlocal last_page
+            if task.cancelled() or task.exception() is not None or task.result().get('more', False):
+                return
+            if last_page is None or done_page < last_page:
+                last_page = done_page
+            for later_page, later in tasks.items():
+                if later_page > done_page:
+                    later.cancel()
+
+        try:
+            while True:
+                # 先読みの枠（window）が空いている分だけ次のページを投げておきます
+                while next_page < page + window and (last_page is None or next_page <= last_page):
+                    body = dict(payload, page=next_page)
+                    task = asyncio.create_task(self.post(endpoint, body))
+                    task.add_done_callback(lambda t, p=next_page: _on_done(p, t))
+                    tasks[next_page] = task
+                    next_page += 1
+                data = await tasks.pop(page)
+                yield page, data
+                if not data.get('more', False):
+                    break
+                page += 1
+        finally:
+            # 最終ページより先に投げてしまった分は取り消します
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def fetch_all(self, endpoint, payload, max_pages=None):
+        """全ページの results を1つのリストにまとめて返します"""
+        results = []
+        async for page, data in self.iter_pages(endpoint, payload):
+            results.extend(data.get('results', []))
+            if max_pages and page >= max_pages:
+                break
+        return results
+
+# -----------------------------------------------------------------------------
+# 3. 同期コードから使うためのヘルパー
+# -----------------------------------------------------------------------------
+# 同期ヘルパーは呼ぶたびにクライアントを作るので、レート制限はこのバケツで共有します
+SYNC_BUCKET = TokenBucket()
+
+def post_sync(endpoint, payload, **client_options):
+    """1回だけPOSTしてJSONを返します（requests.post の置き換え）"""
+    client_options.setdefault('bucket', SYNC_BUCKET)
+
+    async def _run():
+        async with VNDBClient(**client_options) as client:
+            return await client.post(endpoint, payload)
+    return asyncio.run(_run())
+
+def iter_pages_sync(endpoint, payload, start_page=1, prefetch=4, **client_options):
+    """
+    iter_pages() を普通の（同期の）ジェネレータとして使えるようにします。
+    取得は別スレッドのイベントループで進み、最大 prefetch ページ分だけ先に貯めておきます。
+    DB書き込みが遅いときは取得側が待たされるので、メモリは増え続けません。
+    """
+    client_options.setdefault('bucket', SYNC_BUCKET)
+    pages = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    async def _produce():
+        async with VNDBClient(**client_options) as client:
+            async for item in client.iter_pages(endpoint, payload, start_page):
+                # put() で待つとイベントループごと止まるので、put_nowait() と asyncio.sleep() で待ちます
+                while not stop.is_set():
+                    try:
+                        pages.put_nowait(item)
+                        break
+                    except queue.Full:
+                        await asyncio.sleep(0.05)
+                if stop.is_set():
+                    return
+
+    def _worker():
+        try:
+            asyncio.run(_produce())
+            pages.put(done)
+        except BaseException as e:
+            pages.put(e)
+
+    thread = threading.Thread(target=_worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 呼び出し側が途中でやめた場合も、取得スレッドを止めます
+        stop.set()
+        while thread.is_alive():
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                pass
+            thread.join(timeout=0.1)